@@ -0,0 +1,393 @@
+"""Asyncio front end for ConversionCodeDB.
+
+Every call runs on a small thread pool sized to the database's connection
+pool, so the event loop never waits on SQLite and no worker waits for a
+connection::
+
+    async with AsyncConversionCodeDB("conversion_codes.db") as db:
+        record = await db.get_record(42)
+        async for record in db.iter_records("STATUS*"):
+            ...
+        async with db.batch_writer(chunk_size=5000) as writer:
+            async for message in source:
+                await writer.add((message.field, message.source, message.spectrum))
+
+Calls beyond ``max_queued`` wait (without blocking the loop) for earlier
+ones to finish, so a burst of requests cannot queue unbounded work.
+Streams fetch one batch ahead of the consumer, and batch writers hold at
+most ``max_pending`` chunks waiting to be written; ``add`` waits when they
+are full.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from typing import (AsyncIterable, AsyncIterator, Callable, Dict, Iterable, List, Optional,
+                    Sequence, Tuple, TypeVar, Union)
+
+from database import (BATCH_CHUNK_SIZE, DEFAULT_SORT, BulkUpsertResult, Change,
+                      ConversionCodeDB, FieldSummary, Record, Write)
+
+
+T = TypeVar('T')
+
+Row = Sequence[Optional[str]]
+
+
+class AsyncConversionCodeDB:
+    """Awaitable equivalents of the ``ConversionCodeDB`` methods.
+
+    Opens a ``ConversionCodeDB`` for ``db_path`` with ``options``, or wraps
+    ``db`` (which it then does not close). Calls run on ``max_workers``
+    threads, by default one per pooled read connection.
+    """
+
+    def __init__(self, db_path: str = "conversion_codes.db",
+                 max_workers: Optional[int] = None, max_queued: int = 256,
+                 db: Optional[ConversionCodeDB] = None, **options):
+        self._owns_db = db is None
+        self.db = db if db is not None else ConversionCodeDB(db_path, **options)
+        self.max_workers = max_workers or self.db.pool_size
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                            thread_name_prefix='conversion-db')
+        self._slots = asyncio.Semaphore(max_queued)
+
+    async def __aenter__(self) -> 'AsyncConversionCodeDB':
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        """Wait for running calls, then close the database if this opened it."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._shutdown)
+
+    def _shutdown(self):
+        self._executor.shutdown(wait=True)
+        if self._owns_db:
+            self.db.close()
+
+    async def run(self, func: Callable[..., T], *args, **kwargs) -> T:
+        """Call ``func`` on a worker thread, waiting for a slot if too many are queued.
+
+        The slot is held until the call finishes, even if the caller is
+        cancelled first, so the bound covers work already handed to the
+        threads.
+        """
+        await self._slots.acquire()
+        loop = asyncio.get_running_loop()
+        try:
+            future = self._executor.submit(partial(func, *args, **kwargs))
+        except BaseException:
+            self._slots.release()
+            raise
+
+        def release(_):
+            try:
+                loop.call_soon_threadsafe(self._slots.release)
+            except RuntimeError:
+                # The loop has been closed; nothing is waiting any more.
+                pass
+
+        future.add_done_callback(release)
+        return await asyncio.wrap_future(future)
+
+    # Reads
+
+    async def get_records(self, field_name_filter: Optional[str] = None,
+                          match: Optional[str] = None, where=None) -> List[Record]:
+        """See ``ConversionCodeDB.get_records``."""
+        return await self.run(self.db.get_records, field_name_filter, match, where)
+
+    async def get_all_records(self, field_name_filter: Optional[str] = None,
+                              match: Optional[str] = None, where=None) -> List[Dict]:
+        """See ``ConversionCodeDB.get_all_records``."""
+        return await self.run(self.db.get_all_records, field_name_filter, match, where)
+
+    async def count_records(self, field_name_filter: Optional[str] = None,
+                            match: Optional[str] = None, where=None) -> int:
+        """See ``ConversionCodeDB.count_records``."""
+        return await self.run(self.db.count_records, field_name_filter, match, where)
+
+    async def get_record_page(self, after_id: Optional[int] = None, limit: int = 200,
+                              field_name_filter: Optional[str] = None,
+                              match: Optional[str] = None, offset: int = 0,
+                              order_by: str = DEFAULT_SORT, descending: bool = False,
+                              after_value=None, where=None) -> List[Record]:
+        """See ``ConversionCodeDB.get_record_page``."""
+        return await self.run(self.db.get_record_page, after_id, limit, field_name_filter,
+                              match, offset, order_by, descending, after_value, where)
+
+    async def get_page(self, after_id: Optional[int] = None, limit: int = 200,
+                       field_name_filter: Optional[str] = None, match: Optional[str] = None,
+                       offset: int = 0, order_by: str = DEFAULT_SORT,
+                       descending: bool = False, after_value=None,
+                       where=None) -> List[Dict]:
+        """See ``ConversionCodeDB.get_page``."""
+        return await self.run(self.db.get_page, after_id, limit, field_name_filter, match,
+                              offset, order_by, descending, after_value, where)
+
+    async def get_record(self, conversion_code_id: int) -> Optional[Record]:
+        """See ``ConversionCodeDB.get_record``."""
+        return await self.run(self.db.get_record, conversion_code_id)
+
+    async def get_record_by_id(self, conversion_code_id: int) -> Optional[Dict]:
+        """See ``ConversionCodeDB.get_record_by_id``."""
+        return await self.run(self.db.get_record_by_id, conversion_code_id)
+
+    async def get_ids(self, field_name_filter: Optional[str] = None,
+                      match: Optional[str] = None, where=None) -> List[int]:
+        """See ``ConversionCodeDB.get_ids``."""
+        return await self.run(self.db.get_ids, field_name_filter, match, where)
+
+    async def field_name_summary(self, field_name_filter: Optional[str] = None,
+                                 match: Optional[str] = None, where=None) -> List[FieldSummary]:
+        """See ``ConversionCodeDB.field_name_summary``."""
+        return await self.run(self.db.field_name_summary, field_name_filter, match, where)
+
+    async def current_change_seq(self) -> int:
+        """See ``ConversionCodeDB.current_change_seq``."""
+        return await self.run(self.db.current_change_seq)
+
+    # Streams
+
+    async def iter_records(self, field_name_filter: Optional[str] = None,
+                           match: Optional[str] = None,
+                           batch_size: int = 1000, where=None) -> AsyncIterator[Record]:
+        """Stream matching records in ID order, ``batch_size`` at a time.
+
+        Each batch is a keyset page read with its own query, so no
+        connection is held between batches; rows changed while streaming
+        show up in whichever state their batch saw. The next batch is read
+        while the consumer works through the current one.
+        """
+        def fetch(after_id: Optional[int]):
+            return asyncio.ensure_future(self.get_record_page(
+                after_id, batch_size, field_name_filter, match, where=where))
+
+        async for record in self._stream(fetch(None), batch_size,
+                                         lambda batch: fetch(batch[-1].CONVERSION_CODE_ID)):
+            yield record
+
+    async def changes_since(self, seq: int = 0,
+                            batch_size: int = 1000) -> AsyncIterator[Change]:
+        """Stream the change log after ``seq`` (see ``ConversionCodeDB.changes_since``)."""
+        def fetch(after_seq: int):
+            return asyncio.ensure_future(self.run(self._read_changes, after_seq, batch_size))
+
+        async for change in self._stream(fetch(seq), batch_size,
+                                         lambda batch: fetch(batch[-1].seq)):
+            yield change
+
+    def _read_changes(self, seq: int, limit: int) -> List[Change]:
+        """Read one batch of changes and release the connection."""
+        changes = self.db.changes_since(seq, limit)
+        try:
+            return list(islice(changes, limit))
+        finally:
+            changes.close()
+
+    @staticmethod
+    async def _stream(pending: 'asyncio.Future[list]', batch_size: int,
+                      fetch_next: Callable[[list], 'asyncio.Future[list]']) -> AsyncIterator:
+        """Yield from batches, reading each full batch's successor ahead."""
+        try:
+            while pending is not None:
+                batch = await pending
+                pending = fetch_next(batch) if len(batch) == batch_size else None
+                for item in batch:
+                    yield item
+        finally:
+            if pending is not None:
+                pending.cancel()
+
+    # Writes
+
+    async def add_record(self, field_name: str, source_value: str, spectrum_value: str,
+                         is_imported: str = 'N') -> int:
+        """See ``ConversionCodeDB.add_record``."""
+        return await self.run(self.db.add_record, field_name, source_value, spectrum_value,
+                              is_imported)
+
+    async def update_record(self, conversion_code_id: int, field_name: str,
+                            source_value: str, spectrum_value: str, is_imported: str,
+                            expected_update_count: Optional[int] = None) -> bool:
+        """See ``ConversionCodeDB.update_record``."""
+        return await self.run(self.db.update_record, conversion_code_id, field_name,
+                              source_value, spectrum_value, is_imported, expected_update_count)
+
+    async def delete_record(self, conversion_code_id: int,
+                            expected_update_count: Optional[int] = None) -> bool:
+        """See ``ConversionCodeDB.delete_record``."""
+        return await self.run(self.db.delete_record, conversion_code_id, expected_update_count)
+
+    async def apply_writes(self, writes: Sequence[Write]) -> List[object]:
+        """See ``ConversionCodeDB.apply_writes``."""
+        return await self.run(self.db.apply_writes, writes)
+
+    async def update_many(self, changes: Iterable[Tuple[int, Dict[str, Optional[str]]]],
+                          chunk_size: int = BATCH_CHUNK_SIZE,
+                          expected_update_counts: Optional[Dict[int, int]] = None) -> int:
+        """See ``ConversionCodeDB.update_many``; ``changes`` is read on a worker thread."""
+        return await self.run(self.db.update_many, changes, chunk_size, expected_update_counts)
+
+    async def delete_many(self, conversion_code_ids: Iterable[int],
+                          chunk_size: int = BATCH_CHUNK_SIZE,
+                          expected_update_counts: Optional[Dict[int, int]] = None) -> int:
+        """See ``ConversionCodeDB.delete_many``; the IDs are read on a worker thread."""
+        return await self.run(self.db.delete_many, conversion_code_ids, chunk_size,
+                              expected_update_counts)
+
+    async def prune_changes(self, through_seq: int) -> int:
+        """See ``ConversionCodeDB.prune_changes``."""
+        return await self.run(self.db.prune_changes, through_seq)
+
+    async def bulk_upsert(self, rows: Union[Iterable[Row], AsyncIterable[Row]],
+                          chunk_size: int = 5000, max_pending: int = 1,
+                          max_errors: int = 100) -> BulkUpsertResult:
+        """Upsert rows from a plain or async iterable (see ``ConversionCodeDB.bulk_upsert``).
+
+        Rows are collected into the next chunk while the previous one is
+        written, and reading stops while ``max_pending`` chunks are waiting,
+        so a fast source cannot run ahead of the database. A plain iterable
+        is read on the event loop; pass an async one if producing rows
+        involves I/O.
+        """
+        async with self.batch_writer(chunk_size, max_pending, max_errors) as writer:
+            await writer.add_many(rows)
+        return writer.result
+
+    def batch_writer(self, chunk_size: int = 5000, max_pending: int = 1,
+                     max_errors: int = 100) -> 'AsyncBatchWriter':
+        """Return a writer that upserts rows added one at a time, in chunks."""
+        return AsyncBatchWriter(self, chunk_size, max_pending, max_errors)
+
+
+class AsyncBatchWriter:
+    """Collect rows into chunks and upsert them on the database's threads.
+
+    One chunk is written at a time, in the order added. ``add`` waits while
+    ``max_pending`` full chunks are queued behind the one being written, so
+    at most ``(max_pending + 2) * chunk_size`` rows are held. If a write
+    fails, later chunks are dropped and the error is raised from the next
+    ``add``, ``flush`` or ``close``. Use as an async context manager, or
+    call ``close()`` to write the last partial chunk. If the ``async with``
+    block raises, full chunks already queued are written and the partial
+    one is dropped.
+    """
+
+    def __init__(self, db: AsyncConversionCodeDB, chunk_size: int = 5000,
+                 max_pending: int = 1, max_errors: int = 100):
+        if chunk_size < 1 or max_pending < 1:
+            raise ValueError("chunk_size and max_pending must be at least 1.")
+        self.db = db
+        self.chunk_size = chunk_size
+        self.max_errors = max_errors
+        self._queue: 'asyncio.Queue[Optional[Tuple[int, List[Row]]]]' = \
+            asyncio.Queue(maxsize=max_pending)
+        self._chunk: List[Row] = []
+        self._added = 0
+        self._task: Optional[asyncio.Task] = None
+        self._error: Optional[BaseException] = None
+        self._closed = False
+        self.inserted = self.updated = self.unchanged = self.rejected = 0
+        self.errors: List[Tuple[int, str]] = []
+
+    async def __aenter__(self) -> 'AsyncBatchWriter':
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            await self.close()
+        else:
+            await self._stop()
+
+    @property
+    def result(self) -> BulkUpsertResult:
+        """Totals for the chunks written so far; row numbers count from 1 across chunks."""
+        return BulkUpsertResult(self.inserted, self.updated, self.unchanged, self.rejected,
+                                list(self.errors))
+
+    async def add(self, row: Row):
+        """Add one row, waiting if the chunks queued for writing are full."""
+        self._check()
+        self._chunk.append(row)
+        if len(self._chunk) >= self.chunk_size:
+            await self._submit()
+
+    async def add_many(self, rows: Union[Iterable[Row], AsyncIterable[Row]]):
+        """Add rows from a plain or async iterable."""
+        if hasattr(rows, '__aiter__'):
+            async for row in rows:
+                await self.add(row)
+        else:
+            for row in rows:
+                await self.add(row)
+
+    async def flush(self):
+        """Queue the partial chunk and wait until everything added is written."""
+        self._check()
+        if self._chunk:
+            await self._submit()
+        await self._queue.join()
+        self._check()
+
+    async def close(self):
+        """Write everything added, then stop the writer task."""
+        if self._closed:
+            return
+        try:
+            await self.flush()
+        finally:
+            await self._stop()
+
+    async def _stop(self):
+        self._closed = True
+        if self._task is not None:
+            await self._queue.put(None)
+            await self._task
+            self._task = None
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+        if self._closed:
+            raise RuntimeError("The batch writer is closed.")
+
+    async def _submit(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._write_chunks())
+        chunk, self._chunk = self._chunk, []
+        first_row = self._added
+        self._added += len(chunk)
+        await self._queue.put((first_row, chunk))
+
+    async def _write_chunks(self):
+        """Write queued chunks one at a time until told to stop."""
+        while True:
+            item = await self._queue.get()
+            try:
+                if item is None:
+                    return
+                if self._error is None:
+                    first_row, chunk = item
+                    try:
+                        result = await self.db.run(self.db.db.bulk_upsert, chunk,
+                                                   len(chunk), None, self.max_errors)
+                    except Exception as e:
+                        self._error = e
+                    else:
+                        self._add_result(first_row, result)
+            finally:
+                self._queue.task_done()
+
+    def _add_result(self, first_row: int, result: BulkUpsertResult):
+        self.inserted += result.inserted
+        self.updated += result.updated
+        self.unchanged += result.unchanged
+        self.rejected += result.rejected
+        for row_number, message in result.errors:
+            if len(self.errors) >= self.max_errors:
+                break
+            self.errors.append((first_row + row_number, message))
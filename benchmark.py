@@ -0,0 +1,439 @@
+"""Benchmarks for ConversionCodeDB at production-like table sizes.
+
+Usage::
+
+    python benchmark.py --sizes 10000 100000 1000000 --output results.json
+    python benchmark.py --sizes 100000 --compare results.json
+    python benchmark.py --writers 8 --batch 1 10
+
+Each size gets a synthetic table whose FIELD_NAME distribution is skewed
+(a few field names hold most rows, as in real conversion tables). Generated
+databases are kept in ``--data-dir`` and reused by later runs. Every
+operation is timed ``--repeat`` times and reported as p50/p95/p99 latency
+and throughput; results are written as JSON so runs on different commits
+can be compared with ``--compare``.
+
+``--writers`` instead runs concurrent writer processes against one
+database file, each incrementing counters in random records with
+optimistic read-modify-write updates, and reports throughput, the
+conflict rate and the busy retries. The counters' total shows whether any
+update was lost.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from database import CHANGE_UPDATE, ConcurrencyConflictError, ConversionCodeDB, Write
+
+
+DEFAULT_SIZES = (10_000, 100_000)
+
+# Field name stems combined into synthetic names such as CUSTOMER_STATUS_12.
+FIELD_STEMS = ('CUSTOMER', 'STATUS', 'REGION', 'PRODUCT', 'PRIORITY', 'DEPARTMENT',
+               'CURRENCY', 'CHANNEL', 'PAYMENT', 'ACCOUNT', 'SEGMENT', 'CARRIER')
+FIELD_SUFFIXES = ('TYPE', 'CODE', 'LEVEL', 'CLASS', 'GROUP', 'FLAG')
+
+# Operations over every row are skipped above this size; they measure
+# memory bandwidth more than anything the grid does.
+FULL_SCAN_LIMIT = 1_000_000
+
+# Relative p50 slowdown reported as a regression by ``compare_results``, and
+# the absolute change below which sub-millisecond jitter is ignored.
+REGRESSION_THRESHOLD = 0.20
+REGRESSION_MIN_DELTA_MS = 0.1
+
+
+def field_names(count: int, seed: int = 0) -> List[str]:
+    """Return ``count`` distinct, realistic looking field names."""
+    rng = random.Random(seed)
+    names: List[str] = []
+    seen = set()
+    while len(names) < count:
+        name = f"{rng.choice(FIELD_STEMS)}_{rng.choice(FIELD_SUFFIXES)}"
+        if name in seen:
+            name = f"{name}_{len(names)}"
+        seen.add(name)
+        names.append(name)
+    return names
+
+
+def generate_rows(count: int, field_count: int = 500, skew: float = 1.1,
+                  seed: int = 0) -> Iterator[Tuple[str, str, str, str]]:
+    """Yield ``count`` synthetic ``(field, source, spectrum, imported)`` rows.
+
+    Field names follow a Zipf-like distribution with exponent ``skew``, so
+    the first few names hold most of the rows. Source values are unique per
+    field name; the output is deterministic for a given seed.
+    """
+    rng = random.Random(seed)
+    names = field_names(field_count, seed)
+    weights = [1.0 / (rank ** skew) for rank in range(1, field_count + 1)]
+    next_source = dict.fromkeys(names, 0)
+    for start in range(0, count, 10_000):
+        for name in rng.choices(names, weights, k=min(10_000, count - start)):
+            number = next_source[name]
+            next_source[name] = number + 1
+            yield (name, f"SRC{number:06d}", f"S{rng.randrange(10 ** 6):06d}",
+                   'Y' if rng.random() < 0.8 else 'N')
+
+
+def prepare_database(size: int, data_dir: str, seed: int = 0) -> str:
+    """Create (or reuse) a synthetic database of ``size`` rows; returns its path."""
+    path = os.path.join(data_dir, f"bench_{size}_{seed}.db")
+    if os.path.exists(path):
+        conn = sqlite3.connect(path)
+        try:
+            existing = conn.execute(
+                "SELECT COUNT(*) FROM S_CONVERSION_CODE_G97").fetchone()[0]
+        except sqlite3.Error:
+            existing = None
+        finally:
+            conn.close()
+        if existing == size:
+            return path
+        os.remove(path)
+    with ConversionCodeDB(path) as db:
+        db.bulk_upsert(generate_rows(size, seed=seed), chunk_size=20_000)
+    return path
+
+
+def percentile(sorted_samples: Sequence[float], fraction: float) -> float:
+    """Linearly interpolated percentile of already sorted samples."""
+    if not sorted_samples:
+        return 0.0
+    position = (len(sorted_samples) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_samples) - 1)
+    weight = position - lower
+    return sorted_samples[lower] * (1 - weight) + sorted_samples[upper] * weight
+
+
+def summarize(samples: Sequence[float], items: int = 1) -> Dict[str, float]:
+    """Latency percentiles in milliseconds and throughput in items per second.
+
+    ``items`` is how many rows or records one timed call handles.
+    """
+    ordered = sorted(samples)
+    total = sum(ordered)
+    return {
+        'runs': len(ordered),
+        'p50_ms': percentile(ordered, 0.50) * 1000,
+        'p95_ms': percentile(ordered, 0.95) * 1000,
+        'p99_ms': percentile(ordered, 0.99) * 1000,
+        'max_ms': ordered[-1] * 1000 if ordered else 0.0,
+        'per_second': len(ordered) * items / total if total > 0 else 0.0,
+    }
+
+
+def measure(operation: Callable[[], object], repeat: int) -> List[float]:
+    """Time ``repeat`` calls of ``operation`` after one warm-up call."""
+    operation()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        operation()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def benchmark_database(path: str, size: int, repeat: int = 20,
+                       seed: int = 0) -> Dict[str, Dict[str, float]]:
+    """Time each ConversionCodeDB operation against the database at ``path``."""
+    # Imported here: they pull in tkinter, which the other commands do not need.
+    from main import format_record_values
+    from virtual_table import PagedResultSet
+
+    rng = random.Random(seed)
+    names = field_names(500, seed)
+    results: Dict[str, Dict[str, float]] = {}
+
+    def record(name: str, operation: Callable[[], object], items: int = 1,
+               runs: int = repeat):
+        results[name] = summarize(measure(operation, runs), items)
+
+    with ConversionCodeDB(path) as db:
+        max_id = db.get_page(limit=1, offset=size - 1)[0]['CONVERSION_CODE_ID']
+        top, rare = names[0], names[-1]
+        top_count = db.count_records(f"={top}")
+
+        if size <= FULL_SCAN_LIMIT:
+            record('get_all_records', db.get_all_records, items=size,
+                   runs=max(3, repeat // 10))
+            record('get_records', db.get_records, items=size, runs=max(3, repeat // 10))
+            record('iter_rows', lambda: sum(1 for _ in db.iter_rows()), items=size,
+                   runs=max(3, repeat // 10))
+        record('filter_exact_top', lambda: db.get_all_records(f"={top}"), items=top_count)
+        record('filter_exact_rare', lambda: db.get_all_records(f"={rare}"))
+        record('filter_prefix', lambda: db.get_all_records(top[:6] + '*'))
+        record('filter_substring', lambda: db.get_all_records(top[2:8]))
+        record('count_records', db.count_records)
+        record('count_filtered', lambda: db.count_records(top[2:8]))
+        record('get_record_by_id', lambda: db.get_record_by_id(rng.randint(1, max_id)))
+        record('get_page_first', lambda: db.get_page(limit=200))
+        record('get_page_keyset_deep',
+               lambda: db.get_page(after_id=max_id - 1000, limit=200))
+        record('get_page_offset_deep', lambda: db.get_page(offset=size - 1000, limit=200))
+        middle = db.get_record_page(offset=size // 2, limit=1, order_by='SOURCE_VALUE')[0]
+        record('get_page_sorted_keyset',
+               lambda: db.get_record_page(after_id=middle.CONVERSION_CODE_ID,
+                                          after_value=middle.SOURCE_VALUE, limit=200,
+                                          order_by='SOURCE_VALUE'))
+        record('field_name_summary', db.field_name_summary, items=size)
+        record('check_integrity', db.check_integrity, items=size, runs=max(3, repeat // 10))
+
+        def populate_grid():
+            # What refresh_data does off-screen: count, first page, format rows.
+            result_set = PagedResultSet(db, None)
+            return [format_record_values(row) for row in result_set.rows(0, 30)]
+
+        def populate_filtered_grid():
+            result_set = PagedResultSet(db, top[2:8])
+            return [format_record_values(row) for row in result_set.rows(0, 30)]
+
+        record('grid_populate', populate_grid, items=30)
+        record('grid_populate_filtered', populate_filtered_grid, items=30)
+
+        added: List[int] = []
+        record('add_record', lambda: added.append(
+            db.add_record("BENCH_WRITE", f"W{len(added)}", "V", 'N')))
+        record('update_record', lambda: db.update_record(
+            rng.choice(added), "BENCH_WRITE", f"U{rng.randrange(10 ** 6)}", "V", 'Y'))
+        record('delete_record', lambda: db.delete_record(added.pop()))
+        db.delete_many(added)
+
+        batch_runs = max(3, repeat // 10)
+        update_samples, delete_samples = [], []
+        for run in range(batch_runs + 1):
+            db.bulk_upsert(("BENCH_BATCH", f"B{i}", "V") for i in range(500))
+            ids = db.get_ids("=BENCH_BATCH")
+            started = time.perf_counter()
+            db.update_many((record_id, {'IS_IMPORTED': 'Y'}) for record_id in ids)
+            update_samples.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            db.delete_many(ids)
+            delete_samples.append(time.perf_counter() - started)
+        # The first run is the warm-up.
+        results['update_many_500'] = summarize(update_samples[1:], 500)
+        results['delete_many_500'] = summarize(delete_samples[1:], 500)
+
+        # What a delta consumer reads instead of diffing the whole table.
+        since = max(db.current_change_seq() - 1000, 0)
+        record('changes_since_1000', lambda: sum(1 for _ in db.changes_since(since)),
+               items=db.current_change_seq() - since)
+
+        batch = list(generate_rows(20_000, seed=seed + 1))
+        batch = [("BENCH_UPSERT",) + row[1:] for row in batch]
+        started = time.perf_counter()
+        db.bulk_upsert(batch, chunk_size=5000)
+        results['bulk_upsert_20k'] = summarize([time.perf_counter() - started], len(batch))
+        db.delete_many(db.get_ids("=BENCH_UPSERT"))
+    return results
+
+
+def _increment_counters(args: Tuple[str, int, int, int]) -> Dict[str, float]:
+    """One writer process: add 1 to ``operations`` random counters, ``batch``
+    per transaction, re-reading and retrying on conflicts."""
+    path, writer, operations, batch = args
+    rng = random.Random(writer)
+    conflicts = 0
+    with ConversionCodeDB(path, pool_size=1) as db:
+        ids = db.get_ids("=STRESS")
+        started = time.time()
+        done = 0
+        while done < operations:
+            pending = [rng.choice(ids) for _ in range(min(batch, operations - done))]
+            while pending:
+                writes = []
+                for record_id in pending:
+                    record = db.get_record(record_id)
+                    writes.append(Write(CHANGE_UPDATE, record_id,
+                                        (record.FIELD_NAME, record.SOURCE_VALUE,
+                                         str(int(record.SPECTRUM_VALUE) + 1), 'N'),
+                                        record.UPDATE_COUNT))
+                results = db.apply_writes(writes)
+                retry = [write.conversion_code_id for write, result in zip(writes, results)
+                         if isinstance(result, ConcurrencyConflictError)]
+                conflicts += len(retry)
+                done += len(pending) - len(retry)
+                pending = retry
+        return {'started': started, 'finished': time.time(), 'conflicts': conflicts,
+                'busy_retries': db.busy_retry_count}
+
+
+def benchmark_concurrent_writers(path: str, writers: int = 8, operations: int = 200,
+                                 records: int = 50, batch: int = 1) -> Dict[str, float]:
+    """Run ``writers`` processes incrementing counters in one new database.
+
+    Each writer makes ``operations`` increments of random records among
+    ``records``, ``batch`` per transaction. ``lost_updates`` compares the
+    counters' total with the increments made; it is 0 unless concurrency
+    control is broken.
+    """
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    with ConversionCodeDB(path) as db:
+        db.bulk_upsert([("STRESS", f"R{i}", "0") for i in range(records)])
+    with multiprocessing.Pool(writers) as pool:
+        reports = pool.map(_increment_counters, [(path, writer, operations, batch)
+                                                 for writer in range(writers)])
+    with ConversionCodeDB(path) as db:
+        total = sum(int(record.SPECTRUM_VALUE) for record in db.get_records("=STRESS"))
+    seconds = (max(report['finished'] for report in reports)
+               - min(report['started'] for report in reports))
+    made = writers * operations
+    conflicts = sum(report['conflicts'] for report in reports)
+    return {
+        'writers': writers,
+        'batch': batch,
+        'updates': made,
+        'seconds': seconds,
+        'per_second': made / seconds if seconds > 0 else 0.0,
+        'conflicts': conflicts,
+        'conflict_rate': conflicts / (made + conflicts),
+        'busy_retries': sum(report['busy_retries'] for report in reports),
+        'lost_updates': made - total,
+    }
+
+
+def format_concurrency_report(results: Sequence[Dict[str, float]]) -> str:
+    """Render concurrent writer runs as a text table."""
+    lines = [f"  {'writers':>8}{'batch':>7}{'updates':>9}{'per second':>12}"
+             f"{'conflicts':>11}{'rate':>8}{'busy retries':>14}{'lost':>6}"]
+    for result in results:
+        lines.append(f"  {result['writers']:>8}{result['batch']:>7}{result['updates']:>9}"
+                     f"{result['per_second']:>12,.0f}{result['conflicts']:>11}"
+                     f"{result['conflict_rate']:>8.1%}{result['busy_retries']:>14}"
+                     f"{result['lost_updates']:>6}")
+    return '\n'.join(lines)
+
+
+def environment() -> Dict[str, str]:
+    """Describe where the benchmark ran, for comparing results files."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                capture_output=True, text=True, timeout=5,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ''
+    return {
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+    }
+
+
+def run_benchmarks(sizes: Sequence[int], data_dir: str, repeat: int = 20,
+                   seed: int = 0, log=None) -> Dict:
+    """Benchmark every size and return the results document."""
+    document = {'environment': environment(), 'repeat': repeat, 'seed': seed, 'sizes': {}}
+    for size in sizes:
+        if log:
+            log(f"Preparing {size:,} rows...")
+        path = prepare_database(size, data_dir, seed)
+        if log:
+            log(f"Benchmarking {size:,} rows...")
+        document['sizes'][str(size)] = benchmark_database(path, size, repeat, seed)
+    return document
+
+
+def compare_results(previous: Dict, current: Dict, threshold: float = REGRESSION_THRESHOLD,
+                    min_delta_ms: float = REGRESSION_MIN_DELTA_MS
+                    ) -> List[Tuple[str, str, float, float]]:
+    """Return ``(size, operation, old_p50, new_p50)`` for p50 latencies that regressed."""
+    regressions = []
+    for size, operations in current['sizes'].items():
+        for name, stats in operations.items():
+            old = previous.get('sizes', {}).get(size, {}).get(name)
+            if not old:
+                continue
+            new_p50, old_p50 = stats['p50_ms'], old['p50_ms']
+            if new_p50 > old_p50 * (1 + threshold) and new_p50 - old_p50 >= min_delta_ms:
+                regressions.append((size, name, old_p50, new_p50))
+    return regressions
+
+
+def format_report(document: Dict, previous: Optional[Dict] = None) -> str:
+    """Render results as a text table, with p50 change against ``previous``."""
+    lines = []
+    for size, operations in document['sizes'].items():
+        lines.append(f"\n{int(size):,} rows")
+        lines.append(f"  {'operation':<26}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+                     f"{'per second':>14}{'vs prev':>10}")
+        for name, stats in operations.items():
+            change = ''
+            old = (previous or {}).get('sizes', {}).get(size, {}).get(name)
+            if old and old['p50_ms'] > 0:
+                change = f"{(stats['p50_ms'] / old['p50_ms'] - 1) * 100:+.0f}%"
+            lines.append(f"  {name:<26}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}"
+                         f"{stats['p99_ms']:>10.2f}{stats['per_second']:>14,.0f}{change:>10}")
+    return '\n'.join(lines)
+
+
+def main(argv=None) -> int:
+    """Run the benchmarks; returns 1 if ``--compare`` found a regression."""
+    parser = argparse.ArgumentParser(description="Benchmark conversion code operations.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help="Table sizes in rows (default: 10000 100000)")
+    parser.add_argument('--repeat', type=int, default=20, help="Timed runs per operation")
+    parser.add_argument('--seed', type=int, default=0, help="Synthetic data seed")
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(),
+                                                           'conversion_code_bench'),
+                        help="Where generated databases are kept between runs")
+    parser.add_argument('--output', help="Write results to this JSON file")
+    parser.add_argument('--compare', help="Previous results JSON file to compare against")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help="Relative p50 slowdown counted as a regression (default: 0.20)")
+    parser.add_argument('--writers', type=int,
+                        help="Run this many concurrent writer processes instead")
+    parser.add_argument('--operations', type=int, default=200,
+                        help="Updates per writer with --writers (default: 200)")
+    parser.add_argument('--records', type=int, default=50,
+                        help="Records the writers update with --writers (default: 50)")
+    parser.add_argument('--batch', type=int, nargs='+', default=[1],
+                        help="Updates per transaction with --writers; one run each")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    if args.writers:
+        path = os.path.join(args.data_dir, 'bench_writers.db')
+        results = [benchmark_concurrent_writers(path, args.writers, args.operations,
+                                                args.records, batch)
+                   for batch in args.batch]
+        print(format_concurrency_report(results))
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump({'environment': environment(), 'writers': results}, f, indent=2)
+        return 1 if any(result['lost_updates'] for result in results) else 0
+    document = run_benchmarks(args.sizes, args.data_dir, args.repeat, args.seed,
+                              log=lambda message: print(message, file=sys.stderr))
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+    print(format_report(document, previous))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(document, f, indent=2)
+    if previous is not None:
+        regressions = compare_results(previous, document, args.threshold)
+        for size, name, old, new in regressions:
+            print(f"REGRESSION {name} at {int(size):,} rows: p50 {old:.2f} ms -> {new:.2f} ms")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
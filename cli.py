@@ -0,0 +1,501 @@
+"""Command-line interface for conversion code management.
+
+Usage::
+
+    python -m cli import codes.csv more_codes.jsonl.gz --db conversion_codes.db
+    python -m cli export codes.csv.gz
+    python -m cli export changes.jsonl --format jsonl --since 1042
+    python -m cli export codes.csv --connection-string "DRIVER=...;SERVER=db01;..."
+    python -m cli import codes.csv --profile timings.json
+    python -m cli check --known-fields fields.txt
+    python -m cli list "STATUS*" --format jsonl
+    python -m cli list --where "source ^= ACT and changed >= 2024-01-01" --count
+    python -m cli get 42 43
+    python -m cli convert STATUS_CODE ACTIVE PENDING
+    cut -f3 extract.tsv | python -m cli convert STATUS_CODE --default "?"
+    python -m cli snapshot codes.snap --if-changed
+    cut -f3 extract.tsv | python -m cli convert STATUS_CODE --snapshot codes.snap
+    python -m cli convert-file orders.csv.gz out.csv.gz --column status=STATUS_CODE
+    python -m cli serve --port 8765
+
+Heavy modules are imported inside each command so that starting the CLI
+stays cheap.
+"""
+import argparse
+import sys
+import time
+from typing import List
+
+
+DEFAULT_DB_PATH = "conversion_codes.db"
+
+
+class ProgressReporter:
+    """Print row counts and throughput to stderr as work progresses."""
+
+    def __init__(self, label: str, stream=None, interval: float = 0.5):
+        self.label = label
+        self.stream = stream if stream is not None else sys.stderr
+        self.interval = interval
+        self.started = time.perf_counter()
+        self._last_report = 0.0
+        self.count = 0
+
+    def __call__(self, count: int):
+        """Record progress; prints at most once per ``interval`` seconds."""
+        self.count = count
+        now = time.perf_counter()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self._write('\r')
+
+    def rate(self) -> float:
+        """Rows per second since the reporter was created."""
+        elapsed = time.perf_counter() - self.started
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+    def finish(self):
+        """Print the final count and rate on their own line."""
+        self._write('\r')
+        self.stream.write('\n')
+        self.stream.flush()
+
+    def _write(self, prefix: str):
+        self.stream.write(f"{prefix}{self.label}: {self.count:,} rows "
+                          f"({self.rate():,.0f} rows/s)")
+        self.stream.flush()
+
+
+def open_database(args):
+    """Open the SQLite file from ``--db``, or SQL Server if a connection string is given."""
+    from database import ConversionCodeDB
+
+    profiler = getattr(args, 'profiler', None)
+    if args.connection_string:
+        return ConversionCodeDB.from_config({'backend': 'sqlserver',
+                                             'connection_string': args.connection_string,
+                                             'profiler': profiler})
+    return ConversionCodeDB(args.db, profiler=profiler)
+
+
+def cmd_import(args) -> int:
+    """Bulk upsert CSV/JSONL files into the table."""
+    from importer import import_file
+
+    status = 0
+    with open_database(args) as db:
+        for path in args.files:
+            reporter = None if args.quiet else ProgressReporter(f"Importing {path}")
+            result = import_file(db, path, file_format=args.format,
+                                 chunk_size=args.chunk_size, progress=reporter)
+            if reporter is not None:
+                reporter.finish()
+            print(f"{path}: {result.inserted} inserted, {result.updated} updated, "
+                  f"{result.unchanged} unchanged, {result.rejected} rejected")
+            for row_number, message in result.errors:
+                print(f"  row {row_number}: {message}", file=sys.stderr)
+            if result.rejected:
+                status = 1
+    return status
+
+
+def cmd_export(args) -> int:
+    """Stream the table, or the changes since ``--since``, to a file.
+
+    The change sequence number printed at the end is the ``--since`` value
+    for the next delta export.
+    """
+    from database import ChangesPrunedError
+    from exporter import export_changes, export_table
+
+    if args.since is not None and args.format == 'columnar':
+        print("error: --since exports CSV or JSONL only", file=sys.stderr)
+        return 2
+    with open_database(args) as db:
+        if args.since is not None and not db.change_log_enabled:
+            print("error: this database has no change log", file=sys.stderr)
+            return 2
+        reporter = None if args.quiet else ProgressReporter(f"Exporting {args.output}")
+        if args.since is None:
+            # Read first, so the next delta export replays rather than misses
+            # changes made during this one.
+            seq = db.current_change_seq() if db.change_log_enabled else None
+            count = export_table(db, args.output, file_format=args.format,
+                                 gzip_output=args.gzip, batch_size=args.batch_size,
+                                 progress=reporter)
+            what = 'rows'
+        else:
+            try:
+                count, seq = export_changes(db, args.output, args.since,
+                                            file_format=args.format, gzip_output=args.gzip,
+                                            batch_size=args.batch_size, progress=reporter)
+            except ChangesPrunedError as e:
+                print(f"error: {e} Run a full export instead.", file=sys.stderr)
+                return 1
+            what = 'changes'
+        if reporter is not None:
+            reporter.finish()
+    suffix = '' if seq is None else f" (through change {seq})"
+    print(f"{args.output}: {count} {what} exported{suffix}")
+    return 0
+
+
+def cmd_list(args) -> int:
+    """Print the records matching an optional filter, one page at a time."""
+    import csv
+    import json
+    from database import COLUMNS
+    from filters import parse_filter
+
+    try:
+        where = parse_filter(args.where) if args.where else None
+    except ValueError as e:
+        print(f"error: --where: {e}", file=sys.stderr)
+        return 2
+    with open_database(args) as db:
+        if args.count:
+            print(db.count_records(args.filter, where=where))
+            return 0
+        if args.format == 'jsonl':
+            def write(record):
+                sys.stdout.write(json.dumps(record.as_dict(), ensure_ascii=False, default=str))
+                sys.stdout.write('\n')
+        else:
+            writer = csv.writer(sys.stdout, delimiter='\t' if args.format == 'tsv' else ',',
+                                lineterminator='\n')
+            writer.writerow(COLUMNS)
+            write = writer.writerow
+        remaining = args.limit
+        after_id = None
+        while remaining is None or remaining > 0:
+            limit = args.page_size if remaining is None else min(args.page_size, remaining)
+            page = db.get_record_page(after_id=after_id, limit=limit,
+                                      field_name_filter=args.filter, where=where)
+            for record in page:
+                write(record)
+            if len(page) < limit:
+                break
+            after_id = page[-1].CONVERSION_CODE_ID
+            if remaining is not None:
+                remaining -= len(page)
+    return 0
+
+
+def cmd_get(args) -> int:
+    """Print records by ID as JSON lines."""
+    import json
+
+    status = 0
+    with open_database(args) as db:
+        for record_id in args.ids:
+            record = db.get_record(record_id)
+            if record is None:
+                print(f"error: no record with ID {record_id}", file=sys.stderr)
+                status = 1
+                continue
+            print(json.dumps(record.as_dict(), ensure_ascii=False, default=str))
+    return status
+
+
+def cmd_convert(args) -> int:
+    """Print the spectrum value for each source value, one per line.
+
+    Values come from the command line or, if none are given, from stdin,
+    read and converted in chunks so any number of lines can be piped
+    through. Unmapped values print ``--default`` (an empty line by default).
+    With ``--snapshot``, values are looked up in a snapshot file instead
+    of the database.
+    """
+    from itertools import islice
+
+    if args.values:
+        values = iter(args.values)
+    else:
+        values = (line.rstrip('\r\n') for line in sys.stdin)
+    if args.snapshot:
+        from snapshot import Snapshot
+
+        with Snapshot(args.snapshot) as snapshot:
+            while True:
+                chunk = list(islice(values, args.chunk_size))
+                if not chunk:
+                    break
+                for spectrum in snapshot.convert_many(args.field_name, chunk):
+                    sys.stdout.write(f"{args.default if spectrum is None else spectrum}\n")
+        return 0
+    with open_database(args) as db:
+        while True:
+            chunk = list(islice(values, args.chunk_size))
+            if not chunk:
+                break
+            mappings = db.lookup_spectrum_values(args.field_name, chunk)
+            for value in chunk:
+                spectrum = mappings.get(value)
+                sys.stdout.write(f"{args.default if spectrum is None else spectrum}\n")
+    return 0
+
+
+def _parse_column(text: str):
+    """Parse a ``--column`` argument: COLUMN or COLUMN=FIELD_NAME."""
+    column, _, field_name = text.partition('=')
+    if not column or (_ and not field_name):
+        raise argparse.ArgumentTypeError(f"expected COLUMN or COLUMN=FIELD_NAME, not {text!r}")
+    return column, field_name or column
+
+
+def cmd_convert_file(args) -> int:
+    """Convert columns of a CSV or JSONL file through the table, in parallel."""
+    from file_conversion import convert_file, write_unmapped_report
+
+    reporter = None if args.quiet else ProgressReporter(f"Converting {args.input}")
+    columns = dict(args.columns)
+    options = dict(file_format=args.format, default=args.default, workers=args.workers,
+                   chunk_size=args.chunk_size, progress=reporter)
+    if args.snapshot:
+        result = convert_file(args.snapshot, args.input, args.output, columns, **options)
+    else:
+        with open_database(args) as db:
+            result = convert_file(db, args.input, args.output, columns, **options)
+    if reporter is not None:
+        reporter.finish()
+    print(f"{args.output}: {result.rows} rows, {result.converted} values converted, "
+          f"{result.unmapped} unmapped in {result.seconds:.1f}s")
+    for field_name, counts in sorted(result.unmapped_values.items()):
+        print(f"  {field_name}: {sum(counts.values())} unmapped, "
+              f"{len(counts)} distinct values", file=sys.stderr)
+    if args.unmapped_report:
+        write_unmapped_report(result, args.unmapped_report)
+    return 0
+
+
+def cmd_snapshot(args) -> int:
+    """Compile the table into a snapshot file for lookup workers."""
+    from snapshot import compile_snapshot, read_snapshot_info, refresh_snapshot
+
+    started = time.perf_counter()
+    with open_database(args) as db:
+        if not args.if_changed:
+            keys = compile_snapshot(db, args.output)
+        elif refresh_snapshot(db, args.output):
+            keys = read_snapshot_info(args.output).keys
+        else:
+            print(f"{args.output}: up to date")
+            return 0
+    print(f"{args.output}: {keys} mappings written in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+def cmd_serve(args) -> int:
+    """Answer JSON requests over HTTP until interrupted."""
+    from service import make_server
+
+    with open_database(args) as db:
+        server = make_server(db, args.host, args.port, preload=args.preload,
+                             verbose=args.verbose)
+        host, port = server.server_address[:2]
+        print(f"Serving conversion codes on http://{host}:{port}/", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    return 0
+
+
+def _format_values(values, total: int) -> str:
+    """Join sample values, noting how many more there are."""
+    text = ', '.join('NULL' if value is None else str(value) for value in values)
+    if total > len(values):
+        text += f", ... ({total - len(values):,} more)"
+    return text
+
+
+def _print_issues(title: str, count: int, lines: List[str]):
+    """Print one check's count and its listed issues."""
+    print(f"{title}: {count:,}")
+    for line in lines:
+        print(f"  {line}")
+    if count > len(lines):
+        print(f"  ... and {count - len(lines):,} more")
+
+
+def cmd_check(args) -> int:
+    """Report duplicate and conflicting keys, orphaned field names and
+    spectrum values mapped from several source values.
+
+    Exits with 1 if there are duplicates, conflicts or orphaned field
+    names; reverse mappings alone are only a warning.
+    """
+    known_fields = None
+    if args.known_fields:
+        with open(args.known_fields, encoding='utf-8') as f:
+            known_fields = [line.strip() for line in f if line.strip()]
+    with open_database(args) as db:
+        report = db.check_integrity(args.checks, max_issues=args.max_issues,
+                                    known_fields=known_fields)
+
+    print(f"Checked {report.rows_checked:,} rows in {report.seconds:.1f}s")
+    for title, count, issues in (("Conflicting keys", report.conflict_count, report.conflicts),
+                                 ("Duplicate keys", report.duplicate_count, report.duplicates)):
+        _print_issues(title, count, [
+            f"{issue.field_name} / {issue.source_value} -> "
+            f"{_format_values(issue.spectrum_values, len(issue.spectrum_values))} "
+            f"(IDs {_format_values(issue.record_ids, issue.records)})"
+            for issue in issues])
+    _print_issues("Orphaned field names", report.orphaned_count, [
+        f"{orphan.field_name!r}: {orphan.records:,} records, {orphan.reason}"
+        + (f" (use {orphan.canonical!r})" if orphan.canonical else "")
+        for orphan in report.orphaned_field_names])
+    _print_issues("Spectrum values mapped from several source values (warning)",
+                  report.reverse_mapping_count, [
+                      f"{mapping.field_name} / {mapping.spectrum_value} <- "
+                      f"{_format_values(mapping.source_values, mapping.sources)}"
+                      for mapping in report.reverse_mappings])
+    return 0 if report.ok else 1
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build the argument parser for all subcommands."""
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--db', default=DEFAULT_DB_PATH,
+                        help=f"SQLite database file (default: {DEFAULT_DB_PATH})")
+    common.add_argument('--connection-string',
+                        help="ODBC connection string; use SQL Server instead of --db")
+    common.add_argument('--profile', metavar='FILE',
+                        help="Write timings of database operations to a JSON file")
+
+    parser = argparse.ArgumentParser(prog="python -m cli",
+                                     description="Manage conversion codes.")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    import_parser = subparsers.add_parser(
+        'import', parents=[common], help="Insert or update codes from CSV/JSONL files")
+    import_parser.add_argument('files', nargs='+', help="CSV or JSONL files, optionally .gz")
+    import_parser.add_argument('--format', choices=('csv', 'jsonl'),
+                               help="File format (default: from file extension)")
+    import_parser.add_argument('--chunk-size', type=int, default=5000,
+                               help="Rows per transaction (default: 5000)")
+    import_parser.add_argument('--quiet', action='store_true', help="Suppress progress output")
+    import_parser.set_defaults(handler=cmd_import)
+
+    export_parser = subparsers.add_parser(
+        'export', parents=[common], help="Export the table to a CSV, JSONL or columnar file")
+    export_parser.add_argument('output', help="Output file")
+    export_parser.add_argument('--format', choices=('csv', 'jsonl', 'columnar'), default='csv',
+                               help="Output format (default: csv)")
+    export_parser.add_argument('--gzip', action='store_true',
+                               help="Gzip CSV/JSONL output (implied by a .gz file name)")
+    export_parser.add_argument('--batch-size', type=int, default=1000,
+                               help="Rows fetched per database round trip (default: 1000)")
+    export_parser.add_argument('--since', type=int, metavar='SEQ',
+                               help="Export only the changes after this change sequence "
+                                    "number, as CSV or JSONL")
+    export_parser.add_argument('--quiet', action='store_true', help="Suppress progress output")
+    export_parser.set_defaults(handler=cmd_export)
+
+    check_parser = subparsers.add_parser(
+        'check', parents=[common], help="Report duplicate, conflicting and orphaned mappings")
+    check_parser.add_argument('--checks', nargs='+', choices=('keys', 'field_names', 'reverse'),
+                              help="Checks to run (default: all)")
+    check_parser.add_argument('--known-fields', metavar='FILE',
+                              help="File listing the valid field names, one per line")
+    check_parser.add_argument('--max-issues', type=int, default=20,
+                              help="Issues listed per check (default: 20)")
+    check_parser.set_defaults(handler=cmd_check)
+
+    list_parser = subparsers.add_parser(
+        'list', parents=[common], help="Print records, optionally filtered by field name")
+    list_parser.add_argument('filter', nargs='?',
+                             help="Field name filter: TEXT, =EXACT or PREFIX*")
+    list_parser.add_argument('--where', metavar='EXPR',
+                             help="Composite filter, e.g. \"imported = N and updates > 0\"")
+    list_parser.add_argument('--format', choices=('tsv', 'csv', 'jsonl'), default='tsv',
+                             help="Output format (default: tsv)")
+    list_parser.add_argument('--limit', type=int, help="Print at most this many records")
+    list_parser.add_argument('--page-size', type=int, default=1000,
+                             help="Records fetched per query (default: 1000)")
+    list_parser.add_argument('--count', action='store_true',
+                             help="Print only the number of matching records")
+    list_parser.set_defaults(handler=cmd_list)
+
+    get_parser = subparsers.add_parser(
+        'get', parents=[common], help="Print records by ID as JSON lines")
+    get_parser.add_argument('ids', nargs='+', type=int, metavar='ID')
+    get_parser.set_defaults(handler=cmd_get)
+
+    convert_parser = subparsers.add_parser(
+        'convert', parents=[common], help="Convert source values of one field name")
+    convert_parser.add_argument('field_name', help="Field name, matched exactly")
+    convert_parser.add_argument('values', nargs='*',
+                                help="Source values (default: one per line from stdin)")
+    convert_parser.add_argument('--default', default='',
+                                help="Printed for unmapped values (default: empty line)")
+    convert_parser.add_argument('--chunk-size', type=int, default=5000,
+                                help="Values converted per batch (default: 5000)")
+    convert_parser.add_argument('--snapshot', metavar='FILE',
+                                help="Look values up in a snapshot file instead of the database")
+    convert_parser.set_defaults(handler=cmd_convert)
+
+    convert_file_parser = subparsers.add_parser(
+        'convert-file', parents=[common],
+        help="Convert columns of a CSV or JSONL file through the table")
+    convert_file_parser.add_argument('input', help="CSV or JSONL file, optionally .gz")
+    convert_file_parser.add_argument('output', help="Converted file, .gz to compress")
+    convert_file_parser.add_argument('--column', dest='columns', action='append', required=True,
+                                     type=_parse_column, metavar='COLUMN[=FIELD_NAME]',
+                                     help="Column to convert and the field name its values "
+                                          "belong to (default: the column name); repeatable")
+    convert_file_parser.add_argument('--format', choices=('csv', 'jsonl'),
+                                     help="Input format (default: from the file name)")
+    convert_file_parser.add_argument('--default',
+                                     help="Written for unmapped values (default: keep them)")
+    convert_file_parser.add_argument('--workers', type=int,
+                                     help="Worker processes (default: one per CPU)")
+    convert_file_parser.add_argument('--chunk-size', type=int, default=4 * 1024 * 1024,
+                                     help="Characters of input per chunk (default: 4 MiB)")
+    convert_file_parser.add_argument('--snapshot', metavar='FILE',
+                                     help="Use this snapshot file instead of the database")
+    convert_file_parser.add_argument('--unmapped-report', metavar='FILE',
+                                     help="Write unmapped values and their counts as CSV")
+    convert_file_parser.add_argument('--quiet', action='store_true',
+                                     help="Suppress progress output")
+    convert_file_parser.set_defaults(handler=cmd_convert_file)
+
+    snapshot_parser = subparsers.add_parser(
+        'snapshot', parents=[common], help="Write a memory-mappable snapshot of all mappings")
+    snapshot_parser.add_argument('output', help="Snapshot file, replaced atomically")
+    snapshot_parser.add_argument('--if-changed', action='store_true',
+                                 help="Only write it if the table changed since it was written")
+    snapshot_parser.set_defaults(handler=cmd_snapshot)
+
+    serve_parser = subparsers.add_parser(
+        'serve', parents=[common], help="Serve records and conversions as HTTP/JSON")
+    serve_parser.add_argument('--host', default='127.0.0.1',
+                              help="Address to listen on (default: 127.0.0.1)")
+    serve_parser.add_argument('--port', type=int, default=8765,
+                              help="Port to listen on (default: 8765)")
+    serve_parser.add_argument('--preload', action='store_true',
+                              help="Load all mappings into memory for faster conversions")
+    serve_parser.add_argument('--verbose', action='store_true', help="Log every request")
+    serve_parser.set_defaults(handler=cmd_serve)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    """Run the CLI and return its exit status."""
+    args = build_parser().parse_args(argv)
+    if args.profile:
+        from instrumentation import Profiler
+        args.profiler = Profiler(enabled=True)
+    status = args.handler(args)
+    if args.profile:
+        with open(args.profile, 'w', encoding='utf-8') as f:
+            args.profiler.dump(f)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,264 @@
+"""Prefix completion and existing-mapping previews for record entry.
+
+``CompletionIndex`` keeps the distinct field names in memory, in a
+``SortedIndex``, and loads a field's source values and mappings the first
+time they are asked for. Lookups while typing are a binary search and a
+dict lookup, so they never touch the database. ``refresh()`` applies the
+change log entries written since the last call; without a change log it
+reloads, which is one GROUP BY over the covering index on FIELD_NAME.
+"""
+import threading
+from bisect import bisect_left, insort
+from collections import Counter, OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from database import (CHANGE_DELETE, CHANGE_INSERT, TABLE_NAME, Change, ChangesPrunedError,
+                      ConversionCodeDB, Record)
+
+
+# Suggestions returned per prefix.
+MAX_SUGGESTIONS = 20
+
+# Fields whose source values are kept loaded; the least recently used go first.
+MAX_LOADED_FIELDS = 32
+
+SELECT_FIELD_KEYS_SQL = f'''
+    SELECT CONVERSION_CODE_ID, SOURCE_VALUE, SPECTRUM_VALUE FROM {TABLE_NAME}
+    WHERE FIELD_NAME = ?
+    ORDER BY CONVERSION_CODE_ID
+'''
+
+
+def _fold(value: str) -> str:
+    """The form values are compared in: case and surrounding spaces ignored."""
+    return value.strip().casefold()
+
+
+class SortedIndex:
+    """Distinct strings in case-insensitive order, for prefix searches.
+
+    Values that differ only in case or surrounding spaces are kept apart,
+    and ``variants`` finds them.
+    """
+
+    def __init__(self, values=()):
+        self._entries: List[Tuple[str, str]] = sorted({(_fold(v), v) for v in values})
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, value: str) -> bool:
+        entry = (_fold(value), value)
+        position = bisect_left(self._entries, entry)
+        return position < len(self._entries) and self._entries[position] == entry
+
+    def add(self, value: str):
+        if value not in self:
+            insort(self._entries, (_fold(value), value))
+
+    def remove(self, value: str):
+        entry = (_fold(value), value)
+        position = bisect_left(self._entries, entry)
+        if position < len(self._entries) and self._entries[position] == entry:
+            del self._entries[position]
+
+    def complete(self, prefix: str, limit: int = MAX_SUGGESTIONS) -> List[str]:
+        """Values starting with ``prefix``, ignoring case, in order."""
+        folded = prefix.lstrip().casefold()
+        entries = self._entries
+        position = bisect_left(entries, (folded,))
+        matches = []
+        while (position < len(entries) and len(matches) < limit
+               and entries[position][0].startswith(folded)):
+            matches.append(entries[position][1])
+            position += 1
+        return matches
+
+    def variants(self, value: str) -> List[str]:
+        """Stored values equal to ``value`` apart from case and surrounding spaces."""
+        folded = _fold(value)
+        entries = self._entries
+        position = bisect_left(entries, (folded,))
+        found = []
+        while position < len(entries) and entries[position][0] == folded:
+            found.append(entries[position][1])
+            position += 1
+        return found
+
+
+class _FieldKeys:
+    """One field's source values, and the records mapping each."""
+
+    def __init__(self):
+        self.sources = SortedIndex()
+        # SOURCE_VALUE -> {CONVERSION_CODE_ID: SPECTRUM_VALUE}, in ID order.
+        self.records: Dict[str, Dict[int, Optional[str]]] = {}
+
+    def add(self, record_id: int, source_value: str, spectrum_value: Optional[str]):
+        records = self.records.get(source_value)
+        if records is None:
+            records = self.records[source_value] = {}
+            self.sources.add(source_value)
+        records[record_id] = spectrum_value
+
+    def remove(self, record_id: int, source_value: str):
+        records = self.records.get(source_value)
+        if records is None:
+            return
+        records.pop(record_id, None)
+        if not records:
+            del self.records[source_value]
+            self.sources.remove(source_value)
+
+
+class MappingPreview(NamedTuple):
+    """What a (field name, source value) pair already maps to.
+
+    ``spectrum_values`` holds one value per other record with that exact
+    key, the record that conversions use (the highest ID) last.
+    ``field_variants`` and ``source_variants`` are existing values that
+    differ from the typed ones only in case or surrounding spaces.
+    """
+    known_field: bool
+    spectrum_values: Tuple[Optional[str], ...]
+    field_variants: Tuple[str, ...]
+    source_variants: Tuple[str, ...]
+
+    @property
+    def exists(self) -> bool:
+        return bool(self.spectrum_values)
+
+
+class CompletionIndex:
+    """Field names and, per field, source values for completing record entry.
+
+    ``refresh``, ``load_field`` and ``reload`` query the database and are
+    meant for a worker thread; the other methods only read memory and
+    answer while the user types. ``source_values`` and ``preview`` know a
+    field's source values once ``load_field`` has run for it. Thread-safe.
+    """
+
+    def __init__(self, db: ConversionCodeDB):
+        self.db = db
+        self._lock = threading.Lock()
+        self._field_counts: Counter = Counter()
+        self._fields = SortedIndex()
+        self._loaded: 'OrderedDict[str, _FieldKeys]' = OrderedDict()
+        self._change_seq: Optional[int] = None
+        self.loaded = False
+
+    def reload(self):
+        """Load the distinct field names and forget loaded source values."""
+        change_seq = self.db.current_change_seq() if self.db.change_log_enabled else None
+        counts = Counter({group.field_name: group.records
+                          for group in self.db.field_name_summary()
+                          if group.field_name is not None})
+        with self._lock:
+            self._field_counts = counts
+            self._fields = SortedIndex(counts)
+            self._loaded.clear()
+            self._change_seq = change_seq
+            self.loaded = True
+
+    def refresh(self):
+        """Catch up with the table: apply logged changes, or reload."""
+        if not self.loaded or self._change_seq is None:
+            self.reload()
+            return
+        try:
+            changes = list(self.db.changes_since(self._change_seq))
+        except ChangesPrunedError:
+            self.reload()
+            return
+        with self._lock:
+            for change in changes:
+                # A concurrent refresh may have applied it already.
+                if change.seq > self._change_seq:
+                    self._apply(change)
+                    self._change_seq = change.seq
+
+    def _apply(self, change: Change):
+        """Apply one change log entry; the lock is held."""
+        record = change.record
+        if change.operation != CHANGE_INSERT:
+            self._remove_key(record.CONVERSION_CODE_ID, change.old_field_name,
+                             change.old_source_value)
+        if change.operation != CHANGE_DELETE:
+            self._add_record(record)
+
+    def _add_record(self, record: Record):
+        field_name = record.FIELD_NAME
+        if field_name is None:
+            return
+        self._field_counts[field_name] += 1
+        if self._field_counts[field_name] == 1:
+            self._fields.add(field_name)
+        keys = self._loaded.get(field_name)
+        if keys is not None and record.SOURCE_VALUE is not None:
+            keys.add(record.CONVERSION_CODE_ID, record.SOURCE_VALUE, record.SPECTRUM_VALUE)
+
+    def _remove_key(self, record_id: int, field_name: Optional[str],
+                    source_value: Optional[str]):
+        if field_name is None:
+            return
+        self._field_counts[field_name] -= 1
+        if self._field_counts[field_name] <= 0:
+            del self._field_counts[field_name]
+            self._fields.remove(field_name)
+        keys = self._loaded.get(field_name)
+        if keys is not None and source_value is not None:
+            keys.remove(record_id, source_value)
+
+    def load_field(self, field_name: str):
+        """Load a field's source values and mappings, unless already loaded.
+
+        Changes that ``refresh`` applies afterwards may already be in what
+        was read; applying a record's changes again is harmless.
+        """
+        with self._lock:
+            if field_name in self._loaded:
+                self._loaded.move_to_end(field_name)
+                return
+        keys = _FieldKeys()
+        with self.db.connection() as conn:
+            for record_id, source_value, spectrum_value in conn.execute(
+                    SELECT_FIELD_KEYS_SQL, (field_name,)).fetchall():
+                if source_value is not None:
+                    keys.add(record_id, source_value, spectrum_value)
+        with self._lock:
+            self._loaded[field_name] = keys
+            while len(self._loaded) > MAX_LOADED_FIELDS:
+                self._loaded.popitem(last=False)
+
+    def field_loaded(self, field_name: str) -> bool:
+        with self._lock:
+            return field_name in self._loaded
+
+    def field_names(self, prefix: str = '', limit: int = MAX_SUGGESTIONS) -> List[str]:
+        """Existing field names starting with ``prefix``, ignoring case."""
+        with self._lock:
+            return self._fields.complete(prefix, limit)
+
+    def source_values(self, field_name: str, prefix: str = '',
+                      limit: int = MAX_SUGGESTIONS) -> List[str]:
+        """A loaded field's source values starting with ``prefix``, ignoring case."""
+        with self._lock:
+            keys = self._loaded.get(field_name)
+            return keys.sources.complete(prefix, limit) if keys is not None else []
+
+    def preview(self, field_name: str, source_value: str,
+                exclude_id: Optional[int] = None) -> MappingPreview:
+        """What the key already maps to, leaving out record ``exclude_id``."""
+        with self._lock:
+            known_field = field_name in self._field_counts
+            field_variants = tuple(name for name in self._fields.variants(field_name)
+                                   if name != field_name)
+            keys = self._loaded.get(field_name)
+            if keys is None:
+                return MappingPreview(known_field, (), field_variants, ())
+            records = keys.records.get(source_value, {})
+            spectrum_values = tuple(spectrum for record_id, spectrum in sorted(records.items())
+                                    if record_id != exclude_id)
+            source_variants = tuple(value for value in keys.sources.variants(source_value)
+                                    if value != source_value)
+        return MappingPreview(known_field, spectrum_values, field_variants, source_variants)
@@ -0,0 +1,192 @@
+"""Connection pooling for long-lived database connections."""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, List, Optional, Tuple
+
+
+class PoolTimeoutError(RuntimeError):
+    """Raised when no pooled connection becomes available in time."""
+
+
+class PoolClosedError(RuntimeError):
+    """Raised when a connection is requested from a closed pool."""
+
+
+class _ThreadState:
+    """Connection currently checked out by one thread, and its nesting depth."""
+    __slots__ = ('conn', 'depth', 'failed')
+
+    def __init__(self):
+        self.conn = None
+        self.depth = 0
+        self.failed = False
+
+
+class ConnectionPool:
+    """Small thread-aware pool of long-lived DB-API connections.
+
+    A thread that already holds a connection gets the same one back on
+    nested checkouts, so a caller can group several operations on one
+    connection without passing it around. Transactions are the caller's
+    business: e.g. ``with conn:`` commits on exit even when nested. The
+    connection returns to the pool when the last overlapping checkout on
+    that thread ends, whatever order they end in.
+    """
+
+    def __init__(self, connect: Callable[[], Any], size: int = 4,
+                 timeout: float = 30.0,
+                 health_check: Optional[Callable[[Any], None]] = None,
+                 health_check_interval: float = 30.0):
+        """Initialize the pool.
+
+        ``connect`` creates a new connection, ``health_check`` raises if a
+        connection is no longer usable. Idle connections are health checked
+        on checkout once they have been idle for ``health_check_interval``
+        seconds.
+        """
+        if size < 1:
+            raise ValueError("Pool size must be at least 1.")
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        self._health_check = health_check
+        self.health_check_interval = health_check_interval
+        self._idle: List[Tuple[Any, float]] = []
+        self._created = 0
+        self._closed = False
+        self._cond = threading.Condition(threading.Lock())
+        self._local = threading.local()
+
+    @property
+    def closed(self) -> bool:
+        """Whether the pool has been closed."""
+        return self._closed
+
+    def stats(self) -> dict:
+        """Return a snapshot of pool usage counters."""
+        with self._cond:
+            return {
+                'size': self.size,
+                'created': self._created,
+                'idle': len(self._idle),
+                'in_use': self._created - len(self._idle),
+            }
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the duration of the ``with`` block."""
+        # Capture this thread's state so a block finished elsewhere (e.g. a
+        # generator closed by the garbage collector) updates the right thread.
+        state = self._thread_state()
+        if state.conn is None:
+            state.conn = self._acquire()
+            state.failed = False
+        conn = state.conn
+        state.depth += 1
+        try:
+            yield conn
+        except BaseException:
+            state.failed = True
+            raise
+        finally:
+            state.depth -= 1
+            if state.depth == 0:
+                state.conn = None
+                self._release(conn, check=state.failed)
+
+    def _thread_state(self):
+        """Return the calling thread's checkout state."""
+        state = getattr(self._local, 'state', None)
+        if state is None:
+            state = self._local.state = _ThreadState()
+        return state
+
+    def close(self):
+        """Close idle connections and refuse further checkouts.
+
+        Connections still checked out are closed when they are returned.
+        """
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def _acquire(self):
+        """Take an idle connection or open a new one, waiting if at capacity."""
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolClosedError("Connection pool is closed.")
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                    break
+                if self._created < self.size:
+                    self._created += 1
+                    conn, idle_since = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeoutError(
+                        f"No connection available within {self.timeout} seconds.")
+                self._cond.wait(remaining)
+
+        if conn is None:
+            return self._open()
+        if (self._health_check is not None
+                and time.monotonic() - idle_since >= self.health_check_interval):
+            if not self._is_healthy(conn):
+                self._close_quietly(conn)
+                return self._open()
+        return conn
+
+    def _open(self):
+        """Open a new connection for a slot already reserved in ``_created``."""
+        try:
+            return self._connect()
+        except BaseException:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+    def _release(self, conn, check: bool = False):
+        """Return a connection to the pool, dropping it if it is broken."""
+        if check and not self._is_healthy(conn):
+            self._discard(conn)
+            return
+        with self._cond:
+            if not self._closed:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+                return
+        self._discard(conn)
+
+    def _discard(self, conn):
+        """Close a connection and free its slot."""
+        self._close_quietly(conn)
+        with self._cond:
+            self._created -= 1
+            self._cond.notify()
+
+    def _is_healthy(self, conn) -> bool:
+        """Run the health check, treating any error as an unusable connection."""
+        if self._health_check is None:
+            return True
+        try:
+            self._health_check(conn)
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        """Close a connection, ignoring errors from already-broken ones."""
+        try:
+            conn.close()
+        except Exception:
+            pass
@@ -1,23 +1,744 @@
 """Database module for conversion code management."""
+import random
 import sqlite3
-from typing import List, Dict, Optional, Tuple
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
+from typing import Callable, Iterable, Iterator, List, Dict, NamedTuple, Optional, Sequence, Tuple
 from datetime import datetime
 
+from connection_pool import ConnectionPool, PoolClosedError
+from instrumentation import Profiler, ProfilingCursor
+from query_cache import QueryCache
 
-class ConversionCodeDB:
-    """Database handler for conversion codes."""
-    
-    def __init__(self, db_path: str = "conversion_codes.db"):
-        """Initialize database connection."""
+
+TABLE_NAME = 'S_CONVERSION_CODE_G97'
+
+COLUMNS = ('CONVERSION_CODE_ID', 'FIELD_NAME', 'SOURCE_VALUE', 'SPECTRUM_VALUE',
+           'IS_IMPORTED', 'UPDATE_COUNT', 'CHANGE_DATE_TIME')
+
+MAX_FIELD_NAME_LENGTH = 50
+MAX_SOURCE_VALUE_LENGTH = 20
+MAX_SPECTRUM_VALUE_LENGTH = 10
+IMPORTED_FLAGS = ('Y', 'N')
+
+SELECT_ALL_SQL = f'''
+    SELECT * FROM {TABLE_NAME}
+    ORDER BY CONVERSION_CODE_ID
+'''
+
+SELECT_WHERE_SQL = f'''
+    SELECT * FROM {TABLE_NAME}
+    WHERE {{where}}
+    ORDER BY CONVERSION_CODE_ID
+'''
+
+SELECT_ROWS_SQL = f'''
+    SELECT {', '.join(COLUMNS)} FROM {TABLE_NAME}
+    ORDER BY CONVERSION_CODE_ID
+'''
+
+SELECT_PAGE_SQL = f'''
+    SELECT * FROM {TABLE_NAME}
+    WHERE {{where}}
+    ORDER BY {{order}}
+    LIMIT ? OFFSET ?
+'''
+
+# Counts per FIELD_NAME; a covering index on (FIELD_NAME, IS_IMPORTED) lets
+# this run on the index alone.
+FIELD_SUMMARY_SQL = f'''
+    SELECT FIELD_NAME, COUNT(*), SUM(CASE WHEN IS_IMPORTED = 'Y' THEN 1 ELSE 0 END)
+    FROM {TABLE_NAME}
+    WHERE {{where}}
+    GROUP BY FIELD_NAME
+    ORDER BY FIELD_NAME
+'''
+
+COUNT_WHERE_SQL = f'SELECT COUNT(*) FROM {TABLE_NAME} WHERE {{where}}'
+
+SELECT_BY_ID_SQL = f'SELECT * FROM {TABLE_NAME} WHERE CONVERSION_CODE_ID = ?'
+
+INSERT_SQL = f'''
+    INSERT INTO {TABLE_NAME}
+    (FIELD_NAME, SOURCE_VALUE, SPECTRUM_VALUE, IS_IMPORTED, UPDATE_COUNT, CHANGE_DATE_TIME)
+    VALUES (?, ?, ?, ?, 0, ?)
+'''
+
+UPDATE_SQL = f'''
+    UPDATE {TABLE_NAME}
+    SET FIELD_NAME = ?, SOURCE_VALUE = ?, SPECTRUM_VALUE = ?,
+        IS_IMPORTED = ?, UPDATE_COUNT = UPDATE_COUNT + 1,
+        CHANGE_DATE_TIME = ?
+    WHERE CONVERSION_CODE_ID = ?
+'''
+
+DELETE_SQL = f'DELETE FROM {TABLE_NAME} WHERE CONVERSION_CODE_ID = ?'
+
+# Optimistic concurrency: UPDATE_COUNT is the record's version, and these
+# only write if it is still the one the caller read.
+UPDATE_IF_VERSION_SQL = f'''
+    UPDATE {TABLE_NAME}
+    SET FIELD_NAME = ?, SOURCE_VALUE = ?, SPECTRUM_VALUE = ?,
+        IS_IMPORTED = ?, UPDATE_COUNT = UPDATE_COUNT + 1,
+        CHANGE_DATE_TIME = ?
+    WHERE CONVERSION_CODE_ID = ? AND UPDATE_COUNT = ?
+'''
+
+DELETE_IF_VERSION_SQL = (f'DELETE FROM {TABLE_NAME} '
+                         f'WHERE CONVERSION_CODE_ID = ? AND UPDATE_COUNT = ?')
+
+# Columns ``update_many`` may change.
+UPDATABLE_COLUMNS = ('FIELD_NAME', 'SOURCE_VALUE', 'SPECTRUM_VALUE', 'IS_IMPORTED')
+
+# IDs per statement in batch operations, below SQLite's historical limit of
+# 999 bound parameters.
+BATCH_CHUNK_SIZE = 500
+
+SELECT_IDS_SQL = f'''
+    SELECT CONVERSION_CODE_ID FROM {TABLE_NAME}
+    WHERE {{where}}
+    ORDER BY CONVERSION_CODE_ID
+'''
+
+SELECT_UPDATABLE_SQL = f'''
+    SELECT CONVERSION_CODE_ID, UPDATE_COUNT, {', '.join(UPDATABLE_COLUMNS)} FROM {TABLE_NAME}
+    WHERE CONVERSION_CODE_ID IN ({{ids}})
+'''
+
+DELETE_MANY_SQL = f'DELETE FROM {TABLE_NAME} WHERE CONVERSION_CODE_ID IN ({{ids}})'
+
+# Conversions read the (FIELD_NAME, SOURCE_VALUE) index. Where several rows
+# share a key the highest ID wins, as in lookup.CodeTranslator.
+SELECT_MAPPINGS_SQL = f'''
+    SELECT SOURCE_VALUE, SPECTRUM_VALUE FROM {TABLE_NAME}
+    WHERE FIELD_NAME = ? AND SOURCE_VALUE IN ({{values}})
+    ORDER BY CONVERSION_CODE_ID
+'''
+
+FTS_TABLE_NAME = f'{TABLE_NAME}_FTS'
+
+# Substring search over FIELD_NAME uses an external-content FTS5 table with the
+# trigram tokenizer, kept in sync with the base table by triggers.
+CREATE_FTS_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE_NAME} USING fts5("
+    f"FIELD_NAME, content='{TABLE_NAME}', content_rowid='CONVERSION_CODE_ID', "
+    f"tokenize='trigram')"
+)
+
+CREATE_FTS_TRIGGERS_SQL = (
+    f'''
+    CREATE TRIGGER IF NOT EXISTS TR_{TABLE_NAME}_FTS_INSERT
+    AFTER INSERT ON {TABLE_NAME} BEGIN
+        INSERT INTO {FTS_TABLE_NAME} (rowid, FIELD_NAME)
+        VALUES (new.CONVERSION_CODE_ID, new.FIELD_NAME);
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS TR_{TABLE_NAME}_FTS_DELETE
+    AFTER DELETE ON {TABLE_NAME} BEGIN
+        INSERT INTO {FTS_TABLE_NAME} ({FTS_TABLE_NAME}, rowid, FIELD_NAME)
+        VALUES ('delete', old.CONVERSION_CODE_ID, old.FIELD_NAME);
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS TR_{TABLE_NAME}_FTS_UPDATE
+    AFTER UPDATE OF FIELD_NAME ON {TABLE_NAME} BEGIN
+        INSERT INTO {FTS_TABLE_NAME} ({FTS_TABLE_NAME}, rowid, FIELD_NAME)
+        VALUES ('delete', old.CONVERSION_CODE_ID, old.FIELD_NAME);
+        INSERT INTO {FTS_TABLE_NAME} (rowid, FIELD_NAME)
+        VALUES (new.CONVERSION_CODE_ID, new.FIELD_NAME);
+    END
+    ''',
+)
+
+# The trigram tokenizer cannot use its index for terms shorter than this.
+FTS_MIN_TERM_LENGTH = 3
+
+# Records whose FIELD_NAME contains the quoted phrase bound to the parameter.
+FTS_MATCH_SQL = (f'CONVERSION_CODE_ID IN (SELECT rowid FROM {FTS_TABLE_NAME} '
+                 f'WHERE {FTS_TABLE_NAME} MATCH ?)')
+
+CHANGES_TABLE_NAME = f'{TABLE_NAME}_CHANGES'
+
+CHANGE_INSERT = 'I'
+CHANGE_UPDATE = 'U'
+CHANGE_DELETE = 'D'
+
+# One row per inserted, updated or deleted record, written by triggers in the
+# same transaction as the change. CHANGE_SEQ never goes backwards or repeats
+# (AUTOINCREMENT), and SQLite's single writer commits changes in CHANGE_SEQ
+# order. The record columns hold the row after an insert or update and before
+# a delete; OLD_FIELD_NAME and OLD_SOURCE_VALUE hold the natural key before an
+# update or delete.
+CHANGE_COLUMNS = ('CHANGE_SEQ', 'OPERATION') + COLUMNS + ('OLD_FIELD_NAME',
+                                                          'OLD_SOURCE_VALUE')
+
+CREATE_CHANGES_SQL = f'''
+    CREATE TABLE IF NOT EXISTS {CHANGES_TABLE_NAME} (
+        CHANGE_SEQ INTEGER PRIMARY KEY AUTOINCREMENT,
+        OPERATION CHAR(1) NOT NULL,
+        CONVERSION_CODE_ID INTEGER NOT NULL,
+        FIELD_NAME VARCHAR(50),
+        SOURCE_VALUE VARCHAR(20),
+        SPECTRUM_VALUE VARCHAR(10),
+        IS_IMPORTED CHAR(1),
+        UPDATE_COUNT INTEGER,
+        CHANGE_DATE_TIME TIMESTAMP,
+        OLD_FIELD_NAME VARCHAR(50),
+        OLD_SOURCE_VALUE VARCHAR(20)
+    )
+'''
+
+_LOG_CHANGE_SQL = f'''
+    CREATE TRIGGER IF NOT EXISTS TR_{TABLE_NAME}_LOG_{{name}}
+    AFTER {{event}} ON {TABLE_NAME} BEGIN
+        INSERT INTO {CHANGES_TABLE_NAME}
+        (OPERATION, {', '.join(COLUMNS)}, OLD_FIELD_NAME, OLD_SOURCE_VALUE)
+        VALUES ('{{operation}}', {{row}}.CONVERSION_CODE_ID, {{row}}.FIELD_NAME,
+                {{row}}.SOURCE_VALUE, {{row}}.SPECTRUM_VALUE, {{row}}.IS_IMPORTED,
+                {{row}}.UPDATE_COUNT, {{row}}.CHANGE_DATE_TIME, {{old_key}});
+    END
+'''
+
+CREATE_CHANGES_TRIGGERS_SQL = (
+    _LOG_CHANGE_SQL.format(name='INSERT', event='INSERT', operation=CHANGE_INSERT,
+                           row='new', old_key='NULL, NULL'),
+    _LOG_CHANGE_SQL.format(name='UPDATE', event='UPDATE', operation=CHANGE_UPDATE,
+                           row='new', old_key='old.FIELD_NAME, old.SOURCE_VALUE'),
+    _LOG_CHANGE_SQL.format(name='DELETE', event='DELETE', operation=CHANGE_DELETE,
+                           row='old', old_key='old.FIELD_NAME, old.SOURCE_VALUE'),
+)
+
+SELECT_CHANGES_SQL = f'''
+    SELECT {', '.join(CHANGE_COLUMNS)} FROM {CHANGES_TABLE_NAME}
+    WHERE CHANGE_SEQ > ?
+    ORDER BY CHANGE_SEQ
+'''
+
+# Separate subqueries, as SQLite only reads MIN or MAX from the end of the
+# key when the query has a single one of them.
+CHANGE_SEQ_RANGE_SQL = (f'SELECT (SELECT MIN(CHANGE_SEQ) FROM {CHANGES_TABLE_NAME}), '
+                        f'(SELECT MAX(CHANGE_SEQ) FROM {CHANGES_TABLE_NAME})')
+
+# The newest entry is always kept, so a reader can tell from the oldest
+# remaining one whether entries it has not seen yet were pruned.
+PRUNE_CHANGES_SQL = f'''
+    DELETE FROM {CHANGES_TABLE_NAME}
+    WHERE CHANGE_SEQ <= ?
+      AND CHANGE_SEQ < (SELECT MAX(CHANGE_SEQ) FROM {CHANGES_TABLE_NAME})
+'''
+
+# An external commit touching more records than this clears the query cache
+# rather than invalidating it record by record.
+MAX_TRACKED_CHANGES = 1000
+
+# With unique keys enforced, no two records share a (FIELD_NAME,
+# SOURCE_VALUE) key. Keys with a NULL part are exempt, as in SQL Server's
+# filtered index.
+UNIQUE_KEY_INDEX_NAME = f'UX_{TABLE_NAME}_FIELD_SOURCE'
+
+CREATE_UNIQUE_KEY_SQL = f'''
+    CREATE UNIQUE INDEX IF NOT EXISTS {UNIQUE_KEY_INDEX_NAME}
+    ON {TABLE_NAME} (FIELD_NAME, SOURCE_VALUE)
+    WHERE FIELD_NAME IS NOT NULL AND SOURCE_VALUE IS NOT NULL
+'''
+
+# Stops at the first key used by several records.
+FIND_DUPLICATE_KEY_SQL = f'''
+    SELECT FIELD_NAME, SOURCE_VALUE FROM {TABLE_NAME}
+    WHERE FIELD_NAME IS NOT NULL AND SOURCE_VALUE IS NOT NULL
+    GROUP BY FIELD_NAME, SOURCE_VALUE
+    HAVING COUNT(*) > 1
+'''
+
+MATCH_EXACT = 'exact'
+MATCH_PREFIX = 'prefix'
+MATCH_SUBSTRING = 'substring'
+MATCH_MODES = (MATCH_EXACT, MATCH_PREFIX, MATCH_SUBSTRING)
+
+# Pages may be ordered by any column, with CONVERSION_CODE_ID breaking ties.
+# Each has an index matching its sort order, so pages are read in index
+# order rather than sorted.
+SORT_COLUMNS = COLUMNS
+DEFAULT_SORT = 'CONVERSION_CODE_ID'
+# Text columns sort case-insensitively, like the filters compare.
+TEXT_SORT_COLUMNS = ('FIELD_NAME', 'SOURCE_VALUE', 'SPECTRUM_VALUE')
+# NULLs sort before every value, so they come first ascending and last
+# descending.
+NULLABLE_COLUMNS = ('FIELD_NAME', 'SOURCE_VALUE', 'SPECTRUM_VALUE')
+
+# Bulk upserts stage each chunk in a temp table keyed on the natural key, then
+# apply it with two set-based statements driven by the (FIELD_NAME,
+# SOURCE_VALUE) index. Later rows in a chunk win over earlier ones.
+CREATE_UPSERT_STAGE_SQL = '''
+    CREATE TEMP TABLE IF NOT EXISTS UPSERT_STAGE (
+        FIELD_NAME TEXT NOT NULL,
+        SOURCE_VALUE TEXT NOT NULL,
+        SPECTRUM_VALUE TEXT,
+        IS_IMPORTED TEXT NOT NULL,
+        PRIMARY KEY (FIELD_NAME, SOURCE_VALUE)
+    ) WITHOUT ROWID
+'''
+
+STAGE_UPSERT_SQL = '''
+    INSERT OR REPLACE INTO UPSERT_STAGE
+    (FIELD_NAME, SOURCE_VALUE, SPECTRUM_VALUE, IS_IMPORTED)
+    VALUES (?, ?, ?, ?)
+'''
+
+APPLY_UPSERT_UPDATE_SQL = f'''
+    UPDATE {TABLE_NAME}
+    SET SPECTRUM_VALUE = (SELECT s.SPECTRUM_VALUE FROM UPSERT_STAGE s
+                          WHERE s.FIELD_NAME = {TABLE_NAME}.FIELD_NAME
+                            AND s.SOURCE_VALUE = {TABLE_NAME}.SOURCE_VALUE),
+        IS_IMPORTED = (SELECT s.IS_IMPORTED FROM UPSERT_STAGE s
+                       WHERE s.FIELD_NAME = {TABLE_NAME}.FIELD_NAME
+                         AND s.SOURCE_VALUE = {TABLE_NAME}.SOURCE_VALUE),
+        UPDATE_COUNT = UPDATE_COUNT + 1,
+        CHANGE_DATE_TIME = ?
+    WHERE CONVERSION_CODE_ID IN (
+        SELECT t.CONVERSION_CODE_ID
+        FROM UPSERT_STAGE s
+        JOIN {TABLE_NAME} t
+          ON t.FIELD_NAME = s.FIELD_NAME AND t.SOURCE_VALUE = s.SOURCE_VALUE
+        WHERE t.SPECTRUM_VALUE IS NOT s.SPECTRUM_VALUE
+           OR t.IS_IMPORTED IS NOT s.IS_IMPORTED
+    )
+'''
+
+# Staged keys that exist and would not change; counted before applying.
+COUNT_UPSERT_UNCHANGED_SQL = f'''
+    SELECT COUNT(*) FROM UPSERT_STAGE s
+    WHERE EXISTS (
+        SELECT 1 FROM {TABLE_NAME} t
+        WHERE t.FIELD_NAME = s.FIELD_NAME AND t.SOURCE_VALUE = s.SOURCE_VALUE
+    )
+    AND NOT EXISTS (
+        SELECT 1 FROM {TABLE_NAME} t
+        WHERE t.FIELD_NAME = s.FIELD_NAME AND t.SOURCE_VALUE = s.SOURCE_VALUE
+          AND (t.SPECTRUM_VALUE IS NOT s.SPECTRUM_VALUE OR t.IS_IMPORTED IS NOT s.IS_IMPORTED)
+    )
+'''
+
+APPLY_UPSERT_INSERT_SQL = f'''
+    INSERT INTO {TABLE_NAME}
+    (FIELD_NAME, SOURCE_VALUE, SPECTRUM_VALUE, IS_IMPORTED, UPDATE_COUNT, CHANGE_DATE_TIME)
+    SELECT s.FIELD_NAME, s.SOURCE_VALUE, s.SPECTRUM_VALUE, s.IS_IMPORTED, 0, ?
+    FROM UPSERT_STAGE s
+    WHERE NOT EXISTS (
+        SELECT 1 FROM {TABLE_NAME} t
+        WHERE t.FIELD_NAME = s.FIELD_NAME AND t.SOURCE_VALUE = s.SOURCE_VALUE
+    )
+'''
+
+
+def validate_record(field_name: Optional[str], source_value: Optional[str],
+                    spectrum_value: Optional[str], is_imported: Optional[str]) -> Optional[str]:
+    """Check a record against the table's rules.
+
+    Returns an error message, or None if the record is valid.
+    """
+    if not field_name:
+        return "Field Name is required."
+    if len(field_name) > MAX_FIELD_NAME_LENGTH:
+        return f"Field Name cannot exceed {MAX_FIELD_NAME_LENGTH} characters."
+    if source_value and len(source_value) > MAX_SOURCE_VALUE_LENGTH:
+        return f"Source Value cannot exceed {MAX_SOURCE_VALUE_LENGTH} characters."
+    if spectrum_value and len(spectrum_value) > MAX_SPECTRUM_VALUE_LENGTH:
+        return f"Spectrum Value cannot exceed {MAX_SPECTRUM_VALUE_LENGTH} characters."
+    if is_imported not in IMPORTED_FLAGS:
+        return "Is Imported must be Y or N."
+    return None
+
+
+class FieldSummary(NamedTuple):
+    """Record counts for one FIELD_NAME."""
+    field_name: Optional[str]
+    records: int
+    imported: int
+
+    @property
+    def not_imported(self) -> int:
+        return self.records - self.imported
+
+    @property
+    def imported_ratio(self) -> float:
+        """Share of the field's records with IS_IMPORTED = 'Y'."""
+        return self.imported / self.records if self.records else 0.0
+
+
+class BulkUpsertResult(NamedTuple):
+    """Outcome of a bulk upsert.
+
+    ``errors`` holds ``(row_number, message)`` pairs for rejected rows, capped
+    at the ``max_errors`` passed to ``bulk_upsert``; ``rejected`` is the full
+    count.
+    """
+    inserted: int
+    updated: int
+    unchanged: int
+    rejected: int
+    errors: List[Tuple[int, str]]
+
+
+def _escape_like(text: str) -> str:
+    """Escape LIKE wildcards so ``text`` matches literally with ESCAPE '\\'."""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def parse_field_name_filter(filter_text: str) -> Tuple[str, str]:
+    """Split filter text into ``(match_mode, term)``.
+
+    ``=NAME`` asks for an exact match and ``NAME*`` for a prefix match;
+    anything else is a substring match, as the GUI filter always did.
+    """
+    if filter_text.startswith('=') and len(filter_text) > 1:
+        return MATCH_EXACT, filter_text[1:]
+    if filter_text.endswith('*') and len(filter_text) > 1:
+        return MATCH_PREFIX, filter_text[:-1]
+    return MATCH_SUBSTRING, filter_text
+
+
+def field_name_matches(filter_text: Optional[str], field_name: Optional[str],
+                       match: Optional[str] = None) -> bool:
+    """Whether a field name passes a filter, mirroring the SQL strategies."""
+    if not filter_text:
+        return True
+    if field_name is None:
+        return False
+    if match is None:
+        match, term = parse_field_name_filter(filter_text)
+    else:
+        term = filter_text
+    name, term = field_name.lower(), term.lower()
+    if match == MATCH_EXACT:
+        return name == term
+    if match == MATCH_PREFIX:
+        return name.startswith(term)
+    return term in name
+
+
+class Record(NamedTuple):
+    """One table row, in ``COLUMNS`` order.
+
+    A tuple takes a fraction of the memory of a dict per row and is
+    immutable, so cached results can be shared rather than copied. Values
+    are read by attribute (``record.FIELD_NAME``) or, like the dicts from
+    ``get_all_records``, by column name (``record['FIELD_NAME']``).
+    """
+    CONVERSION_CODE_ID: int
+    FIELD_NAME: Optional[str]
+    SOURCE_VALUE: Optional[str]
+    SPECTRUM_VALUE: Optional[str]
+    IS_IMPORTED: str
+    UPDATE_COUNT: int
+    CHANGE_DATE_TIME: object
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return getattr(self, key)
+        return tuple.__getitem__(self, key)
+
+    def as_dict(self) -> Dict:
+        """Return the record as a dict keyed by column name."""
+        return dict(zip(COLUMNS, self))
+
+
+# Builds a Record without NamedTuple's per-call length check.
+_new_record = partial(tuple.__new__, Record)
+
+
+def _make_records(rows: Sequence[Sequence]) -> List[Record]:
+    """Build records from rows in ``COLUMNS`` order.
+
+    FIELD_NAME and CHANGE_DATE_TIME repeat across many rows (a field holds
+    many codes, and rows written in one batch share a timestamp), so equal
+    values are kept as one object per result.
+    """
+    shared: Dict[object, object] = {}
+    share = shared.setdefault
+    return [_new_record((row[0], share(row[1], row[1]), row[2], row[3], row[4], row[5],
+                         share(row[6], row[6])))
+            for row in rows]
+
+
+class Change(NamedTuple):
+    """One entry of the change log.
+
+    ``record`` is the row after an insert or update and before a delete.
+    ``old_field_name`` and ``old_source_value`` are the natural key before
+    an update or delete, and None for an insert.
+    """
+    seq: int
+    operation: str
+    record: Record
+    old_field_name: Optional[str]
+    old_source_value: Optional[str]
+
+
+class ChangesPrunedError(LookupError):
+    """Changes a reader has not seen yet were pruned from the change log.
+
+    The reader has to load the whole table again (see ``changes_since``).
+    """
+
+
+class ConcurrencyConflictError(RuntimeError):
+    """A record changed since the caller read it, so a write was not made.
+
+    ``current`` is the record as it is now, or None if it was deleted.
+    """
+
+    def __init__(self, conversion_code_id: int, expected_update_count: int,
+                 current: Optional['Record']):
+        if current is None:
+            message = f"Record {conversion_code_id} was deleted by someone else."
+        else:
+            message = (f"Record {conversion_code_id} was changed by someone else "
+                       f"(update count {current.UPDATE_COUNT}, expected "
+                       f"{expected_update_count}).")
+        super().__init__(message)
+        self.conversion_code_id = conversion_code_id
+        self.expected_update_count = expected_update_count
+        self.current = current
+
+
+class DuplicateKeysError(ValueError):
+    """Unique keys cannot be enforced while records share a key.
+
+    ``key`` is one such ``(FIELD_NAME, SOURCE_VALUE)``; ``check_integrity``
+    lists them all.
+    """
+
+    def __init__(self, key: Tuple[str, str]):
+        super().__init__(f"Cannot enforce unique keys: several records map "
+                         f"{key[0]!r} / {key[1]!r}. Resolve the duplicates listed by "
+                         f"'python -m cli check' first.")
+        self.key = key
+
+
+class Write(NamedTuple):
+    """One insert, update or delete for ``apply_writes``.
+
+    ``operation`` is ``CHANGE_INSERT``, ``CHANGE_UPDATE`` or
+    ``CHANGE_DELETE``; ``values`` are FIELD_NAME, SOURCE_VALUE,
+    SPECTRUM_VALUE and IS_IMPORTED for inserts and updates. With
+    ``expected_update_count``, an update or delete is only made if the
+    record's UPDATE_COUNT is still that.
+    """
+    operation: str
+    conversion_code_id: Optional[int] = None
+    values: Tuple[Optional[str], ...] = ()
+    expected_update_count: Optional[int] = None
+
+
+def fetch_records(cursor) -> List[Record]:
+    """Fetch a cursor's remaining rows as ``Record`` tuples.
+
+    The cursor's columns may come in any order as long as they include
+    all of ``COLUMNS``.
+    """
+    names = tuple(column[0] for column in cursor.description)
+    rows = cursor.fetchall()
+    if names != COLUMNS:
+        positions = [names.index(column) for column in COLUMNS]
+        rows = [[row[i] for i in positions] for row in rows]
+    profiler = getattr(cursor, 'profiler', None)
+    if profiler is None:
+        return _make_records(rows)
+    with profiler.timer('rows to records') as timing:
+        timing.rows = len(rows)
+        return _make_records(rows)
+
+
+class Backend:
+    """Connections and SQL dialect for one database engine.
+
+    ``ConversionCodeDB`` runs all of its SQL through a backend. The statement
+    attributes default to SQL that SQLite and SQL Server both accept;
+    subclasses override the ones their dialect spells differently and
+    implement the methods below.
+    """
+
+    name = ''
+    # Most bound parameters a single statement may use.
+    max_parameters = 999
+    # Whether reads and writes must share one connection.
+    single_connection = False
+    fts_enabled = False
+    # Whether init_schema maintains the change log table.
+    change_log_enabled = False
+    # Whether a unique index rejects records sharing a natural key.
+    unique_keys_enforced = False
+    # Collation that makes text comparisons case-insensitive, if needed.
+    text_collation: Optional[str] = None
+
+    select_all_sql = SELECT_ALL_SQL
+    select_where_sql = SELECT_WHERE_SQL
+    select_rows_sql = SELECT_ROWS_SQL
+    select_page_sql = SELECT_PAGE_SQL
+    field_summary_sql = FIELD_SUMMARY_SQL
+    count_where_sql = COUNT_WHERE_SQL
+    select_by_id_sql = SELECT_BY_ID_SQL
+    select_ids_sql = SELECT_IDS_SQL
+    select_updatable_sql = SELECT_UPDATABLE_SQL
+    insert_sql = INSERT_SQL
+    update_sql = UPDATE_SQL
+    delete_sql = DELETE_SQL
+    update_if_version_sql = UPDATE_IF_VERSION_SQL
+    delete_if_version_sql = DELETE_IF_VERSION_SQL
+    delete_many_sql = DELETE_MANY_SQL
+    select_mappings_sql = SELECT_MAPPINGS_SQL
+
+    def connect(self):
+        """Open a new DB-API connection."""
+        raise NotImplementedError
+
+    def check_connection(self, conn):
+        """Raise if a pooled connection can no longer run queries."""
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1')
+        cursor.fetchone()
+
+    def cursor(self, conn):
+        """Return a cursor configured for this backend."""
+        return conn.cursor()
+
+    def is_busy_error(self, error: Exception) -> bool:
+        """Whether ``error`` means another connection held a lock, so that
+        running the transaction again may succeed."""
+        return False
+
+    def init_schema(self, conn):
+        """Create the table and its indexes if they do not exist."""
+        raise NotImplementedError
+
+    def create_unique_key_index(self, conn, sql: str):
+        """Run ``sql`` to create the unique key index.
+
+        Raises ``DuplicateKeysError`` when existing records share a key;
+        the engine's own error is chained to it.
+        """
+        try:
+            with conn:
+                conn.cursor().execute(sql)
+        except Exception as e:
+            cursor = conn.cursor()
+            cursor.execute(FIND_DUPLICATE_KEY_SQL)
+            key = cursor.fetchone()
+            cursor.close()
+            if key is None:
+                raise
+            raise DuplicateKeysError(tuple(key)) from e
+
+    def data_version(self, conn) -> Optional[object]:
+        """Return a value that changes when another connection commits.
+
+        None means the backend cannot tell, so cached results are only
+        invalidated by writes made through the same ``ConversionCodeDB``.
+        """
+        return None
+
+    def plan_field_name_filter(self, match: str, term: str) -> Tuple[str, Tuple]:
+        """Return ``(where_sql, params)`` for one FIELD_NAME match mode."""
+        raise NotImplementedError
+
+    def compare_text_sql(self, column: str, operator: str) -> str:
+        """A case-insensitive comparison of a text column with one parameter.
+
+        ``operator`` is a SQL comparison operator or ``LIKE``, whose pattern
+        escapes wildcards as ``escape_like`` does.
+        """
+        collate = f' COLLATE {self.text_collation}' if self.text_collation else ''
+        if operator == 'LIKE':
+            return f"{column} LIKE ?{collate} ESCAPE '\\'"
+        return f'{column} {operator} ?{collate}'
+
+    def escape_like(self, text: str) -> str:
+        """Escape ``text`` to match literally in a LIKE pattern."""
+        return _escape_like(text)
+
+    def unindexed_sql(self, column: str) -> str:
+        """``column`` written so that the planner does not look it up in an index."""
+        return column
+
+    def explain(self, conn, sql: str, params: Sequence) -> Optional[List[str]]:
+        """Describe how a statement would run, or None if the engine cannot say."""
+        return None
+
+    def sort_key_sql(self, column: str) -> str:
+        """The expression ``column`` is ordered and compared by."""
+        return column
+
+    def page_params(self, limit: int, offset: int) -> List[int]:
+        """Order the row limit and offset as ``select_page_sql`` binds them."""
+        return [limit, offset]
+
+    def insert_record(self, cursor, params: Sequence) -> int:
+        """Run ``insert_sql`` and return the new record's ID."""
+        cursor.execute(self.insert_sql, params)
+        return cursor.lastrowid
+
+    def upsert_chunk(self, cursor, rows: List[Tuple[str, str, Optional[str], str]],
+                     now: datetime) -> Tuple[int, int, int]:
+        """Upsert validated rows; returns ``(updated, inserted, unchanged)``.
+
+        Where ``rows`` repeat a natural key, later rows win over earlier
+        ones. ``updated`` counts records, which may share a key;
+        ``unchanged`` counts distinct keys whose records already hold the
+        given values.
+        """
+        raise NotImplementedError
+
+
+class SQLiteBackend(Backend):
+    """Local SQLite database file, tuned for a pool of long-lived connections."""
+
+    name = 'sqlite'
+    text_collation = 'NOCASE'
+
+    def __init__(self, db_path: str = "conversion_codes.db", busy_timeout: float = 5.0,
+                 journal_mode: str = 'WAL', cache_size_kb: int = 16384,
+                 statement_cache_size: int = 128, enable_fts: bool = True,
+                 enable_change_log: bool = True, unique_keys: bool = False):
         self.db_path = db_path
-        self.init_database()
-    
-    def init_database(self):
-        """Create the conversion codes table if it doesn't exist."""
-        with sqlite3.connect(self.db_path) as conn:
+        self.busy_timeout = busy_timeout
+        self.journal_mode = journal_mode
+        self.cache_size_kb = cache_size_kb
+        self.statement_cache_size = statement_cache_size
+        self.enable_fts = enable_fts
+        self.fts_enabled = False
+        self.enable_change_log = enable_change_log
+        self.change_log_enabled = False
+        self.unique_keys = unique_keys
+        self.unique_keys_enforced = False
+        # Every connection to ':memory:' is a separate database.
+        self.single_connection = db_path == ':memory:'
+
+    def connect(self) -> sqlite3.Connection:
+        """Open and tune a new SQLite connection."""
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout,
+                               check_same_thread=False,
+                               cached_statements=self.statement_cache_size)
+        try:
+            conn.execute(f'PRAGMA journal_mode = {self.journal_mode}')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.execute('PRAGMA temp_store = MEMORY')
+            conn.execute(f'PRAGMA cache_size = -{int(self.cache_size_kb)}')
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def init_schema(self, conn: sqlite3.Connection):
+        """Create the table and its indexes, and if enabled the FTS index,
+        change log and unique key index."""
+        with conn:
             cursor = conn.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS S_CONVERSION_CODE_G97 (
+            cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
                     CONVERSION_CODE_ID INTEGER PRIMARY KEY AUTOINCREMENT,
                     FIELD_NAME VARCHAR(50),
                     SOURCE_VALUE VARCHAR(20),
@@ -27,72 +748,1125 @@ class ConversionCodeDB:
                     CHANGE_DATE_TIME TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
                 )
             ''')
-            conn.commit()
-    
-    def get_all_records(self, field_name_filter: Optional[str] = None) -> List[Dict]:
-        """Get all records, optionally filtered by field name."""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            if field_name_filter:
-                cursor.execute('''
-                    SELECT * FROM S_CONVERSION_CODE_G97 
-                    WHERE FIELD_NAME LIKE ? 
-                    ORDER BY CONVERSION_CODE_ID
-                ''', (f'%{field_name_filter}%',))
-            else:
-                cursor.execute('''
-                    SELECT * FROM S_CONVERSION_CODE_G97 
-                    ORDER BY CONVERSION_CODE_ID
+            cursor.execute(f'''
+                CREATE INDEX IF NOT EXISTS IX_{TABLE_NAME}_FIELD_SOURCE
+                ON {TABLE_NAME} (FIELD_NAME, SOURCE_VALUE)
+            ''')
+            # Incremental readers pick up changed rows by CHANGE_DATE_TIME.
+            cursor.execute(f'''
+                CREATE INDEX IF NOT EXISTS IX_{TABLE_NAME}_CHANGE_DATE_TIME
+                ON {TABLE_NAME} (CHANGE_DATE_TIME)
+            ''')
+            # Case-insensitive exact and prefix filters on FIELD_NAME, and
+            # sorting by it.
+            cursor.execute(f'''
+                CREATE INDEX IF NOT EXISTS IX_{TABLE_NAME}_FIELD_NAME_NOCASE
+                ON {TABLE_NAME} (FIELD_NAME COLLATE NOCASE)
+            ''')
+            # Sorting by the other columns; CHANGE_DATE_TIME's index is above.
+            for name, column in (('SOURCE_VALUE_NOCASE', 'SOURCE_VALUE COLLATE NOCASE'),
+                                 ('SPECTRUM_VALUE_NOCASE', 'SPECTRUM_VALUE COLLATE NOCASE'),
+                                 ('IS_IMPORTED', 'IS_IMPORTED'),
+                                 ('UPDATE_COUNT', 'UPDATE_COUNT')):
+                cursor.execute(f'''
+                    CREATE INDEX IF NOT EXISTS IX_{TABLE_NAME}_{name}
+                    ON {TABLE_NAME} ({column})
                 ''')
-            
-            return [dict(row) for row in cursor.fetchall()]
-    
-    def add_record(self, field_name: str, source_value: str, spectrum_value: str, 
+            # Field summaries read only this index.
+            cursor.execute(f'''
+                CREATE INDEX IF NOT EXISTS IX_{TABLE_NAME}_FIELD_IMPORTED
+                ON {TABLE_NAME} (FIELD_NAME, IS_IMPORTED)
+            ''')
+            # Reverse lookups, and the integrity check for spectrum values
+            # mapped from several source values, read only this index. It
+            # leads with SPECTRUM_VALUE so that lookups by (FIELD_NAME,
+            # SOURCE_VALUE) never prefer it to the index above.
+            cursor.execute(f'''
+                CREATE INDEX IF NOT EXISTS IX_{TABLE_NAME}_SPECTRUM_FIELD
+                ON {TABLE_NAME} (SPECTRUM_VALUE, FIELD_NAME, SOURCE_VALUE)
+            ''')
+        if self.unique_keys:
+            self.create_unique_key_index(conn, CREATE_UNIQUE_KEY_SQL)
+        if self.enable_fts:
+            self.fts_enabled = self._init_fts(conn)
+        if self.enable_change_log:
+            with conn:
+                conn.execute(CREATE_CHANGES_SQL)
+                for sql in CREATE_CHANGES_TRIGGERS_SQL:
+                    conn.execute(sql)
+        # A log or unique index created earlier is still maintained.
+        self.change_log_enabled = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (CHANGES_TABLE_NAME,)).fetchone() is not None
+        self.unique_keys_enforced = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?",
+            (UNIQUE_KEY_INDEX_NAME,)).fetchone() is not None
+
+    def _init_fts(self, conn: sqlite3.Connection) -> bool:
+        """Create the trigram FTS index and its triggers, if supported."""
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (FTS_TABLE_NAME,)).fetchone() is not None
+        try:
+            with conn:
+                conn.execute(CREATE_FTS_SQL)
+                for sql in CREATE_FTS_TRIGGERS_SQL:
+                    conn.execute(sql)
+                if not exists:
+                    conn.execute(f"INSERT INTO {FTS_TABLE_NAME} ({FTS_TABLE_NAME}) "
+                                 f"VALUES ('rebuild')")
+        except sqlite3.OperationalError:
+            # FTS5 or the trigram tokenizer (SQLite 3.34+) is unavailable.
+            return False
+        return True
+
+    def is_busy_error(self, error: Exception) -> bool:
+        """SQLITE_BUSY or SQLITE_LOCKED, once the busy timeout has run out or
+        when SQLite does not wait at all (a stale WAL snapshot)."""
+        return (isinstance(error, sqlite3.OperationalError)
+                and ('locked' in str(error) or 'busy' in str(error)))
+
+    def data_version(self, conn: sqlite3.Connection) -> int:
+        """``PRAGMA data_version``, which changes when another connection commits."""
+        return conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def compare_text_sql(self, column: str, operator: str) -> str:
+        """LIKE is case-insensitive already, and uses a NOCASE index as it is."""
+        if operator == 'LIKE':
+            return f"{column} LIKE ? ESCAPE '\\'"
+        return super().compare_text_sql(column, operator)
+
+    def unindexed_sql(self, column: str) -> str:
+        """A unary ``+`` keeps SQLite from using an index on the column."""
+        return '+' + column
+
+    def sort_key_sql(self, column: str) -> str:
+        """Text columns sort with NOCASE, matching their sort indexes."""
+        if column in TEXT_SORT_COLUMNS:
+            return f'{column} COLLATE NOCASE'
+        return column
+
+    def explain(self, conn: sqlite3.Connection, sql: str,
+                params: Sequence) -> Optional[List[str]]:
+        """The ``EXPLAIN QUERY PLAN`` steps for a statement."""
+        try:
+            rows = conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+        except sqlite3.Error:
+            # The statement's tables may be gone by now, e.g. a dropped temp table.
+            return None
+        return [row[-1] for row in rows]
+
+    def plan_field_name_filter(self, match: str, term: str) -> Tuple[str, Tuple]:
+        """Exact and prefix matches use the NOCASE index; substrings the trigram index."""
+        if match == MATCH_EXACT:
+            return 'FIELD_NAME = ? COLLATE NOCASE', (term,)
+        if match == MATCH_PREFIX:
+            return "FIELD_NAME LIKE ? ESCAPE '\\'", (_escape_like(term) + '%',)
+        if self.fts_enabled and len(term) >= FTS_MIN_TERM_LENGTH:
+            phrase = '"' + term.replace('"', '""') + '"'
+            return FTS_MATCH_SQL, (phrase,)
+        return "FIELD_NAME LIKE ? ESCAPE '\\'", ('%' + _escape_like(term) + '%',)
+
+    def upsert_chunk(self, cursor: sqlite3.Cursor,
+                     rows: List[Tuple[str, str, Optional[str], str]],
+                     now: datetime) -> Tuple[int, int, int]:
+        """Stage rows in a temp table, then apply them with two set-based statements."""
+        cursor.execute(CREATE_UPSERT_STAGE_SQL)
+        cursor.execute('DELETE FROM UPSERT_STAGE')
+        cursor.executemany(STAGE_UPSERT_SQL, rows)
+        unchanged = cursor.execute(COUNT_UPSERT_UNCHANGED_SQL).fetchone()[0]
+        cursor.execute(APPLY_UPSERT_UPDATE_SQL, (now,))
+        updated = cursor.rowcount
+        cursor.execute(APPLY_UPSERT_INSERT_SQL, (now,))
+        inserted = cursor.rowcount
+        cursor.execute('DELETE FROM UPSERT_STAGE')
+        return updated, inserted, unchanged
+
+
+class ConversionCodeDB:
+    """Database handler for conversion codes.
+
+    Connections are long-lived and pooled; call ``close()`` (or use the
+    instance as a context manager) to release them. All SQL goes through a
+    ``Backend``: by default a ``SQLiteBackend`` for ``db_path``, or e.g. a
+    ``sqlserver.SqlServerBackend`` passed as ``backend``.
+
+    With ``cache_entries`` set, query results are served from an LRU cache
+    that is invalidated precisely by this instance's writes. When another
+    connection commits (detected with ``PRAGMA data_version``), the change
+    log tells which results to drop; without it the cache is cleared.
+
+    Every insert, update and delete is recorded in a change log, which
+    ``changes_since`` streams so consumers can sync without rereading the
+    table.
+
+    ``check_integrity`` reports records sharing a natural key, which
+    ``unique_keys`` prevents.
+
+    Updates and deletes given the UPDATE_COUNT the caller read raise
+    ``ConcurrencyConflictError`` instead of overwriting someone else's
+    change. Writes that find the database locked are retried.
+
+    With an enabled ``profiler``, connection setup, statements, fetches and
+    row conversion are timed (see ``instrumentation``).
+    """
+
+    def __init__(self, db_path: str = "conversion_codes.db", pool_size: int = 4,
+                 busy_timeout: float = 5.0, journal_mode: str = 'WAL',
+                 cache_size_kb: int = 16384, statement_cache_size: int = 128,
+                 enable_fts: bool = True, cache_entries: int = 0,
+                 cache_bytes: int = 64 * 1024 * 1024, enable_change_log: bool = True,
+                 unique_keys: bool = False, backend: Optional[Backend] = None,
+                 profiler: Optional[Profiler] = None, busy_retries: int = 3,
+                 busy_backoff: float = 0.05):
+        """Initialize the connection pool and ensure the schema exists.
+
+        ``journal_mode`` may be set to e.g. ``'DELETE'`` for database files on
+        network shares, where WAL's shared memory index is not available.
+        ``enable_fts`` builds a trigram full-text index for substring filters
+        when the SQLite library supports it; ``fts_enabled`` reports whether
+        it is in use. ``enable_change_log`` records every write in a change
+        log (see ``changes_since``). ``unique_keys`` adds a unique index on
+        (FIELD_NAME, SOURCE_VALUE), raising ``DuplicateKeysError`` if
+        existing records share a key. These SQLite options are ignored when
+        ``backend`` is given.
+
+        A write transaction that still finds the database locked after
+        ``busy_timeout`` (or that SQLite refuses without waiting) is run
+        again up to ``busy_retries`` times, after a randomized delay that
+        starts at ``busy_backoff`` seconds and doubles each time.
+        """
+        if backend is None:
+            backend = SQLiteBackend(db_path, busy_timeout=busy_timeout,
+                                    journal_mode=journal_mode, cache_size_kb=cache_size_kb,
+                                    statement_cache_size=statement_cache_size,
+                                    enable_fts=enable_fts, enable_change_log=enable_change_log,
+                                    unique_keys=unique_keys)
+        self.backend = backend
+        self.db_path = db_path
+        self.profiler = profiler
+        self.busy_retries = busy_retries
+        self.busy_backoff = busy_backoff
+        self.busy_retry_count = 0
+        # Reads and writes share the pool's single connection when the
+        # backend cannot open several connections to one database.
+        self._single_connection = backend.single_connection
+        if self._single_connection:
+            pool_size = 1
+        self._pool = ConnectionPool(self._connect, size=pool_size,
+                                    health_check=backend.check_connection)
+        self._writer = None
+        self._write_lock = threading.RLock()
+        # Per thread: how many ``transaction`` blocks are open.
+        self._transactions = threading.local()
+        # Reads PRAGMA data_version for the cache without waiting for writes.
+        self._probe = None
+        self._probe_lock = threading.Lock()
+        self._cache = QueryCache(cache_entries, cache_bytes) if cache_entries > 0 else None
+        self._data_version: Optional[object] = None
+        # The last change log entry the cache has been invalidated for.
+        self._cache_change_seq = 0
+        # Commits made through this instance, and how many the last check saw.
+        self._local_commits = 0
+        self._checked_commits = 0
+        self.external_invalidations = 0
+        self._filter_compiler = None
+        self.init_database()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, object]) -> 'ConversionCodeDB':
+        """Create a database handler from settings, e.g. loaded from JSON.
+
+        ``backend`` selects ``'sqlite'`` (the default; ``path`` names the
+        file) or ``'sqlserver'`` (``connection_string`` is required, and
+        ``fast_executemany``, ``login_timeout`` and ``unique_keys`` are
+        passed to the backend). Other keys are passed to the constructor.
+        """
+        options = dict(config)
+        kind = options.pop('backend', 'sqlite')
+        if kind == 'sqlite':
+            return cls(options.pop('path', "conversion_codes.db"), **options)
+        if kind == 'sqlserver':
+            from sqlserver import SqlServerBackend
+            backend_options = {key: options.pop(key)
+                               for key in ('fast_executemany', 'login_timeout',
+                                           'unique_keys')
+                               if key in options}
+            backend = SqlServerBackend(options.pop('connection_string'), **backend_options)
+            return cls(backend=backend, **options)
+        raise ValueError(f"Unknown backend {kind!r}; expected 'sqlite' or 'sqlserver'")
+
+    @property
+    def fts_enabled(self) -> bool:
+        """Whether substring filters use a full-text index."""
+        return self.backend.fts_enabled
+
+    @property
+    def pool_size(self) -> int:
+        """How many read connections may be open at once."""
+        return self._pool.size
+
+    @property
+    def change_log_enabled(self) -> bool:
+        """Whether writes are recorded in the change log."""
+        return self.backend.change_log_enabled
+
+    @property
+    def unique_keys_enforced(self) -> bool:
+        """Whether the database rejects records sharing a natural key."""
+        return self.backend.unique_keys_enforced
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close all pooled connections."""
+        self._pool.close()
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._probe_lock:
+            if self._probe is not None:
+                self._probe.close()
+                self._probe = None
+
+    @contextmanager
+    def connection(self, write: bool = False):
+        """Borrow a connection; nested reads on one thread share one.
+
+        Writes all go through a single dedicated connection, one thread at a
+        time, so this process never competes with itself for SQLite's write
+        lock and ``PRAGMA data_version`` on that connection changes only when
+        another process commits.
+        """
+        if not write or self._single_connection:
+            with self._pool.connection() as conn:
+                yield conn
+            return
+        with self._write_lock:
+            if self._writer is None:
+                if self._pool.closed:
+                    raise PoolClosedError("Connection pool is closed.")
+                self._writer = self._connect()
+            yield self._writer
+
+    @contextmanager
+    def transaction(self):
+        """Borrow the write connection inside a transaction.
+
+        The transaction commits when the outermost ``transaction`` block on
+        this thread exits, and rolls back if an exception leaves it; nested
+        blocks join it rather than committing on their own.
+        """
+        with self.connection(write=True) as conn:
+            depth = getattr(self._transactions, 'depth', 0)
+            self._transactions.depth = depth + 1
+            try:
+                if depth:
+                    yield conn
+                else:
+                    with conn:
+                        yield conn
+                    self._local_commits += 1
+            finally:
+                self._transactions.depth = depth
+
+    def _retry_busy(self, transaction: Callable[[], object]):
+        """Run ``transaction`` again while it fails because of another writer's lock.
+
+        ``transaction`` opens the write connection and commits or rolls
+        back itself, so each attempt starts afresh. The delays are
+        randomized so that writers that collided do not collide again.
+        Inside an outer ``transaction`` block it runs once: only the outer
+        transaction can start afresh.
+        """
+        if getattr(self._transactions, 'depth', 0):
+            return transaction()
+        delay = self.busy_backoff
+        for attempt in range(self.busy_retries + 1):
+            try:
+                return transaction()
+            except Exception as e:
+                if attempt == self.busy_retries or not self.backend.is_busy_error(e):
+                    raise
+            self.busy_retry_count += 1
+            time.sleep(delay * random.uniform(0.5, 1.5))
+            delay *= 2
+
+    @contextmanager
+    def _probe_connection(self):
+        """Borrow the connection that checks for other connections' commits.
+
+        It is only ever used for reads, so checking never waits for a write
+        in progress on this instance. A data version is per connection, so
+        it is always read on the same one.
+        """
+        if self._single_connection:
+            with self._pool.connection() as conn:
+                yield conn
+            return
+        with self._probe_lock:
+            if self._probe is None:
+                if self._pool.closed:
+                    raise PoolClosedError("Connection pool is closed.")
+                self._probe = self._connect()
+            yield self._probe
+
+    def _connect(self):
+        """Open a backend connection, timed when profiling."""
+        profiler = self.profiler
+        if profiler is None or not profiler.enabled:
+            return self.backend.connect()
+        with profiler.timer('connect'):
+            return self.backend.connect()
+
+    def _cursor(self, conn):
+        """Return a backend cursor, wrapped to record statements when profiling."""
+        cursor = self.backend.cursor(conn)
+        profiler = self.profiler
+        if profiler is None or not profiler.enabled:
+            return cursor
+        return ProfilingCursor(cursor, profiler,
+                               lambda sql, params: self.backend.explain(conn, sql, params))
+
+    def _cached(self, key: Tuple, load: Callable[[], object]):
+        """Serve a query result from the cache, loading it on a miss.
+
+        Results are records, record lists or counts, all immutable, so hits
+        are shared rather than copied.
+        """
+        cache = self._cache
+        if cache is None:
+            return load()
+        self._check_external_writes()
+        value = cache.get(key)
+        if value is None:
+            generation = cache.generation
+            value = load()
+            cache.put(key, value, generation)
+        return value
+
+    def _check_external_writes(self):
+        """Drop cached results another connection's commits may have changed.
+
+        The data version is read before the change log, so a commit landing
+        in between is either in the changes read or seen on the next check.
+        The probe connection also sees this instance's own commits: their
+        change log entries drop what the write dropped already, and without
+        a change log they clear the cache. Only checks no local commit could
+        explain count as external invalidations.
+        """
+        with self._probe_connection() as conn:
+            local_commits = self._local_commits
+            version = self.backend.data_version(conn)
+            if version is None or version == self._data_version:
+                return
+            first_check = self._data_version is None
+            external = local_commits == self._checked_commits
+            self._checked_commits = local_commits
+            self._data_version = version
+            changes = None
+            if self.change_log_enabled:
+                if not first_check:
+                    try:
+                        cursor = self._changes_cursor(conn, self._cache_change_seq)
+                    except ChangesPrunedError:
+                        pass
+                    else:
+                        changes = cursor.fetchmany(MAX_TRACKED_CHANGES + 1)
+                        cursor.close()
+                if changes is None or len(changes) > MAX_TRACKED_CHANGES:
+                    changes = None
+                    self._cache_change_seq = self._change_seq_range(conn)[1]
+        if not first_check and external:
+            self.external_invalidations += 1
+        if changes is None:
+            self._cache.clear()
+        elif changes:
+            self._cache_change_seq = changes[-1][0]
+            self._invalidate_cache(
+                [row[2] for row in changes],
+                {name for row in changes for name in (row[3], row[-2])})
+
+    def _invalidate_cache(self, record_ids: Iterable[int] = (),
+                          field_names: Optional[Iterable[Optional[str]]] = None):
+        """Drop cached results a local write may have changed.
+
+        Results for the given record IDs are dropped, as are filtered
+        results whose filter matches any of ``field_names`` (the values
+        before and after the write). ``field_names=None`` drops every
+        multi-record result.
+        """
+        if self._cache is None:
+            return
+        ids = set(record_ids)
+        names = None if field_names is None else list(field_names)
+
+        def affected(key):
+            if key[0] == 'record':
+                return key[1] in ids
+            if names is None:
+                return True
+            filter_text, match, where = key[1], key[2], key[3]
+            if where is not None:
+                # Composite filters may test any column, so any write may
+                # change their results.
+                return True
+            return any(field_name_matches(filter_text, name, match) for name in names)
+
+        self._cache.invalidate(affected)
+
+    def cache_stats(self) -> Dict[str, int]:
+        """Return cache counters, or an empty dict when caching is off."""
+        if self._cache is None:
+            return {}
+        stats = self._cache.stats()
+        stats['external_invalidations'] = self.external_invalidations
+        return stats
+
+    def init_database(self):
+        """Create the conversion codes table if it doesn't exist."""
+        with self.connection(write=True) as conn:
+            self.backend.init_schema(conn)
+
+    def plan_field_name_filter(self, filter_text: str,
+                               match: Optional[str] = None) -> Tuple[str, Tuple]:
+        """Choose the cheapest WHERE clause for a FIELD_NAME filter.
+
+        Returns ``(where_sql, params)`` from the backend. With SQLite, exact
+        and prefix matches use the NOCASE index; substring matches use the
+        trigram index when the term is long enough for it, and fall back to
+        a LIKE scan otherwise. All strategies are case-insensitive, like the
+        original LIKE filter.
+        """
+        if match is None:
+            match, filter_text = parse_field_name_filter(filter_text)
+        if match not in MATCH_MODES:
+            raise ValueError(f"Unknown match mode {match!r}; expected one of {MATCH_MODES}")
+        return self.backend.plan_field_name_filter(match, filter_text)
+
+    def compile_filter(self, where) -> 'CompiledFilter':
+        """Compile a composite filter, or its text, for this database's backend.
+
+        See ``filters``; compiled SQL is cached per filter shape. Raises
+        ValueError for an invalid filter.
+        """
+        if self._filter_compiler is None:
+            from filters import FilterCompiler
+            self._filter_compiler = FilterCompiler(self.backend)
+        return self._filter_compiler.compile(where)
+
+    def get_records(self, field_name_filter: Optional[str] = None,
+                    match: Optional[str] = None, where=None) -> List[Record]:
+        """Get all records as ``Record`` tuples, optionally filtered.
+
+        ``match`` is one of ``MATCH_MODES``; by default it is inferred from
+        the filter text (see ``parse_field_name_filter``). ``where`` is a
+        composite filter over any columns, or its text (see ``filters``),
+        and is combined with the field name filter. The list may be shared
+        with the query cache, so copy it before modifying it.
+        """
+        conditions, params, compiled = self._filter_where(field_name_filter, match, where)
+
+        def load():
+            with self.connection() as conn:
+                cursor = self._cursor(conn)
+                if conditions:
+                    cursor.execute(self.backend.select_where_sql.format(
+                        where=' AND '.join(conditions)), params)
+                else:
+                    cursor.execute(self.backend.select_all_sql)
+                return fetch_records(cursor)
+
+        return self._cached(('records', field_name_filter or None, match, compiled), load)
+
+    def get_all_records(self, field_name_filter: Optional[str] = None,
+                        match: Optional[str] = None, where=None) -> List[Dict]:
+        """Get all records as dicts, optionally filtered.
+
+        Prefer ``get_records`` for large results.
+        """
+        return [record.as_dict()
+                for record in self.get_records(field_name_filter, match, where)]
+
+    def _filter_where(self, field_name_filter: Optional[str], match: Optional[str],
+                      where=None) -> Tuple[List[str], List, Optional['CompiledFilter']]:
+        """Return WHERE conditions and parameters for the optional filters.
+
+        The compiled composite filter is returned too, as it identifies the
+        filter in cache keys.
+        """
+        conditions: List[str] = []
+        params: List = []
+        if field_name_filter:
+            condition, filter_params = self.plan_field_name_filter(field_name_filter, match)
+            conditions.append(condition)
+            params.extend(filter_params)
+        compiled = None
+        if where is not None:
+            compiled = self.compile_filter(where)
+            conditions.append(f'({compiled.sql})')
+            params.extend(compiled.params)
+        return conditions, params, compiled
+
+    def count_records(self, field_name_filter: Optional[str] = None,
+                      match: Optional[str] = None, where=None) -> int:
+        """Count records matching the filters without fetching them."""
+        conditions, params, compiled = self._filter_where(field_name_filter, match, where)
+        where_sql = ' AND '.join(conditions) or '1 = 1'
+
+        def load():
+            with self.connection() as conn:
+                cursor = self._cursor(conn)
+                cursor.execute(self.backend.count_where_sql.format(where=where_sql), params)
+                return cursor.fetchone()[0]
+
+        return self._cached(('count', field_name_filter or None, match, compiled), load)
+
+    def get_record_page(self, after_id: Optional[int] = None, limit: int = 200,
+                        field_name_filter: Optional[str] = None, match: Optional[str] = None,
+                        offset: int = 0, order_by: str = DEFAULT_SORT,
+                        descending: bool = False, after_value=None,
+                        where=None) -> List[Record]:
+        """Get up to ``limit`` records in ``order_by`` order, starting after ``after_id``.
+
+        Keyset pagination on ``after_id`` costs the same wherever the page
+        is; ``offset`` skips rows and is meant for jumping to a page whose
+        preceding ID is not known yet. When ordering by another column than
+        CONVERSION_CODE_ID, ``after_value`` is that column's value in the
+        row with ``after_id``. Like ``get_records``, the list may be shared
+        with the query cache, and ``where`` is a composite filter.
+        """
+        if order_by not in SORT_COLUMNS:
+            raise ValueError(f"Cannot sort by {order_by!r}; expected one of {SORT_COLUMNS}")
+        conditions, params, compiled = self._filter_where(field_name_filter, match, where)
+        direction = 'DESC' if descending else 'ASC'
+        order = f'{self.backend.sort_key_sql(order_by)} {direction}'
+        if order_by != DEFAULT_SORT:
+            order += f', CONVERSION_CODE_ID {direction}'
+        if after_id is None:
+            segments = [('1 = 1', [])]
+        else:
+            segments = self._keyset_segments(order_by, descending, after_id, after_value)
+
+        def load():
+            records: List[Record] = []
+            skip = offset
+            with self.connection() as conn:
+                cursor = self._cursor(conn)
+                for condition, segment_params in segments:
+                    where = ' AND '.join(conditions + [condition])
+                    cursor.execute(self.backend.select_page_sql.format(where=where, order=order),
+                                   params + segment_params
+                                   + self.backend.page_params(limit - len(records), skip))
+                    records.extend(fetch_records(cursor))
+                    if len(records) >= limit:
+                        break
+                    skip = 0
+            return records
+
+        return self._cached(('page', field_name_filter or None, match, compiled, after_id,
+                             limit, offset, order_by, descending, after_value), load)
+
+    def _keyset_segments(self, order_by: str, descending: bool, after_id: int,
+                         after_value) -> List[Tuple[str, List]]:
+        """Conditions selecting the rows after a keyset anchor, in sort order.
+
+        Each condition lets the sort index seek to the anchor; the rows
+        after NULLs (ascending) or before them (descending) form a second
+        segment, queried if the first does not fill the page.
+        """
+        comparison = '<' if descending else '>'
+        if order_by == DEFAULT_SORT:
+            return [(f'CONVERSION_CODE_ID {comparison} ?', [after_id])]
+        key = self.backend.sort_key_sql(order_by)
+        if after_value is None and order_by in NULLABLE_COLUMNS:
+            segments = [(f'{order_by} IS NULL AND CONVERSION_CODE_ID {comparison} ?', [after_id])]
+            if not descending:
+                segments.append((f'{order_by} IS NOT NULL', []))
+            return segments
+        segments = [(f'{key} {comparison}= ? AND ({key} {comparison} ? '
+                     f'OR CONVERSION_CODE_ID {comparison} ?)',
+                     [after_value, after_value, after_id])]
+        if descending and order_by in NULLABLE_COLUMNS:
+            segments.append((f'{order_by} IS NULL', []))
+        return segments
+
+    def get_page(self, after_id: Optional[int] = None, limit: int = 200,
+                 field_name_filter: Optional[str] = None, match: Optional[str] = None,
+                 offset: int = 0, order_by: str = DEFAULT_SORT, descending: bool = False,
+                 after_value=None, where=None) -> List[Dict]:
+        """Like ``get_record_page``, with the records as dicts."""
+        return [record.as_dict() for record in
+                self.get_record_page(after_id, limit, field_name_filter, match, offset,
+                                     order_by, descending, after_value, where)]
+
+    def field_name_summary(self, field_name_filter: Optional[str] = None,
+                           match: Optional[str] = None, where=None) -> List[FieldSummary]:
+        """Count records and imported records per FIELD_NAME, in the database.
+
+        Only one row per field name is fetched, however many records there
+        are.
+        """
+        conditions, params, compiled = self._filter_where(field_name_filter, match, where)
+        where_sql = ' AND '.join(conditions) or '1 = 1'
+
+        def load():
+            with self.connection() as conn:
+                cursor = self._cursor(conn)
+                cursor.execute(self.backend.field_summary_sql.format(where=where_sql), params)
+                return [FieldSummary(name, records, imported or 0)
+                        for name, records, imported in cursor.fetchall()]
+
+        return self._cached(('summary', field_name_filter or None, match, compiled), load)
+
+    def check_integrity(self, checks: Optional[Iterable[str]] = None, max_issues: int = 100,
+                        known_fields: Optional[Iterable[str]] = None) -> 'IntegrityReport':
+        """Find duplicate and conflicting keys, orphaned field names and
+        spectrum values mapped from several source values.
+
+        See ``integrity.check_integrity``; each check is one indexed query,
+        so the table is never loaded.
+        """
+        from integrity import check_integrity
+        return check_integrity(self, checks, max_issues=max_issues, known_fields=known_fields)
+
+    def iter_rows(self, batch_size: int = 1000) -> Iterator[Tuple]:
+        """Stream every row as a tuple in ``COLUMNS`` order.
+
+        Rows are fetched ``batch_size`` at a time from a single cursor, so
+        memory use does not grow with the table. The pooled connection is
+        held until the iterator is exhausted or closed.
+        """
+        with self.connection() as conn:
+            cursor = self._cursor(conn)
+            try:
+                cursor.arraysize = batch_size
+                cursor.execute(self.backend.select_rows_sql)
+                while True:
+                    batch = cursor.fetchmany()
+                    if not batch:
+                        break
+                    yield from batch
+            finally:
+                cursor.close()
+
+    def current_change_seq(self) -> int:
+        """The sequence number of the latest change log entry, or 0 if none.
+
+        A consumer that loads the whole table reads this first and then
+        calls ``changes_since`` with it; changes made while it was loading
+        are replayed, which is harmless as each entry holds a whole row.
+        """
+        self._require_change_log()
+        with self.connection() as conn:
+            return self._change_seq_range(conn)[1]
+
+    def changes_since(self, seq: int = 0, batch_size: int = 1000) -> Iterator[Change]:
+        """Stream the changes logged after ``seq``, oldest first.
+
+        Like ``iter_rows``, entries are fetched ``batch_size`` at a time and
+        the pooled connection is held until the iterator is exhausted or
+        closed. The last entry's ``seq`` is where the next call resumes.
+        Raises ChangesPrunedError, on first iteration, if entries after
+        ``seq`` have been pruned; the consumer then reloads the table.
+        Writes made before the change log was created are not in it.
+        """
+        for row in self.iter_change_rows(seq, batch_size):
+            yield Change(row[0], row[1], _new_record(row[2:9]), row[9], row[10])
+
+    def iter_change_rows(self, seq: int = 0, batch_size: int = 1000) -> Iterator[Tuple]:
+        """Like ``changes_since``, with entries as tuples in ``CHANGE_COLUMNS`` order."""
+        self._require_change_log()
+        with self.connection() as conn:
+            cursor = self._changes_cursor(conn, seq)
+            try:
+                while True:
+                    batch = cursor.fetchmany(batch_size)
+                    if not batch:
+                        break
+                    yield from batch
+            finally:
+                cursor.close()
+
+    def prune_changes(self, through_seq: int) -> int:
+        """Delete change log entries up to ``through_seq``; returns how many.
+
+        The latest entry is always kept. Readers that have not got past
+        ``through_seq`` yet get ChangesPrunedError.
+        """
+        self._require_change_log()
+
+        def transaction():
+            with self.transaction() as conn:
+                cursor = self._cursor(conn)
+                cursor.execute(PRUNE_CHANGES_SQL, (through_seq,))
+                return cursor.rowcount
+
+        return self._retry_busy(transaction)
+
+    def _require_change_log(self):
+        if not self.change_log_enabled:
+            raise RuntimeError(f"The {self.backend.name} database has no change log.")
+
+    def _change_seq_range(self, conn) -> Tuple[int, int]:
+        """The oldest and latest change log sequence numbers, 0 for an empty log."""
+        cursor = self._cursor(conn)
+        cursor.execute(CHANGE_SEQ_RANGE_SQL)
+        oldest, latest = cursor.fetchone()
+        return oldest or 0, latest or 0
+
+    def _changes_cursor(self, conn, seq: int):
+        """Execute the query for the changes after ``seq`` and return its cursor.
+
+        The range is checked while the query's read transaction is open, so
+        both see the same entries.
+        """
+        cursor = self._cursor(conn)
+        cursor.execute(SELECT_CHANGES_SQL, (seq,))
+        oldest = self._change_seq_range(conn)[0]
+        if seq < oldest - 1:
+            cursor.close()
+            raise ChangesPrunedError(f"Changes {seq + 1} to {oldest - 1} have been pruned; "
+                                     f"the log starts at {oldest}.")
+        return cursor
+
+    def add_record(self, field_name: str, source_value: str, spectrum_value: str,
                    is_imported: str = 'N') -> int:
         """Add a new record."""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO S_CONVERSION_CODE_G97 
-                (FIELD_NAME, SOURCE_VALUE, SPECTRUM_VALUE, IS_IMPORTED, UPDATE_COUNT, CHANGE_DATE_TIME)
-                VALUES (?, ?, ?, ?, 0, ?)
-            ''', (field_name, source_value, spectrum_value, is_imported, datetime.now()))
-            conn.commit()
-            return cursor.lastrowid
-    
-    def update_record(self, conversion_code_id: int, field_name: str, source_value: str, 
-                      spectrum_value: str, is_imported: str) -> bool:
-        """Update an existing record."""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                UPDATE S_CONVERSION_CODE_G97 
-                SET FIELD_NAME = ?, SOURCE_VALUE = ?, SPECTRUM_VALUE = ?, 
-                    IS_IMPORTED = ?, UPDATE_COUNT = UPDATE_COUNT + 1, 
-                    CHANGE_DATE_TIME = ?
-                WHERE CONVERSION_CODE_ID = ?
-            ''', (field_name, source_value, spectrum_value, is_imported, 
-                  datetime.now(), conversion_code_id))
-            conn.commit()
-            return cursor.rowcount > 0
-    
-    def delete_record(self, conversion_code_id: int) -> bool:
-        """Delete a record."""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM S_CONVERSION_CODE_G97 WHERE CONVERSION_CODE_ID = ?', 
-                          (conversion_code_id,))
-            conn.commit()
-            return cursor.rowcount > 0
-    
+        return self._write_one(Write(CHANGE_INSERT, None, (field_name, source_value,
+                                                           spectrum_value, is_imported)))
+
+    def update_record(self, conversion_code_id: int, field_name: str, source_value: str,
+                      spectrum_value: str, is_imported: str,
+                      expected_update_count: Optional[int] = None) -> bool:
+        """Update an existing record.
+
+        With ``expected_update_count`` (the UPDATE_COUNT the caller read),
+        raises ``ConcurrencyConflictError`` if the record has been updated
+        or deleted since.
+        """
+        return self._write_one(Write(CHANGE_UPDATE, conversion_code_id,
+                                     (field_name, source_value, spectrum_value, is_imported),
+                                     expected_update_count))
+
+    def delete_record(self, conversion_code_id: int,
+                      expected_update_count: Optional[int] = None) -> bool:
+        """Delete a record; ``expected_update_count`` as for ``update_record``."""
+        return self._write_one(Write(CHANGE_DELETE, conversion_code_id,
+                                     expected_update_count=expected_update_count))
+
+    def _write_one(self, write: Write):
+        """Make one write in its own transaction, raising a conflict."""
+        result = self._apply_writes([write])[0]
+        if isinstance(result, ConcurrencyConflictError):
+            raise result
+        return result
+
+    def apply_writes(self, writes: Sequence[Write]) -> List[object]:
+        """Make many inserts, updates and deletes in one transaction.
+
+        Every insert and update is validated first; if any is invalid,
+        ValueError is raised and nothing is written. Returns one result per
+        write: the new ID for an insert, whether the record existed for an
+        update or delete, or a ``ConcurrencyConflictError`` for a write
+        whose ``expected_update_count`` no longer matched, which was
+        skipped without affecting the others.
+        """
+        for index, write in enumerate(writes):
+            if write.operation not in (CHANGE_INSERT, CHANGE_UPDATE, CHANGE_DELETE):
+                raise ValueError(f"Write {index}: unknown operation {write.operation!r}")
+            if write.operation != CHANGE_DELETE:
+                error = validate_record(*write.values)
+                if error:
+                    raise ValueError(f"Write {index}: {error}")
+        return self._apply_writes(writes)
+
+    def _apply_writes(self, writes: Sequence[Write]) -> List[object]:
+        """Make writes in one transaction, retried if the database is locked."""
+        if not writes:
+            return []
+        record_ids: List[int] = []
+        field_names: List[Optional[str]] = []
+
+        def transaction():
+            del record_ids[:], field_names[:]
+            results = []
+            with self.transaction() as conn:
+                cursor = self._cursor(conn)
+                now = datetime.now()
+                for write in writes:
+                    results.append(self._execute_write(cursor, write, now, record_ids,
+                                                       field_names))
+            return results
+
+        results = self._retry_busy(transaction)
+        if record_ids:
+            self._invalidate_cache(record_ids, field_names)
+        return results
+
+    def _execute_write(self, cursor, write: Write, now: datetime, record_ids: List[int],
+                       field_names: List[Optional[str]]):
+        """Run one write's statement; collects what the cache must drop."""
+        if write.operation == CHANGE_INSERT:
+            record_id = self.backend.insert_record(cursor, (*write.values, now))
+            record_ids.append(record_id)
+            field_names.append(write.values[0])
+            return record_id
+        record_id = write.conversion_code_id
+        old_field_name = self._field_name_for_invalidation(cursor, record_id)
+        expected = write.expected_update_count
+        if write.operation == CHANGE_UPDATE:
+            if expected is None:
+                cursor.execute(self.backend.update_sql, (*write.values, now, record_id))
+            else:
+                cursor.execute(self.backend.update_if_version_sql,
+                               (*write.values, now, record_id, expected))
+        elif expected is None:
+            cursor.execute(self.backend.delete_sql, (record_id,))
+        else:
+            cursor.execute(self.backend.delete_if_version_sql, (record_id, expected))
+        if cursor.rowcount > 0:
+            record_ids.append(record_id)
+            field_names.append(old_field_name)
+            if write.operation == CHANGE_UPDATE:
+                field_names.append(write.values[0])
+            return True
+        if expected is None:
+            return False
+        return self._conflict(cursor, record_id, expected)
+
+    def _conflict(self, cursor, conversion_code_id: int,
+                  expected_update_count: int) -> ConcurrencyConflictError:
+        """The error for a record whose UPDATE_COUNT is not the expected one."""
+        cursor.execute(self.backend.select_by_id_sql, (conversion_code_id,))
+        current = fetch_records(cursor)
+        return ConcurrencyConflictError(conversion_code_id, expected_update_count,
+                                        current[0] if current else None)
+
+    def _check_update_counts(self, cursor, ids: Iterable[int], update_counts: Dict[int, int],
+                             expected_update_counts: Dict[int, int]):
+        """Raise ConcurrencyConflictError for the first of ``ids`` changed since it was read.
+
+        ``update_counts`` holds the current UPDATE_COUNT of the ``ids`` that
+        still exist; IDs without an expected count are not checked.
+        """
+        for conversion_code_id in ids:
+            expected = expected_update_counts.get(conversion_code_id)
+            if expected is not None and update_counts.get(conversion_code_id) != expected:
+                raise self._conflict(cursor, conversion_code_id, expected)
+
+    def update_many(self, changes: Iterable[Tuple[int, Dict[str, Optional[str]]]],
+                    chunk_size: int = BATCH_CHUNK_SIZE,
+                    expected_update_counts: Optional[Dict[int, int]] = None) -> int:
+        """Apply many partial updates in one transaction.
+
+        ``changes`` yields ``(conversion_code_id, values)`` pairs, where
+        ``values`` maps some of ``UPDATABLE_COLUMNS`` to new values (e.g.
+        ``{'IS_IMPORTED': 'Y'}``). Each chunk reads the current rows with one
+        query, validates the merged records and writes them with one
+        ``executemany``. If any change is invalid, ValueError is raised and
+        nothing is written. Returns the number of records updated; IDs that
+        do not exist are skipped.
+
+        ``expected_update_counts`` maps IDs to the UPDATE_COUNT they were
+        read with. If any of those records has changed or been deleted
+        since, ConcurrencyConflictError is raised and nothing is written.
+        """
+        # Kept so that a transaction retried after a busy error sees them again.
+        changes = list(changes)
+        chunk_size = min(chunk_size, self.backend.max_parameters)
+        updated_ids: List[int] = []
+        field_names = set()
+
+        def transaction():
+            del updated_ids[:]
+            field_names.clear()
+            with self.transaction() as conn:
+                cursor = self._cursor(conn)
+                for start in range(0, len(changes), chunk_size):
+                    pending: Dict[int, Dict[str, Optional[str]]] = {}
+                    for conversion_code_id, values in changes[start:start + chunk_size]:
+                        unknown = set(values) - set(UPDATABLE_COLUMNS)
+                        if unknown:
+                            raise ValueError(
+                                f"Cannot update column(s): {', '.join(sorted(unknown))}")
+                        pending.setdefault(conversion_code_id, {}).update(values)
+
+                    cursor.execute(self.backend.select_updatable_sql.format(
+                        ids=', '.join('?' * len(pending))), list(pending))
+                    rows = cursor.fetchall()
+                    if expected_update_counts:
+                        self._check_update_counts(cursor, pending, {
+                            row[0]: row[1] for row in rows}, expected_update_counts)
+                    now = datetime.now()
+                    params = []
+                    for conversion_code_id, _, *current in rows:
+                        record = dict(zip(UPDATABLE_COLUMNS, current))
+                        field_names.add(record['FIELD_NAME'])
+                        record.update(pending[conversion_code_id])
+                        field_names.add(record['FIELD_NAME'])
+                        values = [record[column] for column in UPDATABLE_COLUMNS]
+                        error = validate_record(*values)
+                        if error:
+                            raise ValueError(f"Record {conversion_code_id}: {error}")
+                        params.append((*values, now, conversion_code_id))
+                        updated_ids.append(conversion_code_id)
+                    if params:
+                        cursor.executemany(self.backend.update_sql, params)
+
+        self._retry_busy(transaction)
+        self._invalidate_cache(updated_ids, field_names)
+        return len(updated_ids)
+
+    def delete_many(self, conversion_code_ids: Iterable[int],
+                    chunk_size: int = BATCH_CHUNK_SIZE,
+                    expected_update_counts: Optional[Dict[int, int]] = None) -> int:
+        """Delete many records in one transaction, one statement per chunk.
+
+        Returns the number of records deleted; IDs that do not exist are
+        skipped. ``expected_update_counts`` is checked as by ``update_many``.
+        """
+        requested = list(conversion_code_ids)
+        chunk_size = min(chunk_size, self.backend.max_parameters)
+
+        def transaction():
+            deleted = 0
+            with self.transaction() as conn:
+                cursor = self._cursor(conn)
+                for start in range(0, len(requested), chunk_size):
+                    chunk = requested[start:start + chunk_size]
+                    if expected_update_counts:
+                        cursor.execute(self.backend.select_updatable_sql.format(
+                            ids=', '.join('?' * len(chunk))), chunk)
+                        self._check_update_counts(cursor, chunk, {
+                            row[0]: row[1] for row in cursor.fetchall()}, expected_update_counts)
+                    cursor.execute(self.backend.delete_many_sql.format(
+                        ids=', '.join('?' * len(chunk))), chunk)
+                    deleted += cursor.rowcount
+            return deleted
+
+        deleted = self._retry_busy(transaction)
+        if deleted:
+            self._invalidate_cache(requested)
+        return deleted
+
+    def lookup_spectrum_values(self, field_name: str, source_values: Iterable[str],
+                               chunk_size: int = BATCH_CHUNK_SIZE) -> Dict[str, Optional[str]]:
+        """Map source values of one field to their spectrum values.
+
+        Each chunk of values is one indexed query, and nothing else is
+        loaded, so short-lived processes can convert a batch without
+        building a ``lookup.CodeTranslator``. Unmapped values are left out.
+        """
+        values = list(dict.fromkeys(source_values))
+        chunk_size = min(chunk_size, self.backend.max_parameters - 1)
+        mappings: Dict[str, Optional[str]] = {}
+        with self.connection() as conn:
+            cursor = self._cursor(conn)
+            for start in range(0, len(values), chunk_size):
+                chunk = values[start:start + chunk_size]
+                cursor.execute(self.backend.select_mappings_sql.format(
+                    values=', '.join('?' * len(chunk))), [field_name] + chunk)
+                mappings.update(cursor.fetchall())
+        return mappings
+
+    def get_ids(self, field_name_filter: Optional[str] = None,
+                match: Optional[str] = None, where=None) -> List[int]:
+        """Return the IDs of all records matching the filters, in order."""
+        conditions, params, _ = self._filter_where(field_name_filter, match, where)
+        where_sql = ' AND '.join(conditions) or '1 = 1'
+        with self.connection() as conn:
+            cursor = self._cursor(conn)
+            cursor.execute(self.backend.select_ids_sql.format(where=where_sql), params)
+            return [row[0] for row in cursor.fetchall()]
+
+    def _field_name_for_invalidation(self, cursor, conversion_code_id: int) -> Optional[str]:
+        """Read a record's current FIELD_NAME if the cache needs it."""
+        if self._cache is None:
+            return None
+        cursor.execute(f'SELECT FIELD_NAME FROM {TABLE_NAME} WHERE CONVERSION_CODE_ID = ?',
+                       (conversion_code_id,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def get_record(self, conversion_code_id: int) -> Optional[Record]:
+        """Get a single record by ID as a ``Record``."""
+        return self._cached(('record', conversion_code_id),
+                            lambda: self._load_record(conversion_code_id))
+
     def get_record_by_id(self, conversion_code_id: int) -> Optional[Dict]:
         """Get a single record by ID."""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM S_CONVERSION_CODE_G97 WHERE CONVERSION_CODE_ID = ?', 
-                          (conversion_code_id,))
-            row = cursor.fetchone()
-            return dict(row) if row else None
\ No newline at end of file
+        record = self.get_record(conversion_code_id)
+        return record.as_dict() if record is not None else None
+
+    def _load_record(self, conversion_code_id: int) -> Optional[Record]:
+        """Query a single record by ID."""
+        with self.connection() as conn:
+            cursor = self._cursor(conn)
+            cursor.execute(self.backend.select_by_id_sql, (conversion_code_id,))
+            records = fetch_records(cursor)
+            return records[0] if records else None
+
+    def bulk_upsert(self, rows: Iterable[Sequence[Optional[str]]], chunk_size: int = 5000,
+                    progress: Optional[Callable[[int], None]] = None,
+                    max_errors: int = 100) -> BulkUpsertResult:
+        """Insert or update many records keyed on (FIELD_NAME, SOURCE_VALUE).
+
+        ``rows`` is any iterable of ``(field_name, source_value, spectrum_value)``
+        or ``(field_name, source_value, spectrum_value, is_imported)`` sequences
+        and is consumed lazily, one chunk at a time. Each chunk is validated and
+        committed in its own transaction. Existing rows only get their
+        UPDATE_COUNT and CHANGE_DATE_TIME bumped when a value actually changes,
+        so re-importing the same file is a no-op. ``progress`` is called with
+        the number of input rows processed after each chunk.
+
+        SOURCE_VALUE is part of the key, so rows without one are rejected;
+        an empty string is a valid source value.
+        """
+        inserted = updated = unchanged = rejected = processed = 0
+        errors: List[Tuple[int, str]] = []
+        chunk: List[Tuple[str, str, Optional[str], str]] = []
+
+        def flush():
+            nonlocal inserted, updated, unchanged
+
+            def transaction():
+                with self.transaction() as conn:
+                    return self.backend.upsert_chunk(self._cursor(conn), chunk, datetime.now())
+
+            chunk_updated, chunk_inserted, chunk_unchanged = self._retry_busy(transaction)
+            self._invalidate_cache()
+            inserted += chunk_inserted
+            updated += chunk_updated
+            unchanged += chunk_unchanged
+            chunk.clear()
+
+        for row_number, row in enumerate(rows, 1):
+            processed = row_number
+            field_name, source_value, spectrum_value = row[0], row[1], row[2]
+            is_imported = row[3] if len(row) > 3 and row[3] else 'N'
+            if source_value is None:
+                error = "Source value is required to upsert by key"
+            else:
+                error = validate_record(field_name, source_value, spectrum_value, is_imported)
+            if error is not None:
+                rejected += 1
+                if len(errors) < max_errors:
+                    errors.append((row_number, error))
+                continue
+            chunk.append((field_name, source_value, spectrum_value, is_imported))
+            if len(chunk) >= chunk_size:
+                flush()
+                if progress is not None:
+                    progress(processed)
+
+        if chunk:
+            flush()
+        if progress is not None:
+            progress(processed)
+        return BulkUpsertResult(inserted, updated, unchanged, rejected, errors)
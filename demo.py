@@ -1,4 +1,7 @@
-"""Demo script to populate sample data and show the GUI."""
+"""Demo script to populate sample data and show the GUI.
+
+Pass ``--no-gui`` to only populate the data, without importing Tk.
+"""
 import os
 import sys
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -33,28 +36,26 @@ def create_sample_data():
     ]
     
     print("Creating sample data...")
-    for field_name, source_value, spectrum_value, is_imported in sample_data:
-        db.add_record(field_name, source_value, spectrum_value, is_imported)
+    result = db.bulk_upsert(sample_data)
     
-    print(f"✓ Created {len(sample_data)} sample records")
+    print(f"✓ Created {result.inserted} sample records "
+          f"({result.updated + result.unchanged} already present)")
     
-    # Show summary
-    all_records = db.get_all_records()
-    print(f"Total records in database: {len(all_records)}")
+    # Show summary, counted by the database
+    groups = db.field_name_summary()
+    print(f"Total records in database: {sum(group.records for group in groups)}")
     
     # Show field name distribution
-    field_names = {}
-    for record in all_records:
-        field_name = record['FIELD_NAME']
-        field_names[field_name] = field_names.get(field_name, 0) + 1
-    
     print("\nField name distribution:")
-    for field_name, count in sorted(field_names.items()):
-        print(f"  {field_name}: {count} records")
+    for group in groups:
+        print(f"  {group.field_name}: {group.records} records "
+              f"({group.imported_ratio:.0%} imported)")
 
 
 if __name__ == "__main__":
     create_sample_data()
+    if "--no-gui" in sys.argv[1:]:
+        sys.exit(0)
     print("\nStarting GUI application...")
     
     # Import and run the GUI
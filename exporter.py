@@ -0,0 +1,296 @@
+"""Streaming export of S_CONVERSION_CODE_G97 to CSV, JSONL and columnar files.
+
+All writers pull rows from ``ConversionCodeDB.iter_rows`` in batches and
+write them out incrementally, so memory use stays constant regardless of
+table size. ``export_changes`` writes only the change log entries after a
+sequence number instead, as CSV or JSONL with ``CHANGE_COLUMNS``.
+
+The columnar format is a small self-describing binary layout for downstream
+loaders that want typed columns without parsing text::
+
+    header:    b'CCOL' | u16 version | u16 column count
+               per column: u16 name length | name (UTF-8) | u8 type
+    row group: b'RG' | u32 row count
+               per column: u8 encoding | u8 compressed | u32 length | payload
+    footer:    b'END' | u32 row group count | u64 total rows
+
+Integers are encoded as little-endian int64 arrays. Strings are either
+``plain`` (null bitmap, uint32 end offsets, UTF-8 data) or ``dict`` (u32
+distinct count, u32 block length, a plain block of the distinct values, then
+uint32 indices) when a row group has few distinct values. Payloads are
+optionally zlib-compressed.
+"""
+import csv
+import json
+import struct
+import sys
+import zlib
+from array import array
+from itertools import chain, islice
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from database import CHANGE_COLUMNS, COLUMNS, ConversionCodeDB
+from importer import open_text_file
+
+
+EXPORT_FORMATS = ('csv', 'jsonl', 'columnar')
+
+COLUMNAR_MAGIC = b'CCOL'
+COLUMNAR_VERSION = 1
+
+TYPE_INT = 0
+TYPE_STR = 1
+
+ENCODING_INT64 = 0
+ENCODING_PLAIN = 1
+ENCODING_DICT = 2
+
+COLUMN_TYPES = {
+    'CONVERSION_CODE_ID': TYPE_INT,
+    'UPDATE_COUNT': TYPE_INT,
+}
+
+_LITTLE_ENDIAN = sys.byteorder == 'little'
+
+
+def _little_endian_bytes(values: array) -> bytes:
+    """Serialize an array in little-endian byte order."""
+    if not _LITTLE_ENDIAN:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _array_from_little_endian(typecode: str, data: bytes) -> array:
+    """Deserialize a little-endian array."""
+    values = array(typecode)
+    values.frombytes(data)
+    if not _LITTLE_ENDIAN:
+        values.byteswap()
+    return values
+
+
+def export_csv(rows: Iterable[Sequence], f, columns: Sequence[str] = COLUMNS) -> int:
+    """Write rows as CSV with a header line; returns the row count."""
+    rows = iter(rows)
+    writer = csv.writer(f)
+    writer.writerow(columns)
+    count = 0
+    while True:
+        batch = list(islice(rows, 1000))
+        if not batch:
+            return count
+        writer.writerows(batch)
+        count += len(batch)
+
+
+def export_jsonl(rows: Iterable[Sequence], f, columns: Sequence[str] = COLUMNS) -> int:
+    """Write rows as one JSON object per line; returns the row count."""
+    dumps = json.dumps
+    count = 0
+    for row in rows:
+        f.write(dumps(dict(zip(columns, row)), ensure_ascii=False, default=str))
+        f.write('\n')
+        count += 1
+    return count
+
+
+def _encode_strings(values: Sequence[Optional[str]]) -> bytes:
+    """Encode strings as a null bitmap, end offsets and UTF-8 data."""
+    bitmap = bytearray((len(values) + 7) // 8)
+    offsets = array('I')
+    data = bytearray()
+    for i, value in enumerate(values):
+        if value is None:
+            bitmap[i >> 3] |= 1 << (i & 7)
+        else:
+            data += str(value).encode('utf-8')
+        offsets.append(len(data))
+    return bytes(bitmap) + _little_endian_bytes(offsets) + bytes(data)
+
+
+def _decode_strings(payload: bytes, count: int) -> List[Optional[str]]:
+    """Decode a block written by ``_encode_strings``."""
+    bitmap_size = (count + 7) // 8
+    offsets_end = bitmap_size + 4 * count
+    offsets = _array_from_little_endian('I', payload[bitmap_size:offsets_end])
+    data = payload[offsets_end:]
+    values: List[Optional[str]] = []
+    start = 0
+    for i, end in enumerate(offsets):
+        if payload[i >> 3] & (1 << (i & 7)):
+            values.append(None)
+        else:
+            values.append(data[start:end].decode('utf-8'))
+        start = end
+    return values
+
+
+def _encode_column(column_type: int, values: Sequence) -> Tuple[int, bytes]:
+    """Pick the encoding for one column of a row group."""
+    if column_type == TYPE_INT:
+        return ENCODING_INT64, _little_endian_bytes(array('q', values))
+    distinct = {}
+    indices = array('I', [distinct.setdefault(value, len(distinct)) for value in values])
+    if len(distinct) * 2 <= len(values):
+        block = _encode_strings(list(distinct))
+        return ENCODING_DICT, (struct.pack('<II', len(distinct), len(block)) + block
+                               + _little_endian_bytes(indices))
+    return ENCODING_PLAIN, _encode_strings(values)
+
+
+def _decode_column(encoding: int, payload: bytes, count: int) -> List:
+    """Decode one column of a row group."""
+    if encoding == ENCODING_INT64:
+        return list(_array_from_little_endian('q', payload))
+    if encoding == ENCODING_PLAIN:
+        return _decode_strings(payload, count)
+    if encoding == ENCODING_DICT:
+        distinct_count, block_size = struct.unpack_from('<II', payload)
+        distinct = _decode_strings(payload[8:8 + block_size], distinct_count)
+        indices = _array_from_little_endian('I', payload[8 + block_size:])
+        return [distinct[i] for i in indices]
+    raise ValueError(f"Unknown column encoding {encoding}")
+
+
+def export_columnar(rows: Iterable[Sequence], f, row_group_size: int = 65536,
+                    compress: bool = True) -> int:
+    """Write rows to a binary file object in the columnar format."""
+    types = [COLUMN_TYPES.get(column, TYPE_STR) for column in COLUMNS]
+    header = bytearray(COLUMNAR_MAGIC)
+    header += struct.pack('<HH', COLUMNAR_VERSION, len(COLUMNS))
+    for column, column_type in zip(COLUMNS, types):
+        name = column.encode('utf-8')
+        header += struct.pack('<H', len(name)) + name + struct.pack('<B', column_type)
+    f.write(header)
+
+    rows = iter(rows)
+    total = groups = 0
+    while True:
+        batch = list(islice(rows, row_group_size))
+        if not batch:
+            break
+        f.write(b'RG' + struct.pack('<I', len(batch)))
+        for column_type, values in zip(types, zip(*batch)):
+            encoding, payload = _encode_column(column_type, values)
+            compressed = 0
+            if compress:
+                packed = zlib.compress(payload, 6)
+                if len(packed) < len(payload):
+                    payload, compressed = packed, 1
+            f.write(struct.pack('<BBI', encoding, compressed, len(payload)))
+            f.write(payload)
+        total += len(batch)
+        groups += 1
+    f.write(b'END' + struct.pack('<IQ', groups, total))
+    return total
+
+
+def read_columnar(f) -> Iterator[Tuple]:
+    """Yield row tuples from a binary file object in the columnar format."""
+    magic = f.read(4)
+    if magic != COLUMNAR_MAGIC:
+        raise ValueError("Not a columnar conversion code file.")
+    version, column_count = struct.unpack('<HH', f.read(4))
+    if version != COLUMNAR_VERSION:
+        raise ValueError(f"Unsupported columnar format version {version}.")
+    for _ in range(column_count):
+        name_length = struct.unpack('<H', f.read(2))[0]
+        f.read(name_length + 1)
+
+    groups = total = 0
+    while True:
+        marker = f.read(2)
+        if marker == b'EN' and f.read(1) == b'D':
+            expected_groups, expected_total = struct.unpack('<IQ', f.read(12))
+            if (expected_groups, expected_total) != (groups, total):
+                raise ValueError("Columnar file footer does not match its contents.")
+            return
+        if marker != b'RG':
+            raise ValueError("Truncated or corrupt columnar file.")
+        count = struct.unpack('<I', f.read(4))[0]
+        columns = []
+        for _ in range(column_count):
+            encoding, compressed, length = struct.unpack('<BBI', f.read(6))
+            payload = f.read(length)
+            if compressed:
+                payload = zlib.decompress(payload)
+            columns.append(_decode_column(encoding, payload, count))
+        yield from zip(*columns)
+        groups += 1
+        total += count
+
+
+def export_table(db: ConversionCodeDB, path: str, file_format: str = 'csv',
+                 gzip_output: bool = False, batch_size: int = 1000,
+                 progress: Optional[Callable[[int], None]] = None) -> int:
+    """Export the whole table to ``path`` and return the number of rows.
+
+    CSV and JSONL output is gzip-compressed when ``gzip_output`` is set or
+    the path ends in ``.gz``; columnar output always zlib-compresses column
+    chunks where that makes them smaller.
+    """
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {file_format!r}")
+    rows = db.iter_rows(batch_size)
+    if progress is not None:
+        rows = _report_progress(rows, progress, batch_size)
+    try:
+        if file_format == 'columnar':
+            with open(path, 'wb') as f:
+                return export_columnar(rows, f, compress=True)
+        with open_text_file(path, 'w', compress=gzip_output or None) as f:
+            if file_format == 'csv':
+                return export_csv(rows, f)
+            return export_jsonl(rows, f)
+    finally:
+        rows.close()
+
+
+def export_changes(db: ConversionCodeDB, path: str, since: int = 0,
+                   file_format: str = 'csv', gzip_output: bool = False,
+                   batch_size: int = 1000,
+                   progress: Optional[Callable[[int], None]] = None) -> Tuple[int, int]:
+    """Export the change log entries after ``since`` to ``path``.
+
+    Returns ``(count, last_seq)``, where ``last_seq`` is the sequence number
+    to pass as ``since`` next time (``since`` itself if nothing changed).
+    Raises ChangesPrunedError if entries after ``since`` were pruned.
+    """
+    if file_format not in ('csv', 'jsonl'):
+        raise ValueError(f"Unsupported change export format: {file_format!r}")
+    last_seq = since
+
+    def track(rows: Iterator[Tuple]) -> Iterator[Tuple]:
+        nonlocal last_seq
+        for row in rows:
+            last_seq = row[0]
+            yield row
+
+    changes = db.iter_change_rows(since, batch_size)
+    try:
+        # A pruned log raises here, before the output file is created.
+        first = next(changes, None)
+        rows = track(changes if first is None else chain((first,), changes))
+        if progress is not None:
+            rows = _report_progress(rows, progress, batch_size)
+        with open_text_file(path, 'w', compress=gzip_output or None) as f:
+            write = export_csv if file_format == 'csv' else export_jsonl
+            count = write(rows, f, CHANGE_COLUMNS)
+    finally:
+        changes.close()
+    return count, last_seq
+
+
+def _report_progress(rows: Iterator[Tuple], progress: Callable[[int], None],
+                     every: int) -> Iterator[Tuple]:
+    """Pass rows through, calling ``progress`` with the running count."""
+    count = 0
+    try:
+        for count, row in enumerate(rows, 1):
+            if count % every == 0:
+                progress(count)
+            yield row
+        progress(count)
+    finally:
+        rows.close()
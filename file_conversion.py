@@ -0,0 +1,336 @@
+"""Convert columns of large CSV and JSONL files through the conversion table.
+
+``convert_file`` replaces each value of the chosen columns with its
+SPECTRUM_VALUE for (FIELD_NAME, value), streaming the input in chunks that
+a pool of worker processes converts in parallel::
+
+    result = convert_file(db, "orders.csv.gz", "orders_converted.csv.gz",
+                          {"status": "STATUS_CODE", "region": "REGION_CODE"})
+    print(result.rows, result.unmapped_values)
+
+The mappings are compiled once into a snapshot file (see ``snapshot``) that
+every worker memory-maps, so they share one copy and start without loading
+anything. The parent process only cuts the input into chunks and writes the
+converted chunks out in input order; at most ``max_pending`` chunks are in
+flight, so memory stays bounded whatever the file size.
+
+CSV chunks are cut at line ends outside quoted values: a line end is a
+record boundary when the text before it holds an even number of quote
+characters, since an escaped quote is written as two. Values that have no
+mapping are kept (or replaced by ``default``) and counted per field name;
+empty values are left alone. A value mapped to a NULL SPECTRUM_VALUE
+becomes empty (null in JSONL).
+"""
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections import Counter, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from database import ConversionCodeDB
+from importer import detect_format, open_text_file
+from snapshot import Snapshot, compile_snapshot
+
+
+# Characters of input per chunk handed to a worker.
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Distinct unmapped values counted per field name; more are only totalled.
+MAX_UNMAPPED_VALUES = 10000
+
+# Returned by lookups for values without a mapping.
+_UNMAPPED = object()
+
+# The snapshot a worker process (or the parent, without workers) converts with.
+_snapshot: Optional[Snapshot] = None
+
+
+class FileConversionResult(NamedTuple):
+    """Outcome of converting a file.
+
+    ``unmapped_values`` maps each field name to its unmapped source values
+    and how often each occurred, for at most ``MAX_UNMAPPED_VALUES``
+    distinct values per field; ``unmapped`` counts them all.
+    """
+    rows: int
+    converted: int
+    unmapped: int
+    unmapped_values: Dict[str, Dict[str, int]]
+    seconds: float
+
+
+class _ChunkResult(NamedTuple):
+    """A converted chunk and its counts."""
+    text: str
+    rows: int
+    converted: int
+    unmapped: Dict[str, Counter]
+
+
+def _open_worker_snapshot(path: str):
+    """Process pool initializer: map the snapshot once per worker."""
+    global _snapshot
+    _snapshot = Snapshot(path, verify=False)
+
+
+def _convert_values(field_name: str, values: List[str],
+                    unmapped: Dict[str, Counter]) -> Tuple[List, int]:
+    """Look values of one field up; returns the lookups and the mapped count.
+
+    Unmapped values come back as ``_UNMAPPED`` and are counted.
+    """
+    results = _snapshot.convert_many(field_name, values, _UNMAPPED)
+    missing = [value for value, result in zip(values, results) if result is _UNMAPPED]
+    if missing:
+        unmapped.setdefault(field_name, Counter()).update(missing)
+    return results, len(values) - len(missing)
+
+
+def _convert_csv_chunk(text: str, columns: Tuple[Tuple[int, str], ...],
+                       default: Optional[str], line_terminator: str) -> _ChunkResult:
+    """Convert the given (position, field name) columns of CSV records."""
+    rows = [row for row in csv.reader(io.StringIO(text, newline='')) if row]
+    converted = 0
+    unmapped: Dict[str, Counter] = {}
+    for position, field_name in columns:
+        present = [row for row in rows if len(row) > position and row[position]]
+        results, mapped = _convert_values(field_name, [row[position] for row in present],
+                                          unmapped)
+        converted += mapped
+        for row, result in zip(present, results):
+            if result is _UNMAPPED:
+                if default is not None:
+                    row[position] = default
+            else:
+                row[position] = '' if result is None else result
+    output = io.StringIO()
+    csv.writer(output, lineterminator=line_terminator).writerows(rows)
+    return _ChunkResult(output.getvalue(), len(rows), converted, unmapped)
+
+
+def _convert_jsonl_chunk(text: str, columns: Tuple[Tuple[str, str], ...],
+                         default: Optional[str], first_line: int) -> _ChunkResult:
+    """Convert the given (key, field name) columns of JSON lines."""
+    objects = []
+    # Only '\n' ends a line: JSON strings may hold other line separators.
+    for line_number, line in enumerate(text.split('\n'), first_line):
+        if not line.strip():
+            continue
+        try:
+            objects.append(json.loads(line))
+        except ValueError as e:
+            raise ValueError(f"line {line_number}: invalid JSON: {e}") from None
+    converted = 0
+    unmapped: Dict[str, Counter] = {}
+    for key, field_name in columns:
+        present = [obj for obj in objects
+                   if isinstance(obj, dict) and isinstance(obj.get(key), str) and obj[key]]
+        results, mapped = _convert_values(field_name, [obj[key] for obj in present], unmapped)
+        converted += mapped
+        for obj, result in zip(present, results):
+            if result is _UNMAPPED:
+                if default is not None:
+                    obj[key] = default
+            else:
+                obj[key] = result
+    lines = [json.dumps(obj, ensure_ascii=False) + '\n' for obj in objects]
+    return _ChunkResult(''.join(lines), len(objects), converted, unmapped)
+
+
+def _convert_chunk(file_format: str, *args) -> _ChunkResult:
+    if file_format == 'csv':
+        return _convert_csv_chunk(*args)
+    return _convert_jsonl_chunk(*args)
+
+
+def _record_end(text: str, quoted: bool) -> int:
+    """Index just past the last record boundary in ``text``, or 0.
+
+    With ``quoted`` (CSV), a line end inside a quoted value is not a
+    boundary: the text up to a boundary holds an even number of quotes.
+    """
+    end = text.rfind('\n')
+    if not quoted:
+        return end + 1
+    quotes = text.count('"', 0, end) if end >= 0 else 0
+    while end >= 0 and quotes % 2:
+        previous = text.rfind('\n', 0, end)
+        quotes -= text.count('"', previous + 1, end)
+        end = previous
+    return end + 1
+
+
+def _iter_chunks(f, chunk_size: int, quoted: bool) -> Iterator[str]:
+    """Read ``f`` in chunks of about ``chunk_size`` characters, cut between records."""
+    pending = ''
+    while True:
+        block = f.read(chunk_size)
+        if not block:
+            break
+        text = pending + block
+        end = _record_end(text, quoted)
+        if end == 0:
+            # One record longer than a chunk: keep reading.
+            pending = text
+            continue
+        yield text[:end]
+        pending = text[end:]
+    if pending:
+        yield pending
+
+
+def _read_csv_header(f) -> Tuple[str, List[str]]:
+    """Read the header record; returns its text and column names."""
+    text = ''
+    while True:
+        line = f.readline()
+        text += line
+        if not line or text.count('"') % 2 == 0:
+            break
+    return text, next(csv.reader(io.StringIO(text, newline='')), [])
+
+
+def _resolve_columns(names: List[str], columns: Dict[str, str], path: str) -> Dict[str, str]:
+    """Map requested columns to header names, ignoring case."""
+    by_upper = {name.strip().upper(): name for name in names}
+    resolved = {}
+    for column, field_name in columns.items():
+        name = by_upper.get(column.strip().upper())
+        if name is None:
+            raise ValueError(f"{path}: no column {column!r} in the header")
+        resolved[name] = field_name
+    return resolved
+
+
+def convert_file(source, input_path: str, output_path: str, columns: Dict[str, str],
+                 file_format: Optional[str] = None, default: Optional[str] = None,
+                 workers: Optional[int] = None, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 max_pending: Optional[int] = None,
+                 progress: Optional[Callable[[int], None]] = None) -> FileConversionResult:
+    """Convert ``columns`` of a CSV or JSONL file, writing the result to ``output_path``.
+
+    ``source`` is a ``ConversionCodeDB``, whose mappings are compiled into a
+    temporary snapshot, or the path of a snapshot file. ``columns`` maps
+    column names (CSV header names, matched case-insensitively, or JSON
+    keys) to the FIELD_NAME their values belong to. Either path may end in
+    ``.gz``. ``workers`` defaults to the number of CPUs; with 1, chunks are
+    converted in this process. ``progress`` is called with the number of
+    rows written so far.
+    """
+    global _snapshot
+    started = time.perf_counter()
+    file_format = file_format or detect_format(input_path)
+    if file_format not in ('csv', 'jsonl'):
+        raise ValueError(f"Cannot convert {file_format!r} files; expected 'csv' or 'jsonl'")
+    if not columns:
+        raise ValueError("No columns to convert")
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or 2 * workers
+    temp_dir = None
+    if isinstance(source, ConversionCodeDB):
+        temp_dir = tempfile.mkdtemp(prefix='conversion_snapshot_')
+        snapshot_path = os.path.join(temp_dir, 'codes.snap')
+        compile_snapshot(source, snapshot_path)
+    else:
+        snapshot_path = source
+        Snapshot(snapshot_path).close()  # Check it once, before the workers map it.
+
+    pool = None
+    try:
+        with open_text_file(input_path) as infile, \
+                open_text_file(output_path, 'w') as outfile:
+            if file_format == 'csv':
+                header_text, names = _read_csv_header(infile)
+                if not names:
+                    raise ValueError(f"{input_path}: the file is empty")
+                resolved = _resolve_columns(names, columns, input_path)
+                line_terminator = '\r\n' if header_text.endswith('\r\n') else '\n'
+                spec = tuple((names.index(name), field_name)
+                             for name, field_name in resolved.items())
+                outfile.write(header_text)
+                tasks = (('csv', text, spec, default, line_terminator)
+                         for text in _iter_chunks(infile, chunk_size, quoted=True))
+            else:
+                spec = tuple(columns.items())
+                tasks = _jsonl_tasks(infile, chunk_size, spec, default)
+
+            if workers > 1:
+                pool = ProcessPoolExecutor(workers, initializer=_open_worker_snapshot,
+                                           initargs=(snapshot_path,))
+                results = _ordered_results(pool, tasks, max_pending)
+            else:
+                _open_worker_snapshot(snapshot_path)
+                results = (_convert_chunk(*task) for task in tasks)
+            rows = converted = unmapped = 0
+            unmapped_values: Dict[str, Counter] = {}
+            for chunk in results:
+                outfile.write(chunk.text)
+                rows += chunk.rows
+                converted += chunk.converted
+                for field_name, counts in chunk.unmapped.items():
+                    unmapped += sum(counts.values())
+                    _merge_unmapped(unmapped_values.setdefault(field_name, Counter()), counts)
+                if progress is not None:
+                    progress(rows)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        elif _snapshot is not None:
+            _snapshot.close()
+            _snapshot = None
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    return FileConversionResult(rows, converted, unmapped,
+                                {field_name: dict(counts.most_common())
+                                 for field_name, counts in unmapped_values.items()},
+                                time.perf_counter() - started)
+
+
+def _jsonl_tasks(infile, chunk_size: int, spec, default) -> Iterator[Tuple]:
+    """Chunk tasks for a JSONL file, numbering lines for error messages."""
+    first_line = 1
+    for text in _iter_chunks(infile, chunk_size, quoted=False):
+        yield 'jsonl', text, spec, default, first_line
+        first_line += text.count('\n')
+
+
+def _ordered_results(pool: ProcessPoolExecutor, tasks: Iterator[Tuple],
+                     max_pending: int) -> Iterator[_ChunkResult]:
+    """Yield chunk results in task order, with at most ``max_pending`` submitted."""
+    pending: 'deque[Future]' = deque()
+    for task in tasks:
+        pending.append(pool.submit(_convert_chunk, *task))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _merge_unmapped(total: Counter, counts: Counter):
+    """Add a chunk's unmapped counts, tracking at most MAX_UNMAPPED_VALUES values."""
+    room = MAX_UNMAPPED_VALUES - len(total)
+    for value, count in counts.items():
+        if value in total:
+            total[value] += count
+        elif room > 0:
+            total[value] = count
+            room -= 1
+
+
+def write_unmapped_report(result: FileConversionResult, path: str) -> int:
+    """Write unmapped values as CSV (FIELD_NAME, SOURCE_VALUE, COUNT), most
+    frequent first; returns the number of lines written."""
+    lines = sorted(((field_name, value, count)
+                    for field_name, counts in result.unmapped_values.items()
+                    for value, count in counts.items()),
+                   key=lambda line: (-line[2], line[0], line[1]))
+    with open_text_file(path, 'w') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(('FIELD_NAME', 'SOURCE_VALUE', 'COUNT'))
+        writer.writerows(lines)
+    return len(lines)
@@ -0,0 +1,460 @@
+"""Composite filters over every column, compiled to parameterized SQL.
+
+A filter is a tree of ``Condition``s joined by ``And``, ``Or`` and ``Not``,
+or the same written as text::
+
+    where = And((Condition('SOURCE_VALUE', '^=', 'X'),
+                 Condition('IS_IMPORTED', '=', 'N'),
+                 Condition('CHANGE_DATE_TIME', '>=', datetime(2024, 1, 1))))
+    where = parse_filter("source ^= X and imported = N and changed >= 2024-01-01")
+    db.count_records(where=where)
+    db.get_record_page(where=where, order_by='SOURCE_VALUE')
+
+Operators (``OPERATORS``):
+
+``=  !=  <  <=  >  >=``
+    Compare. Text columns compare case-insensitively, as the field name
+    filter does; CHANGE_DATE_TIME takes ISO dates or date-times.
+``^=`` and ``~``
+    Starts with and contains, for FIELD_NAME, SOURCE_VALUE and
+    SPECTRUM_VALUE.
+``in (A, B, ...)``
+    Equals any of the values.
+``is null`` and ``is not null``
+
+In text, conditions next to each other are joined by ``and``; ``or``,
+``not`` and parentheses work as usual. Columns may be named by their short
+names in ``COLUMN_ALIASES``, and values with spaces or operator characters
+are quoted. As in SQL, a comparison with a NULL column matches nothing,
+negated or not.
+
+Compiled SQL depends only on the filter's shape, the filter with its values
+left out, so it is cached per shape and the database reuses its prepared
+statements for every filter of that shape. ``in`` lists are padded to a
+power of two values for the same reason. Text comparisons use the NOCASE
+collation of the columns' indexes, and on SQLite a condition on IS_IMPORTED,
+which only has two values, is kept from driving the query when another
+condition can use an index.
+"""
+import re
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from database import COLUMNS, FTS_MATCH_SQL, FTS_MIN_TERM_LENGTH, Backend
+
+
+OPERATORS = ('=', '!=', '<', '<=', '>', '>=', '^=', '~', 'in', 'is null', 'is not null')
+
+TEXT_COLUMNS = ('FIELD_NAME', 'SOURCE_VALUE', 'SPECTRUM_VALUE')
+INTEGER_COLUMNS = ('CONVERSION_CODE_ID', 'UPDATE_COUNT')
+DATE_COLUMNS = ('CHANGE_DATE_TIME',)
+
+COLUMN_ALIASES = {
+    'ID': 'CONVERSION_CODE_ID',
+    'FIELD': 'FIELD_NAME',
+    'SOURCE': 'SOURCE_VALUE',
+    'SPECTRUM': 'SPECTRUM_VALUE',
+    'IMPORTED': 'IS_IMPORTED',
+    'UPDATES': 'UPDATE_COUNT',
+    'CHANGED': 'CHANGE_DATE_TIME',
+}
+
+# Operators only text columns support.
+TEXT_OPERATORS = ('^=', '~')
+NULL_OPERATORS = ('is null', 'is not null')
+COMPARISONS = {'=': '=', '!=': '<>', '<': '<', '<=': '<=', '>': '>', '>=': '>='}
+
+# Only two values, so an index on it rarely narrows a query down.
+LOW_SELECTIVITY_COLUMNS = ('IS_IMPORTED',)
+
+# Conditions an index can serve; '!=' and substring LIKEs scan.
+INDEXABLE_OPERATORS = ('=', '<', '<=', '>', '>=', '^=', 'in', 'is null')
+
+# Compiled statements kept per FilterCompiler.
+MAX_CACHED_SHAPES = 256
+
+
+class Condition(NamedTuple):
+    """``column operator value``; ``value`` is a sequence for ``in`` and
+    unused for the null tests."""
+    column: str
+    operator: str
+    value: object = None
+
+
+class And(NamedTuple):
+    """Matches records matching every part."""
+    parts: Tuple['Filter', ...]
+
+
+class Or(NamedTuple):
+    """Matches records matching any part."""
+    parts: Tuple['Filter', ...]
+
+
+class Not(NamedTuple):
+    """Matches records that ``part`` does not match."""
+    part: 'Filter'
+
+
+Filter = Union[Condition, And, Or, Not]
+
+
+class CompiledFilter(NamedTuple):
+    """A filter as a SQL condition with ``?`` placeholders, and its parameters."""
+    sql: str
+    params: Tuple
+
+
+def _column(name: str) -> str:
+    """Resolve a column name or alias, case-insensitively."""
+    upper = name.upper()
+    column = COLUMN_ALIASES.get(upper, upper)
+    if column not in COLUMNS:
+        raise ValueError(f"Unknown column {name!r}; expected one of {COLUMNS} "
+                         f"or {tuple(COLUMN_ALIASES)}")
+    return column
+
+
+def coerce_value(column: str, value):
+    """Convert a value (or its text) to what ``column`` is compared with."""
+    if value is None:
+        raise ValueError(f"{column} cannot be compared with NULL; use 'is null'")
+    if column in INTEGER_COLUMNS:
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{column} must be compared with a whole number, "
+                             f"not {value!r}") from None
+    if column in DATE_COLUMNS:
+        if isinstance(value, datetime):
+            return value
+        if isinstance(value, date):
+            return datetime(value.year, value.month, value.day)
+        try:
+            return datetime.fromisoformat(str(value))
+        except ValueError:
+            raise ValueError(f"{column} must be compared with a date like 2024-01-31 "
+                             f"or 2024-01-31T08:00, not {value!r}") from None
+    if column == 'IS_IMPORTED':
+        return str(value).upper()
+    return str(value)
+
+
+def _check_condition(condition: Condition) -> Condition:
+    """Validate a condition, returning it with its column name resolved."""
+    column = _column(condition.column)
+    operator = condition.operator.lower() if isinstance(condition.operator, str) else None
+    if operator not in OPERATORS:
+        raise ValueError(f"Unknown operator {condition.operator!r}; "
+                         f"expected one of {OPERATORS}")
+    if operator in TEXT_OPERATORS and column not in TEXT_COLUMNS:
+        raise ValueError(f"{operator!r} only applies to text columns {TEXT_COLUMNS}")
+    return Condition(column, operator, condition.value)
+
+
+def _flatten(expr: Filter, backend: Backend, params: List) -> Tuple:
+    """Return the shape of ``expr``, appending its parameters to ``params``.
+
+    The shape holds everything the SQL depends on: structure, columns,
+    operators, ``in`` list lengths and which strategy a ``~`` uses.
+    """
+    if isinstance(expr, Condition):
+        column, operator, value = _check_condition(expr)
+        if operator in NULL_OPERATORS:
+            return ('condition', column, operator, None)
+        if operator == 'in':
+            if isinstance(value, (str, bytes)) or not isinstance(value, Sequence):
+                raise ValueError(f"'in' takes a sequence of values, not {value!r}")
+            values = [coerce_value(column, item) for item in value]
+            if not values:
+                return ('condition', column, operator, 0)
+            size = 1 << (len(values) - 1).bit_length()
+            if size > backend.max_parameters:
+                raise ValueError(f"'in' takes at most {backend.max_parameters} values")
+            params.extend(values)
+            params.extend(values[-1:] * (size - len(values)))
+            return ('condition', column, operator, size)
+        value = coerce_value(column, value)
+        if operator == '^=':
+            params.append(backend.escape_like(value) + '%')
+            return ('condition', column, operator, None)
+        if operator == '~':
+            if (column == 'FIELD_NAME' and backend.fts_enabled
+                    and len(value) >= FTS_MIN_TERM_LENGTH):
+                params.append('"' + value.replace('"', '""') + '"')
+                return ('condition', column, operator, 'fts')
+            params.append('%' + backend.escape_like(value) + '%')
+            return ('condition', column, operator, None)
+        params.append(value)
+        return ('condition', column, operator, None)
+    if isinstance(expr, (And, Or)):
+        if not expr.parts:
+            raise ValueError(f"{type(expr).__name__} needs at least one part")
+        return (type(expr).__name__.lower(),
+                tuple(_flatten(part, backend, params) for part in expr.parts))
+    if isinstance(expr, Not):
+        return ('not', _flatten(expr.part, backend, params))
+    raise TypeError(f"Not a filter: {expr!r}")
+
+
+def _indexable(shape: Tuple) -> bool:
+    """Whether a condition's shape lets an index narrow the query down."""
+    return (shape[0] == 'condition' and shape[1] not in LOW_SELECTIVITY_COLUMNS
+            and (shape[2] in INDEXABLE_OPERATORS or shape[3] == 'fts'))
+
+
+def _render(shape: Tuple, backend: Backend, unindexed: bool = False) -> str:
+    """Build the SQL for a shape; ``unindexed`` keeps low-selectivity
+    columns from driving the query."""
+    kind = shape[0]
+    if kind == 'and':
+        hint = any(_indexable(part) for part in shape[1])
+        return ' AND '.join(f'({_render(part, backend, hint)})' for part in shape[1])
+    if kind == 'or':
+        return ' OR '.join(f'({_render(part, backend)})' for part in shape[1])
+    if kind == 'not':
+        return f'NOT ({_render(shape[1], backend)})'
+    _, column, operator, detail = shape
+    if operator == 'is null':
+        return f'{column} IS NULL'
+    if operator == 'is not null':
+        return f'{column} IS NOT NULL'
+    if operator == '~' and detail == 'fts':
+        return FTS_MATCH_SQL
+    if unindexed and column in LOW_SELECTIVITY_COLUMNS:
+        column = backend.unindexed_sql(column)
+    if operator == 'in':
+        if not detail:
+            return '1 = 0'
+        collate = (f' COLLATE {backend.text_collation}'
+                   if column in TEXT_COLUMNS and backend.text_collation else '')
+        return f"{column}{collate} IN ({', '.join('?' * detail)})"
+    if column in TEXT_COLUMNS:
+        if operator in TEXT_OPERATORS:
+            return backend.compare_text_sql(column, 'LIKE')
+        return backend.compare_text_sql(column, COMPARISONS[operator])
+    return f'{column} {COMPARISONS[operator]} ?'
+
+
+class FilterCompiler:
+    """Compile filters for one backend, caching the SQL of each shape.
+
+    ``hits`` and ``misses`` count cache lookups. Thread-safe.
+    """
+
+    def __init__(self, backend: Backend, max_shapes: int = MAX_CACHED_SHAPES):
+        self.backend = backend
+        self.max_shapes = max_shapes
+        self._statements: 'OrderedDict[Tuple, str]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def compile(self, expr: Union[Filter, str]) -> CompiledFilter:
+        """Compile a filter, or filter text (see ``parse_filter``)."""
+        if isinstance(expr, str):
+            expr = parse_filter(expr)
+        params: List = []
+        shape = _flatten(expr, self.backend, params)
+        with self._lock:
+            sql = self._statements.get(shape)
+            if sql is not None:
+                self._statements.move_to_end(shape)
+                self.hits += 1
+                return CompiledFilter(sql, tuple(params))
+            self.misses += 1
+        sql = _render(shape, self.backend)
+        with self._lock:
+            self._statements[shape] = sql
+            if len(self._statements) > self.max_shapes:
+                self._statements.popitem(last=False)
+        return CompiledFilter(sql, tuple(params))
+
+    def stats(self) -> Dict[str, int]:
+        """Return the shape cache's counters."""
+        with self._lock:
+            return {'shapes': len(self._statements), 'hits': self.hits, 'misses': self.misses}
+
+
+# Strings, multi-character operators, then single characters and bare words.
+_TOKEN = re.compile(r'''\s*(?:
+    (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+  | (?P<symbol>!=|<=|>=|\^=|[=<>~(),])
+  | (?P<word>[^\s"'!=<>~^(),]+)
+)''', re.X)
+
+_QUOTED_ESCAPE = re.compile(r'\\(.)')
+
+
+def _tokenize(text: str) -> List[Tuple[str, str]]:
+    """Split filter text into ``(kind, text)`` tokens."""
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if match is None or match.end() == position:
+            raise ValueError(f"Unexpected {text[position:].strip()[:10]!r} "
+                             f"at position {position + 1}")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'string':
+            value = _QUOTED_ESCAPE.sub(r'\1', value[1:-1])
+        tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    """Recursive descent over the tokens of one filter text."""
+
+    def __init__(self, text: str):
+        self.tokens = _tokenize(text)
+        self.position = 0
+
+    def peek(self) -> Optional[Tuple[str, str]]:
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def peek_keyword(self, *keywords: str) -> bool:
+        token = self.peek()
+        return token is not None and token[0] == 'word' and token[1].lower() in keywords
+
+    def take(self, description: str) -> Tuple[str, str]:
+        token = self.peek()
+        if token is None:
+            raise ValueError(f"Expected {description} at the end of the filter")
+        self.position += 1
+        return token
+
+    def expect(self, symbol: str):
+        token = self.take(repr(symbol))
+        if token != ('symbol', symbol):
+            raise ValueError(f"Expected {symbol!r}, not {token[1]!r}")
+
+    def parse(self) -> Filter:
+        if not self.tokens:
+            raise ValueError("The filter is empty")
+        expr = self.parse_or()
+        if self.peek() is not None:
+            raise ValueError(f"Unexpected {self.peek()[1]!r}")
+        return expr
+
+    def parse_or(self) -> Filter:
+        parts = [self.parse_and()]
+        while self.peek_keyword('or'):
+            self.position += 1
+            parts.append(self.parse_and())
+        return parts[0] if len(parts) == 1 else Or(tuple(parts))
+
+    def parse_and(self) -> Filter:
+        parts = [self.parse_unary()]
+        while True:
+            if self.peek_keyword('and'):
+                self.position += 1
+            elif self.peek() is None or self.peek() == ('symbol', ')') \
+                    or self.peek_keyword('or'):
+                break
+            parts.append(self.parse_unary())
+        return parts[0] if len(parts) == 1 else And(tuple(parts))
+
+    def parse_unary(self) -> Filter:
+        if self.peek_keyword('not'):
+            self.position += 1
+            return Not(self.parse_unary())
+        if self.peek() == ('symbol', '('):
+            self.position += 1
+            expr = self.parse_or()
+            self.expect(')')
+            return expr
+        return self.parse_condition()
+
+    def parse_condition(self) -> Condition:
+        kind, name = self.take("a column name")
+        if kind != 'word':
+            raise ValueError(f"Expected a column name, not {name!r}")
+        column = _column(name)
+        if self.peek_keyword('is'):
+            self.position += 1
+            negated = self.peek_keyword('not')
+            if negated:
+                self.position += 1
+            if not self.peek_keyword('null'):
+                raise ValueError(f"Expected 'null' after 'is' in the condition on {column}")
+            self.position += 1
+            return Condition(column, 'is not null' if negated else 'is null')
+        if self.peek_keyword('in'):
+            self.position += 1
+            self.expect('(')
+            values = [self.parse_value(column)]
+            while self.peek() == ('symbol', ','):
+                self.position += 1
+                values.append(self.parse_value(column))
+            self.expect(')')
+            return Condition(column, 'in', tuple(values))
+        kind, operator = self.take(f"an operator after {name}")
+        if kind != 'symbol' or operator not in OPERATORS:
+            raise ValueError(f"Expected an operator after {name}, not {operator!r}")
+        return _check_condition(Condition(column, operator, self.parse_value(column)))
+
+    def parse_value(self, column: str):
+        kind, value = self.take(f"a value for {column}")
+        if kind == 'symbol':
+            raise ValueError(f"Expected a value for {column}, not {value!r}")
+        return coerce_value(column, value)
+
+
+@lru_cache(maxsize=256)
+def parse_filter(text: str) -> Filter:
+    """Parse filter text such as ``source ^= X and imported = N``.
+
+    Raises ValueError, saying what is wrong, for text that is not a valid
+    filter.
+    """
+    return _Parser(text).parse()
+
+
+def _evaluate(expr: Filter, record) -> Optional[bool]:
+    """Evaluate a filter with SQL's three-valued logic; None is unknown."""
+    if isinstance(expr, And):
+        results = [_evaluate(part, record) for part in expr.parts]
+        return False if False in results else None if None in results else True
+    if isinstance(expr, Or):
+        results = [_evaluate(part, record) for part in expr.parts]
+        return True if True in results else None if None in results else False
+    if isinstance(expr, Not):
+        result = _evaluate(expr.part, record)
+        return None if result is None else not result
+    column, operator, value = _check_condition(expr)
+    actual = record[column]
+    if operator in NULL_OPERATORS:
+        return (actual is None) == (operator == 'is null')
+    if actual is None:
+        return None
+    values = value if operator == 'in' else (value,)
+    values = [coerce_value(column, item) for item in values]
+    if column in TEXT_COLUMNS:
+        actual = actual.lower()
+        values = [item.lower() for item in values]
+    elif column in DATE_COLUMNS and isinstance(actual, str):
+        # Stored as text, compared with the parameter's text form.
+        values = [str(item) for item in values]
+    if operator == 'in':
+        return actual in values
+    value = values[0]
+    if operator == '^=':
+        return actual.startswith(value)
+    if operator == '~':
+        return value in actual
+    return {'=': actual == value, '!=': actual != value, '<': actual < value,
+            '<=': actual <= value, '>': actual > value, '>=': actual >= value}[operator]
+
+
+def matches(expr: Union[Filter, str], record) -> bool:
+    """Whether a record (a ``Record`` or dict) passes a filter, as the SQL decides."""
+    if isinstance(expr, str):
+        expr = parse_filter(expr)
+    return _evaluate(expr, record) is True
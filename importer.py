@@ -0,0 +1,106 @@
+"""Streaming import of conversion codes from CSV and JSONL files."""
+import csv
+import gzip
+import io
+import json
+import os
+from typing import Callable, Iterator, Optional, Tuple
+
+from database import BulkUpsertResult, ConversionCodeDB
+
+
+IMPORT_COLUMNS = ('FIELD_NAME', 'SOURCE_VALUE', 'SPECTRUM_VALUE', 'IS_IMPORTED')
+
+ImportRow = Tuple[Optional[str], Optional[str], Optional[str], Optional[str]]
+
+
+def open_text_file(path: str, mode: str = 'r', encoding: str = 'utf-8',
+                   compress: Optional[bool] = None):
+    """Open a text file, transparently (de)compressing gzip data.
+
+    ``compress`` defaults to whether the path ends in ``.gz``.
+    """
+    if compress is None:
+        compress = path.endswith('.gz')
+    if compress:
+        return gzip.open(path, mode + 't', encoding=encoding, newline='')
+    return io.open(path, mode, encoding=encoding, newline='')
+
+
+def detect_format(path: str) -> str:
+    """Guess 'csv' or 'jsonl' from a file name, ignoring a ``.gz`` suffix."""
+    name = path[:-3] if path.endswith('.gz') else path
+    extension = os.path.splitext(name)[1].lower()
+    if extension in ('.jsonl', '.ndjson', '.json'):
+        return 'jsonl'
+    if extension in ('.csv', '.txt'):
+        return 'csv'
+    raise ValueError(f"Cannot tell the format of {path!r}; pass it explicitly.")
+
+
+def _column_lookup(keys) -> dict:
+    """Map table column names to the matching keys in a header, ignoring case."""
+    by_upper = {key.strip().upper(): key for key in keys if key}
+    return {column: by_upper[column] for column in IMPORT_COLUMNS if column in by_upper}
+
+
+def iter_csv_rows(path: str, encoding: str = 'utf-8') -> Iterator[ImportRow]:
+    """Yield import rows from a CSV file with a header line."""
+    with open_text_file(path, encoding=encoding) as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        lookup = _column_lookup(header)
+        if 'FIELD_NAME' not in lookup:
+            raise ValueError(f"{path}: CSV header has no FIELD_NAME column.")
+        positions = [header.index(lookup[column]) if column in lookup else None
+                     for column in IMPORT_COLUMNS]
+        width = len(header)
+        for row in reader:
+            if not row:
+                continue
+            if len(row) < width:
+                row = row + [''] * (width - len(row))
+            yield tuple(row[i].strip() if i is not None else None for i in positions)
+
+
+def iter_jsonl_rows(path: str, encoding: str = 'utf-8') -> Iterator[ImportRow]:
+    """Yield import rows from a file with one JSON object per line."""
+    lookup, last_keys = {}, None
+    with open_text_file(path, encoding=encoding) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                obj = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path}:{line_number}: invalid JSON: {e}") from None
+            keys = tuple(obj)
+            if keys != last_keys:
+                lookup, last_keys = _column_lookup(keys), keys
+            values = []
+            for column in IMPORT_COLUMNS:
+                value = obj.get(lookup[column]) if column in lookup else None
+                values.append(str(value).strip() if value is not None else None)
+            yield tuple(values)
+
+
+def iter_file_rows(path: str, file_format: Optional[str] = None,
+                   encoding: str = 'utf-8') -> Iterator[ImportRow]:
+    """Yield import rows from a CSV or JSONL file."""
+    file_format = file_format or detect_format(path)
+    if file_format == 'csv':
+        return iter_csv_rows(path, encoding)
+    if file_format == 'jsonl':
+        return iter_jsonl_rows(path, encoding)
+    raise ValueError(f"Unsupported import format: {file_format!r}")
+
+
+def import_file(db: ConversionCodeDB, path: str, file_format: Optional[str] = None,
+                chunk_size: int = 5000, encoding: str = 'utf-8',
+                progress: Optional[Callable[[int], None]] = None) -> BulkUpsertResult:
+    """Stream a CSV or JSONL file into the table with ``bulk_upsert``."""
+    rows = iter_file_rows(path, file_format, encoding)
+    return db.bulk_upsert(rows, chunk_size=chunk_size, progress=progress)
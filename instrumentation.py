@@ -0,0 +1,280 @@
+"""Opt-in timing of database and grid operations.
+
+A ``Profiler`` records how long operations take, how many rows they touch
+and, for SQL statements, the statement text. Statements slower than
+``slow_query_ms`` also get their ``EXPLAIN QUERY PLAN`` captured::
+
+    profiler = Profiler(enabled=True)
+    db = ConversionCodeDB(profiler=profiler)
+    ...
+    profiler.summary()         # per-operation and per-statement totals
+    profiler.dump(open('diagnostics.json', 'w'))
+
+While disabled, ``ConversionCodeDB`` hands out its cursors unwrapped and
+``timer`` returns a shared no-op context manager, so leaving a profiler
+attached costs one attribute check per operation.
+"""
+import json
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence
+
+
+SLOW_QUERY_MS = 50.0
+
+# Statements are grouped by their text with whitespace collapsed.
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapse a statement's whitespace so equal statements group together."""
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+def _new_stats() -> Dict[str, float]:
+    return {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0}
+
+
+def _add_stats(stats: Dict[str, float], ms: float, rows: Optional[int], calls: int = 1):
+    stats['count'] += calls
+    stats['total_ms'] += ms
+    stats['max_ms'] = max(stats['max_ms'], ms)
+    if rows:
+        stats['rows'] += rows
+
+
+def _report_stats(table: Dict[str, Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+    report = {}
+    for name, stats in table.items():
+        entry = dict(stats)
+        entry['mean_ms'] = stats['total_ms'] / stats['count'] if stats['count'] else 0.0
+        report[name] = entry
+    return report
+
+
+class _Timer:
+    """Times one ``with`` block; set ``rows`` inside it to record a row count."""
+
+    __slots__ = ('profiler', 'name', 'rows', 'started')
+
+    def __init__(self, profiler: 'Profiler', name: str):
+        self.profiler = profiler
+        self.name = name
+        self.rows: Optional[int] = None
+
+    def __enter__(self) -> '_Timer':
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.record(self.name, time.perf_counter() - self.started, self.rows)
+
+
+class _NullTimer:
+    """Stands in for ``_Timer`` while profiling is off."""
+
+    __slots__ = ('rows',)
+
+    def __enter__(self) -> '_NullTimer':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Profiler:
+    """Thread-safe collector of operation and statement timings.
+
+    Aggregates are kept per operation name and per statement; the most
+    recent ``max_events`` individual timings and ``max_slow_queries`` slow
+    statements are kept as well. ``enabled`` may be toggled at any time.
+    """
+
+    def __init__(self, enabled: bool = False, slow_query_ms: float = SLOW_QUERY_MS,
+                 max_events: int = 500, max_slow_queries: int = 50):
+        self.enabled = enabled
+        self.slow_query_ms = slow_query_ms
+        self._lock = threading.Lock()
+        self._events: Deque[Dict[str, Any]] = deque(maxlen=max_events)
+        self._slow: Deque[Dict[str, Any]] = deque(maxlen=max_slow_queries)
+        self._operations: Dict[str, Dict[str, float]] = {}
+        self._statements: Dict[str, Dict[str, float]] = {}
+        self.started_at = datetime.now()
+
+    def timer(self, name: str):
+        """Context manager timing a block as operation ``name``."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def record(self, name: str, seconds: float, rows: Optional[int] = None):
+        """Record one timed operation."""
+        ms = seconds * 1000
+        with self._lock:
+            _add_stats(self._operations.setdefault(name, _new_stats()), ms, rows)
+            self._events.append({'name': name, 'ms': ms, 'rows': rows,
+                                 'at': time.time()})
+
+    def record_statement(self, sql: str, seconds: float, rows: Optional[int] = None,
+                         calls: int = 1) -> Dict[str, Any]:
+        """Record a statement's execution; returns its event for ``add_fetch``."""
+        ms = seconds * 1000
+        text = normalize_sql(sql)
+        event = {'name': 'sql', 'ms': ms, 'rows': rows, 'at': time.time(), 'sql': text}
+        with self._lock:
+            _add_stats(self._statements.setdefault(text, _new_stats()), ms, rows, calls)
+            self._events.append(event)
+        return event
+
+    def add_fetch(self, event: Dict[str, Any], seconds: float, rows: int):
+        """Charge fetching ``rows`` result rows to a statement's event."""
+        ms = seconds * 1000
+        with self._lock:
+            event['ms'] += ms
+            event['rows'] = (event['rows'] or 0) + rows
+            stats = self._statements.get(event['sql'])
+            if stats is not None:
+                stats['total_ms'] += ms
+                stats['rows'] += rows
+                stats['max_ms'] = max(stats['max_ms'], event['ms'])
+
+    def is_slow(self, event: Dict[str, Any]) -> bool:
+        """Whether a statement event is slow and has no plan captured yet."""
+        return event['ms'] >= self.slow_query_ms and 'plan' not in event
+
+    def add_slow_query(self, event: Dict[str, Any], plan: Optional[List[str]]):
+        """Keep a slow statement together with its query plan (if available)."""
+        with self._lock:
+            event['plan'] = plan
+            self._slow.append(event)
+
+    def summary(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """Totals per operation and per statement, with mean durations."""
+        with self._lock:
+            return {'operations': _report_stats(self._operations),
+                    'statements': _report_stats(self._statements)}
+
+    def events(self) -> List[Dict[str, Any]]:
+        """The most recent timings, oldest first."""
+        with self._lock:
+            return [dict(event) for event in self._events]
+
+    def slow_queries(self) -> List[Dict[str, Any]]:
+        """The most recent slow statements with their plans, oldest first."""
+        with self._lock:
+            return [dict(event) for event in self._slow]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Everything collected so far, as JSON-serializable data."""
+        snapshot = {
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'taken_at': datetime.now().isoformat(timespec='seconds'),
+            'enabled': self.enabled,
+            'slow_query_ms': self.slow_query_ms,
+        }
+        snapshot.update(self.summary())
+        snapshot['slow_queries'] = self.slow_queries()
+        snapshot['events'] = self.events()
+        return snapshot
+
+    def dump(self, f):
+        """Write ``snapshot()`` to a text file object as JSON."""
+        json.dump(self.snapshot(), f, indent=2)
+        f.write('\n')
+
+    def reset(self):
+        """Discard everything collected so far."""
+        with self._lock:
+            self._events.clear()
+            self._slow.clear()
+            self._operations.clear()
+            self._statements.clear()
+            self.started_at = datetime.now()
+
+
+class ProfilingCursor:
+    """DB-API cursor wrapper that records statements on a ``Profiler``.
+
+    Execution and fetch times are charged to the statement that produced
+    the rows. Once a statement's total passes the profiler's slow
+    threshold, ``explain(sql, params)`` is called to capture its plan.
+    """
+
+    def __init__(self, cursor, profiler: Profiler,
+                 explain: Optional[Callable[[str, Sequence], Optional[List[str]]]] = None):
+        self._cursor = cursor
+        self.profiler = profiler
+        self._explain = explain
+        self._event: Optional[Dict[str, Any]] = None
+        self._statement = ('', ())
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    @property
+    def arraysize(self) -> int:
+        return self._cursor.arraysize
+
+    @arraysize.setter
+    def arraysize(self, size: int):
+        self._cursor.arraysize = size
+
+    def execute(self, sql: str, params: Sequence = ()) -> 'ProfilingCursor':
+        """Run and time one statement."""
+        started = time.perf_counter()
+        self._cursor.execute(sql, params)
+        elapsed = time.perf_counter() - started
+        rowcount = self._cursor.rowcount
+        self._statement = (sql, params)
+        self._event = self.profiler.record_statement(
+            sql, elapsed, rowcount if rowcount is not None and rowcount >= 0 else None)
+        self._check_slow()
+        return self
+
+    def executemany(self, sql: str, seq_of_params: Sequence[Sequence]):
+        """Run and time a statement over many parameter sets."""
+        seq_of_params = list(seq_of_params)
+        started = time.perf_counter()
+        self._cursor.executemany(sql, seq_of_params)
+        elapsed = time.perf_counter() - started
+        self._statement = (sql, seq_of_params[0] if seq_of_params else ())
+        self._event = self.profiler.record_statement(sql, elapsed, len(seq_of_params))
+        self._check_slow()
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._charge_fetch(started, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size: Optional[int] = None):
+        started = time.perf_counter()
+        rows = self._cursor.fetchmany(size or self._cursor.arraysize)
+        self._charge_fetch(started, len(rows))
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._charge_fetch(started, len(rows))
+        return rows
+
+    def _charge_fetch(self, started: float, rows: int):
+        if self._event is not None:
+            self.profiler.add_fetch(self._event, time.perf_counter() - started, rows)
+            self._check_slow()
+
+    def _check_slow(self):
+        event = self._event
+        if not self.profiler.is_slow(event):
+            return
+        plan = None
+        if self._explain is not None:
+            plan = self._explain(*self._statement)
+        self.profiler.add_slow_query(event, plan)
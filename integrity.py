@@ -0,0 +1,288 @@
+"""Integrity checks for conversion code mappings.
+
+Each check is one aggregate query that reads an index rather than the
+table, and only rows that are part of an issue come back to Python::
+
+    report = db.check_integrity()
+    for issue in report.conflicts:
+        print(issue.field_name, issue.source_value, issue.spectrum_values)
+
+``keys``
+    Records sharing a (FIELD_NAME, SOURCE_VALUE) key, from a GROUP BY over
+    the (FIELD_NAME, SOURCE_VALUE) index. Keys whose records all map to the
+    same spectrum value are duplicates; keys mapping to several are
+    conflicts, as it is undefined which one a translation uses.
+``field_names``
+    Blank field names, names that differ from another only in case or
+    whitespace, and, given the list of known fields, names not on it.
+``reverse``
+    Spectrum values mapped from several source values of one field, so the
+    mapping cannot be inverted. These are reported but do not fail a check,
+    as many-to-one mappings are often intended.
+
+Issue lists are capped at ``max_issues`` and each issue at ``SAMPLE_SIZE``
+record IDs or values, so memory use does not grow with the table; the
+report's counts are always complete. The checks run concurrently on pooled
+connections, each in its own read transaction.
+"""
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from database import TABLE_NAME, ConversionCodeDB
+
+
+CHECK_KEYS = 'keys'
+CHECK_FIELD_NAMES = 'field_names'
+CHECK_REVERSE = 'reverse'
+CHECKS = (CHECK_KEYS, CHECK_FIELD_NAMES, CHECK_REVERSE)
+
+# Why a field name is reported as orphaned.
+ORPHAN_BLANK = 'blank'
+ORPHAN_VARIANT = 'variant'
+ORPHAN_UNKNOWN = 'unknown'
+
+# Record IDs, spectrum values or source values kept per issue.
+SAMPLE_SIZE = 20
+
+FETCH_SIZE = 1000
+
+# Every record of every duplicated key, grouped by key. The keys come from
+# the covering (FIELD_NAME, SOURCE_VALUE) index alone; their records are then
+# found with one index seek per key.
+DUPLICATE_KEY_ROWS_SQL = f'''
+    WITH DUPLICATE_KEYS AS (
+        SELECT FIELD_NAME, SOURCE_VALUE FROM {TABLE_NAME}
+        WHERE FIELD_NAME IS NOT NULL AND SOURCE_VALUE IS NOT NULL
+        GROUP BY FIELD_NAME, SOURCE_VALUE
+        HAVING COUNT(*) > 1
+    )
+    SELECT t.FIELD_NAME, t.SOURCE_VALUE, t.CONVERSION_CODE_ID, t.SPECTRUM_VALUE
+    FROM DUPLICATE_KEYS d
+    JOIN {TABLE_NAME} t
+      ON t.FIELD_NAME = d.FIELD_NAME AND t.SOURCE_VALUE = d.SOURCE_VALUE
+    ORDER BY t.FIELD_NAME, t.SOURCE_VALUE, t.CONVERSION_CODE_ID
+'''
+
+# Read from the covering (SPECTRUM_VALUE, FIELD_NAME, SOURCE_VALUE) index in
+# its own order.
+REVERSE_MAPPINGS_SQL = f'''
+    SELECT FIELD_NAME, SPECTRUM_VALUE, COUNT(DISTINCT SOURCE_VALUE) FROM {TABLE_NAME}
+    WHERE FIELD_NAME IS NOT NULL AND SPECTRUM_VALUE IS NOT NULL
+    GROUP BY SPECTRUM_VALUE, FIELD_NAME
+    HAVING COUNT(DISTINCT SOURCE_VALUE) > 1
+    ORDER BY SPECTRUM_VALUE, FIELD_NAME
+'''
+
+REVERSE_SOURCES_SQL = f'''
+    SELECT DISTINCT SOURCE_VALUE FROM {TABLE_NAME}
+    WHERE SPECTRUM_VALUE = ? AND FIELD_NAME = ?
+    ORDER BY SOURCE_VALUE
+'''
+
+
+class KeyIssue(NamedTuple):
+    """Several records sharing one (FIELD_NAME, SOURCE_VALUE) key.
+
+    ``spectrum_values`` are the distinct values the records map to, in
+    record ID order.
+    """
+    field_name: str
+    source_value: str
+    records: int
+    spectrum_values: Tuple[Optional[str], ...]
+    record_ids: Tuple[int, ...]
+
+    @property
+    def conflicting(self) -> bool:
+        """Whether the records disagree on the spectrum value."""
+        return len(self.spectrum_values) > 1
+
+
+class OrphanedFieldName(NamedTuple):
+    """A field name that is blank, a variant of another, or unknown.
+
+    ``canonical`` is the name it is a variant of: the known field name, or
+    else the variant with the most records.
+    """
+    field_name: Optional[str]
+    records: int
+    reason: str
+    canonical: Optional[str]
+
+
+class ReverseMapping(NamedTuple):
+    """A spectrum value mapped from several source values of one field."""
+    field_name: str
+    spectrum_value: str
+    sources: int
+    source_values: Tuple[str, ...]
+
+
+class IntegrityReport(NamedTuple):
+    """Outcome of ``check_integrity``.
+
+    The lists hold at most ``max_issues`` issues each; the ``*_count``
+    fields count them all. Checks that were not run report none.
+    """
+    rows_checked: int
+    duplicates: List[KeyIssue]
+    conflicts: List[KeyIssue]
+    orphaned_field_names: List[OrphanedFieldName]
+    reverse_mappings: List[ReverseMapping]
+    duplicate_count: int
+    conflict_count: int
+    orphaned_count: int
+    reverse_mapping_count: int
+    seconds: float
+
+    @property
+    def ok(self) -> bool:
+        """No duplicates, conflicts or orphaned field names were found."""
+        return not (self.duplicate_count or self.conflict_count or self.orphaned_count)
+
+
+def normalize_field_name(field_name: str) -> str:
+    """The form under which variants of a field name compare equal."""
+    return ' '.join(field_name.split()).casefold()
+
+
+def _fetch_rows(cursor) -> Iterator[Tuple]:
+    """Yield a cursor's rows, fetched ``FETCH_SIZE`` at a time."""
+    cursor.arraysize = FETCH_SIZE
+    while True:
+        batch = cursor.fetchmany()
+        if not batch:
+            return
+        yield from batch
+
+
+def check_keys(db: ConversionCodeDB, max_issues: int = 100
+               ) -> Tuple[List[KeyIssue], List[KeyIssue], int, int]:
+    """Find keys used by several records.
+
+    Returns ``(duplicates, conflicts, duplicate_count, conflict_count)``.
+    """
+    duplicates: List[KeyIssue] = []
+    conflicts: List[KeyIssue] = []
+    counts = {False: 0, True: 0}
+    with db.connection() as conn:
+        cursor = db._cursor(conn)
+        try:
+            cursor.execute(DUPLICATE_KEY_ROWS_SQL)
+            for (field_name, source_value), rows in groupby(_fetch_rows(cursor),
+                                                            key=lambda row: row[:2]):
+                records = 0
+                record_ids: List[int] = []
+                spectrum_values: List[Optional[str]] = []
+                for row in rows:
+                    records += 1
+                    if records <= SAMPLE_SIZE:
+                        record_ids.append(row[2])
+                    if row[3] not in spectrum_values and len(spectrum_values) < SAMPLE_SIZE:
+                        spectrum_values.append(row[3])
+                issue = KeyIssue(field_name, source_value, records,
+                                 tuple(spectrum_values), tuple(record_ids))
+                counts[issue.conflicting] += 1
+                issues = conflicts if issue.conflicting else duplicates
+                if len(issues) < max_issues:
+                    issues.append(issue)
+        finally:
+            cursor.close()
+    return duplicates, conflicts, counts[False], counts[True]
+
+
+def check_reverse_mappings(db: ConversionCodeDB, max_issues: int = 100
+                           ) -> Tuple[List[ReverseMapping], int]:
+    """Find spectrum values mapped from several source values of one field.
+
+    Returns ``(reverse_mappings, count)``.
+    """
+    found: List[Tuple[str, str, int]] = []
+    count = 0
+    with db.connection() as conn:
+        cursor = db._cursor(conn)
+        try:
+            cursor.execute(REVERSE_MAPPINGS_SQL)
+            for row in _fetch_rows(cursor):
+                count += 1
+                if len(found) < max_issues:
+                    found.append(tuple(row))
+        finally:
+            cursor.close()
+        mappings = []
+        for field_name, spectrum_value, sources in found:
+            cursor = db._cursor(conn)
+            cursor.execute(REVERSE_SOURCES_SQL, (spectrum_value, field_name))
+            source_values = tuple(row[0] for row in cursor.fetchmany(SAMPLE_SIZE))
+            cursor.close()
+            mappings.append(ReverseMapping(field_name, spectrum_value, sources, source_values))
+    return mappings, count
+
+
+def check_field_names(db: ConversionCodeDB, known_fields: Optional[Iterable[str]] = None,
+                      max_issues: int = 100) -> Tuple[List[OrphanedFieldName], int, int]:
+    """Find blank, variant and (given ``known_fields``) unknown field names.
+
+    Names are compared with ``normalize_field_name``. Works from the per
+    field counts of ``field_name_summary``. Returns ``(orphaned, count,
+    rows_checked)``.
+    """
+    summary = db.field_name_summary()
+    orphaned: List[OrphanedFieldName] = []
+    variants: Dict[str, List] = defaultdict(list)
+    for group in summary:
+        if group.field_name is None or not group.field_name.strip():
+            orphaned.append(OrphanedFieldName(group.field_name, group.records,
+                                              ORPHAN_BLANK, None))
+        else:
+            variants[normalize_field_name(group.field_name)].append(group)
+    known = None
+    if known_fields is not None:
+        known = {normalize_field_name(name): name for name in known_fields}
+    for key, groups in variants.items():
+        if known is not None:
+            canonical = known.get(key)
+        else:
+            canonical = min(groups, key=lambda group: (-group.records,
+                                                        group.field_name)).field_name
+        for group in groups:
+            if group.field_name != canonical:
+                reason = ORPHAN_UNKNOWN if canonical is None else ORPHAN_VARIANT
+                orphaned.append(OrphanedFieldName(group.field_name, group.records,
+                                                  reason, canonical))
+    rows_checked = sum(group.records for group in summary)
+    return orphaned[:max_issues], len(orphaned), rows_checked
+
+
+def check_integrity(db: ConversionCodeDB, checks: Optional[Iterable[str]] = None,
+                    max_issues: int = 100,
+                    known_fields: Optional[Iterable[str]] = None) -> IntegrityReport:
+    """Run the given ``CHECKS`` (all by default) and report what they find.
+
+    ``known_fields`` lists the valid field names; without it only blank and
+    variant field names are reported.
+    """
+    checks = CHECKS if checks is None else tuple(checks)
+    unknown = [check for check in checks if check not in CHECKS]
+    if unknown:
+        raise ValueError(f"Unknown integrity check {unknown[0]!r}; expected one of {CHECKS}")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(CHECKS)) as executor:
+        keys = executor.submit(check_keys, db, max_issues) if CHECK_KEYS in checks else None
+        reverse = (executor.submit(check_reverse_mappings, db, max_issues)
+                   if CHECK_REVERSE in checks else None)
+        if CHECK_FIELD_NAMES in checks:
+            orphaned, orphaned_count, rows_checked = check_field_names(db, known_fields,
+                                                                       max_issues)
+        else:
+            orphaned, orphaned_count = [], 0
+            rows_checked = db.count_records()
+        duplicates, conflicts, duplicate_count, conflict_count = (
+            keys.result() if keys is not None else ([], [], 0, 0))
+        reverse_mappings, reverse_count = reverse.result() if reverse is not None else ([], 0)
+    return IntegrityReport(rows_checked, duplicates, conflicts, orphaned, reverse_mappings,
+                           duplicate_count, conflict_count, orphaned_count, reverse_count,
+                           time.perf_counter() - started)
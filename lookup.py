@@ -0,0 +1,174 @@
+"""In-memory translation of source values to spectrum values."""
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from database import CHANGE_DELETE, CHANGE_INSERT, TABLE_NAME, ChangesPrunedError, ConversionCodeDB
+
+
+LOAD_MAPPINGS_SQL = f'''
+    SELECT CONVERSION_CODE_ID, FIELD_NAME, SOURCE_VALUE, SPECTRUM_VALUE, CHANGE_DATE_TIME
+    FROM {TABLE_NAME}
+    ORDER BY CONVERSION_CODE_ID
+'''
+
+LOAD_CHANGED_MAPPINGS_SQL = f'''
+    SELECT CONVERSION_CODE_ID, FIELD_NAME, SOURCE_VALUE, SPECTRUM_VALUE, CHANGE_DATE_TIME
+    FROM {TABLE_NAME}
+    WHERE CHANGE_DATE_TIME >= ?
+    ORDER BY CHANGE_DATE_TIME, CONVERSION_CODE_ID
+'''
+
+LOAD_KEY_SQL = f'''
+    SELECT SPECTRUM_VALUE FROM {TABLE_NAME}
+    WHERE CONVERSION_CODE_ID = (
+        SELECT MAX(CONVERSION_CODE_ID) FROM {TABLE_NAME}
+        WHERE FIELD_NAME = ? AND SOURCE_VALUE = ?
+    )
+'''
+
+COUNT_SQL = f'SELECT COUNT(*) FROM {TABLE_NAME}'
+
+
+class CodeTranslator:
+    """Translate SOURCE_VALUE to SPECTRUM_VALUE per FIELD_NAME from memory.
+
+    Mappings are held as one dict per field name, so a batch conversion is a
+    single dict lookup per value. ``refresh()`` applies the change log
+    entries written since the last load, deletes included. Without a change
+    log it picks up rows changed since the last load via CHANGE_DATE_TIME and
+    reloads everything when rows have been deleted. Where several rows share
+    a (FIELD_NAME, SOURCE_VALUE) key, the one with the highest ID wins, as in
+    ``ConversionCodeDB.lookup_spectrum_values``.
+    """
+
+    def __init__(self, db: ConversionCodeDB):
+        self.db = db
+        self._maps: Dict[str, Dict[str, Optional[str]]] = {}
+        self._key_by_id: Dict[int, Tuple[str, str]] = {}
+        self._watermark: Optional[str] = None
+        self._change_seq: Optional[int] = None
+        self._lock = threading.Lock()
+        self.reload()
+
+    def __len__(self) -> int:
+        return len(self._key_by_id)
+
+    def field_names(self) -> List[str]:
+        """Field names that have at least one mapping."""
+        return sorted(self._maps)
+
+    def convert(self, field_name: str, source_value: str,
+                default: Optional[str] = None) -> Optional[str]:
+        """Return the spectrum value for one source value, or ``default``."""
+        mapping = self._maps.get(field_name)
+        if mapping is None:
+            return default
+        return mapping.get(source_value, default)
+
+    def convert_many(self, field_name: str, source_values: Iterable[str],
+                     default: Optional[str] = None) -> List[Optional[str]]:
+        """Convert a batch of source values for one field name."""
+        mapping = self._maps.get(field_name)
+        if mapping is None:
+            return [default for _ in source_values]
+        if default is None:
+            return list(map(mapping.get, source_values))
+        get = mapping.get
+        return [get(value, default) for value in source_values]
+
+    def reload(self):
+        """Rebuild all mappings from the table."""
+        maps: Dict[str, Dict[str, Optional[str]]] = {}
+        key_by_id: Dict[int, Tuple[str, str]] = {}
+        watermark = None
+        # Read first: changes made while loading are replayed by refresh().
+        change_seq = self.db.current_change_seq() if self.db.change_log_enabled else None
+        with self.db.connection() as conn:
+            cursor = conn.execute(LOAD_MAPPINGS_SQL)
+            while True:
+                batch = cursor.fetchmany(10000)
+                if not batch:
+                    break
+                for record_id, field_name, source_value, spectrum_value, changed in batch:
+                    mapping = maps.get(field_name)
+                    if mapping is None:
+                        mapping = maps[field_name] = {}
+                    mapping[source_value] = spectrum_value
+                    key_by_id[record_id] = (field_name, source_value)
+                    if watermark is None or changed > watermark:
+                        watermark = changed
+        with self._lock:
+            self._maps, self._key_by_id, self._watermark = maps, key_by_id, watermark
+            self._change_seq = change_seq
+
+    def refresh(self) -> int:
+        """Apply rows changed since the last load; returns how many were read.
+
+        Without a change log, deletes leave no CHANGE_DATE_TIME behind, so a
+        row count that no longer matches triggers a full reload instead.
+        """
+        if self._change_seq is not None:
+            try:
+                return self._apply_changes()
+            except ChangesPrunedError:
+                self.reload()
+                return len(self)
+        if self._watermark is None:
+            self.reload()
+            return len(self)
+        with self.db.connection() as conn, self._lock:
+            changed = conn.execute(LOAD_CHANGED_MAPPINGS_SQL, (self._watermark,)).fetchall()
+            for record_id, field_name, source_value, spectrum_value, changed_at in changed:
+                old_key = self._key_by_id.get(record_id)
+                if old_key is None:
+                    # New rows have the highest ID for their key.
+                    self._maps.setdefault(field_name, {})[source_value] = spectrum_value
+                else:
+                    self._reload_key(conn, (field_name, source_value))
+                self._key_by_id[record_id] = (field_name, source_value)
+                if old_key is not None and old_key != (field_name, source_value):
+                    self._reload_key(conn, old_key)
+                if changed_at > self._watermark:
+                    self._watermark = changed_at
+            stale = conn.execute(COUNT_SQL).fetchone()[0] != len(self._key_by_id)
+        if stale:
+            self.reload()
+        return len(changed)
+
+    def _apply_changes(self) -> int:
+        """Apply the change log entries after the last one applied."""
+        applied = 0
+        with self.db.connection() as conn, self._lock:
+            for change in self.db.changes_since(self._change_seq):
+                record = change.record
+                record_id = record.CONVERSION_CODE_ID
+                if change.operation == CHANGE_DELETE:
+                    old_key = self._key_by_id.pop(record_id, None)
+                    if old_key is not None:
+                        self._reload_key(conn, old_key)
+                else:
+                    key = (record.FIELD_NAME, record.SOURCE_VALUE)
+                    old_key = self._key_by_id.get(record_id)
+                    if change.operation == CHANGE_INSERT:
+                        self._maps.setdefault(key[0], {})[key[1]] = record.SPECTRUM_VALUE
+                    else:
+                        # A row with a higher ID may share the key.
+                        self._reload_key(conn, key)
+                    self._key_by_id[record_id] = key
+                    if old_key is not None and old_key != key:
+                        self._reload_key(conn, old_key)
+                self._change_seq = change.seq
+                applied += 1
+        return applied
+
+    def _reload_key(self, conn, key: Tuple[str, str]):
+        """Re-read the winning row for a key, or drop the key if no row maps it."""
+        field_name, source_value = key
+        row = conn.execute(LOAD_KEY_SQL, key).fetchone()
+        mapping = self._maps.get(field_name)
+        if row is not None:
+            self._maps.setdefault(field_name, {})[source_value] = row[0]
+        elif mapping is not None:
+            mapping.pop(source_value, None)
+            if not mapping:
+                del self._maps[field_name]
@@ -1,22 +1,123 @@
 """Main GUI application for conversion code management."""
+import time
+
+# Start-up is timed from here when the module is run as a script.
+_IMPORTED_AT = time.perf_counter()
+
 import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog
-from typing import Optional
-from database import ConversionCodeDB
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from tkinter import ttk, messagebox
+from itertools import islice
+from typing import Dict, Iterable, List, Optional
+from completion import CompletionIndex, MappingPreview
+from database import (COLUMNS, DEFAULT_SORT, IMPORTED_FLAGS, Change, ChangesPrunedError,
+                      ConcurrencyConflictError, ConversionCodeDB, FieldSummary,
+                      field_name_matches, validate_record)
 from datetime import datetime
+from filters import Filter, parse_filter
+from instrumentation import Profiler
+from virtual_table import PagedResultSet, VirtualTreeview
+from write_queue import WriteQueue
+
+
+# Delay after the last keystroke before the filter query runs.
+FILTER_DEBOUNCE_MS = 200
+
+# How often the event loop checks for a finished background query.
+QUERY_POLL_MS = 10
+
+# Step of the indeterminate progress bar shown while a query runs.
+PROGRESS_INTERVAL_MS = 20
+
+# Refresh re-runs the query instead of reading the change log when more
+# records than this have changed.
+MAX_SYNC_CHANGES = 1000
+
+
+@lru_cache(maxsize=4096)
+def format_change_date(change_date) -> str:
+    """Format a CHANGE_DATE_TIME value for display.
+    
+    Rows written in one batch share a timestamp, so results are cached
+    rather than parsed and formatted again for every row.
+    """
+    if isinstance(change_date, str):
+        # Parse if it's a string
+        try:
+            dt = datetime.fromisoformat(change_date.replace('Z', '+00:00'))
+            return dt.strftime('%Y-%m-%d %H:%M')
+        except ValueError:
+            return change_date
+    return str(change_date)
+
+
+def format_record_values(record) -> tuple:
+    """Format a ``Record`` (or record dict) as the tuple of values shown in the table."""
+    if isinstance(record, tuple):
+        record_id, field_name, source_value, spectrum_value, is_imported, update_count, \
+            change_date = record
+    else:
+        record_id, field_name, source_value, spectrum_value, is_imported, update_count, \
+            change_date = (record[column] for column in COLUMNS)
+    
+    return (
+        record_id,
+        field_name or '',
+        source_value or '',
+        spectrum_value or '',
+        is_imported,
+        update_count,
+        format_change_date(change_date)
+    )
 
 
 class ConversionCodeGUI:
     """Main GUI application for managing conversion codes."""
     
-    def __init__(self):
-        """Initialize the GUI application."""
-        self.db = ConversionCodeDB()
+    def __init__(self, started: Optional[float] = None):
+        """Initialize the GUI application.
+        
+        The window is shown before the database is opened: opening it
+        (which checks the schema) and the first page query run on the query
+        thread, with a progress bar in the status line meanwhile. Start-up
+        milestones are timed from ``started`` (a ``time.perf_counter()``
+        value, by default now) into ``startup_timings``.
+        """
+        self._started = time.perf_counter() if started is None else started
+        # Seconds from start to 'first_paint', 'database_open' and 'first_page'.
+        self.startup_timings: Dict[str, float] = {}
+        # Timings are only collected while enabled in the diagnostics window.
+        self.profiler = Profiler()
+        # Set on the query thread once the database is open.
+        self.db: Optional[ConversionCodeDB] = None
+        # Field names and source values offered while entering records.
+        self.completions: Optional[CompletionIndex] = None
+        # Record writes, grouped into one transaction when made in quick succession.
+        self.writes: Optional[WriteQueue] = None
         self.root = tk.Tk()
         self.root.title("Conversion Code Manager")
         self.root.geometry("1000x600")
         
+        # Filter queries run on one worker thread; each new query supersedes
+        # any still pending, and only the latest generation's results are shown.
+        self._query_executor = ThreadPoolExecutor(max_workers=1)
+        self._query_generation = 0
+        self._pending_query: Optional[Future] = None
+        self._filter_after_id = None
+        self._filter_changed_at: Optional[float] = None
+        self._applied_filter: Optional[str] = None
+        self._applied_where: Optional[str] = None
+        self._diagnostics: Optional[DiagnosticsDialog] = None
+        # (column, descending) the table is sorted by; set by clicking a heading.
+        self._sort = (DEFAULT_SORT, False)
+        # The last change log entry the table reflects; None without a log.
+        self._change_seq: Optional[int] = None
+        
         self.setup_ui()
+        self.root.bind('<Map>', self._on_map, add='+')
+        # Queued ahead of the first query on the single query thread.
+        self._poll_open(self._query_executor.submit(self._open_database))
         self.refresh_data()
     
     def setup_ui(self):
@@ -50,6 +151,17 @@ class ConversionCodeGUI:
         ttk.Button(filter_frame, text="Clear Filter", 
                   command=self.clear_filter).grid(row=0, column=2, padx=5)
         
+        # Composite filter over any columns, ANDed with the field name filter
+        ttk.Label(filter_frame, text="Where:").grid(row=1, column=0, sticky=tk.W,
+                                                    padx=(0, 5), pady=(5, 0))
+        self.where_var = tk.StringVar()
+        self.where_entry = ttk.Entry(filter_frame, textvariable=self.where_var, width=30)
+        self.where_entry.grid(row=1, column=1, sticky=(tk.W, tk.E), padx=(0, 5), pady=(5, 0))
+        self.where_entry.bind('<KeyRelease>', self.on_filter_change)
+        ttk.Label(filter_frame, foreground='gray',
+                  text="e.g. source ^= X and imported = N and changed >= 2024-01-31"
+                  ).grid(row=2, column=1, columnspan=2, sticky=tk.W)
+        
         # Data table
         table_frame = ttk.Frame(main_frame)
         table_frame.grid(row=2, column=0, columnspan=3, sticky=(tk.W, tk.E, tk.N, tk.S))
@@ -73,14 +185,20 @@ class ConversionCodeGUI:
             'CHANGE_DATE_TIME': ('Last Changed', 150)
         }
         
+        self._headings = {col_id: heading for col_id, (heading, width) in columns.items()}
         for col_id, (heading, width) in columns.items():
-            self.tree.heading(col_id, text=heading)
+            self.tree.heading(col_id, text=heading,
+                              command=lambda col_id=col_id: self.sort_by(col_id))
             self.tree.column(col_id, width=width, minwidth=width)
+        self._update_headings()
         
-        # Scrollbars
-        v_scrollbar = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=self.tree.yview)
+        # Scrollbars; the vertical one scrolls a window over the result set
+        # rather than the Treeview, which only holds the visible rows.
+        v_scrollbar = ttk.Scrollbar(table_frame, orient=tk.VERTICAL)
         h_scrollbar = ttk.Scrollbar(table_frame, orient=tk.HORIZONTAL, command=self.tree.xview)
-        self.tree.configure(yscrollcommand=v_scrollbar.set, xscrollcommand=h_scrollbar.set)
+        self.tree.configure(xscrollcommand=h_scrollbar.set)
+        self.table = VirtualTreeview(self.tree, v_scrollbar, format_record_values,
+                                     profiler=self.profiler)
         
         self.tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
         v_scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
@@ -96,149 +214,580 @@ class ConversionCodeGUI:
                   command=self.edit_record).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Delete Selected", 
                   command=self.delete_record).pack(side=tk.LEFT, padx=5)
+        imported_button = ttk.Menubutton(button_frame, text="Set Imported")
+        imported_menu = tk.Menu(imported_button, tearoff=False)
+        for flag in IMPORTED_FLAGS:
+            imported_menu.add_command(label=f"Set Imported = {flag}",
+                                      command=lambda flag=flag: self.set_imported(flag))
+        imported_button['menu'] = imported_menu
+        imported_button.pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Select All", 
+                  command=self.select_all).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Refresh", 
-                  command=self.refresh_data).pack(side=tk.LEFT, padx=5)
+                  command=self.sync_changes).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Field Summary", 
+                  command=self.show_field_summary).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Check Integrity", 
+                  command=self.show_integrity_check).pack(side=tk.LEFT, padx=5)
+        # Everything above needs the database, and is enabled once it is open.
+        self._database_widgets = button_frame.winfo_children()
+        for widget in self._database_widgets:
+            widget.state(['disabled'])
+        ttk.Button(button_frame, text="Diagnostics", 
+                  command=self.show_diagnostics).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Exit", 
                   command=self.root.quit).pack(side=tk.RIGHT)
         
+        # Status bar, with a progress bar shown while a query runs
+        self.status_var = tk.StringVar()
+        ttk.Label(main_frame, textvariable=self.status_var, 
+                  anchor=tk.W).grid(row=4, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(5, 0))
+        self.progress = ttk.Progressbar(main_frame, mode='indeterminate', length=120)
+        self.progress.grid(row=4, column=2, sticky=tk.E, pady=(5, 0))
+        self.progress.grid_remove()
+        
         # Double-click to edit
         self.tree.bind('<Double-1>', lambda e: self.edit_record())
+        self.tree.bind('<Control-a>', lambda e: self.select_all() or 'break')
     
     def refresh_data(self):
-        """Refresh the data in the table."""
-        # Clear existing data
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        
-        # Get filtered data
-        filter_text = self.filter_var.get().strip()
-        records = self.db.get_all_records(filter_text if filter_text else None)
-        
-        # Populate tree
-        for record in records:
-            # Format datetime for display
-            change_date = record['CHANGE_DATE_TIME']
-            if isinstance(change_date, str):
-                # Parse if it's a string
-                try:
-                    dt = datetime.fromisoformat(change_date.replace('Z', '+00:00'))
-                    formatted_date = dt.strftime('%Y-%m-%d %H:%M')
-                except:
-                    formatted_date = change_date
-            else:
-                formatted_date = str(change_date)
-            
-            self.tree.insert('', tk.END, values=(
-                record['CONVERSION_CODE_ID'],
-                record['FIELD_NAME'] or '',
-                record['SOURCE_VALUE'] or '',
-                record['SPECTRUM_VALUE'] or '',
-                record['IS_IMPORTED'],
-                record['UPDATE_COUNT'],
-                formatted_date
-            ))
+        """Refresh the data in the table.
+        
+        The query runs on a background thread and the table is repopulated
+        when its results arrive, so the UI stays responsive.
+        """
+        self._cancel_scheduled_filter()
+        filter_text, where_text = self._filter_texts()
+        try:
+            where = parse_filter(where_text) if where_text else None
+        except ValueError as e:
+            # The table keeps showing the last valid filter's results.
+            self._applied_where = where_text
+            self._filter_changed_at = None
+            self.status_var.set(f"Invalid filter: {e}")
+            return
+        if self._pending_query is not None:
+            self._pending_query.cancel()
+        
+        self._query_generation += 1
+        generation = self._query_generation
+        self._applied_filter = filter_text
+        self._applied_where = where_text
+        started = self._filter_changed_at or time.perf_counter()
+        self._filter_changed_at = None
+        self.status_var.set("Searching..." if self.db is not None else "Opening database...")
+        self._set_busy(True)
+        
+        future = self._query_executor.submit(self._run_query, generation, filter_text, where,
+                                             *self._sort)
+        self._pending_query = future
+        self._poll_query(generation, started, future)
+    
+    def _run_query(self, generation: int, filter_text: str, where: Optional[Filter],
+                   order_by: str, descending: bool):
+        """Run a filter query on the worker thread unless it is already stale."""
+        if generation != self._query_generation or self.db is None:
+            # A database that failed to open is reported by _poll_open.
+            return None
+        query_started = time.perf_counter()
+        # Read before querying, so a later sync replays rather than misses
+        # changes committed meanwhile.
+        change_seq = self.db.current_change_seq() if self.db.change_log_enabled else None
+        result_set = PagedResultSet(self.db, filter_text if filter_text else None,
+                                    order_by=order_by, descending=descending, where=where)
+        result_set.get_page(0)
+        return result_set, time.perf_counter() - query_started, change_seq
+    
+    def _poll_query(self, generation: int, started: float, future: Future):
+        """Hand a query's results to the Tk thread once the worker finishes.
+        
+        Polling from the event loop keeps all Tk calls on the main thread.
+        """
+        if future.done():
+            self._on_query_done(generation, started, future)
+        elif generation == self._query_generation:
+            self.root.after(QUERY_POLL_MS, self._poll_query, generation, started, future)
+    
+    def _on_query_done(self, generation: int, started: float, future: Future):
+        """Show a finished query's results if no newer query has started."""
+        if generation != self._query_generation or future.cancelled():
+            return
+        self._pending_query = None
+        self._set_busy(False)
+        try:
+            result = future.result()
+        except Exception as e:
+            self.status_var.set(f"Query failed: {e}")
+            return
+        if result is None:
+            return
+        result_set, query_seconds, self._change_seq = result
+        self.table.set_result_set(result_set)
+        elapsed = time.perf_counter() - started
+        if self.profiler.enabled:
+            self.profiler.record('refresh', elapsed, len(result_set))
+        if 'first_page' not in self.startup_timings:
+            self._record_startup('first_page')
+            self.status_var.set(f"{len(result_set)} records | {self.startup_summary()}")
+            return
+        elapsed_ms = elapsed * 1000
+        self.status_var.set(f"{len(result_set)} records | results in {elapsed_ms:.0f} ms "
+                            f"(query {query_seconds * 1000:.0f} ms)")
+    
+    def _open_database(self):
+        """Open the database on the query thread, ahead of the first query."""
+        self.db = ConversionCodeDB(cache_entries=256, profiler=self.profiler)
+        self.completions = CompletionIndex(self.db)
+        self.writes = WriteQueue(self.db)
+    
+    def _poll_open(self, future: Future):
+        """Enable the database's controls once it is open, or report why it is not."""
+        if not future.done():
+            self.root.after(QUERY_POLL_MS, self._poll_open, future)
+            return
+        try:
+            future.result()
+        except Exception as e:
+            self._set_busy(False)
+            self.status_var.set(f"Failed to open database: {e}")
+            messagebox.showerror("Error", f"Failed to open database: {e}")
+            return
+        self._record_startup('database_open')
+        for widget in self._database_widgets:
+            widget.state(['!disabled'])
+    
+    def _on_map(self, event):
+        """Time the first paint: when the main window first appears on screen."""
+        if event.widget is self.root and 'first_paint' not in self.startup_timings:
+            self._record_startup('first_paint')
+    
+    def _record_startup(self, milestone: str):
+        """Record the time from start to a start-up milestone.
+        
+        Start-up timings are kept in the profiler even while it is disabled,
+        as there is only one of each.
+        """
+        seconds = time.perf_counter() - self._started
+        self.startup_timings[milestone] = seconds
+        self.profiler.record(f'startup.{milestone}', seconds)
+    
+    def startup_summary(self) -> str:
+        """Describe the start-up timings recorded so far."""
+        labels = (('first_paint', 'window shown'), ('database_open', 'database open'),
+                  ('first_page', 'first page'))
+        return ", ".join(f"{label} in {self.startup_timings[milestone] * 1000:.0f} ms"
+                         for milestone, label in labels if milestone in self.startup_timings)
+    
+    def _set_busy(self, busy: bool):
+        """Show or hide the progress bar in the status line."""
+        if busy:
+            self.progress.grid()
+            self.progress.start(PROGRESS_INTERVAL_MS)
+        else:
+            self.progress.stop()
+            self.progress.grid_remove()
+    
+    def sync_changes(self):
+        """Bring the table up to date with the changes logged since it was loaded.
+        
+        Only the change log is read; the visible window is re-queried if
+        any change touches the shown result set. Falls back to a full
+        refresh without a change log, after many changes, or when the
+        filter text has been edited.
+        """
+        if (self._change_seq is None or self.table.result_set is None
+                or self._pending_query is not None
+                or self._filter_texts() != (self._applied_filter, self._applied_where)):
+            self.refresh_data()
+            return
+        self.status_var.set("Checking for changes...")
+        future = self._query_executor.submit(self._read_changes, self._change_seq)
+        self._poll_sync(self._query_generation, future)
+    
+    def _read_changes(self, seq: int) -> Optional[List[Change]]:
+        """Read up to one more than ``MAX_SYNC_CHANGES`` changes; None if pruned."""
+        try:
+            return list(islice(self.db.changes_since(seq), MAX_SYNC_CHANGES + 1))
+        except ChangesPrunedError:
+            return None
+    
+    def _poll_sync(self, generation: int, future: Future):
+        """Apply the changes read by ``sync_changes`` once they arrive."""
+        if not future.done():
+            self.root.after(QUERY_POLL_MS, self._poll_sync, generation, future)
+            return
+        if generation != self._query_generation:
+            return
+        try:
+            changes = future.result()
+        except Exception as e:
+            self.status_var.set(f"Refresh failed: {e}")
+            return
+        if changes is None or len(changes) > MAX_SYNC_CHANGES:
+            self.refresh_data()
+            return
+        if not changes:
+            self.status_var.set(f"{self.table.total} records | no changes")
+            return
+        self._change_seq = changes[-1].seq
+        result_set = self.table.result_set
+        # A composite filter may have matched a record's earlier values,
+        # which the log does not hold.
+        if result_set.where is not None or any(
+                result_set.matches(change.record)
+                or field_name_matches(result_set.field_name_filter, change.old_field_name)
+                for change in changes):
+            self.table.reload()
+        self.status_var.set(f"{self.table.total} records | {len(changes)} changes applied")
     
     def on_filter_change(self, event=None):
-        """Handle filter text change."""
+        """Handle filter text change.
+        
+        Keystrokes are debounced: the query runs once typing pauses for
+        ``FILTER_DEBOUNCE_MS``, timed from the last keystroke.
+        """
+        self._cancel_scheduled_filter()
+        if self._filter_texts() == (self._applied_filter, self._applied_where):
+            # Navigation keys and the like leave the filter unchanged.
+            return
+        self._filter_changed_at = time.perf_counter()
+        self._filter_after_id = self.root.after(FILTER_DEBOUNCE_MS, self.refresh_data)
+    
+    def _filter_texts(self):
+        """The field name filter and composite filter texts as typed."""
+        return self.filter_var.get().strip(), self.where_var.get().strip()
+    
+    def _cancel_scheduled_filter(self):
+        """Cancel a debounced filter refresh that has not fired yet."""
+        if self._filter_after_id is not None:
+            self.root.after_cancel(self._filter_after_id)
+            self._filter_after_id = None
+    
+    def sort_by(self, col_id: str):
+        """Sort by a column, or reverse the order if already sorted by it.
+        
+        The database sorts, using the column's index, so only the visible
+        page is fetched.
+        """
+        column = 'CONVERSION_CODE_ID' if col_id == 'ID' else col_id
+        order_by, descending = self._sort
+        self._sort = (column, not descending if column == order_by else False)
+        self._update_headings()
+        self.refresh_data()
+    
+    def _update_headings(self):
+        """Mark the sorted column's heading with the sort direction."""
+        order_by, descending = self._sort
+        for col_id, heading in self._headings.items():
+            column = 'CONVERSION_CODE_ID' if col_id == 'ID' else col_id
+            if column == order_by:
+                heading += ' ▼' if descending else ' ▲'
+            self.tree.heading(col_id, text=heading)
+    
+    def show_field_summary(self):
+        """Open a window with record counts per field name for the current filter."""
+        FieldSummaryDialog(self.root, self.db, self._query_executor,
+                           self._applied_filter or None, self.filter_field,
+                           self._shown_where())
+    
+    def show_integrity_check(self):
+        """Open a window listing duplicate, conflicting and orphaned mappings."""
+        IntegrityDialog(self.root, self.db, self.filter_field)
+    
+    def filter_field(self, field_name: str):
+        """Show only the records of one field name."""
+        self.filter_var.set(f"={field_name}")
         self.refresh_data()
     
     def clear_filter(self):
-        """Clear the filter."""
+        """Clear both filters."""
         self.filter_var.set('')
+        self.where_var.set('')
         self.refresh_data()
     
+    def _shown_where(self) -> Optional[Filter]:
+        """The composite filter of the results shown in the table."""
+        result_set = self.table.result_set
+        return result_set.where if result_set is not None else None
+    
     def get_selected_id(self) -> Optional[int]:
         """Get the ID of the currently selected record."""
         selection = self.tree.selection()
-        if not selection:
-            return None
-        item = self.tree.item(selection[0])
-        return int(item['values'][0])
+        if selection:
+            return int(selection[0])
+        if self.table.selected_ids:
+            return min(self.table.selected_ids)
+        return None
+    
+    def get_selected_ids(self) -> List[int]:
+        """Get the IDs of all selected records, including ones scrolled out of view."""
+        visible = {int(iid) for iid in self.tree.selection()}
+        return sorted(self.table.selected_ids | visible)
+    
+    def select_all(self):
+        """Select every record matching the current filter; the IDs are read on the query thread."""
+        if self.db is None:
+            return
+        future = self._query_executor.submit(self.db.get_ids, self._applied_filter or None,
+                                             where=self._shown_where())
+        self._poll_select_all(self._query_generation, future)
+    
+    def _poll_select_all(self, generation: int, future: Future):
+        """Select the IDs read by ``select_all`` once they arrive, unless the filter changed."""
+        if not future.done():
+            self.root.after(QUERY_POLL_MS, self._poll_select_all, generation, future)
+            return
+        if generation != self._query_generation:
+            return
+        try:
+            record_ids = future.result()
+        except Exception as e:
+            self.status_var.set(f"Select all failed: {e}")
+            return
+        self.table.select_ids(record_ids)
+        self.status_var.set(f"{len(self.table.selected_ids)} records selected")
     
     def add_record(self):
         """Add a new record."""
-        dialog = RecordDialog(self.root, "Add New Record")
+        dialog = RecordDialog(self.root, "Add New Record", completions=self.completions,
+                              executor=self._query_executor)
         if dialog.result:
             try:
-                self.db.add_record(
+                future = self.writes.add(
                     dialog.result['field_name'],
                     dialog.result['source_value'],
                     dialog.result['spectrum_value'],
                     dialog.result['is_imported']
                 )
-                self.refresh_data()
-                messagebox.showinfo("Success", "Record added successfully!")
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to add record: {str(e)}")
+                return
+            self._poll_write(future, "add", self._record_added)
+    
+    def _record_added(self, new_id: int):
+        self.apply_change(None, self.db.get_record(new_id))
+        messagebox.showinfo("Success", "Record added successfully!")
     
     def edit_record(self):
-        """Edit the selected record."""
+        """Edit the selected record.
+        
+        The update only applies if nobody else has written the record since
+        it was read here (its UPDATE_COUNT is unchanged); otherwise the row
+        shows the other change and the edit can be made again.
+        """
         record_id = self.get_selected_id()
         if not record_id:
             messagebox.showwarning("No Selection", "Please select a record to edit.")
             return
         
         # Get current record data
-        current_record = self.db.get_record_by_id(record_id)
+        current_record = self.db.get_record(record_id)
         if not current_record:
             messagebox.showerror("Error", "Record not found.")
             return
         
-        dialog = RecordDialog(self.root, "Edit Record", current_record)
+        dialog = RecordDialog(self.root, "Edit Record", current_record,
+                              completions=self.completions, executor=self._query_executor,
+                              record_id=record_id)
         if dialog.result:
             try:
-                self.db.update_record(
+                future = self.writes.update(
                     record_id,
                     dialog.result['field_name'],
                     dialog.result['source_value'],
                     dialog.result['spectrum_value'],
-                    dialog.result['is_imported']
+                    dialog.result['is_imported'],
+                    expected_update_count=current_record['UPDATE_COUNT']
                 )
-                self.refresh_data()
-                messagebox.showinfo("Success", "Record updated successfully!")
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to update record: {str(e)}")
+                return
+            self._poll_write(future, "update",
+                             lambda updated: self._record_updated(current_record),
+                             current_record)
+    
+    def _record_updated(self, old_record):
+        self.apply_change(old_record, self.db.get_record(old_record['CONVERSION_CODE_ID']))
+        messagebox.showinfo("Success", "Record updated successfully!")
     
     def delete_record(self):
-        """Delete the selected record."""
-        record_id = self.get_selected_id()
-        if not record_id:
+        """Delete the selected record, or all selected records in one transaction."""
+        record_ids = self.get_selected_ids()
+        if not record_ids:
             messagebox.showwarning("No Selection", "Please select a record to delete.")
             return
+        if len(record_ids) > 1:
+            self.delete_records(record_ids)
+            return
+        record_id = record_ids[0]
         
         if messagebox.askyesno("Confirm Delete", 
                               f"Are you sure you want to delete record ID {record_id}?"):
-            try:
-                self.db.delete_record(record_id)
-                self.refresh_data()
-                messagebox.showinfo("Success", "Record deleted successfully!")
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to delete record: {str(e)}")
+            old_record = self.db.get_record(record_id)
+            if old_record is None:
+                messagebox.showerror("Error", "Record not found.")
+                return
+            future = self.writes.delete(record_id,
+                                        expected_update_count=old_record['UPDATE_COUNT'])
+            self._poll_write(future, "delete", lambda deleted: self._record_deleted(old_record),
+                             old_record)
+    
+    def _record_deleted(self, old_record):
+        self.apply_change(old_record, None)
+        messagebox.showinfo("Success", "Record deleted successfully!")
+    
+    def _poll_write(self, future: Future, action: str, on_success, old_record=None,
+                    batch: bool = False):
+        """Wait for a write, then report it or the conflict that stopped it.
+        
+        ``batch`` writes change several records in one transaction; a
+        conflict on any of them means none was written.
+        """
+        if not future.done():
+            self.root.after(QUERY_POLL_MS, self._poll_write, future, action, on_success,
+                            old_record, batch)
+            return
+        noun = "records" if batch else "record"
+        try:
+            result = future.result()
+        except ConcurrencyConflictError as e:
+            # Show the other user's change in place of the stale rows.
+            if batch:
+                self.apply_batch_change()
+                shown = f"records as they are; {action} them"
+            else:
+                self.apply_change(old_record, e.current)
+                shown = f"record as it is; {action} it"
+            messagebox.showwarning(
+                "Edit Conflict",
+                f"{e}\n\nYour change was not saved. The table now shows the "
+                f"{shown} again if still needed.")
+            return
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to {action} {noun}: {str(e)}")
+            return
+        on_success(result)
+    
+    def _shown_update_counts(self, record_ids: Iterable[int]) -> Dict[int, int]:
+        """The UPDATE_COUNT of each of ``record_ids`` as the table last showed it.
+        
+        Selected records whose rows have not been read since (e.g. after
+        "Select All") are left out and written without a version check.
+        """
+        wanted = set(record_ids)
+        if self.table.result_set is None:
+            return {}
+        return {record['CONVERSION_CODE_ID']: record['UPDATE_COUNT']
+                for record in self.table.result_set.cached_records()
+                if record['CONVERSION_CODE_ID'] in wanted}
+    
+    def delete_records(self, record_ids: List[int]):
+        """Delete several records in one transaction, on the query thread."""
+        if not messagebox.askyesno("Confirm Delete", 
+                                   f"Are you sure you want to delete {len(record_ids)} records?"):
+            return
+        future = self._query_executor.submit(
+            self.db.delete_many, record_ids,
+            expected_update_counts=self._shown_update_counts(record_ids))
+        self._poll_write(future, "delete",
+                         lambda deleted: self._records_deleted(record_ids, deleted), batch=True)
+    
+    def _records_deleted(self, record_ids: List[int], deleted: int):
+        self.apply_batch_change(record_ids)
+        messagebox.showinfo("Success", f"{deleted} records deleted successfully!")
+    
+    def set_imported(self, flag: str):
+        """Set IS_IMPORTED on every selected record in one transaction, on the query thread."""
+        record_ids = self.get_selected_ids()
+        if not record_ids:
+            messagebox.showwarning("No Selection", "Please select records to update.")
+            return
+        future = self._query_executor.submit(
+            self.db.update_many, [(record_id, {'IS_IMPORTED': flag}) for record_id in record_ids],
+            expected_update_counts=self._shown_update_counts(record_ids))
+        self._poll_write(future, "update", lambda updated: self._records_updated(updated, flag),
+                         batch=True)
+    
+    def _records_updated(self, updated: int, flag: str):
+        self.apply_batch_change()
+        self.status_var.set(f"{updated} records set to Imported = {flag}")
+    
+    def apply_batch_change(self, removed_ids: Iterable[int] = ()):
+        """Re-query the visible window after a batch write, keeping the scroll position."""
+        if self.table.result_set is None or self._pending_query is not None:
+            self.table.selected_ids.difference_update(removed_ids)
+            self.refresh_data()
+            return
+        self.table.reload(removed_ids)
+        self.status_var.set(f"{self.table.total} records")
+    
+    def apply_change(self, old_record: Optional[dict], new_record: Optional[dict]):
+        """Update just the affected row after one record was written.
+        
+        ``old_record`` is None for an insert and ``new_record`` is None for a
+        delete. Falls back to a full refresh if no results are shown yet.
+        """
+        if self.table.result_set is None or self._pending_query is not None:
+            self.refresh_data()
+            return
+        self.table.apply_change(old_record, new_record)
+        self.status_var.set(f"{self.table.total} records")
+    
+    def show_diagnostics(self):
+        """Open the diagnostics window, or raise it if it is already open."""
+        if self._diagnostics is not None and self._diagnostics.dialog.winfo_exists():
+            self._diagnostics.dialog.lift()
+            return
+        self._diagnostics = DiagnosticsDialog(self.root, self.profiler)
     
     def run(self):
         """Start the GUI application."""
-        self.root.mainloop()
+        try:
+            self.root.mainloop()
+        finally:
+            self._query_executor.shutdown(wait=False)
+            if self.writes is not None:
+                self.writes.close()
+            if self.db is not None:
+                self.db.close()
 
 
 class RecordDialog:
-    """Dialog for adding/editing records."""
+    """Dialog for adding/editing records.
     
-    def __init__(self, parent, title: str, record_data: Optional[dict] = None):
+    With a completion index, the field name and source value boxes offer
+    existing values as they are typed, and a preview line shows what the
+    entered key already maps to. The index is brought up to date, and a
+    field's source values loaded, on the query thread; suggestions and the
+    preview come from memory.
+    """
+    
+    def __init__(self, parent, title: str, record_data: Optional[dict] = None,
+                 completions: Optional[CompletionIndex] = None,
+                 executor: Optional[ThreadPoolExecutor] = None,
+                 record_id: Optional[int] = None):
         """Initialize the dialog."""
         self.result = None
+        self.completions = completions
+        self.executor = executor
+        # The record being edited, left out of the existing-mapping preview.
+        self.record_id = record_id
+        self._loading_field: Optional[str] = None
         self.dialog = tk.Toplevel(parent)
         self.dialog.title(title)
-        self.dialog.geometry("400x300")
+        self.dialog.geometry("420x340")
         self.dialog.transient(parent)
         self.dialog.grab_set()
         
         # Center the dialog
         self.dialog.update_idletasks()
-        x = (parent.winfo_screenwidth() // 2) - (400 // 2)
-        y = (parent.winfo_screenheight() // 2) - (300 // 2)
-        self.dialog.geometry(f"400x300+{x}+{y}")
+        x = (parent.winfo_screenwidth() // 2) - (420 // 2)
+        y = (parent.winfo_screenheight() // 2) - (340 // 2)
+        self.dialog.geometry(f"420x340+{x}+{y}")
         
         self.setup_dialog(record_data)
+        if self.completions is not None and self.executor is not None:
+            self._poll_completions(self.executor.submit(self.completions.refresh))
         
         # Wait for dialog to close
         self.dialog.wait_window()
@@ -251,14 +800,16 @@ class RecordDialog:
         # Field Name
         ttk.Label(main_frame, text="Field Name:").grid(row=0, column=0, sticky=tk.W, pady=5)
         self.field_name_var = tk.StringVar()
-        field_name_entry = ttk.Entry(main_frame, textvariable=self.field_name_var, width=40)
-        field_name_entry.grid(row=0, column=1, sticky=(tk.W, tk.E), pady=5)
+        self.field_name_combo = ttk.Combobox(main_frame, textvariable=self.field_name_var,
+                                             width=37)
+        self.field_name_combo.grid(row=0, column=1, sticky=(tk.W, tk.E), pady=5)
         
         # Source Value
         ttk.Label(main_frame, text="Source Value:").grid(row=1, column=0, sticky=tk.W, pady=5)
         self.source_value_var = tk.StringVar()
-        source_value_entry = ttk.Entry(main_frame, textvariable=self.source_value_var, width=40)
-        source_value_entry.grid(row=1, column=1, sticky=(tk.W, tk.E), pady=5)
+        self.source_value_combo = ttk.Combobox(main_frame, textvariable=self.source_value_var,
+                                               width=37)
+        self.source_value_combo.grid(row=1, column=1, sticky=(tk.W, tk.E), pady=5)
         
         # Spectrum Value
         ttk.Label(main_frame, text="Spectrum Value:").grid(row=2, column=0, sticky=tk.W, pady=5)
@@ -281,12 +832,19 @@ class RecordDialog:
             self.spectrum_value_var.set(record_data['SPECTRUM_VALUE'] or '')
             self.is_imported_var.set(record_data['IS_IMPORTED'])
         
+        # What the entered key already maps to
+        self.preview_var = tk.StringVar()
+        ttk.Label(main_frame, textvariable=self.preview_var, foreground='gray',
+                  wraplength=360).grid(row=4, column=0, columnspan=2, sticky=tk.W, pady=5)
+        self.field_name_var.trace_add('write', self._on_key_changed)
+        self.source_value_var.trace_add('write', self._on_key_changed)
+        
         # Configure grid
         main_frame.columnconfigure(1, weight=1)
         
         # Buttons
         button_frame = ttk.Frame(main_frame)
-        button_frame.grid(row=4, column=0, columnspan=2, pady=20)
+        button_frame.grid(row=5, column=0, columnspan=2, pady=20)
         
         ttk.Button(button_frame, text="Save", 
                   command=self.save_record).pack(side=tk.LEFT, padx=5)
@@ -294,7 +852,46 @@ class RecordDialog:
                   command=self.dialog.destroy).pack(side=tk.LEFT, padx=5)
         
         # Focus on first field
-        field_name_entry.focus_set()
+        self.field_name_combo.focus_set()
+    
+    def _on_key_changed(self, *args):
+        """Update the suggestions and the preview as the field or source changes."""
+        if self.completions is not None and self.completions.loaded:
+            self._update_completions()
+    
+    def _poll_completions(self, future: Future):
+        """Update the suggestions once the index has caught up or loaded a field."""
+        if not self.dialog.winfo_exists():
+            return
+        if not future.done():
+            self.dialog.after(QUERY_POLL_MS, self._poll_completions, future)
+            return
+        self._loading_field = None
+        try:
+            future.result()
+        except Exception as e:
+            # Suggestions are a convenience; the record can still be entered.
+            self.preview_var.set(f"Suggestions unavailable: {e}")
+            return
+        self._update_completions()
+    
+    def _update_completions(self):
+        """Offer existing values for the entered prefixes and preview the key."""
+        field_name = self.field_name_var.get().strip()
+        source_value = self.source_value_var.get().strip()
+        self.field_name_combo['values'] = self.completions.field_names(field_name)
+        preview = self.completions.preview(field_name, source_value, exclude_id=self.record_id)
+        if preview.known_field and not self.completions.field_loaded(field_name):
+            self.source_value_combo['values'] = ()
+            if self._loading_field is None and self.executor is not None:
+                self._loading_field = field_name
+                self._poll_completions(self.executor.submit(self.completions.load_field,
+                                                            field_name))
+            self.preview_var.set("Loading source values...")
+            return
+        self.source_value_combo['values'] = self.completions.source_values(field_name,
+                                                                           source_value)
+        self.preview_var.set(describe_preview(preview, field_name, source_value))
     
     def save_record(self):
         """Save the record and close dialog."""
@@ -304,24 +901,9 @@ class RecordDialog:
         spectrum_value = self.spectrum_value_var.get().strip()
         is_imported = self.is_imported_var.get()
         
-        if not field_name:
-            messagebox.showerror("Validation Error", "Field Name is required.")
-            return
-        
-        if len(field_name) > 50:
-            messagebox.showerror("Validation Error", "Field Name cannot exceed 50 characters.")
-            return
-        
-        if len(source_value) > 20:
-            messagebox.showerror("Validation Error", "Source Value cannot exceed 20 characters.")
-            return
-        
-        if len(spectrum_value) > 10:
-            messagebox.showerror("Validation Error", "Spectrum Value cannot exceed 10 characters.")
-            return
-        
-        if is_imported not in ['Y', 'N']:
-            messagebox.showerror("Validation Error", "Is Imported must be Y or N.")
+        error = validate_record(field_name, source_value, spectrum_value, is_imported)
+        if error:
+            messagebox.showerror("Validation Error", error)
             return
         
         self.result = {
@@ -333,6 +915,421 @@ class RecordDialog:
         self.dialog.destroy()
 
 
+def describe_preview(preview: MappingPreview, field_name: str, source_value: str) -> str:
+    """Describe what an entered field name and source value already map to."""
+    if not field_name:
+        return ""
+    if not preview.known_field:
+        if preview.field_variants:
+            return f"Similar field name exists: {', '.join(preview.field_variants)}"
+        return "New field name"
+    if not source_value:
+        return ""
+    if preview.exists:
+        spectrum_value = preview.spectrum_values[-1]
+        if spectrum_value is None:
+            spectrum_value = "(no spectrum value)"
+        text = f"Existing: {source_value} → {spectrum_value}"
+        if len(preview.spectrum_values) > 1:
+            text += f" ({len(preview.spectrum_values)} records)"
+        return text
+    if preview.source_variants:
+        return f"Similar source value exists: {', '.join(preview.source_variants)}"
+    return "New source value"
+
+
+class FieldSummaryDialog:
+    """Non-modal window with record counts per field name.
+    
+    The counts are computed by the database with GROUP BY on a background
+    thread. Double-clicking a field shows its records in the main table.
+    """
+    
+    def __init__(self, parent, db: ConversionCodeDB, executor: ThreadPoolExecutor,
+                 field_name_filter: Optional[str], on_select, where: Optional[Filter] = None):
+        """Initialize the window and start counting."""
+        self.db = db
+        self.executor = executor
+        self.field_name_filter = field_name_filter
+        self.where = where
+        self.on_select = on_select
+        self.dialog = tk.Toplevel(parent)
+        self.dialog.title("Field Summary")
+        self.dialog.geometry("650x450")
+        self.dialog.transient(parent)
+        
+        self.setup_dialog()
+        self.refresh()
+    
+    def setup_dialog(self):
+        """Set up the window UI."""
+        main_frame = ttk.Frame(self.dialog, padding="10")
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        
+        summary_frame = ttk.LabelFrame(main_frame, text="Summary", padding="5")
+        summary_frame.pack(fill=tk.X, pady=(0, 10))
+        if self.field_name_filter:
+            ttk.Label(summary_frame, text=f"Filter: {self.field_name_filter}").pack(anchor=tk.W)
+        if self.where is not None:
+            ttk.Label(summary_frame, text="Where: the main window's filter").pack(anchor=tk.W)
+        self.summary_var = tk.StringVar()
+        ttk.Label(summary_frame, textvariable=self.summary_var).pack(anchor=tk.W)
+        
+        table_frame = ttk.Frame(main_frame)
+        table_frame.pack(fill=tk.BOTH, expand=True)
+        table_frame.columnconfigure(0, weight=1)
+        table_frame.rowconfigure(0, weight=1)
+        self.tree = ttk.Treeview(table_frame, columns=(
+            'FIELD_NAME', 'RECORDS', 'IMPORTED', 'NOT_IMPORTED', 'IMPORTED_RATIO'
+        ), show='headings')
+        for col_id, heading, width in (('FIELD_NAME', 'Field Name', 200),
+                                       ('RECORDS', 'Records', 90),
+                                       ('IMPORTED', 'Imported', 90),
+                                       ('NOT_IMPORTED', 'Not Imported', 90),
+                                       ('IMPORTED_RATIO', 'Imported %', 90)):
+            self.tree.heading(col_id, text=heading)
+            self.tree.column(col_id, width=width, minwidth=width,
+                             anchor=tk.W if col_id == 'FIELD_NAME' else tk.E)
+        v_scrollbar = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=v_scrollbar.set)
+        self.tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        v_scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        self.tree.bind('<Double-1>', self.select_field)
+        
+        button_frame = ttk.Frame(main_frame)
+        button_frame.pack(fill=tk.X, pady=(10, 0))
+        ttk.Button(button_frame, text="Refresh", 
+                  command=self.refresh).pack(side=tk.LEFT)
+        ttk.Button(button_frame, text="Close", 
+                  command=self.dialog.destroy).pack(side=tk.RIGHT)
+    
+    def refresh(self):
+        """Recount on the worker thread."""
+        self.summary_var.set("Counting...")
+        future = self.executor.submit(self.db.field_name_summary, self.field_name_filter,
+                                      where=self.where)
+        self._poll(future)
+    
+    def _poll(self, future: Future):
+        """Show the counts once the worker has them."""
+        if not self.dialog.winfo_exists():
+            return
+        if not future.done():
+            self.dialog.after(QUERY_POLL_MS, self._poll, future)
+            return
+        try:
+            groups = future.result()
+        except Exception as e:
+            self.summary_var.set(f"Summary failed: {e}")
+            return
+        self.show(groups)
+    
+    def show(self, groups: List[FieldSummary]):
+        """Fill the table and the summary from per-field counts."""
+        self.tree.delete(*self.tree.get_children())
+        for group in groups:
+            self.tree.insert('', tk.END, values=(
+                group.field_name or '', f"{group.records:,}", f"{group.imported:,}",
+                f"{group.not_imported:,}", f"{group.imported_ratio:.0%}"))
+        total = sum(group.records for group in groups)
+        imported = sum(group.imported for group in groups)
+        ratio = imported / total if total else 0.0
+        self.summary_var.set(f"{total:,} records in {len(groups):,} fields | "
+                             f"{imported:,} imported ({ratio:.0%}) | "
+                             f"{total - imported:,} not imported")
+    
+    def select_field(self, event=None):
+        """Show the double-clicked field's records in the main table."""
+        selection = self.tree.selection()
+        if selection:
+            self.on_select(self.tree.item(selection[0], 'values')[0])
+
+
+class IntegrityDialog:
+    """Non-modal window with the issues found by ``check_integrity``.
+    
+    The check runs on the window's own worker thread, as on large tables it
+    takes seconds and should not hold up the main table's queries. Each tab
+    lists one kind of issue; double-clicking one shows its field's records
+    in the main table.
+    """
+    
+    MAX_ISSUES = 1000
+    
+    TABS = (
+        ('conflicts', "Conflicts", (('FIELD_NAME', 'Field Name', 180),
+                                    ('SOURCE_VALUE', 'Source Value', 140),
+                                    ('SPECTRUM_VALUES', 'Spectrum Values', 180),
+                                    ('RECORD_IDS', 'Record IDs', 160))),
+        ('duplicates', "Duplicates", (('FIELD_NAME', 'Field Name', 180),
+                                      ('SOURCE_VALUE', 'Source Value', 140),
+                                      ('SPECTRUM_VALUES', 'Spectrum Value', 180),
+                                      ('RECORD_IDS', 'Record IDs', 160))),
+        ('orphaned_field_names', "Field Names", (('FIELD_NAME', 'Field Name', 220),
+                                                 ('RECORDS', 'Records', 90),
+                                                 ('REASON', 'Reason', 90),
+                                                 ('CANONICAL', 'Variant Of', 220))),
+        ('reverse_mappings', "Reverse Mappings", (('FIELD_NAME', 'Field Name', 180),
+                                                  ('SPECTRUM_VALUE', 'Spectrum Value', 120),
+                                                  ('SOURCES', 'Sources', 80),
+                                                  ('SOURCE_VALUES', 'Source Values', 280))),
+    )
+    
+    def __init__(self, parent, db: ConversionCodeDB, on_select):
+        """Initialize the window and start checking."""
+        self.db = db
+        self.on_select = on_select
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.dialog = tk.Toplevel(parent)
+        self.dialog.title("Check Integrity")
+        self.dialog.geometry("750x450")
+        self.dialog.transient(parent)
+        self.dialog.bind('<Destroy>', self._on_destroy)
+        
+        self.setup_dialog()
+        self.refresh()
+    
+    def setup_dialog(self):
+        """Set up the window UI."""
+        main_frame = ttk.Frame(self.dialog, padding="10")
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        
+        self.summary_var = tk.StringVar()
+        ttk.Label(main_frame, textvariable=self.summary_var).pack(anchor=tk.W, pady=(0, 10))
+        
+        self.notebook = ttk.Notebook(main_frame)
+        self.notebook.pack(fill=tk.BOTH, expand=True)
+        self.trees = {}
+        for key, title, columns in self.TABS:
+            frame = ttk.Frame(self.notebook, padding="5")
+            frame.columnconfigure(0, weight=1)
+            frame.rowconfigure(0, weight=1)
+            tree = ttk.Treeview(frame, columns=[col_id for col_id, _, _ in columns],
+                                show='headings')
+            for col_id, heading, width in columns:
+                tree.heading(col_id, text=heading)
+                tree.column(col_id, width=width, minwidth=60,
+                            anchor=tk.E if col_id in ('RECORDS', 'SOURCES') else tk.W)
+            v_scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=tree.yview)
+            tree.configure(yscrollcommand=v_scrollbar.set)
+            tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+            v_scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+            tree.bind('<Double-1>', self.select_field)
+            self.notebook.add(frame, text=title)
+            self.trees[key] = tree
+        
+        button_frame = ttk.Frame(main_frame)
+        button_frame.pack(fill=tk.X, pady=(10, 0))
+        ttk.Button(button_frame, text="Check Again", 
+                  command=self.refresh).pack(side=tk.LEFT)
+        ttk.Button(button_frame, text="Close", 
+                  command=self.dialog.destroy).pack(side=tk.RIGHT)
+    
+    def refresh(self):
+        """Run the check on the worker thread."""
+        self.summary_var.set("Checking...")
+        future = self.executor.submit(self.db.check_integrity, max_issues=self.MAX_ISSUES)
+        self._poll(future)
+    
+    def _poll(self, future: Future):
+        """Show the report once the worker has it."""
+        if not self.dialog.winfo_exists():
+            return
+        if not future.done():
+            self.dialog.after(QUERY_POLL_MS, self._poll, future)
+            return
+        try:
+            report = future.result()
+        except Exception as e:
+            self.summary_var.set(f"Check failed: {e}")
+            return
+        self.show(report)
+    
+    def show(self, report):
+        """Fill the tabs and the summary from an ``IntegrityReport``."""
+        def values_text(values):
+            return ', '.join('NULL' if value is None else str(value) for value in values)
+        
+        rows = {
+            'conflicts': [(issue.field_name, issue.source_value,
+                           values_text(issue.spectrum_values), values_text(issue.record_ids))
+                          for issue in report.conflicts],
+            'duplicates': [(issue.field_name, issue.source_value,
+                            values_text(issue.spectrum_values), values_text(issue.record_ids))
+                           for issue in report.duplicates],
+            'orphaned_field_names': [(orphan.field_name or '', f"{orphan.records:,}",
+                                      orphan.reason, orphan.canonical or '')
+                                     for orphan in report.orphaned_field_names],
+            'reverse_mappings': [(mapping.field_name, mapping.spectrum_value,
+                                  f"{mapping.sources:,}", values_text(mapping.source_values))
+                                 for mapping in report.reverse_mappings],
+        }
+        counts = {'conflicts': report.conflict_count, 'duplicates': report.duplicate_count,
+                  'orphaned_field_names': report.orphaned_count,
+                  'reverse_mappings': report.reverse_mapping_count}
+        for index, (key, title, _) in enumerate(self.TABS):
+            tree = self.trees[key]
+            tree.delete(*tree.get_children())
+            for values in rows[key]:
+                tree.insert('', tk.END, values=values)
+            self.notebook.tab(index, text=f"{title} ({counts[key]:,})")
+        status = "No problems found" if report.ok else "Problems found"
+        listed = f" (first {self.MAX_ISSUES:,} of each listed)" if any(
+            count > self.MAX_ISSUES for count in counts.values()) else ""
+        self.summary_var.set(f"{status} in {report.rows_checked:,} records, "
+                             f"{report.seconds:.1f}s{listed}")
+    
+    def select_field(self, event=None):
+        """Show the double-clicked issue's field in the main table."""
+        tree = event.widget
+        selection = tree.selection()
+        if selection:
+            field_name = tree.item(selection[0], 'values')[0]
+            if field_name:
+                self.on_select(field_name)
+    
+    def _on_destroy(self, event):
+        """Let the worker thread exit with the window."""
+        if event.widget is self.dialog:
+            self.executor.shutdown(wait=False)
+
+
+class DiagnosticsDialog:
+    """Non-modal window showing the timings collected by a profiler."""
+    
+    STATS_COLUMNS = (('count', 'Count', 60), ('total_ms', 'Total ms', 80),
+                     ('mean_ms', 'Mean ms', 80), ('max_ms', 'Max ms', 80),
+                     ('rows', 'Rows', 80))
+    
+    def __init__(self, parent, profiler: Profiler):
+        """Initialize the window."""
+        self.profiler = profiler
+        self.dialog = tk.Toplevel(parent)
+        self.dialog.title("Diagnostics")
+        self.dialog.geometry("900x550")
+        self.dialog.transient(parent)
+        self._slow_queries: List[dict] = []
+        
+        self.setup_dialog()
+        self.refresh()
+    
+    def setup_dialog(self):
+        """Set up the window UI."""
+        main_frame = ttk.Frame(self.dialog, padding="10")
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        
+        options_frame = ttk.Frame(main_frame)
+        options_frame.pack(fill=tk.X, pady=(0, 5))
+        self.enabled_var = tk.BooleanVar(value=self.profiler.enabled)
+        ttk.Checkbutton(options_frame, text="Record timings", variable=self.enabled_var,
+                        command=self.toggle_enabled).pack(side=tk.LEFT)
+        ttk.Label(options_frame, text=f"Query plans are captured for statements slower "
+                  f"than {self.profiler.slow_query_ms:.0f} ms").pack(side=tk.LEFT, padx=10)
+        
+        notebook = ttk.Notebook(main_frame)
+        notebook.pack(fill=tk.BOTH, expand=True)
+        self.operations_tree = self._stats_tree(notebook, 'Operation', 200)
+        notebook.add(self.operations_tree.master, text="Operations")
+        self.statements_tree = self._stats_tree(notebook, 'Statement', 420)
+        notebook.add(self.statements_tree.master, text="Statements")
+        
+        slow_frame = ttk.Frame(notebook)
+        slow_frame.columnconfigure(0, weight=1)
+        slow_frame.rowconfigure(0, weight=1)
+        self.slow_tree = ttk.Treeview(slow_frame, columns=('ms', 'rows', 'sql'),
+                                      show='headings', height=8)
+        for col_id, heading, width in (('ms', 'ms', 80), ('rows', 'Rows', 80),
+                                       ('sql', 'Statement', 600)):
+            self.slow_tree.heading(col_id, text=heading)
+            self.slow_tree.column(col_id, width=width, minwidth=width)
+        self.slow_tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.slow_tree.bind('<<TreeviewSelect>>', self.show_plan)
+        self.plan_text = tk.Text(slow_frame, height=8, wrap=tk.WORD, state=tk.DISABLED)
+        self.plan_text.grid(row=1, column=0, sticky=(tk.W, tk.E), pady=(5, 0))
+        notebook.add(slow_frame, text="Slow Queries")
+        
+        button_frame = ttk.Frame(main_frame)
+        button_frame.pack(fill=tk.X, pady=(10, 0))
+        ttk.Button(button_frame, text="Refresh", 
+                  command=self.refresh).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(button_frame, text="Reset", 
+                  command=self.reset).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Save JSON...", 
+                  command=self.save).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Close", 
+                  command=self.dialog.destroy).pack(side=tk.RIGHT)
+    
+    def _stats_tree(self, parent, name_heading: str, name_width: int) -> ttk.Treeview:
+        """Create a table of per-name totals inside its own frame."""
+        frame = ttk.Frame(parent)
+        tree = ttk.Treeview(frame, columns=('name',) + tuple(c[0] for c in self.STATS_COLUMNS),
+                            show='headings')
+        tree.heading('name', text=name_heading)
+        tree.column('name', width=name_width, minwidth=100)
+        for col_id, heading, width in self.STATS_COLUMNS:
+            tree.heading(col_id, text=heading)
+            tree.column(col_id, width=width, minwidth=width, anchor=tk.E)
+        tree.pack(fill=tk.BOTH, expand=True)
+        return tree
+    
+    def toggle_enabled(self):
+        """Start or stop recording timings."""
+        self.profiler.enabled = self.enabled_var.get()
+    
+    def refresh(self):
+        """Show the latest totals and slow queries."""
+        summary = self.profiler.summary()
+        for tree, stats in ((self.operations_tree, summary['operations']),
+                            (self.statements_tree, summary['statements'])):
+            tree.delete(*tree.get_children())
+            # Largest total first: that is where the time went.
+            for name, entry in sorted(stats.items(), key=lambda item: -item[1]['total_ms']):
+                tree.insert('', tk.END, values=(
+                    name, entry['count'], f"{entry['total_ms']:.1f}",
+                    f"{entry['mean_ms']:.2f}", f"{entry['max_ms']:.1f}", entry['rows']))
+        
+        self._slow_queries = self.profiler.slow_queries()
+        self.slow_tree.delete(*self.slow_tree.get_children())
+        for index, event in enumerate(self._slow_queries):
+            self.slow_tree.insert('', tk.END, iid=str(index), values=(
+                f"{event['ms']:.1f}", event['rows'] or '', event['sql']))
+        self._set_plan_text('')
+    
+    def show_plan(self, event=None):
+        """Show the query plan of the selected slow query."""
+        selection = self.slow_tree.selection()
+        if not selection:
+            return
+        query = self._slow_queries[int(selection[0])]
+        plan = query.get('plan')
+        self._set_plan_text('\n'.join(plan) if plan else "No query plan available.")
+    
+    def _set_plan_text(self, text: str):
+        self.plan_text.configure(state=tk.NORMAL)
+        self.plan_text.delete('1.0', tk.END)
+        self.plan_text.insert('1.0', text)
+        self.plan_text.configure(state=tk.DISABLED)
+    
+    def reset(self):
+        """Discard the timings collected so far."""
+        self.profiler.reset()
+        self.refresh()
+    
+    def save(self):
+        """Write the collected timings to a JSON file."""
+        from tkinter import filedialog
+        path = filedialog.asksaveasfilename(
+            parent=self.dialog, title="Save Diagnostics", defaultextension=".json",
+            filetypes=[("JSON files", "*.json"), ("All files", "*.*")])
+        if not path:
+            return
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                self.profiler.dump(f)
+        except OSError as e:
+            messagebox.showerror("Error", f"Failed to save diagnostics: {e}", parent=self.dialog)
+
+
 if __name__ == "__main__":
-    app = ConversionCodeGUI()
+    app = ConversionCodeGUI(started=_IMPORTED_AT)
     app.run()
\ No newline at end of file
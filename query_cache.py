@@ -0,0 +1,93 @@
+"""Bounded LRU cache for ConversionCodeDB query results."""
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+# Rough in-memory footprint of one Record tuple with its seven values.
+RECORD_SIZE_ESTIMATE = 400
+
+_MISSING = object()
+
+
+def estimate_size(value: Any) -> int:
+    """Approximate the memory held by a cached query result, in bytes."""
+    if isinstance(value, list):
+        return 64 + 8 * len(value) + RECORD_SIZE_ESTIMATE * len(value)
+    if isinstance(value, tuple):
+        return RECORD_SIZE_ESTIMATE
+    return 32
+
+
+class QueryCache:
+    """Thread-safe LRU cache bounded by entry count and estimated bytes.
+
+    ``generation`` increases on every invalidation; a caller that loads a
+    value passes the generation it saw before loading to ``put``, so a
+    result read before a concurrent write is never cached after it.
+    """
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[Hashable, Tuple[Any, int]]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return a cached value and mark it recently used."""
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, generation: int):
+        """Cache a value loaded while the cache was at ``generation``."""
+        size = estimate_size(value)
+        with self._lock:
+            if generation != self.generation or size > self.max_bytes:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Drop entries whose key satisfies ``predicate``; returns how many."""
+        with self._lock:
+            self.generation += 1
+            doomed = [key for key in self._entries if predicate(key)]
+            for key in doomed:
+                self._bytes -= self._entries.pop(key)[1]
+            self.invalidations += len(doomed)
+            return len(doomed)
+
+    def clear(self) -> int:
+        """Drop every entry; returns how many there were."""
+        return self.invalidate(lambda key: True)
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss/eviction counters and current usage."""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,274 @@
+"""Local HTTP/JSON service over ConversionCodeDB.
+
+Other processes on the box query and convert codes through one long-running
+process instead of each opening the database::
+
+    python -m cli serve --port 8765
+
+Endpoints, all answering JSON:
+
+``GET /health``
+    ``{"status": "ok"}``
+``GET /records?filter=STATUS*&after_id=0&limit=200``
+    One keyset page: ``{"records": [...], "next_after_id": ID or null}``.
+    ``/records``, ``/count`` and ``/fields`` also take ``where``, a
+    composite filter such as ``source ^= ACT and imported = N`` (see
+    ``filters``).
+``GET /records/<id>``
+    One record, or 404.
+``GET /count?filter=STATUS*``
+    ``{"count": N}``
+``GET /fields?filter=STATUS*``
+    Record counts per field name.
+``POST /convert``
+    ``{"field_name": F, "values": [...], "default": null}`` returns
+    ``{"values": [...]}`` in request order.
+``POST /convert/batch``
+    ``{"items": [[F, V], ...], "default": null}`` converts values of several
+    fields in one round trip.
+
+The server speaks HTTP/1.1 with keep-alive, so a client converting batch
+after batch reuses one connection. Each connection is served on its own
+thread; the database's connection pool bounds how many queries run at once.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from database import ConversionCodeDB
+
+
+# Largest request body accepted, in bytes.
+MAX_BODY_BYTES = 16 * 1024 * 1024
+
+MAX_PAGE_SIZE = 10000
+
+
+class ServiceError(Exception):
+    """A request the service rejects, answered with ``status``."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class Converter:
+    """Convert source values, from the database or a preloaded translator.
+
+    With a ``lookup.CodeTranslator``, conversions are dict lookups and the
+    translator is refreshed from the change log at most every
+    ``refresh_interval`` seconds. Without one, each batch is a few indexed
+    queries (see ``ConversionCodeDB.lookup_spectrum_values``).
+    """
+
+    def __init__(self, db: ConversionCodeDB, translator=None, refresh_interval: float = 1.0):
+        self.db = db
+        self.translator = translator
+        self.refresh_interval = refresh_interval
+        self._refreshed_at = time.monotonic()
+        self._refresh_lock = threading.Lock()
+
+    def convert(self, field_name: str, source_values: Sequence[str],
+                default: Optional[str] = None) -> List[Optional[str]]:
+        """Convert values of one field, in order."""
+        if self.translator is not None:
+            self._maybe_refresh()
+            return self.translator.convert_many(field_name, source_values, default)
+        mappings = self.db.lookup_spectrum_values(field_name, source_values)
+        return [mappings.get(value, default) for value in source_values]
+
+    def convert_items(self, items: Sequence[Tuple[str, str]],
+                      default: Optional[str] = None) -> List[Optional[str]]:
+        """Convert ``(field_name, source_value)`` pairs, in order."""
+        by_field: Dict[str, List[int]] = {}
+        for index, (field_name, _) in enumerate(items):
+            by_field.setdefault(field_name, []).append(index)
+        results: List[Optional[str]] = [default] * len(items)
+        for field_name, indexes in by_field.items():
+            values = self.convert(field_name, [items[i][1] for i in indexes], default)
+            for index, value in zip(indexes, values):
+                results[index] = value
+        return results
+
+    def _maybe_refresh(self):
+        """Refresh the translator if the last refresh is old enough."""
+        if time.monotonic() - self._refreshed_at < self.refresh_interval:
+            return
+        # One request refreshes; the others keep converting meanwhile.
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            self.translator.refresh()
+            self._refreshed_at = time.monotonic()
+        finally:
+            self._refresh_lock.release()
+
+
+def _single(query: Dict[str, List[str]], name: str) -> Optional[str]:
+    """One query string parameter, or None."""
+    values = query.get(name)
+    return values[-1] if values else None
+
+
+def _int_param(query: Dict[str, List[str]], name: str, default: Optional[int],
+               maximum: Optional[int] = None) -> Optional[int]:
+    """An integer query string parameter."""
+    text = _single(query, name)
+    if text is None or text == '':
+        return default
+    try:
+        value = int(text)
+    except ValueError:
+        raise ServiceError(400, f"{name} must be an integer") from None
+    if value < 0 or (maximum is not None and value > maximum):
+        raise ServiceError(400, f"{name} must be between 0 and {maximum}")
+    return value
+
+
+def _string_list(value, name: str) -> List[str]:
+    """Validate a JSON list of strings."""
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ServiceError(400, f"{name} must be a list of strings")
+    return value
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """Answer the service's JSON endpoints."""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'ConversionCodeService/1'
+
+    def do_GET(self):
+        self._dispatch(self._get)
+
+    def do_POST(self):
+        self._dispatch(self._post)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _dispatch(self, route):
+        """Run a route and send its result or error as JSON."""
+        try:
+            url = urlsplit(self.path)
+            status, body = 200, route(url.path.rstrip('/') or '/', parse_qs(url.query))
+        except ServiceError as e:
+            status, body = e.status, {'error': str(e)}
+        except ValueError as e:
+            status, body = 400, {'error': str(e)}
+        except Exception as e:
+            self.log_error("%s failed: %r", self.path, e)
+            status, body = 500, {'error': 'internal error'}
+        payload = json.dumps(body, ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _get(self, path: str, query: Dict[str, List[str]]):
+        db: ConversionCodeDB = self.server.db
+        field_filter = _single(query, 'filter') or None
+        where = _single(query, 'where') or None
+        if path == '/health':
+            return {'status': 'ok'}
+        if path == '/records':
+            limit = _int_param(query, 'limit', 200, MAX_PAGE_SIZE)
+            page = db.get_record_page(after_id=_int_param(query, 'after_id', None),
+                                      limit=limit, field_name_filter=field_filter,
+                                      where=where)
+            next_after_id = page[-1].CONVERSION_CODE_ID if len(page) == limit and page else None
+            return {'records': [record.as_dict() for record in page],
+                    'next_after_id': next_after_id}
+        if path.startswith('/records/'):
+            try:
+                record_id = int(path[len('/records/'):])
+            except ValueError:
+                raise ServiceError(404, f"No such record: {path}") from None
+            record = db.get_record(record_id)
+            if record is None:
+                raise ServiceError(404, f"No record with ID {record_id}")
+            return record.as_dict()
+        if path == '/count':
+            return {'count': db.count_records(field_filter, where=where)}
+        if path == '/fields':
+            return {'fields': [group._asdict()
+                               for group in db.field_name_summary(field_filter, where=where)]}
+        raise ServiceError(404, f"Unknown endpoint {path}")
+
+    def _post(self, path: str, query: Dict[str, List[str]]):
+        converter: Converter = self.server.converter
+        body = self._read_json()
+        default = body.get('default')
+        if default is not None and not isinstance(default, str):
+            raise ServiceError(400, "default must be a string or null")
+        if path == '/convert':
+            field_name = body.get('field_name')
+            if not isinstance(field_name, str):
+                raise ServiceError(400, "field_name must be a string")
+            values = _string_list(body.get('values'), 'values')
+            return {'values': converter.convert(field_name, values, default)}
+        if path == '/convert/batch':
+            items = body.get('items')
+            if not isinstance(items, list) or not all(
+                    isinstance(item, list) and len(item) == 2
+                    and all(isinstance(part, str) for part in item) for item in items):
+                raise ServiceError(400, "items must be a list of [field_name, source_value]")
+            return {'values': converter.convert_items(items, default)}
+        raise ServiceError(404, f"Unknown endpoint {path}")
+
+    def _read_json(self) -> Dict:
+        """Read and parse the request body as a JSON object."""
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length < 0:
+                raise ValueError(length)
+        except ValueError:
+            self.close_connection = True
+            raise ServiceError(400, "Invalid Content-Length") from None
+        if length > MAX_BODY_BYTES:
+            # The body is not read, so the connection cannot be reused.
+            self.close_connection = True
+            raise ServiceError(413, f"Request body exceeds {MAX_BODY_BYTES} bytes")
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            raise ServiceError(400, "Request body is not valid JSON") from None
+        if not isinstance(body, dict):
+            raise ServiceError(400, "Request body must be a JSON object")
+        return body
+
+
+class ConversionCodeServer(ThreadingHTTPServer):
+    """HTTP server holding the database and converter its handlers use."""
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], db: ConversionCodeDB,
+                 converter: Optional[Converter] = None, verbose: bool = False):
+        super().__init__(address, ServiceHandler)
+        self.db = db
+        self.converter = converter or Converter(db)
+        self.verbose = verbose
+
+
+def make_server(db: ConversionCodeDB, host: str = '127.0.0.1', port: int = 8765,
+                preload: bool = False, refresh_interval: float = 1.0,
+                verbose: bool = False) -> ConversionCodeServer:
+    """Create a server; call ``serve_forever()`` on it to start answering.
+
+    ``preload`` loads every mapping into a ``lookup.CodeTranslator`` first,
+    trading memory and start-up time for faster conversions.
+    """
+    translator = None
+    if preload:
+        from lookup import CodeTranslator
+        translator = CodeTranslator(db)
+    return ConversionCodeServer((host, port), db,
+                                Converter(db, translator, refresh_interval), verbose)
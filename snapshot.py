@@ -0,0 +1,417 @@
+"""Read-only snapshots of the conversion map for many lookup processes.
+
+``compile_snapshot`` writes every (FIELD_NAME, SOURCE_VALUE) mapping into
+one binary file; ``Snapshot`` maps it into memory and looks keys up in
+place, without loading or deserializing anything. Processes that open the
+same file share its pages through the OS page cache, so sixteen ETL
+workers cost one copy of the map rather than sixteen dicts::
+
+    refresh_snapshot(db, "codes.snap")     # in the process that owns the table
+    with Snapshot("codes.snap") as snapshot:     # in each worker
+        snapshot.convert("STATUS_CODE", "ACTIVE")
+        snapshot.reopen_if_replaced()      # now and then, to pick up a new file
+
+Layout, little-endian::
+
+    header:  b'CCSNAP\\0\\0' | u16 version | u16 header size | u32 key count
+             | u32 slot count | u64 slots offset | u64 entries offset
+             | u64 strings offset | u64 file size | f64 created (Unix time)
+             | 32s table stamp | u32 CRC-32 of the header and everything after it
+    slots:   u32 per slot, an entry number plus one, or 0 if empty
+    entries: per key, sorted by field name then source value (UTF-8 bytes):
+             u32 key hash | u32 field offset | u32 source offset
+             | u32 spectrum offset | u16 field length | u16 source length
+             | u16 spectrum length | u16 flags
+    strings: UTF-8 field names, source values and spectrum values; field
+             names and spectrum values are stored once each
+
+The slots are an open-addressing hash table over the entries, with linear
+probing and at most half the slots in use. Where several rows share a key,
+the highest CONVERSION_CODE_ID wins, as in
+``ConversionCodeDB.lookup_spectrum_values``. The table stamp identifies the
+table contents the file was compiled from (see ``table_stamp``), so
+``refresh_snapshot`` rewrites it only when the table changed. A new file is
+written beside the old one and renamed over it, so readers never see a
+partial file, and readers holding the old one keep using it until they
+reopen.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+import zlib
+from array import array
+from functools import partial
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from database import TABLE_NAME, ConversionCodeDB
+from lookup import LOAD_MAPPINGS_SQL
+
+
+SNAPSHOT_MAGIC = b'CCSNAP\0\0'
+SNAPSHOT_VERSION = 1
+
+HEADER = struct.Struct('<8sHHIIQQQQd32s')
+CHECKSUM = struct.Struct('<I')
+HEADER_SIZE = 128
+SLOT = struct.Struct('<I')
+ENTRY = struct.Struct('<IIIIHHHH')
+
+# Entry flags.
+FLAG_NULL_SPECTRUM = 1
+
+MAX_STRING_BYTES = 0xFFFF
+
+# Field names whose lookup state a Snapshot keeps; past this it starts over.
+MAX_CACHED_FIELDS = 1024
+
+TABLE_FINGERPRINT_SQL = f'''
+    SELECT COUNT(*), MAX(CONVERSION_CODE_ID), MAX(CHANGE_DATE_TIME) FROM {TABLE_NAME}
+'''
+
+assert HEADER.size + CHECKSUM.size <= HEADER_SIZE
+
+
+class SnapshotInfo(NamedTuple):
+    """A snapshot file's header."""
+    version: int
+    keys: int
+    created: float
+    stamp: bytes
+
+
+def _key_hash(field_name: bytes, source_value: bytes) -> int:
+    """Hash a key the same way in every process (unlike ``hash``)."""
+    return zlib.crc32(source_value, zlib.crc32(field_name + b'\0'))
+
+
+def _slot_bits(keys: int) -> int:
+    """Bits of the slot number: at least twice as many slots as keys."""
+    return max(1, (2 * keys - 1).bit_length())
+
+
+def _home_slot(key_hash: int, bits: int) -> int:
+    """Spread the hash over the slots (Fibonacci hashing)."""
+    return ((key_hash * 0x9E3779B1) & 0xFFFFFFFF) >> (32 - bits)
+
+
+def table_stamp(db: ConversionCodeDB) -> bytes:
+    """Identify the table's current contents.
+
+    With a change log this is the latest change's sequence number, which
+    costs one indexed read. Without one it is the row count, highest ID and
+    latest CHANGE_DATE_TIME, which every insert, update and delete moves.
+    """
+    if db.change_log_enabled:
+        fingerprint = f"seq:{db.current_change_seq()}"
+    else:
+        with db.connection() as conn:
+            count, max_id, changed = conn.execute(TABLE_FINGERPRINT_SQL).fetchone()
+        fingerprint = f"rows:{count}:{max_id}:{changed}"
+    return hashlib.sha256(fingerprint.encode('utf-8')).digest()
+
+
+def _encode(value: str, what: str) -> bytes:
+    """UTF-8 bytes of a string short enough for a u16 length."""
+    data = value.encode('utf-8')
+    if len(data) > MAX_STRING_BYTES:
+        raise ValueError(f"{what} is longer than {MAX_STRING_BYTES} bytes: {value[:40]!r}...")
+    return data
+
+
+def compile_snapshot(db: ConversionCodeDB, path: str) -> int:
+    """Write a snapshot of every mapping to ``path``; returns the key count.
+
+    The file is written to a temporary file in the same directory and
+    renamed over ``path``, so it is replaced in one step. Rows with a NULL
+    field name or source value cannot be looked up and are left out.
+    """
+    # Read the stamp first: changes made while loading make it stale, so
+    # the next refresh rewrites the file.
+    stamp = table_stamp(db)
+    mappings: Dict[Tuple[str, str], Optional[str]] = {}
+    with db.connection() as conn:
+        cursor = conn.execute(LOAD_MAPPINGS_SQL)
+        while True:
+            batch = cursor.fetchmany(10000)
+            if not batch:
+                break
+            for _, field_name, source_value, spectrum_value, _ in batch:
+                if field_name is not None and source_value is not None:
+                    mappings[field_name, source_value] = spectrum_value
+
+    # Field names and spectrum values repeat across many keys: encode and
+    # store each once, mapped to its (offset, length) in the strings.
+    strings = bytearray()
+    shared: Dict[Optional[str], Tuple[int, int]] = {}
+
+    def store(value: str, what: str) -> Tuple[int, int]:
+        data = _encode(value, what)
+        location = shared[value] = (len(strings), len(data))
+        strings.extend(data)
+        return location
+
+    keys = sorted(((field_name.encode('utf-8'), source_value.encode('utf-8')), field_name,
+                   spectrum_value)
+                  for (field_name, source_value), spectrum_value in mappings.items())
+    del mappings
+    entries = bytearray(ENTRY.size * len(keys))
+    pack_entry = partial(ENTRY.pack_into, entries)
+    bits = _slot_bits(len(keys))
+    mask = (1 << bits) - 1
+    slots = array('I', bytes(SLOT.size << bits))
+    for index, ((field, source), field_name, spectrum_value) in enumerate(keys):
+        if len(source) > MAX_STRING_BYTES:
+            raise ValueError(f"SOURCE_VALUE is longer than {MAX_STRING_BYTES} bytes: "
+                             f"{source[:40]!r}...")
+        field_offset, field_length = shared.get(field_name) or store(field_name, "FIELD_NAME")
+        if spectrum_value is None:
+            spectrum_offset, spectrum_length, flags = 0, 0, FLAG_NULL_SPECTRUM
+        else:
+            spectrum_offset, spectrum_length = (shared.get(spectrum_value)
+                                                or store(spectrum_value, "SPECTRUM_VALUE"))
+            flags = 0
+        # _key_hash and _home_slot, inlined as they run once per key.
+        key_hash = zlib.crc32(source, zlib.crc32(field + b'\0'))
+        pack_entry(index * ENTRY.size, key_hash, field_offset, len(strings), spectrum_offset,
+                   field_length, len(source), spectrum_length, flags)
+        strings.extend(source)
+        slot = ((key_hash * 0x9E3779B1) & 0xFFFFFFFF) >> (32 - bits)
+        while slots[slot]:
+            slot = (slot + 1) & mask
+        slots[slot] = index + 1
+    key_count = len(keys)
+    del keys
+    if sys.byteorder == 'big':
+        slots.byteswap()
+
+    slots_offset = HEADER_SIZE
+    entries_offset = slots_offset + len(slots) * SLOT.size
+    strings_offset = entries_offset + len(entries)
+    file_size = strings_offset + len(strings)
+    header = HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, HEADER_SIZE, key_count, len(slots),
+                         slots_offset, entries_offset, strings_offset, file_size, time.time(),
+                         stamp)
+    padding = bytes(HEADER_SIZE - len(header) - CHECKSUM.size)
+    body = (slots.tobytes(), entries, strings)
+    checksum = zlib.crc32(padding, zlib.crc32(header))
+    for part in body:
+        checksum = zlib.crc32(part, checksum)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp',
+                                     dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header + CHECKSUM.pack(checksum) + padding)
+            for part in body:
+                f.write(part)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return key_count
+
+
+def read_snapshot_info(path: str) -> SnapshotInfo:
+    """Read a snapshot's header without mapping or checking the file.
+
+    Raises ValueError if the file is not a snapshot of this version.
+    """
+    with open(path, 'rb') as f:
+        return _parse_header(f.read(HEADER_SIZE))[0]
+
+
+def _parse_header(data) -> Tuple[SnapshotInfo, Tuple[int, ...], int]:
+    """Return the info, layout fields and stored checksum of a header."""
+    if len(data) < HEADER_SIZE or data[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+        raise ValueError("Not a conversion code snapshot.")
+    (_, version, header_size, keys, slot_count, slots_offset, entries_offset, strings_offset,
+     file_size, created, stamp) = HEADER.unpack_from(data)
+    if version != SNAPSHOT_VERSION or header_size != HEADER_SIZE:
+        raise ValueError(f"Unsupported snapshot version {version}; "
+                         f"expected {SNAPSHOT_VERSION}. Compile the snapshot again.")
+    checksum = CHECKSUM.unpack_from(data, HEADER.size)[0]
+    return (SnapshotInfo(version, keys, created, stamp),
+            (slot_count, slots_offset, entries_offset, strings_offset, file_size), checksum)
+
+
+def refresh_snapshot(db: ConversionCodeDB, path: str) -> bool:
+    """Compile the snapshot unless ``path`` already holds the table's contents.
+
+    Returns whether the file was written. A missing, unreadable or
+    outdated file is replaced.
+    """
+    try:
+        current = read_snapshot_info(path).stamp == table_stamp(db)
+    except (OSError, ValueError):
+        current = False
+    if current:
+        return False
+    compile_snapshot(db, path)
+    return True
+
+
+class Snapshot:
+    """Look mappings up in a memory-mapped snapshot file.
+
+    ``convert`` and ``convert_many`` behave like ``lookup.CodeTranslator``'s.
+    Each lookup reads a few bytes of the mapping in place. The file is
+    checked against its checksum when opened, unless ``verify`` is false.
+    A ``Snapshot`` may be shared by threads; it is not passed to other
+    processes, each of which opens the file itself.
+    """
+
+    def __init__(self, path: str, verify: bool = True):
+        self.path = path
+        self.verify = verify
+        self._map: Optional[mmap.mmap] = None
+        self._open()
+
+    def _open(self):
+        """Map the file at ``path`` and read its header."""
+        with open(self.path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size < HEADER_SIZE:
+                raise ValueError("Not a conversion code snapshot.")
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            info, layout, checksum = _parse_header(mapped)
+            slot_count, slots_offset, entries_offset, strings_offset, file_size = layout
+            if file_size != len(mapped):
+                raise ValueError("Truncated or corrupt snapshot.")
+            if self.verify:
+                actual = zlib.crc32(mapped[:HEADER.size])
+                actual = zlib.crc32(memoryview(mapped)[HEADER.size + CHECKSUM.size:], actual)
+                if actual != checksum:
+                    raise ValueError("Snapshot checksum mismatch; the file is corrupt.")
+        except BaseException:
+            mapped.close()
+            raise
+        # The old map is not closed: lookups under way on other threads
+        # finish on it, and it is unmapped once they drop it.
+        self._map, self.info = mapped, info
+        self._finders: Dict[str, Callable[[str], Optional[Tuple[int, ...]]]] = {}
+        self._identity = (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        self._slot_count, self._slots_offset = slot_count, slots_offset
+        self._entries_offset, self._strings_offset = entries_offset, strings_offset
+        self._bits = slot_count.bit_length() - 1
+
+    def __len__(self) -> int:
+        return self.info.keys
+
+    def __enter__(self) -> 'Snapshot':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Unmap the file."""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            self._finders = {}
+
+    def reopen_if_replaced(self) -> bool:
+        """Map the file again if another one was renamed over ``path``.
+
+        Returns whether it was reopened. Lookups keep using the old file
+        until then.
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        if (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size) == self._identity:
+            return False
+        self._open()
+        return True
+
+    def _entry(self, index: int) -> Tuple[int, ...]:
+        return ENTRY.unpack_from(self._map, self._entries_offset + index * ENTRY.size)
+
+    def _string(self, offset: int, length: int) -> bytes:
+        start = self._strings_offset + offset
+        return self._map[start:start + length]
+
+    def _finder(self, field_name: str) -> Callable[[str], Optional[Tuple[int, ...]]]:
+        """Return a function finding the entry for a source value of one field."""
+        find = self._finders.get(field_name)
+        if find is None:
+            if len(self._finders) >= MAX_CACHED_FIELDS:
+                self._finders = {}
+            find = self._finders[field_name] = self._make_finder(field_name)
+        return find
+
+    def _make_finder(self, field_name: str) -> Callable[[str], Optional[Tuple[int, ...]]]:
+        mapped = self._map
+        if mapped is None:
+            raise ValueError("Snapshot is closed.")
+        field = field_name.encode('utf-8')
+        field_hash = zlib.crc32(field + b'\0')
+        shift = 32 - self._bits
+        mask = self._slot_count - 1
+        slots_offset, entries_offset = self._slots_offset, self._entries_offset
+        strings_offset = self._strings_offset
+        unpack_slot, unpack_entry = SLOT.unpack_from, ENTRY.unpack_from
+
+        def find(source_value: str) -> Optional[Tuple[int, ...]]:
+            source = source_value.encode('utf-8')
+            # _key_hash and _home_slot, with the field name's part done once.
+            key_hash = zlib.crc32(source, field_hash)
+            slot = ((key_hash * 0x9E3779B1) & 0xFFFFFFFF) >> shift
+            while True:
+                index = unpack_slot(mapped, slots_offset + 4 * slot)[0]
+                if not index:
+                    return None
+                entry = unpack_entry(mapped, entries_offset + ENTRY.size * (index - 1))
+                if entry[0] == key_hash and entry[5] == len(source) and entry[4] == len(field):
+                    start = strings_offset + entry[2]
+                    if mapped[start:start + entry[5]] == source:
+                        start = strings_offset + entry[1]
+                        if mapped[start:start + entry[4]] == field:
+                            return entry
+                slot = (slot + 1) & mask
+
+        return find
+
+    def _spectrum(self, entry: Tuple[int, ...]) -> Optional[str]:
+        if entry[7] & FLAG_NULL_SPECTRUM:
+            return None
+        return self._string(entry[3], entry[6]).decode('utf-8')
+
+    def __contains__(self, key: Tuple[str, str]) -> bool:
+        field_name, source_value = key
+        return self._finder(field_name)(source_value) is not None
+
+    def convert(self, field_name: str, source_value: str,
+                default: Optional[str] = None) -> Optional[str]:
+        """Return the spectrum value for one source value, or ``default``.
+
+        A key mapped to a NULL spectrum value returns None.
+        """
+        entry = self._finder(field_name)(source_value)
+        return default if entry is None else self._spectrum(entry)
+
+    def convert_many(self, field_name: str, source_values: Iterable[str],
+                     default: Optional[str] = None) -> List[Optional[str]]:
+        """Convert a batch of source values for one field name."""
+        find, spectrum = self._finder(field_name), self._spectrum
+        results = []
+        for value in source_values:
+            entry = find(value)
+            results.append(default if entry is None else spectrum(entry))
+        return results
+
+    def items(self) -> Iterator[Tuple[str, str, Optional[str]]]:
+        """Yield ``(field_name, source_value, spectrum_value)`` in key order."""
+        for index in range(len(self)):
+            entry = self._entry(index)
+            yield (self._string(entry[1], entry[4]).decode('utf-8'),
+                   self._string(entry[2], entry[5]).decode('utf-8'), self._spectrum(entry))
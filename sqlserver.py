@@ -0,0 +1,272 @@
+"""SQL Server backend for ConversionCodeDB, using pyodbc.
+
+pyodbc is only imported when the first connection is opened, so this module
+can be imported (and exercised against ``tsql_standin``) without it::
+
+    backend = SqlServerBackend("DRIVER={ODBC Driver 18 for SQL Server};"
+                               "SERVER=db01;DATABASE=Spectrum;Trusted_Connection=yes")
+    db = ConversionCodeDB(backend=backend)
+
+Connections are pooled by ``ConversionCodeDB`` like SQLite ones. Batched
+statements use pyodbc's ``fast_executemany``, which sends the whole
+parameter array in one round trip, and new IDs come back from ``OUTPUT``
+clauses rather than a second query.
+"""
+from datetime import datetime
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from database import (TABLE_NAME, MATCH_EXACT, MATCH_PREFIX, UNIQUE_KEY_INDEX_NAME, Backend,
+                      _escape_like)
+
+
+# Case-insensitive comparisons, as SQLite's NOCASE filters behave.
+COLLATION = 'SQL_Latin1_General_CP1_CI_AS'
+
+CREATE_TABLE_SQL = f'''
+    IF OBJECT_ID(N'{TABLE_NAME}', N'U') IS NULL
+    CREATE TABLE {TABLE_NAME} (
+        CONVERSION_CODE_ID BIGINT IDENTITY(1,1) NOT NULL PRIMARY KEY,
+        FIELD_NAME VARCHAR(50) NULL,
+        SOURCE_VALUE VARCHAR(20) NULL,
+        SPECTRUM_VALUE VARCHAR(10) NULL,
+        IS_IMPORTED CHAR(1) NOT NULL DEFAULT 'N',
+        UPDATE_COUNT INT NOT NULL DEFAULT 0,
+        CHANGE_DATE_TIME SMALLDATETIME NOT NULL DEFAULT GETDATE()
+    )
+'''
+
+CREATE_INDEX_SQL = '''
+    IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'{name}')
+    CREATE INDEX {name} ON {table} ({columns})
+'''
+
+INDEXES = (
+    (f'IX_{TABLE_NAME}_FIELD_SOURCE', 'FIELD_NAME, SOURCE_VALUE'),
+    (f'IX_{TABLE_NAME}_CHANGE_DATE_TIME', 'CHANGE_DATE_TIME'),
+    # Sorting by column; each index ends in the clustered key, so it covers
+    # the CONVERSION_CODE_ID tie-break.
+    (f'IX_{TABLE_NAME}_SOURCE_VALUE', 'SOURCE_VALUE'),
+    (f'IX_{TABLE_NAME}_SPECTRUM_VALUE', 'SPECTRUM_VALUE'),
+    (f'IX_{TABLE_NAME}_IS_IMPORTED', 'IS_IMPORTED'),
+    (f'IX_{TABLE_NAME}_UPDATE_COUNT', 'UPDATE_COUNT'),
+    (f'IX_{TABLE_NAME}_FIELD_IMPORTED', 'FIELD_NAME, IS_IMPORTED'),
+    (f'IX_{TABLE_NAME}_SPECTRUM_FIELD', 'SPECTRUM_VALUE, FIELD_NAME, SOURCE_VALUE'),
+)
+
+# A filtered index, as a plain unique index would allow only one NULL key.
+CREATE_UNIQUE_KEY_SQL = f'''
+    IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'{UNIQUE_KEY_INDEX_NAME}')
+    CREATE UNIQUE INDEX {UNIQUE_KEY_INDEX_NAME} ON {TABLE_NAME} (FIELD_NAME, SOURCE_VALUE)
+    WHERE FIELD_NAME IS NOT NULL AND SOURCE_VALUE IS NOT NULL
+'''
+
+SELECT_PAGE_SQL = f'''
+    SELECT * FROM {TABLE_NAME}
+    WHERE {{where}}
+    ORDER BY {{order}}
+    OFFSET ? ROWS FETCH NEXT ? ROWS ONLY
+'''
+
+INSERT_SQL = f'''
+    INSERT INTO {TABLE_NAME}
+    (FIELD_NAME, SOURCE_VALUE, SPECTRUM_VALUE, IS_IMPORTED, UPDATE_COUNT, CHANGE_DATE_TIME)
+    OUTPUT INSERTED.CONVERSION_CODE_ID
+    VALUES (?, ?, ?, ?, 0, ?)
+'''
+
+# Upserts stage each chunk in a session temp table, filled with one
+# fast_executemany call, then apply it with two set-based statements. The
+# EXCEPT comparison treats NULLs as equal, like SQLite's IS NOT.
+CREATE_UPSERT_STAGE_SQL = '''
+    CREATE TABLE #UPSERT_STAGE (
+        FIELD_NAME VARCHAR(50) NOT NULL,
+        SOURCE_VALUE VARCHAR(20) NOT NULL,
+        SPECTRUM_VALUE VARCHAR(10) NULL,
+        IS_IMPORTED CHAR(1) NOT NULL,
+        PRIMARY KEY (FIELD_NAME, SOURCE_VALUE)
+    )
+'''
+
+STAGE_UPSERT_SQL = '''
+    INSERT INTO #UPSERT_STAGE (FIELD_NAME, SOURCE_VALUE, SPECTRUM_VALUE, IS_IMPORTED)
+    VALUES (?, ?, ?, ?)
+'''
+
+APPLY_UPSERT_UPDATE_SQL = f'''
+    UPDATE {TABLE_NAME}
+    SET SPECTRUM_VALUE = (SELECT s.SPECTRUM_VALUE FROM #UPSERT_STAGE s
+                          WHERE s.FIELD_NAME = {TABLE_NAME}.FIELD_NAME
+                            AND s.SOURCE_VALUE = {TABLE_NAME}.SOURCE_VALUE),
+        IS_IMPORTED = (SELECT s.IS_IMPORTED FROM #UPSERT_STAGE s
+                       WHERE s.FIELD_NAME = {TABLE_NAME}.FIELD_NAME
+                         AND s.SOURCE_VALUE = {TABLE_NAME}.SOURCE_VALUE),
+        UPDATE_COUNT = UPDATE_COUNT + 1,
+        CHANGE_DATE_TIME = ?
+    WHERE CONVERSION_CODE_ID IN (
+        SELECT t.CONVERSION_CODE_ID
+        FROM #UPSERT_STAGE s
+        JOIN {TABLE_NAME} t
+          ON t.FIELD_NAME = s.FIELD_NAME AND t.SOURCE_VALUE = s.SOURCE_VALUE
+        WHERE EXISTS (SELECT t.SPECTRUM_VALUE, t.IS_IMPORTED
+                      EXCEPT SELECT s.SPECTRUM_VALUE, s.IS_IMPORTED)
+    )
+'''
+
+COUNT_UPSERT_UNCHANGED_SQL = f'''
+    SELECT COUNT(*) FROM #UPSERT_STAGE s
+    WHERE EXISTS (
+        SELECT 1 FROM {TABLE_NAME} t
+        WHERE t.FIELD_NAME = s.FIELD_NAME AND t.SOURCE_VALUE = s.SOURCE_VALUE
+    )
+    AND NOT EXISTS (
+        SELECT 1 FROM {TABLE_NAME} t
+        WHERE t.FIELD_NAME = s.FIELD_NAME AND t.SOURCE_VALUE = s.SOURCE_VALUE
+          AND EXISTS (SELECT t.SPECTRUM_VALUE, t.IS_IMPORTED
+                      EXCEPT SELECT s.SPECTRUM_VALUE, s.IS_IMPORTED)
+    )
+'''
+
+APPLY_UPSERT_INSERT_SQL = f'''
+    INSERT INTO {TABLE_NAME}
+    (FIELD_NAME, SOURCE_VALUE, SPECTRUM_VALUE, IS_IMPORTED, UPDATE_COUNT, CHANGE_DATE_TIME)
+    SELECT s.FIELD_NAME, s.SOURCE_VALUE, s.SPECTRUM_VALUE, s.IS_IMPORTED, 0, ?
+    FROM #UPSERT_STAGE s
+    WHERE NOT EXISTS (
+        SELECT 1 FROM {TABLE_NAME} t
+        WHERE t.FIELD_NAME = s.FIELD_NAME AND t.SOURCE_VALUE = s.SOURCE_VALUE
+    )
+'''
+
+DROP_UPSERT_STAGE_SQL = 'DROP TABLE #UPSERT_STAGE'
+
+# Requires change tracking on the database; NULL otherwise.
+DATA_VERSION_SQL = 'SELECT CHANGE_TRACKING_CURRENT_VERSION()'
+
+
+def _escape_tsql_like(text: str) -> str:
+    """Escape LIKE wildcards, including T-SQL's ``[`` character classes."""
+    return _escape_like(text).replace('[', '\\[')
+
+
+def _pyodbc_connect(connection_string: str, **kwargs):
+    """Open a pyodbc connection, importing pyodbc on first use."""
+    try:
+        import pyodbc
+    except ImportError as e:
+        raise RuntimeError("The SQL Server backend requires pyodbc "
+                           "(pip install pyodbc).") from e
+    return pyodbc.connect(connection_string, **kwargs)
+
+
+class SqlServerBackend(Backend):
+    """SQL Server database reached through an ODBC connection string.
+
+    ``connect`` replaces ``pyodbc.connect`` (it is called with the
+    connection string and keyword arguments), e.g. with
+    ``tsql_standin.StandInServer.connect`` in tests.
+    """
+
+    name = 'sqlserver'
+    # SQL Server accepts up to 2100 parameters per statement.
+    max_parameters = 2000
+
+    text_collation = COLLATION
+    select_page_sql = SELECT_PAGE_SQL
+    insert_sql = INSERT_SQL
+
+    def __init__(self, connection_string: str, fast_executemany: bool = True,
+                 login_timeout: int = 15, connect: Optional[Callable] = None,
+                 unique_keys: bool = False):
+        self.connection_string = connection_string
+        self.fast_executemany = fast_executemany
+        self.login_timeout = login_timeout
+        self._connect = connect or _pyodbc_connect
+        self.unique_keys = unique_keys
+        self.unique_keys_enforced = unique_keys
+        # Becomes False once the server reports change tracking is off.
+        self._tracks_changes = True
+
+    def connect(self):
+        """Open a new connection with explicit transactions."""
+        return self._connect(self.connection_string, autocommit=False,
+                             timeout=self.login_timeout)
+
+    def cursor(self, conn):
+        """Return a cursor that sends executemany parameters as one array."""
+        cursor = conn.cursor()
+        cursor.fast_executemany = self.fast_executemany
+        return cursor
+
+    def init_schema(self, conn):
+        """Create the table and indexes unless they already exist.
+
+        An existing unique key index is only detected when ``unique_keys``
+        is set.
+        """
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute(CREATE_TABLE_SQL)
+            for name, columns in INDEXES:
+                cursor.execute(CREATE_INDEX_SQL.format(name=name, table=TABLE_NAME,
+                                                       columns=columns))
+        if self.unique_keys:
+            self.create_unique_key_index(conn, CREATE_UNIQUE_KEY_SQL)
+
+    def is_busy_error(self, error: Exception) -> bool:
+        """Deadlock victims (SQLSTATE 40001) and lock request timeouts (HYT00)."""
+        return bool(error.args) and error.args[0] in ('40001', 'HYT00')
+
+    def data_version(self, conn) -> Optional[int]:
+        """The change tracking version, or None if change tracking is off.
+
+        Unlike SQLite's data_version this also moves on this process's own
+        commits, so each write clears the whole query cache.
+        """
+        if not self._tracks_changes:
+            return None
+        cursor = conn.cursor()
+        cursor.execute(DATA_VERSION_SQL)
+        version = cursor.fetchone()[0]
+        if version is None:
+            self._tracks_changes = False
+        return version
+
+    def plan_field_name_filter(self, match: str, term: str) -> Tuple[str, Tuple]:
+        """Case-insensitive comparisons; exact and prefix ones can seek an index."""
+        if match == MATCH_EXACT:
+            return f'FIELD_NAME = ? COLLATE {COLLATION}', (term,)
+        if match == MATCH_PREFIX:
+            return (f"FIELD_NAME LIKE ? COLLATE {COLLATION} ESCAPE '\\'",
+                    (_escape_tsql_like(term) + '%',))
+        return (f"FIELD_NAME LIKE ? COLLATE {COLLATION} ESCAPE '\\'",
+                ('%' + _escape_tsql_like(term) + '%',))
+
+    def escape_like(self, text: str) -> str:
+        """Escape LIKE wildcards, including ``[``."""
+        return _escape_tsql_like(text)
+
+    def page_params(self, limit: int, offset: int) -> List[int]:
+        """OFFSET ... FETCH binds the offset first."""
+        return [offset, limit]
+
+    def insert_record(self, cursor, params: Sequence) -> int:
+        """Insert and read the new ID from the OUTPUT clause in one round trip."""
+        cursor.execute(self.insert_sql, params)
+        return int(cursor.fetchone()[0])
+
+    def upsert_chunk(self, cursor, rows: List[Tuple[str, str, Optional[str], str]],
+                     now: datetime) -> Tuple[int, int, int]:
+        """Stage rows with one parameter array, then apply them set-based."""
+        # The stage's primary key compares case-insensitively, so duplicate
+        # keys are collapsed here, later rows winning, before staging.
+        staged = list({(row[0].upper(), row[1].upper()): row for row in rows}.values())
+        cursor.execute(CREATE_UPSERT_STAGE_SQL)
+        cursor.executemany(STAGE_UPSERT_SQL, staged)
+        cursor.execute(COUNT_UPSERT_UNCHANGED_SQL)
+        unchanged = cursor.fetchone()[0]
+        cursor.execute(APPLY_UPSERT_UPDATE_SQL, (now,))
+        updated = cursor.rowcount
+        cursor.execute(APPLY_UPSERT_INSERT_SQL, (now,))
+        inserted = cursor.rowcount
+        cursor.execute(DROP_UPSERT_STAGE_SQL)
+        return updated, inserted, unchanged
@@ -0,0 +1,112 @@
+"""Test the asyncio front end against an SQLite file."""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from async_database import AsyncConversionCodeDB
+from database import ConcurrencyConflictError
+from test_database import remove_db_files
+
+
+async def _generated_rows(count: int, produced: list):
+    for i in range(count):
+        produced.append(i)
+        yield ("ASYNC_FIELD", f"SRC{i}", f"V{i % 10}")
+
+
+async def _exercise_async_api(path: str):
+    async with AsyncConversionCodeDB(path, pool_size=4, max_queued=64) as db:
+        assert db.max_workers == 4
+        record_id = await db.add_record("STATUS", "ACTIVE", "A")
+        assert (await db.get_record(record_id)).SPECTRUM_VALUE == "A"
+        assert await db.update_record(record_id, "STATUS", "ACTIVE", "B", "Y")
+        assert (await db.get_record_by_id(record_id))['IS_IMPORTED'] == "Y"
+        assert await db.count_records("=STATUS") == 1
+        assert await db.delete_record(record_id)
+        assert await db.get_record(record_id) is None
+        print("✓ Awaitable CRUD")
+
+        produced = []
+        writer = db.batch_writer(chunk_size=100, max_pending=1)
+        async with writer:
+            async for row in _generated_rows(1000, produced):
+                await writer.add(row)
+                # Full chunk being filled, one queued, one being written.
+                assert len(produced) - (writer.result.inserted + writer.rejected) <= 300
+        assert writer.result.inserted == 1000
+        result = await db.bulk_upsert([("ASYNC_FIELD", "SRC1", "CHANGED"),
+                                       ("ASYNC_FIELD", "", "X"), ("TOO_LONG", "S" * 30, "X")],
+                                      chunk_size=2)
+        assert (result.inserted, result.updated, result.rejected) == (1, 1, 1), result
+        assert result.errors[0][0] == 3, "Row numbers should count across chunks"
+        print("✓ Batch writes apply backpressure")
+
+        started = time.perf_counter()
+        ticks = []
+
+        async def ticker():
+            while True:
+                ticks.append(time.perf_counter())
+                await asyncio.sleep(0.001)
+
+        ticking = asyncio.ensure_future(ticker())
+        ids = await db.get_ids("=ASYNC_FIELD")
+        assert len(ids) == 1001
+        lookups = await asyncio.gather(*(db.get_record(record_id) for record_id in ids[:500]))
+        ticking.cancel()
+        assert [r.CONVERSION_CODE_ID for r in lookups] == ids[:500]
+        gaps = [b - a for a, b in zip(ticks, ticks[1:])]
+        assert len(ticks) > 1 and max(gaps) < 0.25, "The event loop was blocked"
+        print(f"✓ 500 concurrent lookups in {time.perf_counter() - started:.2f}s "
+              f"(longest loop stall {max(gaps) * 1000:.0f} ms)")
+
+        streamed = [record.CONVERSION_CODE_ID
+                    async for record in db.iter_records("=ASYNC_FIELD", batch_size=64)]
+        assert streamed == ids
+        seqs = [change.seq async for change in db.changes_since(0, batch_size=100)]
+        assert seqs == list(range(1, len(seqs) + 1)) and len(seqs) == 1005
+        async for record in db.iter_records(batch_size=10):
+            break
+        print("✓ Records and changes stream in batches")
+
+        await db.update_many((record_id, {'IS_IMPORTED': 'Y'}) for record_id in ids[:10])
+        assert await db.count_records("=ASYNC_FIELD") == 1001
+        assert await db.delete_many(ids[:10]) == 10
+        summary = await db.field_name_summary()
+        assert summary[0].records == 991
+
+        records = [await db.get_record(record_id) for record_id in ids[10:12]]
+        counts = {record.CONVERSION_CODE_ID: record.UPDATE_COUNT for record in records}
+        await db.update_record(ids[10], "ASYNC_FIELD", "CHANGED", "C", 'N')
+        for write in (db.update_many([(i, {'IS_IMPORTED': 'Y'}) for i in counts],
+                                     expected_update_counts=counts),
+                      db.delete_many(counts, expected_update_counts=counts)):
+            try:
+                await write
+            except ConcurrencyConflictError as e:
+                assert e.conversion_code_id == ids[10]
+            else:
+                raise AssertionError("A stale batch should conflict")
+        assert (await db.get_record(ids[11])).IS_IMPORTED == 'N', "Nothing written"
+        counts[ids[10]] += 1
+        assert await db.delete_many(counts, expected_update_counts=counts) == 2
+        print("✓ Batch writes check update counts")
+
+
+def test_async_database():
+    """Test awaitable CRUD, streams, batch writes and concurrent lookups."""
+    temp_db = os.path.join(tempfile.gettempdir(), 'test_conversion_async.db')
+    remove_db_files(temp_db)
+
+    try:
+        asyncio.run(_exercise_async_api(temp_db))
+    finally:
+        remove_db_files(temp_db)
+
+
+if __name__ == "__main__":
+    test_async_database()
@@ -0,0 +1,53 @@
+"""Test the benchmark harness on a small synthetic table."""
+import os
+import sys
+import tempfile
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from benchmark import (compare_results, generate_rows, percentile, prepare_database,
+                       run_benchmarks, summarize)
+from test_database import remove_db_files
+
+
+def test_benchmark_harness():
+    """Test data generation, statistics, a small run and result comparison."""
+    rows = list(generate_rows(5000, seed=3))
+    assert rows == list(generate_rows(5000, seed=3)), "Generation should be deterministic"
+    assert len({(row[0], row[1]) for row in rows}) == 5000, "Natural keys should be unique"
+    counts = Counter(row[0] for row in rows).most_common()
+    assert counts[0][1] > 20 * counts[-1][1], "Field names should be skewed"
+    print("✓ Synthetic rows are deterministic and skewed")
+
+    assert percentile([1.0, 2.0, 3.0, 4.0], 0.5) == 2.5
+    stats = summarize([0.001] * 99 + [0.1], items=10)
+    assert round(stats['p50_ms'], 3) == 1.0 and stats['p99_ms'] > 1.0
+    assert round(stats['per_second']) == round(1000 / 0.199)
+    print("✓ Percentiles and throughput")
+
+    data_dir = tempfile.mkdtemp(prefix='conversion_bench_')
+    try:
+        document = run_benchmarks([2000], data_dir, repeat=2)
+        operations = document['sizes']['2000']
+        for name in ('get_all_records', 'filter_substring', 'get_page_keyset_deep',
+                     'grid_populate', 'add_record', 'update_many_500', 'bulk_upsert_20k'):
+            assert operations[name]['runs'] >= 1, f"{name} was not measured"
+        path = prepare_database(2000, data_dir)
+        assert os.path.getsize(path) > 0
+        print("✓ Benchmark run covers the CRUD, filter and grid paths")
+
+        slower = {'sizes': {'2000': {name: dict(stats, p50_ms=stats['p50_ms'] * 2 + 1)
+                                     for name, stats in operations.items()}}}
+        assert compare_results(document, document) == []
+        regressions = compare_results(document, slower)
+        assert len(regressions) == len(operations), "Every slower operation should be flagged"
+        print("✓ Regressions detected against previous results")
+    finally:
+        for name in os.listdir(data_dir):
+            remove_db_files(os.path.join(data_dir, name))
+        os.rmdir(data_dir)
+
+
+if __name__ == "__main__":
+    test_benchmark_harness()
@@ -0,0 +1,127 @@
+"""Test prefix completion and existing-mapping previews."""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from completion import CompletionIndex, MappingPreview, SortedIndex
+from database import ConversionCodeDB
+from main import describe_preview
+from test_database import remove_db_files
+
+
+def test_sorted_index():
+    """Prefix searches ignore case; values differing only in case stay apart."""
+    index = SortedIndex(["STATUS_CODE", "status_code", "STATE", "REGION", "Stage"])
+    assert index.complete("sta") == ["Stage", "STATE", "STATUS_CODE", "status_code"]
+    assert index.complete("STATUS", limit=1) == ["STATUS_CODE"]
+    assert index.complete("x") == [] and len(index.complete("")) == 5
+    assert index.variants(" Status_Code ") == ["STATUS_CODE", "status_code"]
+    index.add("STATUS")
+    index.add("STATUS")
+    index.remove("status_code")
+    index.remove("MISSING")
+    assert index.complete("status") == ["STATUS", "STATUS_CODE"]
+    assert "STATUS" in index and "status" not in index and len(index) == 5
+
+    index = SortedIndex(f"FIELD_{i:05d}" for i in range(50000))
+    start = time.perf_counter()
+    for i in range(1000):
+        assert len(index.complete(f"field_{i % 500:03d}")) == 20
+    per_lookup = (time.perf_counter() - start) / 1000
+    assert per_lookup < 0.001, f"{per_lookup * 1000:.3f} ms per lookup"
+    print(f"✓ Sorted index completes in {per_lookup * 1e6:.0f} µs over 50000 values")
+
+
+def test_completion_index():
+    """Test suggestions and previews kept current from the change log."""
+    temp_db = os.path.join(tempfile.gettempdir(), 'test_conversion_completion.db')
+    remove_db_files(temp_db)
+
+    try:
+        with ConversionCodeDB(temp_db) as db:
+            db.bulk_upsert([("STATUS_CODE", f"S{i}", f"V{i}") for i in range(50)])
+            active_id = db.add_record("STATUS_CODE", "ACTIVE", "A")
+            db.add_record("REGION_CODE", "EUROPE", "EU")
+            db.add_record("Status_Code", "active", "a")
+
+            completions = CompletionIndex(db)
+            completions.refresh()
+            assert completions.field_names("st") == ["STATUS_CODE", "Status_Code"]
+            assert completions.source_values("STATUS_CODE", "a") == [], "Not loaded yet"
+            preview = completions.preview("STATUS_CODE", "ACTIVE")
+            assert preview.known_field and not preview.exists
+
+            completions.load_field("STATUS_CODE")
+            assert completions.field_loaded("STATUS_CODE")
+            assert completions.source_values("STATUS_CODE", "s1") == [
+                "S1"] + [f"S{i}" for i in range(10, 20)]
+            assert completions.preview("STATUS_CODE", "ACTIVE").spectrum_values == ("A",)
+            assert not completions.preview("STATUS_CODE", "ACTIVE", exclude_id=active_id).exists
+            preview = completions.preview("status_code", "ACTIVE")
+            assert not preview.known_field
+            assert preview.field_variants == ("STATUS_CODE", "Status_Code")
+            print("✓ Field names, source values and previews")
+
+            second_id = db.add_record("STATUS_CODE", "ACTIVE", "B")
+            db.update_record(active_id, "STATUS_CODE", "RETIRED", "R", 'N')
+            db.delete_record(db.get_ids("=REGION_CODE")[0])
+            db.add_record("STATE", "NEW", "N")
+            completions.refresh()
+            assert completions.preview("STATUS_CODE", "ACTIVE").spectrum_values == ("B",)
+            assert completions.preview("STATUS_CODE", "RETIRED").spectrum_values == ("R",)
+            assert completions.field_names("") == ["STATE", "STATUS_CODE", "Status_Code"]
+            db.add_record("STATUS_CODE", "ACTIVE", "C")
+            completions.refresh()
+            preview = completions.preview("STATUS_CODE", "ACTIVE", exclude_id=second_id)
+            assert preview.spectrum_values == ("C",)
+            assert completions.preview("STATUS_CODE", "ACTIVE").spectrum_values == ("B", "C")
+            assert completions.preview("STATUS_CODE", "active").source_variants == ("ACTIVE",)
+            print("✓ Inserts, updates and deletes applied from the change log")
+
+            db.add_record("REGION_CODE", "ASIA", "AS")
+            db.add_record("REGION_CODE", "AFRICA", "AF")
+            db.prune_changes(db.current_change_seq())
+            completions.refresh()
+            assert "REGION_CODE" in completions.field_names("reg")
+            assert not completions.field_loaded("STATUS_CODE"), "Reloaded after pruning"
+            print("✓ Reloaded when changes were pruned")
+
+        remove_db_files(temp_db)
+        with ConversionCodeDB(temp_db, enable_change_log=False) as db:
+            db.add_record("STATUS_CODE", "ACTIVE", "A")
+            completions = CompletionIndex(db)
+            completions.refresh()
+            db.add_record("REGION_CODE", "EUROPE", "EU")
+            completions.refresh()
+            assert completions.field_names("") == ["REGION_CODE", "STATUS_CODE"]
+        print("✓ Reloaded without a change log")
+    finally:
+        remove_db_files(temp_db)
+
+
+def test_describe_preview():
+    """Test the preview line shown in the record dialog."""
+    cases = [
+        (MappingPreview(False, (), (), ()), "NEW", "X", "New field name"),
+        (MappingPreview(False, (), ("STATUS_CODE",), ()), "status_code", "X",
+         "Similar field name exists: STATUS_CODE"),
+        (MappingPreview(True, ("A",), (), ()), "STATUS_CODE", "ACTIVE", "Existing: ACTIVE → A"),
+        (MappingPreview(True, ("A", None), (), ()), "STATUS_CODE", "ACTIVE",
+         "Existing: ACTIVE → (no spectrum value) (2 records)"),
+        (MappingPreview(True, (), (), ("ACTIVE",)), "STATUS_CODE", "active",
+         "Similar source value exists: ACTIVE"),
+        (MappingPreview(True, (), (), ()), "STATUS_CODE", "NEW", "New source value"),
+        (MappingPreview(True, (), (), ()), "STATUS_CODE", "", ""),
+    ]
+    for preview, field_name, source_value, expected in cases:
+        assert describe_preview(preview, field_name, source_value) == expected
+    print("✓ Preview descriptions")
+
+
+if __name__ == "__main__":
+    test_sorted_index()
+    test_completion_index()
+    test_describe_preview()
@@ -5,13 +5,22 @@ sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from database import ConversionCodeDB
 import tempfile
+import threading
 import os
 
 
+def remove_db_files(path):
+    """Remove a SQLite database file and its WAL/shared-memory companions."""
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
 def test_database_functionality():
     """Test basic database operations."""
     # Use a temporary database file
     temp_db = os.path.join(tempfile.gettempdir(), 'test_conversion_codes.db')
+    db = None
     
     try:
         # Initialize database
@@ -63,9 +72,472 @@ def test_database_functionality():
     
     finally:
         # Clean up
-        if os.path.exists(temp_db):
-            os.remove(temp_db)
+        if db is not None:
+            db.close()
+        remove_db_files(temp_db)
+
+
+
+def test_connection_pool():
+    """Test that connections are pooled, reused and released on close."""
+    temp_db = os.path.join(tempfile.gettempdir(), 'test_conversion_pool.db')
+    remove_db_files(temp_db)
+    
+    try:
+        with ConversionCodeDB(temp_db, pool_size=2) as db:
+            with db.connection() as outer:
+                with db.connection() as inner:
+                    assert inner is outer, "Nested checkouts should share a connection"
+            with db.connection() as again:
+                assert again is outer, "Idle connection should be reused"
+            mode = again.execute('PRAGMA journal_mode').fetchone()[0]
+            assert mode == 'wal', f"Expected WAL journal mode, got {mode}"
+            print("✓ Connections reused with WAL journal mode")
+            
+            try:
+                with db.transaction():
+                    db.add_record("NESTED", "A", "A", "N")
+                    with db.transaction():
+                        db.add_record("NESTED", "B", "B", "N")
+                    raise RuntimeError("abort")
+            except RuntimeError:
+                pass
+            assert db.count_records("=NESTED") == 0, "Nested writes roll back with the outer one"
+            with db.transaction():
+                db.delete_many([db.add_record("NESTED", "A", "A", "N")])
+            assert db.count_records("=NESTED") == 0
+            print("✓ Nested transactions commit or roll back as one")
+            
+            errors = []
+            
+            def worker(n):
+                try:
+                    for i in range(20):
+                        db.add_record(f"THREAD_{n}", f"SRC{i}", "S", "N")
+                        db.get_all_records(f"THREAD_{n}")
+                except Exception as e:
+                    errors.append(e)
+            
+            threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            assert not errors, f"Concurrent access failed: {errors}"
+            assert len(db.get_all_records()) == 80, "Expected 80 records from 4 threads"
+            stats = db._pool.stats()
+            assert stats['created'] <= 2, f"Pool grew past its size: {stats}"
+            print(f"✓ 4 threads shared a pool of {stats['created']} connection(s)")
+        
+        assert db._pool.closed, "Context manager should close the pool"
+        print("✓ Pool closed on context exit")
+    
+    finally:
+        remove_db_files(temp_db)
+
+
+
+def test_bulk_upsert():
+    """Test chunked bulk upserts keyed on field name and source value."""
+    temp_db = os.path.join(tempfile.gettempdir(), 'test_conversion_upsert.db')
+    remove_db_files(temp_db)
+    
+    try:
+        with ConversionCodeDB(temp_db) as db:
+            rows = [("FIELD_A", f"SRC{i}", f"S{i}", "Y") for i in range(25)]
+            rows.append(("", "SRC", "S", "N"))
+            rows.append(("FIELD_A", "SRC_TOO_LONG_FOR_COLUMN_X", "S", "N"))
+            progress = []
+            result = db.bulk_upsert(rows, chunk_size=10, progress=progress.append)
+            assert result.inserted == 25, f"Expected 25 inserts, got {result}"
+            assert result.rejected == 2, f"Expected 2 rejected rows, got {result}"
+            assert [n for n, _ in result.errors] == [26, 27], "Rejected rows misreported"
+            assert progress[-1] == 27, f"Progress should end at 27, got {progress}"
+            print(f"✓ Inserted {result.inserted} rows in chunks, rejected {result.rejected}")
+            
+            again = db.bulk_upsert([("FIELD_A", "SRC0", "S0", "Y"),
+                                    ("FIELD_A", "SRC1", "CHANGED", "Y"),
+                                    ("FIELD_A", "SRC2", "S2")])
+            assert (again.inserted, again.updated, again.unchanged) == (0, 2, 1), \
+                f"Unexpected re-import result: {again}"
+            records = {r['SOURCE_VALUE']: r for r in db.get_all_records("FIELD_A")}
+            assert len(records) == 25, "Upsert should not duplicate keys"
+            assert records['SRC0']['UPDATE_COUNT'] == 0, "Unchanged row should not be bumped"
+            assert records['SRC1']['SPECTRUM_VALUE'] == "CHANGED"
+            assert records['SRC1']['UPDATE_COUNT'] == 1, "Changed row should be bumped"
+            assert records['SRC2']['IS_IMPORTED'] == "N", "Missing flag should default to N"
+            print("✓ Re-import updated only changed rows")
+            
+            db.add_record("FIELD_A", "SRC3", "S3", "Y")
+            result = db.bulk_upsert([("FIELD_A", "SRC3", "S3", "Y"),
+                                     ("FIELD_A", "SRC4", "S4", "Y"),
+                                     ("FIELD_A", "SRC4", "S4", "Y"),
+                                     ("FIELD_A", None, "S", "Y"),
+                                     ("FIELD_A", "", "EMPTY", "Y")])
+            assert (result.inserted, result.updated, result.unchanged) == (1, 0, 2), result
+            assert result.rejected == 1 and result.errors[0][0] == 4
+            assert db.get_all_records("=FIELD_A")[-1]['SOURCE_VALUE'] == ""
+            result = db.bulk_upsert([("FIELD_A", "SRC3", "NEW", "Y")])
+            assert (result.updated, result.unchanged) == (2, 0), \
+                "Both records sharing the key are updated"
+            print("✓ Duplicate keys counted once, missing source values rejected")
+    
+    finally:
+        remove_db_files(temp_db)
+
+
+
+def test_filter_strategies():
+    """Test exact, prefix and substring filters with and without the FTS index."""
+    temp_db = os.path.join(tempfile.gettempdir(), 'test_conversion_filter.db')
+    remove_db_files(temp_db)
+    
+    try:
+        with ConversionCodeDB(temp_db) as db:
+            db.bulk_upsert([("STATUS_CODE", "A", "A"), ("status_code_old", "B", "B"),
+                            ("CUSTOMER_STATUS", "C", "C"), ("REGION", "D", "D"),
+                            ("100%_DONE", "E", "E")])
+            assert db.fts_enabled, "FTS5 trigram index should be available"
+            
+            def names(filter_text, match=None):
+                return sorted(r['FIELD_NAME'] for r in db.get_all_records(filter_text, match))
+            
+            assert names("=status_code") == ["STATUS_CODE"], "Exact match failed"
+            assert names("STATUS*") == ["STATUS_CODE", "status_code_old"], "Prefix match failed"
+            assert names("status") == ["CUSTOMER_STATUS", "STATUS_CODE", "status_code_old"]
+            assert names("GI") == ["REGION"], "Short substring fallback failed"
+            assert names("0%_") == ["100%_DONE"], "Wildcards should match literally"
+            print("✓ Exact, prefix and substring filters matched")
+            
+            region_id = db.get_all_records("=REGION")[0]['CONVERSION_CODE_ID']
+            db.update_record(region_id, "REGION_STATUS", "D", "D", "N")
+            assert "REGION_STATUS" in names("status"), "FTS index missed an update"
+            db.delete_record(region_id)
+            assert "REGION_STATUS" not in names("status"), "FTS index missed a delete"
+            print("✓ FTS index kept in sync by triggers")
+        
+        with ConversionCodeDB(temp_db, enable_fts=False) as db:
+            assert not db.fts_enabled
+            assert len(db.get_all_records("status", "substring")) == 3, "LIKE fallback failed"
+            print("✓ LIKE fallback matches FTS results")
+    
+    finally:
+        remove_db_files(temp_db)
+
+
+def test_query_cache():
+    """Test cache hits, precise invalidation and detection of external writes."""
+    temp_db = os.path.join(tempfile.gettempdir(), 'test_conversion_cache.db')
+    remove_db_files(temp_db)
+    
+    try:
+        with ConversionCodeDB(temp_db, cache_entries=4) as db:
+            db.bulk_upsert([("STATUS", "A", "1"), ("STATUS", "B", "2"), ("REGION", "C", "3")])
+            assert len(db.get_all_records("STATUS*")) == 2
+            records = db.get_all_records("STATUS*")
+            assert db.cache_stats()['hits'] == 1, "Repeated query should be a cache hit"
+            records[0]['SPECTRUM_VALUE'] = "changed"
+            assert db.get_all_records("STATUS*")[0]['SPECTRUM_VALUE'] != "changed", \
+                "Callers must get copies of cached results"
+            print("✓ Repeated queries served from cache")
+            
+            region_count = db.count_records("=REGION")
+            db.add_record("STATUS", "D", "4", "N")
+            assert len(db.get_all_records("STATUS*")) == 3, "Stale result after insert"
+            assert db.count_records("=REGION") == region_count
+            assert db.cache_stats()['hits'] == 3, "Unrelated filter should stay cached"
+            
+            region_id = db.get_all_records("=REGION")[0]['CONVERSION_CODE_ID']
+            assert db.get_record_by_id(region_id)['SPECTRUM_VALUE'] == "3"
+            db.update_record(region_id, "STATUS", "C", "9", "Y")
+            assert db.get_record_by_id(region_id)['SPECTRUM_VALUE'] == "9"
+            assert db.count_records("=REGION") == 0, "Stale count after field name change"
+            db.delete_record(region_id)
+            assert db.get_record_by_id(region_id) is None
+            print("✓ Local writes invalidate affected entries")
+            
+            with ConversionCodeDB(temp_db) as other:
+                other.add_record("STATUS", "E", "5", "N")
+            assert len(db.get_all_records("STATUS*")) == 4, "External write not detected"
+            assert db.cache_stats()['external_invalidations'] == 1
+            print("✓ Commits from other connections invalidate the cache")
+
+            writing, done = threading.Event(), threading.Event()
+            def hold_transaction():
+                with db.transaction():
+                    writing.set()
+                    done.wait(5)
+            writer = threading.Thread(target=hold_transaction)
+            writer.start()
+            writing.wait(5)
+            reader = threading.Thread(target=db.count_records, args=("=STATUS",))
+            reader.start()
+            reader.join(2)
+            blocked = reader.is_alive()
+            done.set()
+            writer.join()
+            reader.join()
+            assert not blocked, "Cached reads should not wait for a write transaction"
+            print("✓ Cached reads run while a write transaction is open")
+
+            for name in ("A", "B", "C", "D", "E", "F"):
+                db.count_records(name)
+            stats = db.cache_stats()
+            assert stats['entries'] <= 4 and stats['evictions'] > 0, "Cache exceeded its bound"
+            print("✓ Cache stays within its entry limit")
+    
+    finally:
+        remove_db_files(temp_db)
+
+
+def test_batch_operations():
+    """Test update_many and delete_many across several chunks."""
+    temp_db = os.path.join(tempfile.gettempdir(), 'test_conversion_batch.db')
+    remove_db_files(temp_db)
+    
+    try:
+        with ConversionCodeDB(temp_db, cache_entries=16) as db:
+            db.bulk_upsert([("OBSOLETE", f"S{i}", f"V{i}") for i in range(1200)]
+                           + [("KEEP", "A", "1")])
+            ids = db.get_ids("=OBSOLETE")
+            assert len(ids) == 1200
+            assert db.count_records("=OBSOLETE") == 1200
+            
+            updated = db.update_many(((record_id, {'IS_IMPORTED': 'Y'}) for record_id in ids),
+                                     chunk_size=500)
+            assert updated == 1200, f"Expected 1200 updates, got {updated}"
+            record = db.get_record_by_id(ids[0])
+            assert record['IS_IMPORTED'] == 'Y' and record['UPDATE_COUNT'] == 1
+            assert record['SPECTRUM_VALUE'] == "V0", "Unchanged columns must be kept"
+            print("✓ update_many applied partial updates")
+            
+            try:
+                db.update_many([(ids[0], {'IS_IMPORTED': 'N'}), (ids[1], {'IS_IMPORTED': 'X'})])
+                assert False, "Invalid flag should be rejected"
+            except ValueError:
+                pass
+            assert db.get_record_by_id(ids[0])['IS_IMPORTED'] == 'Y', "Batch was not rolled back"
+            try:
+                db.update_many([(ids[0], {'UPDATE_COUNT': 5})])
+                assert False, "Non-updatable column should be rejected"
+            except ValueError:
+                pass
+            print("✓ Invalid batches are rejected atomically")
+            
+            db.update_many([(ids[0], {'FIELD_NAME': 'RENAMED'})])
+            assert db.count_records("=OBSOLETE") == 1199, "Stale cached count after rename"
+            
+            deleted = db.delete_many(ids + [999999], chunk_size=500)
+            assert deleted == 1200, f"Expected 1200 deletes, got {deleted}"
+            assert db.count_records("=OBSOLETE") == 0
+            assert db.get_record_by_id(ids[0]) is None
+            assert [r['FIELD_NAME'] for r in db.get_all_records()] == ["KEEP"]
+            print("✓ delete_many removed the whole group")
+    
+    finally:
+        remove_db_files(temp_db)
+
+
+def test_records():
+    """Test Record tuples, the dict adapters and their memory footprint."""
+    import tracemalloc
+    from database import COLUMNS, Record
+    
+    temp_db = os.path.join(tempfile.gettempdir(), 'test_conversion_records.db')
+    remove_db_files(temp_db)
+    
+    try:
+        with ConversionCodeDB(temp_db, cache_entries=16) as db:
+            db.bulk_upsert((f"FIELD_{i % 5}", f"SRC{i}", f"V{i}") for i in range(5000))
+            records = db.get_records("=FIELD_1")
+            assert len(records) == 1000 and isinstance(records[0], Record)
+            record = records[0]
+            assert record.FIELD_NAME == record['FIELD_NAME'] == record[1] == "FIELD_1"
+            assert db.get_all_records("=FIELD_1")[0] == record.as_dict()
+            assert list(record.as_dict()) == list(COLUMNS)
+            assert db.get_record(record.CONVERSION_CODE_ID) == record
+            assert db.get_record_page(after_id=record.CONVERSION_CODE_ID, limit=2,
+                                      field_name_filter="=FIELD_1") == records[1:3]
+            assert db.get_records("=FIELD_1") is records, "Cache hits should not be copied"
+            
+            dicts = db.get_all_records("=FIELD_1")
+            dicts[0]['SPECTRUM_VALUE'] = "CHANGED"
+            assert db.get_all_records("=FIELD_1")[0]['SPECTRUM_VALUE'] == "V1", \
+                "Dicts handed out must not alias the cache"
+            print("✓ Records by attribute, index and column name; dict adapters")
+        
+        with ConversionCodeDB(temp_db) as db:
+            tracemalloc.start()
+            try:
+                records = db.get_records()
+                record_bytes = tracemalloc.get_traced_memory()[0]
+                del records
+                tracemalloc.reset_peak()
+                baseline = tracemalloc.get_traced_memory()[0]
+                dicts = db.get_all_records()
+                dict_bytes = tracemalloc.get_traced_memory()[0] - baseline
+            finally:
+                tracemalloc.stop()
+            assert len(dicts) == 5000
+            assert record_bytes < 0.8 * dict_bytes, (record_bytes, dict_bytes)
+            print(f"✓ Records use {record_bytes / dict_bytes:.0%} of the memory of dicts")
+    
+    finally:
+        remove_db_files(temp_db)
+
+
+def test_sorting_and_summary():
+    """Test keyset paging in every sort order and per-field summaries."""
+    from database import SORT_COLUMNS
+    
+    temp_db = os.path.join(tempfile.gettempdir(), 'test_conversion_sort.db')
+    remove_db_files(temp_db)
+    
+    def sort_key(record, column):
+        value = record[column]
+        if isinstance(value, str) and column != 'CHANGE_DATE_TIME':
+            value = value.lower()
+        # NULLs sort first, then by value; ties are broken by ID.
+        return (value is not None, value if value is not None else 0,
+                record['CONVERSION_CODE_ID'])
+    
+    try:
+        with ConversionCodeDB(temp_db, cache_entries=32) as db:
+            db.bulk_upsert((f"field_{i % 7}" if i % 3 else f"FIELD_{i % 7}", f"S{i % 50}",
+                            None if i % 11 == 0 else f"v{i % 13}", 'Y' if i % 4 else 'N')
+                           for i in range(400))
+            for record_id in db.get_ids("field_1")[:30]:
+                db.update_record(record_id, "FIELD_1", "UPDATED", "U", "Y")
+            records = db.get_records()
+            
+            for column in SORT_COLUMNS:
+                for descending in (False, True):
+                    expected = sorted(records, key=lambda r: sort_key(r, column),
+                                      reverse=descending)
+                    walked, after = [], None
+                    while True:
+                        page = db.get_record_page(
+                            after_id=after.CONVERSION_CODE_ID if after else None,
+                            after_value=after[column] if after else None,
+                            limit=37, order_by=column, descending=descending)
+                        walked.extend(page)
+                        if len(page) < 37:
+                            break
+                        after = page[-1]
+                    assert [r.CONVERSION_CODE_ID for r in walked] == \
+                        [r.CONVERSION_CODE_ID for r in expected], (column, descending)
+            offset_page = db.get_record_page(offset=100, limit=10, order_by='SPECTRUM_VALUE')
+            expected = sorted(records, key=lambda r: sort_key(r, 'SPECTRUM_VALUE'))[100:110]
+            assert offset_page == expected
+            try:
+                db.get_record_page(order_by='FIELD_NAME; DROP TABLE X')
+                assert False, "Unknown sort column should be rejected"
+            except ValueError:
+                pass
+            print("✓ Keyset pages in every sort order, including NULLs")
+            
+            groups = db.field_name_summary()
+            counts = {}
+            for record in records:
+                total, imported = counts.get(record.FIELD_NAME, (0, 0))
+                counts[record.FIELD_NAME] = (total + 1, imported + (record.IS_IMPORTED == 'Y'))
+            assert {g.field_name: (g.records, g.imported) for g in groups} == counts
+            assert [g.field_name for g in groups] == sorted(counts)
+            assert {g.field_name for g in db.field_name_summary("=field_1")} == \
+                {"field_1", "FIELD_1"}, "Summary filter should ignore case"
+            
+            flipped = db.get_ids("=FIELD_2")
+            db.update_many((record_id, {'IS_IMPORTED': 'N'}) for record_id in flipped)
+            group = next(g for g in db.field_name_summary() if g.field_name == "FIELD_2")
+            assert group.imported == 0 and group.imported_ratio == 0.0, \
+                "Cached summary should be invalidated by writes"
+            print("✓ Per-field counts and imported ratios from GROUP BY")
+    
+    finally:
+        remove_db_files(temp_db)
+
+
+def test_change_log():
+    """Test change log entries, streaming, pruning and cache invalidation from them."""
+    from database import CHANGE_DELETE, CHANGE_INSERT, CHANGE_UPDATE, ChangesPrunedError
+    temp_db = os.path.join(tempfile.gettempdir(), 'test_conversion_changes.db')
+    remove_db_files(temp_db)
+    
+    try:
+        with ConversionCodeDB(temp_db, cache_entries=16) as db:
+            assert db.change_log_enabled and db.current_change_seq() == 0
+            first = db.add_record("STATUS", "A", "1")
+            second = db.add_record("STATUS", "B", "2")
+            db.update_record(first, "REGION", "A", "9", "Y")
+            db.delete_record(second)
+            db.bulk_upsert([("REGION", "A", "8"), ("REGION", "C", "3")])
+            db.update_many([(first, {'IS_IMPORTED': 'N'})])
+            db.delete_many([first])
+            
+            changes = list(db.changes_since(0, batch_size=2))
+            assert [c.operation for c in changes] == [
+                CHANGE_INSERT, CHANGE_INSERT, CHANGE_UPDATE, CHANGE_DELETE,
+                CHANGE_UPDATE, CHANGE_INSERT, CHANGE_UPDATE, CHANGE_DELETE]
+            assert [c.seq for c in changes] == list(range(1, 9))
+            assert db.current_change_seq() == 8
+            moved = changes[2]
+            assert moved.record['FIELD_NAME'] == "REGION" and moved.record.UPDATE_COUNT == 1
+            assert (moved.old_field_name, moved.old_source_value) == ("STATUS", "A")
+            assert changes[3].record.SOURCE_VALUE == "B", "Deletes keep the deleted row"
+            assert [c.seq for c in db.changes_since(6)] == [7, 8]
+            assert list(db.changes_since(8)) == []
+            print("✓ Inserts, updates and deletes logged in sequence")
+            
+            assert db.prune_changes(5) == 5
+            assert [c.seq for c in db.changes_since(5)] == [6, 7, 8]
+            try:
+                list(db.changes_since(4))
+                assert False, "Reading past pruned changes should fail"
+            except ChangesPrunedError:
+                pass
+            assert db.prune_changes(100) == 2 and db.current_change_seq() == 8, \
+                "The latest entry should be kept"
+            try:
+                list(db.changes_since(6))
+                assert False, "A fully pruned gap should still be detected"
+            except ChangesPrunedError:
+                pass
+            print("✓ Pruning keeps the latest entry and gaps are detected")
+            
+            assert len(db.get_records("=STATUS")) == 0
+            assert len(db.get_records("=REGION")) == 1
+            with ConversionCodeDB(temp_db) as other:
+                other.add_record("STATUS", "D", "4")
+            assert len(db.get_records("=REGION")) == 1
+            assert db.cache_stats()['hits'] == 1, "Unrelated result should stay cached"
+            assert len(db.get_records("=STATUS")) == 1, "External insert not seen"
+            with ConversionCodeDB(temp_db) as other:
+                other.bulk_upsert([("OTHER", f"S{i}", "X") for i in range(1100)])
+            assert len(db.get_records("=REGION")) == 1
+            assert db.cache_stats()['hits'] == 1, "Large external writes should clear the cache"
+            print("✓ External commits invalidate only the results they touched")
+        
+        with ConversionCodeDB(':memory:', enable_change_log=False) as db:
+            db.add_record("STATUS", "A", "1")
+            assert not db.change_log_enabled
+            try:
+                db.current_change_seq()
+                assert False, "No change log should be available"
+            except RuntimeError:
+                pass
+        print("✓ Change log can be turned off")
+    
+    finally:
+        remove_db_files(temp_db)
 
 
 if __name__ == "__main__":
-    test_database_functionality()
\ No newline at end of file
+    test_database_functionality()
+    test_connection_pool()
+    test_bulk_upsert()
+    test_filter_strategies()
+    test_query_cache()
+    test_batch_operations()
+    test_records()
+    test_sorting_and_summary()
+    test_change_log()
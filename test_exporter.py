@@ -0,0 +1,119 @@
+"""Test streaming exports of the conversion code table."""
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import cli
+from database import CHANGE_COLUMNS, COLUMNS, ChangesPrunedError, ConversionCodeDB
+from exporter import export_changes, export_table, read_columnar
+
+
+def test_export_formats():
+    """Test CSV, gzipped JSONL and columnar exports round-trip the table."""
+    temp_dir = tempfile.mkdtemp()
+    temp_db = os.path.join(temp_dir, 'export.db')
+    
+    try:
+        with ConversionCodeDB(temp_db) as db:
+            db.bulk_upsert((f"FIELD_{i % 7}", f"SRC{i}", f"S{i % 100}", "YN"[i % 2])
+                           for i in range(2500))
+            db.add_record("UNICODE", "CAFÉ", "Ç", "N")
+            expected = list(db.iter_rows(batch_size=100))
+            assert len(expected) == 2501, f"Expected 2501 rows, got {len(expected)}"
+            print("✓ iter_rows streamed the whole table")
+            
+            csv_path = os.path.join(temp_dir, 'codes.csv')
+            progress = []
+            count = export_table(db, csv_path, 'csv', batch_size=500,
+                                 progress=progress.append)
+            assert count == 2501 and progress[-1] == 2501, "CSV export count mismatch"
+            with open(csv_path, newline='', encoding='utf-8') as f:
+                rows = list(csv.reader(f))
+            assert tuple(rows[0]) == COLUMNS, "CSV header mismatch"
+            assert rows[-1][1:4] == ["UNICODE", "CAFÉ", "Ç"], "CSV row mismatch"
+            print("✓ CSV export written")
+            
+            jsonl_path = os.path.join(temp_dir, 'codes.jsonl')
+            export_table(db, jsonl_path, 'jsonl', gzip_output=True)
+            with gzip.open(jsonl_path, 'rt', encoding='utf-8') as f:
+                objects = [json.loads(line) for line in f]
+            assert [tuple(o[c] for c in COLUMNS) for o in objects] == expected
+            print("✓ Gzipped JSONL export round-trips")
+            
+            columnar_path = os.path.join(temp_dir, 'codes.ccol')
+            export_table(db, columnar_path, 'columnar')
+            with open(columnar_path, 'rb') as f:
+                assert list(read_columnar(f)) == expected, "Columnar round trip mismatch"
+            print(f"✓ Columnar export round-trips ({os.path.getsize(columnar_path)} bytes)")
+        
+        output = io.StringIO()
+        with redirect_stdout(output):
+            cli.main(['export', os.path.join(temp_dir, 'cli.csv.gz'), '--db', temp_db, '--quiet'])
+        assert "2501 rows exported (through change 2501)" in output.getvalue()
+        print("✓ CLI export works")
+    
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def test_export_changes():
+    """Test delta exports of the change log, from the API and the CLI."""
+    temp_dir = tempfile.mkdtemp()
+    temp_db = os.path.join(temp_dir, 'changes.db')
+    
+    try:
+        with ConversionCodeDB(temp_db) as db:
+            db.bulk_upsert((f"FIELD_{i % 3}", f"SRC{i}", f"S{i}") for i in range(100))
+            since = db.current_change_seq()
+            ids = db.get_ids("=FIELD_0")
+            db.update_many([(ids[0], {'SPECTRUM_VALUE': "NEW"})])
+            db.delete_many(ids[1:3])
+            
+            csv_path = os.path.join(temp_dir, 'delta.csv')
+            count, last_seq = export_changes(db, csv_path, since, batch_size=2)
+            assert (count, last_seq) == (3, since + 3), (count, last_seq)
+            with open(csv_path, newline='', encoding='utf-8') as f:
+                rows = list(csv.reader(f))
+            assert tuple(rows[0]) == CHANGE_COLUMNS
+            assert [row[1] for row in rows[1:]] == ['U', 'D', 'D']
+            assert rows[1][5] == "NEW" and rows[1][-2] == "FIELD_0"
+            assert export_changes(db, csv_path, last_seq) == (0, last_seq)
+            print("✓ Only the changes after a sequence number are exported")
+            
+            db.add_record("FIELD_9", "X", "Y")
+            db.prune_changes(db.current_change_seq())
+            jsonl_path = os.path.join(temp_dir, 'pruned.jsonl')
+            try:
+                export_changes(db, jsonl_path, since, 'jsonl')
+                assert False, "Exporting pruned changes should fail"
+            except ChangesPrunedError:
+                assert not os.path.exists(jsonl_path), "No partial output expected"
+        
+        output = io.StringIO()
+        jsonl_path = os.path.join(temp_dir, 'delta.jsonl')
+        with redirect_stdout(output):
+            assert cli.main(['export', jsonl_path, '--db', temp_db, '--quiet',
+                             '--format', 'jsonl', '--since', str(last_seq)]) == 0
+        assert f"1 changes exported (through change {last_seq + 1})" in output.getvalue()
+        with open(jsonl_path, encoding='utf-8') as f:
+            change = json.loads(f.readline())
+        assert change['OPERATION'] == 'I' and change['FIELD_NAME'] == "FIELD_9"
+        assert cli.main(['export', jsonl_path, '--db', temp_db, '--quiet',
+                         '--since', '0']) == 1, "Pruned changes should fail the export"
+        print("✓ CLI delta export")
+    
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_export_formats()
+    test_export_changes()
@@ -0,0 +1,135 @@
+"""Test converting CSV and JSONL files through the table."""
+import csv
+import gzip
+import io
+import json
+import os
+import sys
+import tempfile
+from contextlib import redirect_stderr, redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cli import main as cli_main
+from database import ConversionCodeDB
+from file_conversion import _record_end, convert_file, write_unmapped_report
+from snapshot import compile_snapshot
+from test_database import remove_db_files
+
+
+def test_record_boundaries():
+    """Chunks are only cut at line ends outside quoted values."""
+    assert _record_end('a,b\nc,d\ne', quoted=True) == 8
+    assert _record_end('a,"x\ny"\nc,"open\nmore', quoted=True) == 8
+    assert _record_end('a,"x\ny', quoted=True) == 0
+    assert _record_end('a,"say ""hi"""\nb', quoted=True) == 15
+    assert _record_end('{"a": "x\\ny"}\n{"b"', quoted=False) == 14
+    print("✓ Record boundaries respect quoting")
+
+
+def test_convert_file():
+    """Test CSV and JSONL conversion across workers, chunks and options."""
+    temp_dir = tempfile.mkdtemp(prefix='test_file_conversion_')
+    temp_db = os.path.join(temp_dir, 'codes.db')
+
+    def path(name):
+        return os.path.join(temp_dir, name)
+
+    try:
+        with ConversionCodeDB(temp_db) as db:
+            db.bulk_upsert([("STATUS_CODE", f"S{i}", f"V{i}") for i in range(100)])
+            db.bulk_upsert([("REGION_CODE", "EUROPE", "EU"), ("REGION_CODE", "ASIA", None),
+                            ("REGION_CODE", "ZÜRICH", "ZH")])
+            compile_snapshot(db, path('codes.snap'))
+
+            with open(path('in.csv'), 'w', encoding='utf-8', newline='') as f:
+                writer = csv.writer(f, lineterminator='\r\n')
+                writer.writerow(['ID', 'Status', 'Note', 'region'])
+                for i in range(3000):
+                    writer.writerow([i, f"S{i % 120}", f'line "{i}",\nnext' if i % 7 == 0 else '',
+                                     ("EUROPE", "ASIA", "MARS", "", "ZÜRICH")[i % 5]])
+            expected_rows = []
+            for i in range(3000):
+                status = f"V{i % 120}" if i % 120 < 100 else f"S{i % 120}"
+                region = ("EU", "", "MARS", "", "ZH")[i % 5]
+                expected_rows.append([str(i), status,
+                                      f'line "{i}",\nnext' if i % 7 == 0 else '', region])
+
+            outputs = []
+            for source, workers in ((db, 1), (path('codes.snap'), 3)):
+                result = convert_file(source, path('in.csv'), path(f'out{workers}.csv'),
+                                      {'status': 'STATUS_CODE', 'REGION': 'REGION_CODE'},
+                                      workers=workers, chunk_size=1000, max_pending=2)
+                assert result.rows == 3000
+                assert result.converted == 2500 + 1200 + 600, result
+                assert result.unmapped == 500 + 600
+                assert result.unmapped_values['REGION_CODE'] == {'MARS': 600}
+                assert len(result.unmapped_values['STATUS_CODE']) == 20
+                with open(path(f'out{workers}.csv'), encoding='utf-8', newline='') as f:
+                    outputs.append(f.read())
+            assert outputs[0] == outputs[1], "Output should not depend on the worker count"
+            assert outputs[0].startswith('ID,Status,Note,region\r\n')
+            assert list(csv.reader(io.StringIO(outputs[0], newline='')))[1:] == expected_rows
+            print("✓ CSV converted in order, in and out of worker processes")
+
+            result = convert_file(db, path('in.csv'), path('out.csv.gz'),
+                                  {'REGION': 'REGION_CODE'}, default='??', workers=2,
+                                  chunk_size=4096)
+            assert write_unmapped_report(result, path('unmapped.csv')) == 1
+            with gzip.open(path('out.csv.gz'), 'rt', encoding='utf-8', newline='') as f:
+                regions = [row[3] for row in list(csv.reader(f))[1:]]
+            assert regions[:5] == ["EU", "", "??", "", "ZH"]
+            with open(path('unmapped.csv'), encoding='utf-8') as f:
+                assert f.read() == "FIELD_NAME,SOURCE_VALUE,COUNT\nREGION_CODE,MARS,600\n"
+            print("✓ Defaults, gzip output and the unmapped report")
+
+            with open(path('in.jsonl'), 'w', encoding='utf-8') as f:
+                for i in range(500):
+                    f.write(json.dumps({'id': i, 'status': f"S{i % 110}",
+                                        'note': "a b", 'region': None if i % 2 else "ASIA"},
+                                       ensure_ascii=False) + '\n')
+                f.write('\n')
+            result = convert_file(path('codes.snap'), path('in.jsonl'), path('out.jsonl'),
+                                  {'status': 'STATUS_CODE', 'region': 'REGION_CODE'},
+                                  workers=2, chunk_size=2000)
+            assert (result.rows, result.unmapped) == (500, 40)
+            with open(path('out.jsonl'), encoding='utf-8') as f:
+                objects = [json.loads(line) for line in f]
+            assert objects[0] == {'id': 0, 'status': 'V0', 'note': "a b", 'region': None}
+            assert objects[105]['status'] == 'S105' and objects[1]['region'] is None
+            assert [obj['id'] for obj in objects] == list(range(500))
+            print("✓ JSONL converted")
+
+            with open(path('bad.jsonl'), 'w', encoding='utf-8') as f:
+                f.write('{"status": "S1"}\n{"status": \n')
+            for args in ((path('in.csv'), {'missing': 'STATUS_CODE'}),
+                         (path('bad.jsonl'), {'status': 'STATUS_CODE'})):
+                try:
+                    convert_file(path('codes.snap'), args[0], path('never.out'), args[1],
+                                 workers=1)
+                except ValueError as e:
+                    assert 'missing' in str(e) or 'line 2' in str(e), e
+                else:
+                    raise AssertionError(f"{args} should be rejected")
+            print("✓ Missing columns and invalid lines rejected")
+
+        output = io.StringIO()
+        with redirect_stdout(output), redirect_stderr(io.StringIO()):
+            status = cli_main(['convert-file', path('in.csv'), path('cli.csv'),
+                               '--db', temp_db, '--column', 'status=STATUS_CODE',
+                               '--column', 'region=REGION_CODE', '--workers', '2', '--quiet'])
+        assert status == 0
+        assert "3000 rows, 4300 values converted, 1100 unmapped" in output.getvalue()
+        with open(path('cli.csv'), encoding='utf-8', newline='') as f:
+            assert f.read() == outputs[0]
+        print("✓ CLI convert-file")
+    finally:
+        remove_db_files(temp_db)
+        for name in os.listdir(temp_dir):
+            os.remove(os.path.join(temp_dir, name))
+        os.rmdir(temp_dir)
+
+
+if __name__ == "__main__":
+    test_record_boundaries()
+    test_convert_file()
@@ -0,0 +1,176 @@
+"""Test composite filters: parsing, compiled SQL and results."""
+import io
+import os
+import sys
+import tempfile
+from contextlib import redirect_stderr, redirect_stdout
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cli import main as cli_main
+from database import TABLE_NAME, ConversionCodeDB
+from filters import And, Condition, Not, Or, matches, parse_filter
+from sqlserver import SqlServerBackend
+from test_database import remove_db_files
+from tsql_standin import StandInServer
+from virtual_table import PagedResultSet
+
+
+FILTERS = [
+    "source ^= s1",
+    "imported = n and updates > 0",
+    "field in (status_code, REGION_CODE) and not spectrum ~ 9",
+    "changed >= 2024-06-01 and changed < 2025-01-01",
+    "spectrum is null or (field = region_code and source != eu)",
+    "field ~ tus_ and id <= 150",
+    "(imported = Y or updates >= 3) and source ~ '1'",
+    "not (spectrum is not null)",
+]
+
+
+def add_records(db: ConversionCodeDB):
+    """Add 300 records with varied values, dates and update counts."""
+    db.bulk_upsert([(("STATUS_CODE", "REGION_CODE", "UNIT_CODE")[i % 3], f"S{i}",
+                     None if i % 11 == 0 else f"V{i}", 'Y' if i % 4 == 0 else 'N')
+                    for i in range(300)])
+    with db.connection(write=True) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT CONVERSION_CODE_ID FROM {TABLE_NAME}")
+        for record_id in [row[0] for row in cursor.fetchall()]:
+            cursor.execute(f"UPDATE {TABLE_NAME} SET UPDATE_COUNT = ?, CHANGE_DATE_TIME = ? "
+                           f"WHERE CONVERSION_CODE_ID = ?",
+                           (record_id % 5, datetime(2024, 1 + record_id % 12, 15, 8, 30),
+                            record_id))
+        conn.commit()
+
+
+def check_against_python(db: ConversionCodeDB):
+    """Every query path should agree with ``matches`` on every filter."""
+    records = db.get_records()
+    for text in FILTERS:
+        expected = [record for record in records if matches(text, record)]
+        assert expected, f"{text!r} should match something"
+        assert db.get_records(where=text) == expected, text
+        assert db.count_records(where=text) == len(expected), text
+        assert db.get_ids(where=text) == [r.CONVERSION_CODE_ID for r in expected], text
+        by_source = sorted(expected, key=lambda r: (r.SOURCE_VALUE.lower(),
+                                                    r.CONVERSION_CODE_ID))
+        pages, after = [], None
+        while True:
+            page = db.get_record_page(after_id=after and after.CONVERSION_CODE_ID, limit=7,
+                                      order_by='SOURCE_VALUE',
+                                      after_value=after and after.SOURCE_VALUE, where=text)
+            pages.extend(page)
+            if len(page) < 7:
+                break
+            after = page[-1]
+        assert pages == by_source, text
+        summary = {group.field_name: group.records for group in db.field_name_summary(where=text)}
+        assert sum(summary.values()) == len(expected), text
+        combined = [r for r in expected if r.FIELD_NAME.startswith("STATUS")]
+        assert db.count_records("STATUS*", where=text) == len(combined), text
+
+
+def test_parse_filter():
+    """Test the filter syntax and its errors."""
+    assert parse_filter("source ^= X imported = n") == And((
+        Condition('SOURCE_VALUE', '^=', 'X'), Condition('IS_IMPORTED', '=', 'N')))
+    assert parse_filter("not id < 5 or updates in (1, '2')") == Or((
+        Not(Condition('CONVERSION_CODE_ID', '<', 5)), Condition('UPDATE_COUNT', 'in', (1, 2))))
+    assert parse_filter("changed >= 2024-01-31") == Condition(
+        'CHANGE_DATE_TIME', '>=', datetime(2024, 1, 31))
+    assert parse_filter('spectrum = "A B" and field is not null') == And((
+        Condition('SPECTRUM_VALUE', '=', 'A B'), Condition('FIELD_NAME', 'is not null')))
+    for text in ("", "colour = red", "id = x", "updates ~ 1", "source =", "(id = 1",
+                 "id = 1 )", "changed > yesterday", "spectrum is empty", "source = 'open"):
+        try:
+            parse_filter(text)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"{text!r} should be rejected")
+    print("✓ Filter syntax")
+
+
+def test_compiled_filters():
+    """Test results, shape caching and invalidation on SQLite."""
+    temp_db = os.path.join(tempfile.gettempdir(), 'test_conversion_filters.db')
+    remove_db_files(temp_db)
+
+    try:
+        with ConversionCodeDB(temp_db) as db:
+            add_records(db)
+            check_against_python(db)
+            print("✓ Filters agree with matches() on every query")
+
+            first = db.compile_filter("source ^= A and updates in (1, 2, 3)")
+            second = db.compile_filter("source ^= B and updates in (4, 5, 6, 7)")
+            assert first.sql == second.sql and first.params != second.params
+            assert first.params[-2:] == (3, 3), "in lists are padded with their last value"
+            assert db.compile_filter("imported = Y and source = X").sql.startswith(
+                "(+IS_IMPORTED = ?)"), "IS_IMPORTED should not drive an indexed query"
+            assert db.compile_filter("source = A_%").params == ("A_%",)
+            assert db.compile_filter("source ^= A_%").params == ("A\\_\\%%",)
+            stats = db._filter_compiler.stats()
+            assert stats['hits'] >= 1 and stats['misses'] >= 1
+            print("✓ Compiled SQL is cached per shape")
+
+            where = parse_filter("spectrum = v3 and imported = n")
+            assert db.count_records(where=where) == 1
+            record_id = db.get_ids(where=where)[0]
+            record = db.get_record(record_id)
+            db.update_record(record_id, record.FIELD_NAME, record.SOURCE_VALUE, "V3", 'Y')
+            assert db.count_records(where=where) == 0, "Writes should invalidate the count"
+            result_set = PagedResultSet(db, where="spectrum = v3")
+            assert len(result_set) == 1
+            assert result_set.matches(db.get_record(record_id))
+            print("✓ Cached filtered results are invalidated by writes")
+    finally:
+        remove_db_files(temp_db)
+
+
+def test_filters_sqlserver():
+    """Test the SQL Server dialect, case-insensitive through its collation."""
+    temp_db = os.path.join(tempfile.gettempdir(), 'test_conversion_filters_mssql.db')
+    remove_db_files(temp_db)
+    server = StandInServer(temp_db)
+
+    try:
+        with ConversionCodeDB(backend=SqlServerBackend("", connect=server.connect)) as db:
+            add_records(db)
+            check_against_python(db)
+            assert "COLLATE" in db.compile_filter("source = x").sql
+        print("✓ Filters through the SQL Server dialect")
+    finally:
+        remove_db_files(temp_db)
+
+
+def test_cli_where():
+    """Test ``list --where``."""
+    temp_db = os.path.join(tempfile.gettempdir(), 'test_conversion_filters_cli.db')
+    remove_db_files(temp_db)
+
+    try:
+        with ConversionCodeDB(temp_db) as db:
+            add_records(db)
+            expected = db.count_records("STATUS*", where="imported = y")
+        output = io.StringIO()
+        with redirect_stdout(output):
+            status = cli_main(['list', 'STATUS*', '--where', 'imported = y', '--count',
+                               '--db', temp_db])
+        assert (status, output.getvalue()) == (0, f"{expected}\n")
+        errors = io.StringIO()
+        with redirect_stdout(io.StringIO()), redirect_stderr(errors):
+            assert cli_main(['list', '--where', 'imported ~ y', '--db', temp_db]) == 2
+        assert "only applies to text columns" in errors.getvalue()
+        print("✓ CLI --where")
+    finally:
+        remove_db_files(temp_db)
+
+
+if __name__ == "__main__":
+    test_parse_filter()
+    test_compiled_filters()
+    test_filters_sqlserver()
+    test_cli_where()
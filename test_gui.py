@@ -3,6 +3,7 @@ import tkinter as tk
 from tkinter import ttk
 import sys
 import os
+import time
 
 # Add current directory to path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -34,6 +35,15 @@ def test_gui_components():
         app.root.withdraw()  # Hide this window too
         print("✓ Main GUI class initialized")
         
+        # The database opens and the first page loads in the background
+        deadline = time.monotonic() + 10
+        while 'first_page' not in app.startup_timings and time.monotonic() < deadline:
+            app.root.update()
+            time.sleep(0.01)
+        assert app.db is not None and 'database_open' in app.startup_timings
+        assert not app.progress.grid_info(), "The progress bar hides once loaded"
+        print(f"✓ Loaded in the background: {app.startup_summary()}")
+        
         # Test that treeview is properly configured
         columns = app.tree['columns']
         print(f"✓ Treeview configured with {len(columns)} columns: {list(columns)}")
@@ -0,0 +1,63 @@
+"""Test streaming imports from CSV and JSONL files."""
+import gzip
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import cli
+from database import ConversionCodeDB
+from importer import iter_file_rows
+
+
+def test_import_csv_and_jsonl():
+    """Test importing CSV and gzipped JSONL files through the CLI."""
+    temp_dir = tempfile.mkdtemp()
+    temp_db = os.path.join(temp_dir, 'import.db')
+    csv_path = os.path.join(temp_dir, 'codes.csv')
+    jsonl_path = os.path.join(temp_dir, 'codes.jsonl.gz')
+    
+    try:
+        with open(csv_path, 'w', newline='') as f:
+            f.write("field_name,Source_Value,SPECTRUM_VALUE,EXTRA\n")
+            f.write("STATUS_CODE,ACTIVE,A,x\n")
+            f.write('STATUS_CODE,"INACTIVE",I,y\n')
+            f.write("\n")
+            f.write(",MISSING_FIELD,M,z\n")
+        with gzip.open(jsonl_path, 'wt') as f:
+            f.write(json.dumps({"FIELD_NAME": "REGION_CODE", "SOURCE_VALUE": "EUROPE",
+                                "SPECTRUM_VALUE": "EU", "IS_IMPORTED": "Y"}) + "\n")
+            f.write(json.dumps({"FIELD_NAME": "STATUS_CODE", "SOURCE_VALUE": "ACTIVE",
+                                "SPECTRUM_VALUE": "AC"}) + "\n")
+        
+        rows = list(iter_file_rows(csv_path))
+        assert rows[0] == ("STATUS_CODE", "ACTIVE", "A", None), f"Unexpected CSV row {rows[0]}"
+        assert len(rows) == 3, f"Blank lines should be skipped, got {rows}"
+        print("✓ CSV header matched case-insensitively")
+        
+        output = io.StringIO()
+        with redirect_stdout(output):
+            status = cli.main(['import', csv_path, jsonl_path, '--db', temp_db, '--quiet'])
+        assert status == 1, "Rejected rows should give a non-zero exit status"
+        assert "2 inserted, 0 updated, 0 unchanged, 1 rejected" in output.getvalue()
+        assert "1 inserted, 1 updated, 0 unchanged, 0 rejected" in output.getvalue()
+        print("✓ CLI reported per-file import results")
+        
+        with ConversionCodeDB(temp_db) as db:
+            records = db.get_all_records()
+            assert len(records) == 3, f"Expected 3 records, got {len(records)}"
+            active = [r for r in records if r['SOURCE_VALUE'] == 'ACTIVE'][0]
+            assert active['SPECTRUM_VALUE'] == 'AC' and active['UPDATE_COUNT'] == 1
+        print("✓ Imported records stored and upserted")
+    
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_import_csv_and_jsonl()
@@ -0,0 +1,83 @@
+"""Test opt-in timing of database operations."""
+import io
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cli import main as cli_main
+from database import ConversionCodeDB
+from instrumentation import Profiler, ProfilingCursor
+from test_database import remove_db_files
+
+
+def test_profiler():
+    """Test statement, fetch and operation timings, slow query plans and dumps."""
+    temp_db = os.path.join(tempfile.gettempdir(), 'test_conversion_profile.db')
+    profile_path = temp_db + '.json'
+    remove_db_files(temp_db)
+
+    try:
+        profiler = Profiler()
+        with ConversionCodeDB(temp_db, profiler=profiler) as db:
+            with db.connection() as conn:
+                assert not isinstance(db._cursor(conn), ProfilingCursor), \
+                    "Cursors should not be wrapped while profiling is off"
+            db.bulk_upsert([("STATUS_CODE", f"S{i}", f"V{i}") for i in range(50)])
+            assert profiler.summary() == {'operations': {}, 'statements': {}}
+            print("✓ Nothing recorded while disabled")
+
+            profiler.enabled = True
+            profiler.slow_query_ms = 0
+            record_id = db.add_record("REGION_CODE", "EUROPE", "EU")
+            assert db.get_record_by_id(record_id)['SPECTRUM_VALUE'] == "EU"
+            assert len(db.get_all_records("=status_code")) == 50
+            assert sum(1 for _ in db.iter_rows(batch_size=20)) == 51
+
+            summary = profiler.summary()
+            assert summary['operations']['rows to records']['rows'] == 51
+            statements = summary['statements']
+            select = next(stats for sql, stats in statements.items()
+                          if sql.startswith('SELECT * FROM') and 'COLLATE NOCASE' in sql)
+            assert select['count'] == 1 and select['rows'] == 50, select
+            streamed = next(stats for sql, stats in statements.items()
+                            if 'CONVERSION_CODE_ID, FIELD_NAME' in sql)
+            assert streamed['rows'] == 51, "Fetches should be charged to their statement"
+            print("✓ Statements, fetches and row conversion timed")
+
+            slow = profiler.slow_queries()
+            filtered = next(q for q in slow if 'COLLATE NOCASE' in q['sql'])
+            assert any('USING INDEX' in step for step in filtered['plan']), filtered['plan']
+            print("✓ Query plans captured for slow statements")
+
+        profiler.slow_query_ms = 50
+        with ConversionCodeDB(temp_db, profiler=profiler) as db:
+            db.count_records()
+        assert profiler.summary()['operations']['connect']['count'] >= 1
+
+        buffer = io.StringIO()
+        profiler.dump(buffer)
+        snapshot = json.loads(buffer.getvalue())
+        assert snapshot['enabled'] and snapshot['events'] and snapshot['statements']
+        profiler.reset()
+        assert profiler.events() == [] and profiler.slow_queries() == []
+        print("✓ JSON snapshot and reset")
+
+        assert cli_main(['export', temp_db + '.csv', '--db', temp_db, '--quiet',
+                         '--profile', profile_path]) == 0
+        with open(profile_path, encoding='utf-8') as f:
+            snapshot = json.load(f)
+        assert any('FROM S_CONVERSION_CODE_G97' in sql for sql in snapshot['statements'])
+        print("✓ CLI writes a profile")
+
+    finally:
+        remove_db_files(temp_db)
+        for path in (profile_path, temp_db + '.csv'):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+if __name__ == "__main__":
+    test_profiler()
@@ -0,0 +1,173 @@
+"""Test duplicate, conflict, field name and reverse mapping checks."""
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cli import main as cli_main
+from database import ConversionCodeDB, DuplicateKeysError
+from integrity import ORPHAN_BLANK, ORPHAN_UNKNOWN, ORPHAN_VARIANT
+from sqlserver import SqlServerBackend
+from test_database import remove_db_files
+from tsql_standin import StandInServer
+
+
+def test_check_integrity():
+    """Test the report, its caps, the CLI and enforcing unique keys."""
+    temp_db = os.path.join(tempfile.gettempdir(), 'test_conversion_integrity.db')
+    fields_path = temp_db + '.fields'
+    remove_db_files(temp_db)
+
+    try:
+        with ConversionCodeDB(temp_db, pool_size=2) as db:
+            db.bulk_upsert([(f"FIELD_{i % 5}", f"S{i}", f"V{i}") for i in range(100)])
+            report = db.check_integrity()
+            assert report.ok and report.rows_checked == 100, report
+            assert report.reverse_mapping_count == 0
+            print("✓ Clean table passes")
+
+            dup_ids = [db.add_record("FIELD_0", "S0", "V0") for _ in range(2)]
+            conflict_id = db.add_record("FIELD_1", "S1", "OTHER")
+            db.add_record("FIELD_2", "S2", "V2", "Y")
+            db.add_record("FIELD_2", "S2", None)
+            db.add_record("FIELD_3", "S3_ALIAS", "V3")
+            db.add_record("field_0 ", "S0", "V0")
+            db.add_record("", "X", "Y")
+            db.add_record(None, "X", "Y")
+
+            report = db.check_integrity()
+            assert not report.ok
+            assert report.rows_checked == 109
+            assert report.duplicate_count == 1 and report.conflict_count == 2, report
+            duplicate = report.duplicates[0]
+            assert (duplicate.field_name, duplicate.source_value) == ("FIELD_0", "S0")
+            assert duplicate.records == 3 and duplicate.spectrum_values == ("V0",)
+            assert duplicate.record_ids[1:] == tuple(dup_ids)
+            assert not duplicate.conflicting
+            conflict = next(issue for issue in report.conflicts if issue.field_name == "FIELD_1")
+            assert conflict.spectrum_values == ("V1", "OTHER") and conflict.conflicting
+            assert conflict.record_ids[-1] == conflict_id
+            assert next(issue for issue in report.conflicts
+                        if issue.field_name == "FIELD_2").spectrum_values == ("V2", None)
+            print("✓ Duplicates and conflicts found by key")
+
+            orphans = {orphan.field_name: orphan for orphan in report.orphaned_field_names}
+            assert orphans[None].reason == ORPHAN_BLANK and orphans[""].reason == ORPHAN_BLANK
+            assert orphans["field_0 "] == ("field_0 ", 1, ORPHAN_VARIANT, "FIELD_0")
+            assert report.orphaned_count == 3
+            report = db.check_integrity(['field_names'],
+                                        known_fields=["FIELD_0", "field_1", "FIELD_2"])
+            reasons = {orphan.field_name: (orphan.reason, orphan.canonical)
+                       for orphan in report.orphaned_field_names}
+            assert reasons["FIELD_1"] == (ORPHAN_VARIANT, "field_1")
+            assert reasons["FIELD_3"] == (ORPHAN_UNKNOWN, None)
+            assert "FIELD_0" not in reasons and reasons["field_0 "][1] == "FIELD_0"
+            assert report.duplicate_count == 0 and report.reverse_mapping_count == 0
+            print("✓ Blank, variant and unknown field names")
+
+            report = db.check_integrity(['reverse'])
+            assert report.rows_checked == 109 and report.ok
+            assert report.reverse_mappings == [("FIELD_3", "V3", 2, ("S3", "S3_ALIAS"))]
+            assert report.reverse_mapping_count == 1
+            print("✓ Reverse mappings")
+
+            report = db.check_integrity(max_issues=1)
+            assert len(report.conflicts) == 1 and report.conflict_count == 2
+            assert len(report.orphaned_field_names) == 1 and report.orphaned_count == 3
+            try:
+                db.check_integrity(['nothing'])
+            except ValueError:
+                pass
+            else:
+                raise AssertionError("Unknown checks should be rejected")
+            print("✓ Issue lists are capped, counts are not")
+
+        with open(fields_path, 'w', encoding='utf-8') as f:
+            f.write("FIELD_0\nFIELD_1\nFIELD_2\nFIELD_3\nFIELD_4\n")
+        output = io.StringIO()
+        with redirect_stdout(output):
+            status = cli_main(['check', '--db', temp_db, '--known-fields', fields_path])
+        assert status == 1, output.getvalue()
+        assert "Conflicting keys: 2" in output.getvalue()
+        assert "FIELD_1 / S1 -> V1, OTHER" in output.getvalue()
+        print("✓ CLI report")
+
+        try:
+            ConversionCodeDB(temp_db, unique_keys=True)
+        except DuplicateKeysError as e:
+            assert e.key in (("FIELD_0", "S0"), ("FIELD_1", "S1"), ("FIELD_2", "S2")), e.key
+        else:
+            raise AssertionError("Unique keys cannot be enforced over duplicates")
+        with ConversionCodeDB(temp_db) as db:
+            assert not db.unique_keys_enforced
+            report = db.check_integrity(['keys'])
+            for issue in report.duplicates + report.conflicts:
+                db.delete_many(issue.record_ids[1:])
+        with ConversionCodeDB(temp_db, unique_keys=True) as db:
+            assert db.unique_keys_enforced
+            try:
+                db.add_record("FIELD_0", "S0", "V9")
+            except sqlite3.IntegrityError:
+                pass
+            else:
+                raise AssertionError("A duplicate key should be rejected")
+            db.add_record(None, "X", "Z")
+            result = db.bulk_upsert([("FIELD_0", "S0", "V9"), ("FIELD_0", "NEW", "N")])
+            assert (result.inserted, result.updated) == (1, 1)
+            assert db.check_integrity(['keys']).ok
+        with ConversionCodeDB(temp_db) as db:
+            assert db.unique_keys_enforced, "The index should outlive the option"
+        with redirect_stdout(io.StringIO()):
+            assert cli_main(['check', '--db', temp_db, '--checks', 'keys']) == 0
+        print("✓ Unique keys enforced")
+    finally:
+        remove_db_files(temp_db)
+        if os.path.exists(fields_path):
+            os.remove(fields_path)
+
+
+def test_unique_keys_sqlserver():
+    """Test the filtered unique index through the SQL Server dialect."""
+    temp_db = os.path.join(tempfile.gettempdir(), 'test_conversion_integrity_mssql.db')
+    remove_db_files(temp_db)
+    server = StandInServer(temp_db)
+
+    try:
+        backend = SqlServerBackend("", connect=server.connect)
+        with ConversionCodeDB(backend=backend) as db:
+            db.add_record("STATUS_CODE", "ACTIVE", "A")
+            db.add_record("STATUS_CODE", "ACTIVE", "B")
+            report = db.check_integrity()
+            assert report.conflict_count == 1 and report.rows_checked == 2
+        try:
+            ConversionCodeDB(backend=SqlServerBackend("", connect=server.connect,
+                                                      unique_keys=True))
+        except DuplicateKeysError as e:
+            assert e.key == ("STATUS_CODE", "ACTIVE")
+        else:
+            raise AssertionError("Unique keys cannot be enforced over duplicates")
+        with ConversionCodeDB(backend=SqlServerBackend("", connect=server.connect)) as db:
+            db.delete_record(db.check_integrity().conflicts[0].record_ids[1])
+        backend = SqlServerBackend("", connect=server.connect, unique_keys=True)
+        with ConversionCodeDB(backend=backend) as db:
+            assert db.unique_keys_enforced
+            db.add_record(None, "X", "A")
+            db.add_record(None, "X", "B")
+            try:
+                db.add_record("STATUS_CODE", "ACTIVE", "C")
+            except sqlite3.IntegrityError:
+                pass
+            else:
+                raise AssertionError("A duplicate key should be rejected")
+        print("✓ Unique keys through the SQL Server dialect")
+    finally:
+        remove_db_files(temp_db)
+
+
+if __name__ == "__main__":
+    test_check_integrity()
+    test_unique_keys_sqlserver()
@@ -0,0 +1,86 @@
+"""Test the in-memory code translator."""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import ConversionCodeDB
+from lookup import CodeTranslator
+from test_database import remove_db_files
+
+
+def test_code_translator():
+    """Test single and batch conversion and incremental refresh."""
+    temp_db = os.path.join(tempfile.gettempdir(), 'test_conversion_lookup.db')
+    remove_db_files(temp_db)
+    
+    try:
+        with ConversionCodeDB(temp_db) as db:
+            db.bulk_upsert([("STATUS_CODE", "ACTIVE", "A"), ("STATUS_CODE", "INACTIVE", "I"),
+                            ("REGION_CODE", "EUROPE", "EU")])
+            translator = CodeTranslator(db)
+            assert translator.convert("STATUS_CODE", "ACTIVE") == "A"
+            assert translator.convert("STATUS_CODE", "UNKNOWN", "?") == "?"
+            assert translator.convert("NO_SUCH_FIELD", "ACTIVE") is None
+            assert translator.convert_many("STATUS_CODE", ["INACTIVE", "X", "ACTIVE"]) == ["I", None, "A"]
+            assert translator.convert_many("STATUS_CODE", ["X"], default="") == [""]
+            assert translator.convert_many("NO_SUCH_FIELD", ["A", "B"]) == [None, None]
+            print("✓ Single and batch conversions")
+            
+            active_id = db.get_all_records("=STATUS_CODE")[0]['CONVERSION_CODE_ID']
+            db.update_record(active_id, "STATUS_CODE", "ENABLED", "E", "N")
+            db.add_record("REGION_CODE", "ASIA", "AP")
+            assert translator.convert("REGION_CODE", "ASIA") is None, "Refresh should be explicit"
+            assert translator.refresh() >= 2, "Changed rows should be read"
+            assert translator.convert("STATUS_CODE", "ENABLED") == "E"
+            assert translator.convert("STATUS_CODE", "ACTIVE") is None, "Old key should be dropped"
+            assert translator.convert("REGION_CODE", "ASIA") == "AP"
+            print("✓ Incremental refresh applied inserts and key changes")
+            
+            reloads = []
+            translator.reload = lambda: reloads.append(True)
+            db.delete_record(active_id)
+            assert translator.refresh() == 1
+            assert translator.convert("STATUS_CODE", "ENABLED") is None, "Delete not applied"
+            assert len(translator) == 3 and not reloads, "Deletes should not force a reload"
+            del translator.reload
+            print("✓ Deletes applied from the change log")
+            
+            db.add_record("REGION_CODE", "AFRICA", "AF")
+            db.add_record("REGION_CODE", "AMERICA", "AM")
+            db.prune_changes(db.current_change_seq())
+            assert translator.refresh() == 5
+            assert translator.convert("REGION_CODE", "AFRICA") == "AF", "Pruned changes should reload"
+            assert len(translator) == 5
+            print("✓ Pruned change log falls back to a reload")
+            
+            older_id = db.get_ids("=REGION_CODE")[0]
+            db.add_record("REGION_CODE", "EUROPE", "EU2")
+            db.update_record(older_id, "REGION_CODE", "EUROPE", "OLD", "N")
+            translator.refresh()
+            assert translator.convert("REGION_CODE", "EUROPE") == "EU2", "Highest ID should win"
+            print("✓ Updates to lower IDs sharing a key leave the highest ID's mapping")
+        
+        remove_db_files(temp_db)
+        with ConversionCodeDB(temp_db, enable_change_log=False) as db:
+            db.bulk_upsert([("STATUS_CODE", "ACTIVE", "A"), ("STATUS_CODE", "INACTIVE", "I")])
+            translator = CodeTranslator(db)
+            db.delete_many(db.get_ids("=STATUS_CODE")[:1])
+            translator.refresh()
+            assert translator.convert("STATUS_CODE", "ACTIVE") is None and len(translator) == 1
+            print("✓ Deletes detected and reloaded without a change log")
+            
+            older_id = db.get_ids("=STATUS_CODE")[0]
+            db.add_record("STATUS_CODE", "INACTIVE", "I2")
+            db.update_record(older_id, "STATUS_CODE", "INACTIVE", "OLD", "N")
+            translator.refresh()
+            assert translator.convert("STATUS_CODE", "INACTIVE") == "I2", "Highest ID should win"
+            print("✓ Highest ID wins without a change log")
+    
+    finally:
+        remove_db_files(temp_db)
+
+
+if __name__ == "__main__":
+    test_code_translator()
@@ -0,0 +1,173 @@
+"""Test the headless commands and the HTTP/JSON service."""
+import http.client
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cli import main as cli_main
+from database import ConversionCodeDB
+from service import make_server
+from test_database import remove_db_files
+
+
+def run_cli(argv, stdin_text=None):
+    """Run the CLI, returning its exit status and stdout."""
+    output = io.StringIO()
+    stdin = sys.stdin
+    if stdin_text is not None:
+        sys.stdin = io.StringIO(stdin_text)
+    try:
+        with redirect_stdout(output):
+            status = cli_main(argv)
+    finally:
+        sys.stdin = stdin
+    return status, output.getvalue()
+
+
+def test_headless_commands():
+    """Test list, get and convert from the command line."""
+    temp_db = os.path.join(tempfile.gettempdir(), 'test_conversion_headless.db')
+    remove_db_files(temp_db)
+
+    try:
+        with ConversionCodeDB(temp_db) as db:
+            db.bulk_upsert([("STATUS_CODE", f"S{i}", f"V{i}") for i in range(2500)])
+            db.bulk_upsert([("REGION_CODE", "EUROPE", "EU"), ("REGION_CODE", "ASIA", None)])
+            first_id = db.get_page(limit=1)[0]['CONVERSION_CODE_ID']
+            dup_id = db.add_record("STATUS_CODE", "S1", "NEWER")
+            mappings = db.lookup_spectrum_values("STATUS_CODE", ["S1", "S2", "S2", "NOPE"])
+            assert mappings == {"S1": "NEWER", "S2": "V2"}, "The highest ID should win"
+            assert db.lookup_spectrum_values("STATUS_CODE", []) == {}
+            many = db.lookup_spectrum_values("STATUS_CODE", [f"S{i}" for i in range(2500)],
+                                             chunk_size=300)
+            assert len(many) == 2500
+            print("✓ Batch lookups")
+
+        status, output = run_cli(['list', '=REGION_CODE', '--db', temp_db])
+        lines = output.splitlines()
+        assert status == 0 and lines[0].split('\t')[:3] == [
+            'CONVERSION_CODE_ID', 'FIELD_NAME', 'SOURCE_VALUE']
+        assert len(lines) == 3
+        assert sorted(line.split('\t')[2:4] for line in lines[1:]) == [['ASIA', ''],
+                                                                       ['EUROPE', 'EU']]
+        status, output = run_cli(['list', '--db', temp_db, '--format', 'jsonl',
+                                  '--page-size', '700'])
+        records = [json.loads(line) for line in output.splitlines()]
+        assert len(records) == 2503
+        assert [r['CONVERSION_CODE_ID'] for r in records] == sorted(
+            r['CONVERSION_CODE_ID'] for r in records)
+        status, output = run_cli(['list', 'STATUS*', '--db', temp_db, '--format', 'csv',
+                                  '--limit', '1001', '--page-size', '500'])
+        assert len(output.splitlines()) == 1002
+        assert run_cli(['list', 'status', '--count', '--db', temp_db]) == (0, "2501\n")
+        print("✓ list")
+
+        status, output = run_cli(['get', str(first_id), str(dup_id), '--db', temp_db])
+        assert status == 0
+        assert [json.loads(line)['SOURCE_VALUE'] for line in output.splitlines()] == ["S0", "S1"]
+        assert run_cli(['get', '999999', '--db', temp_db])[0] == 1
+        print("✓ get")
+
+        status, output = run_cli(['convert', 'STATUS_CODE', 'S5', 'NOPE', 'S1', '--db', temp_db])
+        assert (status, output) == (0, "V5\n\nNEWER\n")
+        status, output = run_cli(['convert', 'REGION_CODE', '--default', '?',
+                                  '--chunk-size', '2', '--db', temp_db],
+                                 stdin_text="EUROPE\nASIA\nMARS\nEUROPE\n")
+        assert output == "EU\n?\n?\nEU\n", output
+        print("✓ convert from arguments and stdin")
+    finally:
+        remove_db_files(temp_db)
+
+
+def test_service():
+    """Test the JSON endpoints over one keep-alive connection."""
+    temp_db = os.path.join(tempfile.gettempdir(), 'test_conversion_service.db')
+    remove_db_files(temp_db)
+
+    try:
+        with ConversionCodeDB(temp_db) as db:
+            db.bulk_upsert([("STATUS_CODE", f"S{i}", f"V{i}") for i in range(300)])
+            db.bulk_upsert([("REGION_CODE", "EUROPE", "EU")])
+            for preload in (False, True):
+                server = make_server(db, port=0, preload=preload, refresh_interval=0)
+                thread = threading.Thread(target=server.serve_forever, daemon=True)
+                thread.start()
+                try:
+                    check_endpoints(db, server.server_address[1])
+                finally:
+                    server.shutdown()
+                    server.server_close()
+                print(f"✓ Endpoints ({'preloaded' if preload else 'indexed'} conversions)")
+    finally:
+        remove_db_files(temp_db)
+
+
+def check_endpoints(db: ConversionCodeDB, port: int):
+    """Exercise every endpoint, reusing one HTTP connection."""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+
+    def request(method, path, body=None):
+        payload = None if body is None else json.dumps(body)
+        conn.request(method, path, payload, {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+
+    try:
+        assert request('GET', '/health') == (200, {'status': 'ok'})
+        sock = conn.sock
+        status, page = request('GET', '/records?filter=STATUS*&limit=200')
+        assert status == 200 and len(page['records']) == 200
+        status, rest = request('GET', f"/records?filter=STATUS*&limit=200"
+                                      f"&after_id={page['next_after_id']}")
+        assert len(rest['records']) == 100 and rest['next_after_id'] is None
+        record = page['records'][5]
+        assert request('GET', f"/records/{record['CONVERSION_CODE_ID']}") == (200, record)
+        assert request('GET', '/records/999999')[0] == 404
+        assert request('GET', '/count?filter==region_code') == (200, {'count': 1})
+        assert request('GET', '/count?where=source%20in%20(S1,S2)%20or%20spectrum%20=%20eu'
+                       ) == (200, {'count': 3})
+        assert request('GET', '/records?where=source%20~')[0] == 400
+        status, fields = request('GET', '/fields')
+        assert {f['field_name']: f['records'] for f in fields['fields']} == {
+            'REGION_CODE': 1, 'STATUS_CODE': 300}
+
+        status, body = request('POST', '/convert', {'field_name': 'STATUS_CODE',
+                                                    'values': ['S3', 'NOPE', 'S3']})
+        assert (status, body) == (200, {'values': ['V3', None, 'V3']})
+        status, body = request('POST', '/convert/batch', {
+            'items': [['REGION_CODE', 'EUROPE'], ['STATUS_CODE', 'S7'], ['X', 'Y']],
+            'default': '?'})
+        assert body == {'values': ['EU', 'V7', '?']}
+        db.update_record(db.get_ids("=REGION_CODE")[0], "REGION_CODE", "EUROPE", "EUR", 'N')
+        assert request('POST', '/convert', {'field_name': 'REGION_CODE',
+                                            'values': ['EUROPE']})[1] == {'values': ['EUR']}
+        db.update_record(db.get_ids("=REGION_CODE")[0], "REGION_CODE", "EUROPE", "EU", 'N')
+
+        assert request('POST', '/convert', {'field_name': 'STATUS_CODE'})[0] == 400
+        assert request('POST', '/convert/batch', {'items': [['ONLY_ONE']]})[0] == 400
+        assert request('GET', '/records?limit=abc')[0] == 400
+        assert request('GET', '/nowhere')[0] == 404
+        conn.request('POST', '/convert', b'{not json', {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        assert response.status == 400 and 'error' in json.loads(response.read())
+        assert conn.sock is sock, "Every request should reuse the first connection"
+
+        conn.putrequest('POST', '/convert')
+        conn.putheader('Content-Length', '-1')
+        conn.endheaders()
+        response = conn.getresponse()
+        assert response.status == 400 and 'error' in json.loads(response.read())
+        assert response.will_close, "A request with an unread body should close the connection"
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    test_headless_commands()
+    test_service()
@@ -0,0 +1,138 @@
+"""Test compiling, reading and refreshing snapshot files."""
+import io
+import multiprocessing
+import os
+import struct
+import sys
+import tempfile
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cli import main as cli_main
+from database import ConversionCodeDB
+from snapshot import (HEADER_SIZE, SNAPSHOT_VERSION, Snapshot, compile_snapshot,
+                      read_snapshot_info, refresh_snapshot)
+from test_database import remove_db_files
+
+
+def convert_in_worker(args):
+    """Open the snapshot in a worker process and convert a batch."""
+    path, field_name, values = args
+    with Snapshot(path) as snapshot:
+        return snapshot.convert_many(field_name, values, "?")
+
+
+def test_snapshot():
+    """Test lookups, atomic replacement, change detection and corruption."""
+    temp_db = os.path.join(tempfile.gettempdir(), 'test_conversion_snapshot.db')
+    path = temp_db + '.snap'
+    remove_db_files(temp_db)
+
+    try:
+        with ConversionCodeDB(temp_db) as db:
+            db.bulk_upsert([(f"FIELD_{i % 7}", f"S{i}", f"V{i % 13}") for i in range(5000)])
+            db.add_record("STATUS_CODE", "ACTIVE", "A")
+            db.add_record("STATUS_CODE", "ACTIVE", "B")
+            db.add_record("STATUS_CODE", "NONE", None)
+            db.add_record("STATUS_CODE", "", "EMPTY")
+            db.add_record("RÉGION", "Zürich", "ZH")
+            db.add_record(None, "ORPHAN", "X")
+            assert compile_snapshot(db, path) == 5004
+
+            with Snapshot(path) as snapshot:
+                assert len(snapshot) == 5004
+                assert snapshot.convert("STATUS_CODE", "ACTIVE") == "B", "Highest ID wins"
+                assert snapshot.convert("STATUS_CODE", "NONE", "?") is None
+                assert snapshot.convert("STATUS_CODE", "") == "EMPTY"
+                assert snapshot.convert("RÉGION", "Zürich") == "ZH"
+                assert snapshot.convert("STATUS_CODE", "active", "?") == "?"
+                assert snapshot.convert("NO_SUCH_FIELD", "ACTIVE") is None
+                assert ("FIELD_3", "S3") in snapshot and ("FIELD_3", "S4") not in snapshot
+                values = [f"S{i}" for i in range(0, 5000, 7)] + ["NOPE"]
+                expected = db.lookup_spectrum_values("FIELD_0", values)
+                assert snapshot.convert_many("FIELD_0", values, "?") == [
+                    expected.get(value, "?") for value in values]
+                items = list(snapshot.items())
+                assert len(items) == 5004
+                assert items == sorted(items, key=lambda item: (item[0].encode(),
+                                                                item[1].encode()))
+            print("✓ Lookups match the database")
+
+            info = read_snapshot_info(path)
+            assert info.version == SNAPSHOT_VERSION and info.keys == 5004
+            assert not refresh_snapshot(db, path), "An unchanged table keeps the file"
+            old = Snapshot(path)
+            db.update_record(db.get_ids("=RÉGION")[0], "RÉGION", "Zürich", "ZUE", 'N')
+            assert refresh_snapshot(db, path)
+            assert read_snapshot_info(path).stamp != info.stamp
+            assert old.convert("RÉGION", "Zürich") == "ZH", "Readers keep the file they opened"
+            assert old.reopen_if_replaced() and not old.reopen_if_replaced()
+            assert old.convert("RÉGION", "Zürich") == "ZUE"
+            old.close()
+            leftovers = [name for name in os.listdir(os.path.dirname(path))
+                         if name.startswith(os.path.basename(path) + '.')]
+            assert not leftovers, leftovers
+            print("✓ Refreshed only on change and replaced atomically")
+
+            with multiprocessing.Pool(4) as pool:
+                batches = [(path, f"FIELD_{i}", [f"S{j}" for j in range(i, 5000, 7)] + ["X"])
+                           for i in range(7)]
+                for (_, field_name, values), result in zip(batches,
+                                                          pool.map(convert_in_worker, batches)):
+                    assert result[:-1] == [f"V{int(v[1:]) % 13}" for v in values[:-1]]
+                    assert result[-1] == "?"
+            print("✓ Worker processes share one file")
+
+        remove_db_files(temp_db)
+        with ConversionCodeDB(temp_db, enable_change_log=False) as db:
+            db.bulk_upsert([(f"FIELD_{i % 7}", f"S{i}", f"V{i % 13}") for i in range(5000)])
+            assert refresh_snapshot(db, path), "A different stamp means a rewrite"
+            assert not refresh_snapshot(db, path)
+            db.delete_record(db.get_ids("=FIELD_1")[0])
+            assert refresh_snapshot(db, path), "Deletes change the stamp without a change log"
+            with Snapshot(path) as snapshot:
+                assert len(snapshot) == 4999
+        print("✓ Changes detected without a change log")
+
+        with open(path, 'r+b') as f:
+            f.seek(HEADER_SIZE + 100)
+            byte = f.read(1)
+            f.seek(HEADER_SIZE + 100)
+            f.write(bytes([byte[0] ^ 1]))
+        for action in (lambda: Snapshot(path), lambda: read_snapshot_info(temp_db)):
+            try:
+                action()
+            except ValueError:
+                pass
+            else:
+                raise AssertionError("Corrupt and foreign files should be rejected")
+        Snapshot(path, verify=False).close()
+        with open(path, 'r+b') as f:
+            f.seek(8)
+            f.write(struct.pack('<H', SNAPSHOT_VERSION + 1))
+        try:
+            read_snapshot_info(path)
+        except ValueError as e:
+            assert "version" in str(e)
+        else:
+            raise AssertionError("Other versions should be rejected")
+        with ConversionCodeDB(temp_db) as db:
+            assert refresh_snapshot(db, path), "An unreadable file is replaced"
+        print("✓ Corrupt, foreign and other-version files rejected")
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            assert cli_main(['snapshot', path, '--if-changed', '--db', temp_db]) == 0
+            assert cli_main(['convert', 'FIELD_2', 'S2', 'S3', '--snapshot', path]) == 0
+        assert output.getvalue().splitlines()[-2:] == ["V2", ""]
+        assert "up to date" in output.getvalue()
+        print("✓ CLI snapshot and convert --snapshot")
+    finally:
+        remove_db_files(temp_db)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    test_snapshot()
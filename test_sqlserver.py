@@ -0,0 +1,142 @@
+"""Test the SQL Server backend against the in-process T-SQL stand-in."""
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import ConcurrencyConflictError, ConversionCodeDB
+from exporter import export_table
+from sqlserver import SqlServerBackend
+from test_database import remove_db_files
+from tsql_standin import StandInServer, translate
+
+
+def test_sqlserver_backend():
+    """Test CRUD, filters, batching and pooling through the SQL Server dialect."""
+    temp_db = os.path.join(tempfile.gettempdir(), 'test_conversion_sqlserver.db')
+    remove_db_files(temp_db)
+    server = StandInServer(temp_db)
+    export_path = temp_db + '.jsonl'
+
+    try:
+        assert translate("INSERT INTO T (A) OUTPUT INSERTED.ID VALUES (?)") == \
+            "INSERT INTO T (A) VALUES (?) RETURNING ID"
+        assert "LIMIT ?, ?" in translate("SELECT * FROM T ORDER BY ID OFFSET ? ROWS FETCH NEXT ? ROWS ONLY")
+        for sql in ("SELECT * FROM T WHERE 1", "SELECT * FROM T WHERE 1 ORDER BY ID"):
+            try:
+                translate(sql)
+            except sqlite3.OperationalError:
+                pass
+            else:
+                raise AssertionError(f"T-SQL has no bare conditions: {sql}")
+        assert "WHERE 1 = 1" in translate("SELECT * FROM T WHERE 1 = 1 ORDER BY ID")
+
+        backend = SqlServerBackend("DRIVER={stand-in}", connect=server.connect)
+        with ConversionCodeDB(backend=backend, pool_size=2) as db:
+            assert not db.fts_enabled
+            first_id = db.add_record("STATUS_CODE", "ACTIVE", "A", "N")
+            second_id = db.add_record("STATUS_CODE", "INACTIVE", "I", "N")
+            assert second_id == first_id + 1, "IDs should come back from the OUTPUT clause"
+            assert db.get_record_by_id(first_id)['SPECTRUM_VALUE'] == "A"
+            assert db.update_record(first_id, "STATUS_CODE", "ACTIVE", "AC", "Y")
+            assert db.get_record_by_id(first_id)['UPDATE_COUNT'] == 1
+            try:
+                db.update_record(first_id, "STATUS_CODE", "ACTIVE", "AY", "Y",
+                                 expected_update_count=0)
+            except ConcurrencyConflictError as e:
+                assert e.current.SPECTRUM_VALUE == "AC"
+            else:
+                raise AssertionError("A stale update count should conflict")
+            assert db.update_record(first_id, "STATUS_CODE", "ACTIVE", "AC", "Y",
+                                    expected_update_count=1)
+            print("✓ CRUD through the SQL Server dialect")
+
+            rows = [("FIELD_%03d" % (i % 40), f"S{i}", f"V{i}") for i in range(2500)]
+            rows.append(("STATUS_CODE", "ACTIVE", "AC", "Y"))
+            before = server.stats()
+            result = db.bulk_upsert(rows, chunk_size=1000)
+            after = server.stats()
+            assert (result.inserted, result.updated, result.unchanged) == (2500, 0, 1), result
+            assert after['fast_batches'] - before['fast_batches'] == 3, \
+                "Each chunk should be staged with one parameter array"
+            # Per chunk: create stage, stage rows, count unchanged, update, insert,
+            # drop, commit.
+            assert after['round_trips'] - before['round_trips'] == 3 * 7
+            result = db.bulk_upsert([("STATUS_CODE", "ACTIVE", "AX", "Y"),
+                                     ("STATUS_CODE", "ACTIVE", "AZ", "Y")])
+            assert (result.inserted, result.updated) == (0, 1), "Later duplicate should win"
+            assert db.get_all_records("=STATUS_CODE")[0]['SPECTRUM_VALUE'] == "AZ"
+            print("✓ Bulk upsert staged with fast_executemany")
+
+            assert db.count_records("=status_code") == 2, "Exact match should ignore case"
+            assert db.count_records("field_00*") == 630
+            assert db.count_records("D_01") == 630
+            db.add_record("A[1]_%", "X", "X", "N")
+            assert [r['FIELD_NAME'] for r in db.get_all_records("[1]_%")] == ["A[1]_%"], \
+                "LIKE wildcards should match literally"
+            page = db.get_page(limit=10, offset=20)
+            assert [r['CONVERSION_CODE_ID'] for r in page] == list(range(first_id + 20, first_id + 30))
+            after_page = db.get_page(after_id=page[-1]['CONVERSION_CODE_ID'], limit=5)
+            assert after_page[0]['CONVERSION_CODE_ID'] == first_id + 30
+            by_source = db.get_record_page(limit=3, order_by='SOURCE_VALUE', descending=True,
+                                           field_name_filter="FIELD_001")
+            assert [r.SOURCE_VALUE for r in by_source] == ["S961", "S921", "S881"]
+            after = db.get_record_page(limit=1, order_by='SOURCE_VALUE', descending=True,
+                                       field_name_filter="FIELD_001",
+                                       after_id=by_source[-1].CONVERSION_CODE_ID,
+                                       after_value=by_source[-1].SOURCE_VALUE)
+            assert after[0].SOURCE_VALUE == "S841"
+            summary = {g.field_name: g.records for g in db.field_name_summary("FIELD_00*")}
+            assert len(summary) == 10 and summary["FIELD_001"] == 63
+            print("✓ Filters, sorting, summaries and OFFSET/FETCH paging")
+
+            ids = db.get_ids("FIELD_*")
+            before = server.stats()
+            assert db.update_many((record_id, {'IS_IMPORTED': 'Y'}) for record_id in ids) == 2500
+            after = server.stats()
+            # Five chunks of 500 IDs: one SELECT and one parameter array each, then commit.
+            assert after['round_trips'] - before['round_trips'] == 5 * 2 + 1
+            assert db.delete_many(ids) == 2500
+            assert db.count_records("FIELD_*") == 0
+            print("✓ Batch update and delete in parameter-array chunks")
+
+            record = db.get_records("STATUS*")[0]
+            assert isinstance(record.CHANGE_DATE_TIME, datetime), "pyodbc returns datetimes"
+            count = export_table(db, export_path, 'jsonl')
+            with open(export_path, encoding='utf-8') as f:
+                exported = [json.loads(line) for line in f]
+            assert count == len(exported) == db.count_records()
+            row = next(row for row in exported
+                       if row['CONVERSION_CODE_ID'] == record.CONVERSION_CODE_ID)
+            assert row['CHANGE_DATE_TIME'] == str(record.CHANGE_DATE_TIME)
+            print("✓ JSONL export writes datetimes as text")
+
+            def reader():
+                for _ in range(20):
+                    db.count_records("STATUS*")
+
+            threads = [threading.Thread(target=reader) for _ in range(6)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            # Two pooled readers plus the dedicated writer.
+            assert server.stats()['connections_opened'] <= 3, server.stats()
+            print("✓ Connections pooled across threads")
+
+        with ConversionCodeDB.from_config({'backend': 'sqlite', 'path': temp_db + '.local'}) as db:
+            assert db.backend.name == 'sqlite'
+
+    finally:
+        remove_db_files(temp_db)
+        remove_db_files(temp_db + '.local')
+        remove_db_files(export_path)
+
+
+if __name__ == "__main__":
+    test_sqlserver_backend()
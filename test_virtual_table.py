@@ -0,0 +1,120 @@
+"""Test paged result sets used by the virtual scrolling table."""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import ConversionCodeDB
+from test_database import remove_db_files
+from virtual_table import PagedResultSet
+
+
+def test_paged_result_set():
+    """Test keyset pages, random access and counts without loading all rows."""
+    temp_db = os.path.join(tempfile.gettempdir(), 'test_conversion_paged.db')
+    remove_db_files(temp_db)
+    
+    try:
+        with ConversionCodeDB(temp_db) as db:
+            db.bulk_upsert((f"FIELD_{i % 3}", f"SRC{i}", "S") for i in range(1000))
+            all_ids = [r['CONVERSION_CODE_ID'] for r in db.get_all_records()]
+            field_1_ids = [r['CONVERSION_CODE_ID'] for r in db.get_all_records("=FIELD_1")]
+            
+            page = db.get_page(after_id=all_ids[99], limit=50)
+            assert [r['CONVERSION_CODE_ID'] for r in page] == all_ids[100:150]
+            assert db.count_records("=FIELD_1") == len(field_1_ids)
+            print("✓ Keyset page and filtered count match")
+            
+            result_set = PagedResultSet(db, page_size=64, max_pages=3)
+            assert len(result_set) == 1000
+            window = result_set.rows(60, 10)
+            assert [r['CONVERSION_CODE_ID'] for r in window] == all_ids[60:70], \
+                "Window spanning two pages is wrong"
+            window = result_set.rows(900, 30)
+            assert [r['CONVERSION_CODE_ID'] for r in window] == all_ids[900:930], \
+                "Jump to an unvisited page is wrong"
+            assert [r['CONVERSION_CODE_ID'] for r in result_set.rows(990, 50)] == all_ids[990:]
+            assert len(result_set._pages) <= 3, "Page cache exceeded its bound"
+            print("✓ Random access across pages with a bounded cache")
+            
+            filtered = PagedResultSet(db, "=FIELD_1", page_size=25)
+            rows = filtered.rows(0, len(filtered))
+            assert [r['CONVERSION_CODE_ID'] for r in rows] == field_1_ids
+            print(f"✓ Filtered result set walked {len(rows)} rows by keyset")
+            
+            by_source = PagedResultSet(db, "=FIELD_2", page_size=30, order_by='SOURCE_VALUE',
+                                       descending=True)
+            expected = sorted(db.get_records("=FIELD_2"),
+                              key=lambda r: (r.SOURCE_VALUE.lower(), r.CONVERSION_CODE_ID),
+                              reverse=True)
+            assert by_source.rows(0, len(by_source)) == expected
+            moved = expected[40]
+            db.update_record(moved.CONVERSION_CODE_ID, "FIELD_2", "ZZZ", "S", "N")
+            by_source.apply_change(moved, db.get_record(moved.CONVERSION_CODE_ID))
+            assert by_source.rows(0, 1)[0].CONVERSION_CODE_ID == moved.CONVERSION_CODE_ID, \
+                "A row whose sort value changed should move"
+            print("✓ Sorted result set walked by (value, ID) keyset")
+            
+            db.delete_record(all_ids[0])
+            result_set.invalidate()
+            assert len(result_set) == 999 and result_set.rows(0, 1)[0]['CONVERSION_CODE_ID'] == all_ids[1]
+            print("✓ Invalidation recounts and refetches")
+    
+    finally:
+        remove_db_files(temp_db)
+
+
+
+def test_result_set_apply_change():
+    """Test patching a result set after single-record writes."""
+    temp_db = os.path.join(tempfile.gettempdir(), 'test_conversion_paged_change.db')
+    remove_db_files(temp_db)
+    
+    def ids(result_set):
+        return [r['CONVERSION_CODE_ID'] for r in result_set.rows(0, len(result_set))]
+    
+    def expected_ids(filter_text):
+        return [r['CONVERSION_CODE_ID'] for r in db.get_all_records(filter_text)]
+    
+    try:
+        with ConversionCodeDB(temp_db) as db:
+            db.bulk_upsert((f"FIELD_{i % 2}", f"SRC{i}", "S") for i in range(300))
+            result_set = PagedResultSet(db, "=FIELD_0", page_size=20, max_pages=50)
+            ids(result_set)
+            fetched = []
+            original_get_page = db.get_record_page
+            db.get_record_page = lambda *a, **k: fetched.append(k) or original_get_page(*a, **k)
+            
+            target = db.get_all_records("=FIELD_0")[5]
+            db.update_record(target['CONVERSION_CODE_ID'], "FIELD_0", "SRC", "NEW", "Y")
+            updated = db.get_record_by_id(target['CONVERSION_CODE_ID'])
+            result_set.apply_change(target, updated)
+            assert result_set.rows(5, 1)[0]['SPECTRUM_VALUE'] == "NEW"
+            assert not fetched, "In-place update should not refetch pages"
+            print("✓ In-place update patched the cached page")
+            
+            moved = db.get_all_records("=FIELD_0")[100]
+            db.update_record(moved['CONVERSION_CODE_ID'], "FIELD_1", "SRC", "S", "N")
+            result_set.apply_change(moved, db.get_record_by_id(moved['CONVERSION_CODE_ID']))
+            assert len(result_set) == 149 and ids(result_set) == expected_ids("=FIELD_0")
+            assert all(k['after_id'] is not None for k in fetched), "Only later pages refetch"
+            print(f"✓ Row leaving the filter refetched {len(fetched)} page(s)")
+            
+            new_id = db.add_record("FIELD_0", "NEW_SRC", "S", "N")
+            result_set.apply_change(None, db.get_record_by_id(new_id))
+            deleted = db.get_all_records("=FIELD_0")[0]
+            db.delete_record(deleted['CONVERSION_CODE_ID'])
+            result_set.apply_change(deleted, None)
+            ignored = db.get_all_records("=FIELD_1")[0]
+            result_set.apply_change(ignored, None)
+            assert len(result_set) == 149 and ids(result_set) == expected_ids("=FIELD_0")
+            print("✓ Inserts and deletes applied; non-matching rows ignored")
+    
+    finally:
+        remove_db_files(temp_db)
+
+
+if __name__ == "__main__":
+    test_paged_result_set()
+    test_result_set_apply_change()
@@ -0,0 +1,237 @@
+"""Test optimistic concurrency, busy retries and the write-coalescing queue."""
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from benchmark import benchmark_concurrent_writers
+from database import (CHANGE_DELETE, CHANGE_INSERT, CHANGE_UPDATE, ConcurrencyConflictError,
+                     ConversionCodeDB, Write)
+from test_database import remove_db_files
+from write_queue import WriteQueue
+
+
+def test_optimistic_concurrency():
+    """Updates and deletes given a stale UPDATE_COUNT conflict instead of overwriting."""
+    temp_db = os.path.join(tempfile.gettempdir(), 'test_conversion_concurrency.db')
+    remove_db_files(temp_db)
+
+    try:
+        with ConversionCodeDB(temp_db, cache_entries=64) as mine, \
+                ConversionCodeDB(temp_db) as theirs:
+            record_id = mine.add_record("STATUS_CODE", "ACTIVE", "A")
+            read = mine.get_record(record_id)
+            assert theirs.update_record(record_id, "STATUS_CODE", "ACTIVE", "B", 'N',
+                                        expected_update_count=read.UPDATE_COUNT)
+            try:
+                mine.update_record(record_id, "STATUS_CODE", "ACTIVE", "C", 'N',
+                                   expected_update_count=read.UPDATE_COUNT)
+            except ConcurrencyConflictError as e:
+                assert e.conversion_code_id == record_id and e.expected_update_count == 0
+                assert e.current.SPECTRUM_VALUE == "B" and e.current.UPDATE_COUNT == 1
+            else:
+                raise AssertionError("The second update should conflict")
+            assert mine.get_record(record_id).SPECTRUM_VALUE == "B", "Nothing overwritten"
+            assert mine.update_record(record_id, "STATUS_CODE", "ACTIVE", "C", 'N',
+                                      expected_update_count=1)
+            assert mine.update_record(record_id, "STATUS_CODE", "ACTIVE", "D", 'N'), \
+                "Without an expected count the update is unconditional"
+            print("✓ Stale updates conflict")
+
+            theirs.delete_record(record_id)
+            for action in (lambda: mine.update_record(record_id, "STATUS_CODE", "ACTIVE",
+                                                      "E", 'N', expected_update_count=3),
+                           lambda: mine.delete_record(record_id, expected_update_count=3)):
+                try:
+                    action()
+                except ConcurrencyConflictError as e:
+                    assert e.current is None and "deleted" in str(e)
+                else:
+                    raise AssertionError("Writing a deleted record should conflict")
+            assert not mine.update_record(record_id, "STATUS_CODE", "ACTIVE", "E", 'N')
+            print("✓ Writes to deleted records conflict")
+
+            first = mine.add_record("REGION_CODE", "EUROPE", "EU")
+            second = mine.add_record("REGION_CODE", "ASIA", "AS")
+            results = mine.apply_writes([
+                Write(CHANGE_INSERT, None, ("REGION_CODE", "AFRICA", "AF", 'N')),
+                Write(CHANGE_UPDATE, first, ("REGION_CODE", "EUROPE", "EUR", 'Y'), 5),
+                Write(CHANGE_UPDATE, second, ("REGION_CODE", "ASIA", "ASI", 'N'), 0),
+                Write(CHANGE_DELETE, first),
+            ])
+            assert isinstance(results[0], int) and isinstance(results[1],
+                                                              ConcurrencyConflictError)
+            assert results[2:] == [True, True]
+            assert [r.SPECTRUM_VALUE for r in mine.get_records("=REGION_CODE")] == ["ASI", "AF"]
+            for writes in ([Write(CHANGE_INSERT, None, ("", "X", "X", 'N'))],
+                           [Write('X', first)]):
+                try:
+                    mine.apply_writes([Write(CHANGE_DELETE, second)] + writes)
+                except ValueError:
+                    pass
+                else:
+                    raise AssertionError(f"{writes} should be rejected")
+            assert mine.get_record(second) is not None, "Nothing written on invalid writes"
+            print("✓ Batched writes skip conflicts and reject invalid records")
+
+            ids = mine.get_ids("=REGION_CODE")
+            counts = {record.CONVERSION_CODE_ID: record.UPDATE_COUNT
+                      for record in mine.get_records("=REGION_CODE")}
+            theirs.update_record(ids[0], "REGION_CODE", "ASIA", "A", 'N')
+            for action in (lambda: mine.update_many([(i, {'IS_IMPORTED': 'Y'}) for i in ids],
+                                                    expected_update_counts=counts),
+                           lambda: mine.delete_many(ids, expected_update_counts=counts)):
+                try:
+                    action()
+                except ConcurrencyConflictError as e:
+                    assert e.conversion_code_id == ids[0] and e.current.SPECTRUM_VALUE == "A"
+                else:
+                    raise AssertionError("A stale batch should conflict")
+                assert [r.IS_IMPORTED for r in mine.get_records("=REGION_CODE")] == ['N', 'N'], \
+                    "Nothing in a conflicting batch is written"
+            counts[ids[0]] += 1
+            assert mine.update_many([(i, {'IS_IMPORTED': 'Y'}) for i in ids],
+                                    expected_update_counts=counts) == 2
+            assert mine.delete_many(ids, expected_update_counts={
+                i: count + 1 for i, count in counts.items()}) == 2
+            print("✓ Stale batch updates and deletes conflict as a whole")
+    finally:
+        remove_db_files(temp_db)
+
+
+def test_busy_retry():
+    """Writes that find the database locked are retried with backoff."""
+    temp_db = os.path.join(tempfile.gettempdir(), 'test_conversion_busy.db')
+    remove_db_files(temp_db)
+
+    try:
+        with ConversionCodeDB(temp_db, busy_timeout=0.05, busy_retries=6,
+                              busy_backoff=0.05) as db, \
+                ConversionCodeDB(temp_db, busy_timeout=0.05, busy_retries=0) as impatient:
+            db.add_record("STATUS_CODE", "ACTIVE", "A")
+            blocker = sqlite3.connect(temp_db, isolation_level=None, check_same_thread=False)
+            blocker.execute('BEGIN IMMEDIATE')
+            try:
+                impatient.add_record("STATUS_CODE", "X", "X")
+            except sqlite3.OperationalError as e:
+                assert "locked" in str(e)
+            else:
+                raise AssertionError("Without retries the locked write should fail")
+
+            release = threading.Timer(0.3, blocker.execute, ('COMMIT',))
+            release.start()
+            db.add_record("STATUS_CODE", "INACTIVE", "I")
+            release.join()
+            assert db.busy_retry_count > 0
+            assert db.count_records("=STATUS_CODE") == 2
+
+            ids = db.get_ids("=STATUS_CODE")
+            for write in (lambda: db.update_many([(ids[0], {'IS_IMPORTED': 'Y'})]),
+                          lambda: db.bulk_upsert([("STATUS_CODE", "ACTIVE", "AC", 'Y')]),
+                          lambda: db.delete_many(ids[1:]),
+                          lambda: db.prune_changes(db.current_change_seq())):
+                retries = db.busy_retry_count
+                blocker.execute('BEGIN IMMEDIATE')
+                release = threading.Timer(0.3, blocker.execute, ('COMMIT',))
+                release.start()
+                assert write()
+                release.join()
+                assert db.busy_retry_count > retries
+            assert [(r.SPECTRUM_VALUE, r.IS_IMPORTED) for r in db.get_records()] == [("AC", 'Y')]
+            blocker.close()
+        print(f"✓ Locked writes succeeded after {db.busy_retry_count} retries")
+    finally:
+        remove_db_files(temp_db)
+
+
+def test_write_queue():
+    """Writes submitted together share a transaction but keep their own results."""
+    temp_db = os.path.join(tempfile.gettempdir(), 'test_conversion_write_queue.db')
+    remove_db_files(temp_db)
+
+    try:
+        with ConversionCodeDB(temp_db) as db:
+            with WriteQueue(db, max_delay=0.05) as writes:
+                with ThreadPoolExecutor(max_workers=4) as pool:
+                    futures = list(pool.map(
+                        lambda i: writes.add("FIELD", f"S{i}", f"V{i}"), range(200)))
+                ids = [future.result() for future in futures]
+                assert len(set(ids)) == 200 and db.count_records("=FIELD") == 200
+                assert writes.writes == 200 and writes.batches < 20, writes.batches
+                print(f"✓ 200 inserts from 4 threads in {writes.batches} transactions")
+
+                record = db.get_record(ids[0])
+                update = writes.update(ids[0], "FIELD", "S0", "NEW", 'N',
+                                       expected_update_count=record.UPDATE_COUNT)
+                stale = writes.update(ids[0], "FIELD", "S0", "OLD", 'N',
+                                      expected_update_count=record.UPDATE_COUNT)
+                delete = writes.delete(ids[1])
+                assert update.result() is True and delete.result() is True
+                try:
+                    stale.result()
+                except ConcurrencyConflictError as e:
+                    assert e.current.SPECTRUM_VALUE == "NEW"
+                else:
+                    raise AssertionError("The stale update should conflict")
+                try:
+                    writes.add("", "X", "X")
+                except ValueError:
+                    pass
+                else:
+                    raise AssertionError("Invalid records should be rejected on submit")
+                last = writes.add("FIELD", "LAST", "L")
+            assert last.done() and db.get_record(last.result()) is not None, \
+                "Closing applies queued writes"
+            try:
+                writes.add("FIELD", "LATE", "L")
+            except RuntimeError:
+                pass
+            else:
+                raise AssertionError("A closed queue should refuse writes")
+        print("✓ Per-write results, conflicts and closing")
+
+        remove_db_files(temp_db)
+        with ConversionCodeDB(temp_db, unique_keys=True) as db:
+            db.add_record("F", "A", "1")
+            with WriteQueue(db, max_delay=0.2) as writes:
+                futures = [writes.add("F", "B", "2"), writes.add("F", "A", "3"),
+                           writes.add("F", "C", "4")]
+                try:
+                    futures[1].result()
+                except sqlite3.IntegrityError:
+                    pass
+                else:
+                    raise AssertionError("The duplicate key should be refused")
+                assert all(isinstance(futures[i].result(), int) for i in (0, 2))
+            assert [(r.SOURCE_VALUE, r.SPECTRUM_VALUE) for r in db.get_records("=F")] == [
+                ("A", "1"), ("B", "2"), ("C", "4")]
+        print("✓ A refused write fails alone in its batch")
+    finally:
+        remove_db_files(temp_db)
+
+
+def test_concurrent_writers():
+    """Eight writer processes lose no updates, one or several per transaction."""
+    path = os.path.join(tempfile.gettempdir(), 'test_conversion_writers.db')
+    try:
+        for batch in (1, 5):
+            result = benchmark_concurrent_writers(path, writers=8, operations=40,
+                                                  records=10, batch=batch)
+            assert result['lost_updates'] == 0, result
+            assert result['updates'] == 320
+            print(f"✓ 8 writers, batch {batch}: {result['per_second']:,.0f} updates/s, "
+                  f"{result['conflict_rate']:.1%} conflicts, "
+                  f"{result['busy_retries']} busy retries")
+    finally:
+        remove_db_files(path)
+
+
+if __name__ == "__main__":
+    test_optimistic_concurrency()
+    test_busy_retry()
+    test_write_queue()
+    test_concurrent_writers()
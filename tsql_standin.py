@@ -0,0 +1,208 @@
+"""In-process stand-in for SQL Server, backed by SQLite.
+
+``StandInServer.connect`` returns connections with the parts of the pyodbc
+API that ``sqlserver.SqlServerBackend`` uses. Statements are rewritten from
+the T-SQL the backend emits into SQLite, so the backend's SQL, batching and
+pooling can be tested without a server::
+
+    server = StandInServer(path)
+    db = ConversionCodeDB(backend=SqlServerBackend("", connect=server.connect))
+
+It is not a general T-SQL emulator: only the constructs the backend uses are
+translated. Date and time columns come back as ``datetime`` objects, as
+pyodbc returns them. The server counts connections and round trips the way pyodbc
+would incur them, including one round trip per row for ``executemany``
+without ``fast_executemany``.
+"""
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, List, Optional, Sequence
+
+
+# (pattern, replacement) pairs applied in order.
+TRANSLATIONS = (
+    (re.compile(r"IF OBJECT_ID\(N'\w+', N'U'\) IS NULL\s+CREATE TABLE", re.I),
+     'CREATE TABLE IF NOT EXISTS'),
+    (re.compile(r"IF NOT EXISTS \(SELECT 1 FROM sys\.indexes WHERE name = N'\w+'\)\s+"
+                r"CREATE (UNIQUE )?INDEX", re.I),
+     r'CREATE \1INDEX IF NOT EXISTS'),
+    (re.compile(r'BIGINT IDENTITY\(1,\s*1\) NOT NULL PRIMARY KEY', re.I),
+     'INTEGER PRIMARY KEY AUTOINCREMENT'),
+    (re.compile(r'GETDATE\(\)', re.I), 'CURRENT_TIMESTAMP'),
+    (re.compile(r'CHANGE_TRACKING_CURRENT_VERSION\(\)', re.I), 'NULL'),
+    (re.compile(r'COLLATE \w+_CI_\w+', re.I), 'COLLATE NOCASE'),
+    (re.compile(r'OFFSET \? ROWS FETCH NEXT \? ROWS ONLY', re.I), 'LIMIT ?, ?'),
+    (re.compile(r'CREATE TABLE #', re.I), 'CREATE TEMP TABLE '),
+    (re.compile(r'#(\w+)'), r'\1'),
+)
+
+# A bare number used as a condition, which SQLite accepts and T-SQL rejects.
+NON_BOOLEAN_CONDITION = re.compile(
+    r'\b(?:WHERE|AND|OR)\s+\d+\s*(?=$|;|\)|AND\b|OR\b|ORDER\b|GROUP\b)', re.I)
+
+
+# Declared column types read back as datetimes.
+DATETIME_TYPES = ('SMALLDATETIME', 'DATETIME', 'DATETIME2')
+
+OUTPUT_CLAUSE = re.compile(r'\s+OUTPUT\s+((?:INSERTED|DELETED)\.\w+'
+                           r'(?:\s*,\s*(?:INSERTED|DELETED)\.\w+)*)', re.I)
+
+
+def translate(sql: str) -> str:
+    """Rewrite a T-SQL statement used by the SQL Server backend for SQLite."""
+    if NON_BOOLEAN_CONDITION.search(sql):
+        raise sqlite3.OperationalError(
+            "An expression of non-boolean type specified in a context where a condition "
+            f"is expected: {sql}")
+    for pattern, replacement in TRANSLATIONS:
+        sql = pattern.sub(replacement, sql)
+    output = OUTPUT_CLAUSE.search(sql)
+    if output:
+        columns = re.sub(r'(?:INSERTED|DELETED)\.', '', output.group(1), flags=re.I)
+        sql = sql[:output.start()] + sql[output.end():]
+        sql = sql.rstrip().rstrip(';') + f' RETURNING {columns}'
+    return sql
+
+
+def _convert_datetime(value: bytes) -> datetime:
+    return datetime.fromisoformat(value.decode())
+
+
+for _type in DATETIME_TYPES:
+    sqlite3.register_converter(_type, _convert_datetime)
+
+
+class StandInServer:
+    """A SQLite database file playing the part of one SQL Server database."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.connections_opened = 0
+        self.round_trips = 0
+        self.fast_batches = 0
+
+    def connect(self, connection_string: str = '', autocommit: bool = False,
+                timeout: int = 0, **kwargs) -> 'StandInConnection':
+        """Open a connection, with the signature of ``pyodbc.connect``."""
+        with self._lock:
+            self.connections_opened += 1
+        return StandInConnection(self, autocommit)
+
+    def stats(self) -> dict:
+        """Return connection and round trip counters."""
+        with self._lock:
+            return {
+                'connections_opened': self.connections_opened,
+                'round_trips': self.round_trips,
+                'fast_batches': self.fast_batches,
+            }
+
+    def _count(self, round_trips: int, fast_batch: bool = False):
+        with self._lock:
+            self.round_trips += round_trips
+            self.fast_batches += fast_batch
+
+
+class StandInConnection:
+    """pyodbc-style connection; ``with conn:`` commits or rolls back."""
+
+    def __init__(self, server: StandInServer, autocommit: bool = False):
+        self.server = server
+        self._conn = sqlite3.connect(server.path, check_same_thread=False,
+                                     isolation_level=None if autocommit else '',
+                                     detect_types=sqlite3.PARSE_DECLTYPES)
+        self.autocommit = autocommit
+
+    def cursor(self) -> 'StandInCursor':
+        return StandInCursor(self)
+
+    def execute(self, sql: str, *params) -> 'StandInCursor':
+        return self.cursor().execute(sql, *params)
+
+    def commit(self):
+        self.server._count(1)
+        self._conn.commit()
+
+    def rollback(self):
+        self.server._count(1)
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+
+class StandInCursor:
+    """pyodbc-style cursor over translated statements."""
+
+    def __init__(self, connection: StandInConnection):
+        self.connection = connection
+        self.fast_executemany = False
+        self.arraysize = 1
+        self._cursor = connection._conn.cursor()
+        self._buffered: Optional[List[tuple]] = None
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    def execute(self, sql: str, *params) -> 'StandInCursor':
+        """Run one statement; parameters may be a sequence or positional."""
+        if len(params) == 1 and isinstance(params[0], (list, tuple)):
+            params = params[0]
+        self.connection.server._count(1)
+        translated = translate(sql)
+        self._cursor.execute(translated, tuple(params))
+        # Like OUTPUT rows, RETURNING rows must be read before the statement
+        # completes; buffer them so the caller can fetch at leisure.
+        self._buffered = self._cursor.fetchall() if ' RETURNING ' in translated else None
+        return self
+
+    def executemany(self, sql: str, seq_of_params: Sequence[Sequence[Any]]):
+        """Run a statement per parameter set, counted as pyodbc would send them."""
+        rows = [tuple(params) for params in seq_of_params]
+        if self.fast_executemany:
+            self.connection.server._count(1, fast_batch=True)
+        else:
+            self.connection.server._count(len(rows))
+        self._buffered = None
+        self._cursor.executemany(translate(sql), rows)
+
+    def fetchone(self):
+        if self._buffered is not None:
+            return self._buffered.pop(0) if self._buffered else None
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size: Optional[int] = None):
+        size = size or self.arraysize
+        if self._buffered is not None:
+            rows, self._buffered = self._buffered[:size], self._buffered[size:]
+            return rows
+        return self._cursor.fetchmany(size)
+
+    def fetchall(self):
+        if self._buffered is not None:
+            rows, self._buffered = self._buffered, []
+            return rows
+        return self._cursor.fetchall()
+
+    def close(self):
+        self._cursor.close()
+
+    def __iter__(self):
+        return iter(self.fetchall())
@@ -0,0 +1,367 @@
+"""Virtual scrolling for large conversion code tables.
+
+``PagedResultSet`` gives random access to the rows of a filtered query while
+only keeping a few pages in memory, and ``VirtualTreeview`` drives a
+``ttk.Treeview`` so that only the rows currently on screen exist as items.
+"""
+import tkinter as tk
+from collections import OrderedDict
+from tkinter import ttk
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+from database import DEFAULT_SORT, ConversionCodeDB, Record, field_name_matches
+from filters import Filter, matches, parse_filter
+from instrumentation import Profiler
+
+
+DEFAULT_PAGE_SIZE = 200
+
+# Pages jumped over by walking keyset pages rather than with an OFFSET query.
+MAX_KEYSET_WALK = 4
+
+
+class PagedResultSet:
+    """Random access to a filtered query's rows, fetched a page at a time.
+
+    Pages are fetched with keyset pagination on ``(order_by,
+    CONVERSION_CODE_ID)``, remembering the last record of each fetched page
+    as the anchor for the next one. Only ``max_pages`` pages are cached,
+    least recently used first out. ``where`` is a composite filter, or its
+    text (see ``filters``), applied on top of the field name filter.
+    """
+
+    def __init__(self, db: ConversionCodeDB, field_name_filter: Optional[str] = None,
+                 page_size: int = DEFAULT_PAGE_SIZE, max_pages: int = 20,
+                 order_by: str = DEFAULT_SORT, descending: bool = False,
+                 where=None):
+        self.db = db
+        self.field_name_filter = field_name_filter
+        self.where: Optional[Filter] = parse_filter(where) if isinstance(where, str) else where
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.order_by = order_by
+        self.descending = descending
+        self.total = db.count_records(field_name_filter, where=self.where)
+        self._pages: 'OrderedDict[int, List[Record]]' = OrderedDict()
+        # Page index -> record the page starts after (None for the first page).
+        self._anchors: Dict[int, Optional[Record]] = {0: None}
+
+    def __len__(self) -> int:
+        return self.total
+
+    def get_page(self, index: int) -> List[Record]:
+        """Return the records of page ``index``, fetching it if needed."""
+        page = self._pages.get(index)
+        if page is not None:
+            self._pages.move_to_end(index)
+            return page
+
+        known = max(i for i in self._anchors if i <= index)
+        if index - known <= MAX_KEYSET_WALK:
+            for i in range(known, index + 1):
+                page = self._pages.get(i)
+                if page is None:
+                    page = self._fetch(i, after=self._anchors[i])
+        else:
+            page = self._fetch(index, offset=index * self.page_size)
+        return page
+
+    def _fetch(self, index: int, after: Optional[Record] = None, offset: int = 0) -> List[Record]:
+        """Fetch and cache one page, recording the next page's anchor."""
+        # Copied, since rows are patched in place and the list may be cached.
+        page = list(self.db.get_record_page(
+            after_id=after['CONVERSION_CODE_ID'] if after is not None else None,
+            after_value=after[self.order_by] if after is not None else None,
+            limit=self.page_size, field_name_filter=self.field_name_filter, offset=offset,
+            order_by=self.order_by, descending=self.descending, where=self.where))
+        self._pages[index] = page
+        if len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+        if len(page) == self.page_size:
+            self._anchors[index + 1] = page[-1]
+        return page
+
+    def rows(self, start: int, count: int) -> List[Record]:
+        """Return up to ``count`` records starting at row ``start``."""
+        end = min(start + count, self.total)
+        rows: List[Record] = []
+        position = max(start, 0)
+        while position < end:
+            index, within = divmod(position, self.page_size)
+            page = self.get_page(index)
+            if within >= len(page):
+                break
+            taken = page[within:within + end - position]
+            rows.extend(taken)
+            position += len(taken)
+        return rows
+
+    def cached_records(self) -> Iterator[Record]:
+        """The records in the cached pages, as last read or patched."""
+        for page in self._pages.values():
+            yield from page
+
+    def matches(self, record: Optional[Record]) -> bool:
+        """Whether a record belongs in this result set."""
+        return (record is not None
+                and field_name_matches(self.field_name_filter, record['FIELD_NAME'])
+                and (self.where is None or matches(self.where, record)))
+
+    def apply_change(self, old: Optional[Record], new: Optional[Record]):
+        """Patch the result set after one record was inserted, updated or deleted.
+
+        ``old`` is the record before the change (None for an insert) and
+        ``new`` the record after it (None for a delete). A row updated in
+        place is patched in the cached pages; rows entering or leaving the
+        set only discard the cached pages from the one holding that ID on.
+        When sorted by another column, rows entering, leaving or moving
+        discard every cached page.
+        """
+        old_in, new_in = self.matches(old), self.matches(new)
+        if self.order_by != DEFAULT_SORT and old_in and new_in \
+                and old[self.order_by] != new[self.order_by]:
+            self._pages.clear()
+            self._anchors = {0: None}
+            return
+        if old_in and new_in:
+            record_id = new['CONVERSION_CODE_ID']
+            for page in self._pages.values():
+                for i, record in enumerate(page):
+                    if record['CONVERSION_CODE_ID'] == record_id:
+                        page[i] = new
+                        return
+            return
+        if old_in:
+            self.total -= 1
+        if new_in:
+            self.total += 1
+        if self.order_by != DEFAULT_SORT and (old_in or new_in):
+            self._pages.clear()
+            self._anchors = {0: None}
+        elif old_in or new_in:
+            self._invalidate_from_id((old or new)['CONVERSION_CODE_ID'])
+
+    def _invalidate_from_id(self, record_id: int):
+        """Drop cached pages that could hold ``record_id`` or follow it."""
+        # The last page known to start before the ID, and every page after
+        # it, may have shifted; earlier pages are unaffected.
+        first = max(i for i, anchor in self._anchors.items()
+                    if anchor is None or anchor['CONVERSION_CODE_ID'] < record_id)
+        for index in [i for i in self._pages if i >= first]:
+            del self._pages[index]
+        for index in [i for i in self._anchors if i > first]:
+            del self._anchors[index]
+
+    def invalidate(self):
+        """Drop cached pages and recount, e.g. after the table changed."""
+        self.total = self.db.count_records(self.field_name_filter, where=self.where)
+        self._pages.clear()
+        self._anchors = {0: None}
+
+
+class VirtualTreeview:
+    """Show a ``PagedResultSet`` in a Treeview, one screenful at a time.
+
+    The Treeview only holds the visible rows; the scrollbar, mouse wheel and
+    navigation keys move a window over the result set instead of scrolling
+    the widget. Items use the record's CONVERSION_CODE_ID as their iid, and
+    the selection is tracked by ID so it survives scrolling. Rendering is
+    timed on ``profiler`` while it is enabled.
+    """
+
+    def __init__(self, tree: ttk.Treeview, scrollbar: ttk.Scrollbar,
+                 format_values: Callable[[Record], tuple],
+                 profiler: Optional[Profiler] = None):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.format_values = format_values
+        self.profiler = profiler if profiler is not None else Profiler()
+        self.result_set: Optional[PagedResultSet] = None
+        self.offset = 0
+        self.selected_ids: Set[int] = set()
+        self._visible_rows = int(tree.cget('height'))
+        self._measured = False
+        self._rendering = False
+
+        scrollbar.configure(command=self.yview)
+        tree.bind('<Configure>', self._on_configure, add='+')
+        tree.bind('<<TreeviewSelect>>', self._on_select, add='+')
+        tree.bind('<ButtonPress-1>', self._on_click, add='+')
+        tree.bind('<MouseWheel>', self._on_mousewheel)
+        tree.bind('<Button-4>', lambda e: self.scroll(-3))
+        tree.bind('<Button-5>', lambda e: self.scroll(3))
+        tree.bind('<Up>', lambda e: self._on_arrow(-1))
+        tree.bind('<Down>', lambda e: self._on_arrow(1))
+        tree.bind('<Prior>', lambda e: self._on_page_key(-1))
+        tree.bind('<Next>', lambda e: self._on_page_key(1))
+        tree.bind('<Control-Home>', lambda e: self.scroll_to(0))
+        tree.bind('<Control-End>', lambda e: self.scroll_to(self.total))
+
+    @property
+    def total(self) -> int:
+        """Number of rows in the current result set."""
+        return len(self.result_set) if self.result_set is not None else 0
+
+    def set_result_set(self, result_set: PagedResultSet):
+        """Show a new result set from the top, keeping the selection."""
+        self.result_set = result_set
+        self.offset = 0
+        self.render()
+
+    def scroll(self, rows: int):
+        """Move the window by ``rows`` rows."""
+        self.scroll_to(self.offset + rows)
+        return 'break'
+
+    def scroll_to(self, offset: int):
+        """Move the window so that row ``offset`` is at the top."""
+        offset = max(0, min(offset, self.total - self._visible_rows))
+        if offset != self.offset:
+            self.offset = offset
+            self.render()
+        return 'break'
+
+    def yview(self, *args):
+        """Scrollbar command: handles 'moveto' and 'scroll' requests."""
+        if not args:
+            return
+        if args[0] == 'moveto':
+            self.scroll_to(int(float(args[1]) * self.total))
+        elif args[0] == 'scroll':
+            amount = int(args[1])
+            if args[2] == 'pages':
+                amount *= max(self._visible_rows - 1, 1)
+            self.scroll(amount)
+
+    def render(self):
+        """Materialize the visible window of rows as Treeview items."""
+        with self.profiler.timer('grid rows') as timing:
+            rows = self.result_set.rows(self.offset, self._visible_rows) if self.result_set else []
+            timing.rows = len(rows)
+        focus = self.tree.focus()
+        self._rendering = True
+        try:
+            with self.profiler.timer('treeview insert') as timing:
+                timing.rows = len(rows)
+                children = self.tree.get_children()
+                if children:
+                    self.tree.delete(*children)
+                visible_selection = []
+                for record in rows:
+                    record_id = record['CONVERSION_CODE_ID']
+                    iid = str(record_id)
+                    self.tree.insert('', tk.END, iid=iid, values=self.format_values(record))
+                    if record_id in self.selected_ids:
+                        visible_selection.append(iid)
+                self.tree.selection_set(visible_selection)
+            if focus and self.tree.exists(focus):
+                self.tree.focus(focus)
+        finally:
+            self._rendering = False
+        self._update_scrollbar()
+        if rows and not self._measured:
+            # Row height is only known once an item has been laid out.
+            self.tree.after_idle(self._on_configure)
+
+    def apply_change(self, old: Optional[Record], new: Optional[Record]):
+        """Reflect one inserted, updated or deleted record without a reload.
+
+        The scroll position and selection are kept. A visible row updated in
+        place is rewritten on its own; otherwise the window is re-rendered
+        from the page cache.
+        """
+        if self.result_set is None:
+            return
+        self.result_set.apply_change(old, new)
+        if old is not None and new is None:
+            self.selected_ids.discard(old['CONVERSION_CODE_ID'])
+        if old is not None and new is not None and self.result_set.matches(new):
+            iid = str(new['CONVERSION_CODE_ID'])
+            if self.tree.exists(iid):
+                self.tree.item(iid, values=self.format_values(new))
+                return
+        self.offset = max(0, min(self.offset, self.total - self._visible_rows))
+        self.render()
+
+    def reload(self, removed_ids: Iterable[int] = ()):
+        """Re-query the current result set after a batch change.
+
+        The scroll position is kept where possible; ``removed_ids`` are
+        dropped from the selection.
+        """
+        self.selected_ids.difference_update(removed_ids)
+        if self.result_set is None:
+            return
+        self.result_set.invalidate()
+        self.offset = max(0, min(self.offset, self.total - self._visible_rows))
+        self.render()
+
+    def select_ids(self, ids: Iterable[int]):
+        """Replace the selection, including rows that are not on screen."""
+        self.selected_ids = set(ids)
+        self.render()
+
+    def _update_scrollbar(self):
+        """Size and place the scrollbar thumb to match the window."""
+        total = self.total
+        if total <= 0:
+            self.scrollbar.set(0.0, 1.0)
+            return
+        first = self.offset / total
+        last = min(self.offset + self._visible_rows, total) / total
+        self.scrollbar.set(first, last)
+
+    def _on_configure(self, event=None):
+        """Recompute how many rows fit after the widget is resized."""
+        children = self.tree.get_children()
+        bbox = self.tree.bbox(children[0]) if children else None
+        if not bbox:
+            return
+        self._measured = True
+        header_height, row_height = bbox[1], bbox[3]
+        visible = max((self.tree.winfo_height() - header_height) // max(row_height, 1), 1)
+        if visible != self._visible_rows:
+            self._visible_rows = visible
+            self.offset = max(0, min(self.offset, self.total - visible))
+            self.render()
+
+    def _on_click(self, event):
+        """A click without Ctrl/Shift starts a new selection."""
+        if not event.state & (0x0001 | 0x0004):
+            self.selected_ids.clear()
+
+    def _on_select(self, event=None):
+        """Track the selection by ID, including rows scrolled out of view."""
+        if self._rendering:
+            return
+        visible = {int(iid) for iid in self.tree.get_children()}
+        selected = {int(iid) for iid in self.tree.selection()}
+        self.selected_ids = (self.selected_ids - visible) | selected
+
+    def _on_mousewheel(self, event):
+        """Scroll three rows per wheel notch."""
+        notches = event.delta // 120 if abs(event.delta) >= 120 else (1 if event.delta > 0 else -1)
+        return self.scroll(-3 * notches)
+
+    def _on_arrow(self, direction: int):
+        """Scroll when arrow keys move the focus past the visible window."""
+        children = self.tree.get_children()
+        if not children:
+            return None
+        edge = children[0] if direction < 0 else children[-1]
+        if self.tree.focus() != edge:
+            return None
+        before = self.offset
+        self.scroll(direction)
+        if self.offset == before:
+            return 'break'
+        children = self.tree.get_children()
+        target = children[0] if direction < 0 else children[-1]
+        self.selected_ids = {int(target)}
+        self.tree.selection_set(target)
+        self.tree.focus(target)
+        return 'break'
+
+    def _on_page_key(self, direction: int):
+        """Page Up/Page Down move the window by one screenful."""
+        return self.scroll(direction * max(self._visible_rows - 1, 1))
@@ -0,0 +1,158 @@
+"""Write-coalescing queue for a ConversionCodeDB.
+
+Writes submitted from the GUI (or any thread) are applied by one worker
+thread. Writes submitted within ``max_delay`` of each other are grouped
+into one ``apply_writes`` transaction, so a burst of edits takes the
+database's write lock and commits once instead of once per record. Each
+write still gets its own result: a future that resolves to the new ID,
+True/False, or raises ``ConcurrencyConflictError`` for that write alone.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional, Tuple
+
+from database import (CHANGE_DELETE, CHANGE_INSERT, CHANGE_UPDATE, ConcurrencyConflictError,
+                      ConversionCodeDB, Write, validate_record)
+
+
+# How long the worker waits for more writes after the first of a batch.
+DEFAULT_MAX_DELAY = 0.02
+
+# Writes per transaction.
+DEFAULT_MAX_BATCH = 500
+
+# Queued instead of a write to stop the worker.
+_STOP = object()
+
+
+class WriteQueue:
+    """Applies writes on a worker thread, several per transaction.
+
+    Writes are applied in the order they were submitted. Invalid records
+    are rejected by ``submit`` with ValueError. If a batch fails for
+    another reason, it is split in halves that are applied on their own,
+    so a write the database refuses (e.g. a duplicate key) only fails its
+    own future; an error every write hits (e.g. the database stayed locked
+    after the retries) reaches every future.
+    """
+
+    def __init__(self, db: ConversionCodeDB, max_delay: float = DEFAULT_MAX_DELAY,
+                 max_batch: int = DEFAULT_MAX_BATCH):
+        self.db = db
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self.batches = 0
+        self.writes = 0
+        self._queue: 'queue.Queue' = queue.Queue()
+        self._closed = False
+        # Keeps writes from being queued behind the stop marker.
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='WriteQueue', daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(self, write: Write) -> Future:
+        """Queue a write; the future resolves once its batch has committed."""
+        if write.operation != CHANGE_DELETE:
+            error = validate_record(*write.values)
+            if error:
+                raise ValueError(error)
+        future: Future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The write queue is closed.")
+            self._queue.put((write, future))
+        return future
+
+    def add(self, field_name: str, source_value: str, spectrum_value: str,
+            is_imported: str = 'N') -> Future:
+        """Queue an insert; the future resolves to the new record's ID."""
+        return self.submit(Write(CHANGE_INSERT, None, (field_name, source_value,
+                                                       spectrum_value, is_imported)))
+
+    def update(self, conversion_code_id: int, field_name: str, source_value: str,
+               spectrum_value: str, is_imported: str,
+               expected_update_count: Optional[int] = None) -> Future:
+        """Queue an update, as ``ConversionCodeDB.update_record``."""
+        return self.submit(Write(CHANGE_UPDATE, conversion_code_id,
+                                 (field_name, source_value, spectrum_value, is_imported),
+                                 expected_update_count))
+
+    def delete(self, conversion_code_id: int,
+               expected_update_count: Optional[int] = None) -> Future:
+        """Queue a delete, as ``ConversionCodeDB.delete_record``."""
+        return self.submit(Write(CHANGE_DELETE, conversion_code_id,
+                                 expected_update_count=expected_update_count))
+
+    def close(self):
+        """Apply the writes already queued, then stop the worker."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stopping = self._collect(batch)
+            self._apply(batch)
+            if stopping:
+                return
+
+    def _collect(self, batch: List[Tuple[Write, Future]]) -> bool:
+        """Add writes arriving within ``max_delay`` to ``batch``; True on stop."""
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                return False
+            if item is _STOP:
+                return True
+            batch.append(item)
+        return False
+
+    def _apply(self, batch: List[Tuple[Write, Future]]):
+        writes, futures = [], []
+        for write, future in batch:
+            # Cancelled futures drop their writes.
+            if future.set_running_or_notify_cancel():
+                writes.append(write)
+                futures.append(future)
+        if writes:
+            self._apply_running(writes, futures)
+
+    def _apply_running(self, writes: List[Write], futures: List[Future]):
+        """Apply writes in one transaction, or in halves if that fails."""
+        try:
+            results = self.db.apply_writes(writes)
+        except Exception as e:
+            # Still locked after the retries: smaller batches would be too.
+            if len(writes) == 1 or self.db.backend.is_busy_error(e):
+                for future in futures:
+                    future.set_exception(e)
+                return
+            # Nothing was committed; find the failing writes by halving.
+            middle = len(writes) // 2
+            self._apply_running(writes[:middle], futures[:middle])
+            self._apply_running(writes[middle:], futures[middle:])
+            return
+        self.batches += 1
+        self.writes += len(writes)
+        for future, result in zip(futures, results):
+            if isinstance(result, ConcurrencyConflictError):
+                future.set_exception(result)
+            else:
+                future.set_result(result)